@@ -67,6 +67,12 @@ def create_app():
     # from app.routes.whatsapp import whatsapp_bp  # استُبدل بـ whatsapp_api
     from app.routes.whatsapp_api import whatsapp_bp as whatsapp_api_bp
     from app.routes.user import user_bp
+    from app.routes.jobs import jobs_bp  # المهام الخلفية
+    from app.routes.geofence import geofence_bp  # مواقع السياج الجغرافي
+    from app.routes.feed import feed_bp  # البث المباشر (SSE)
+    from app.routes.search import search_bp  # البحث الموحد
+    from app.routes.email_outbox import email_outbox_bp  # صندوق البريد الصادر
+    from app.routes.holidays import holidays_bp  # العطل الرسمية وتقويم العمل
     app.register_blueprint(auth_bp)
     app.register_blueprint(employees_bp)
     app.register_blueprint(user_bp)
@@ -103,11 +109,50 @@ def create_app():
     app.register_blueprint(client_support_bp)
     app.register_blueprint(support_ticket_bp)
     app.register_blueprint(support_hub_bp)
+    app.register_blueprint(jobs_bp)
+    app.register_blueprint(geofence_bp)
+    app.register_blueprint(feed_bp)
+    app.register_blueprint(holidays_bp)
+    app.register_blueprint(search_bp)
+    app.register_blueprint(email_outbox_bp)
     # whatsapp_bp القديم تم استبداله بـ whatsapp_api_bp (مُسجّل في السطر 72)
 
-    # تشغيل التحديث التلقائي لقاعدة البيانات
+    # تتبع تغييرات الحضور/الإجازات/السلف لإعادة حساب الرواتب تزايدياً
+    from app.utils.payroll_dirty import register_payroll_dirty_tracking
+    register_payroll_dirty_tracking()
+
+    # كاش هوية الطلب (load_user) وإبطاله عند تعديل المستخدمين/الموظفين/الأدوار
+    from app.utils.identity import register_identity_cache
+    register_identity_cache(app)
+
+    # لقطات الإعدادات (AttendanceSettings/Settings) وإبطالها عند الحفظ
+    from app.utils.settings_cache import register_settings_cache
+    register_settings_cache()
+
+    # فهرس مواقع السياج الجغرافي وإبطاله عند تعديل المواقع
+    from app.utils.geofence import register_geofence_cache
+    register_geofence_cache()
+
+    # تقويم أيام العمل (العطل الرسمية) وإبطاله عند تعديل العطل
+    from app.utils.work_calendar import register_calendar_cache
+    register_calendar_cache()
+
+    # التجميع اليومي للحضور (attendance_daily) لتعديلات ORM على الحضور والإجازات
+    from app.utils.attendance_daily import register_attendance_daily
+    register_attendance_daily()
+
+    # أحداث البث المباشر لتعيين التذاكر
+    from app.utils.feed import register_feed_events
+    register_feed_events()
+
+    # فهرس البحث الموحد (رسائل WhatsApp والتذاكر والشكاوى) لتعديلات ORM
+    from app.utils.search_index import register_search_index
+    register_search_index()
+
+    # فحص بصمة البنية (استعلام واحد)، والترحيل تحت قفل فقط عند الاختلاف
+    from app.db_manager import ensure_schema, register_schema_cli
+    register_schema_cli(app)
     with app.app_context():
-        from app.db_manager import auto_migrate_database
-        auto_migrate_database()
+        ensure_schema(app)
 
     return app
@@ -30,6 +30,17 @@ class Config:
     SQLALCHEMY_DATABASE_URI = _normalize_db_uri(_RAW_DB_URL)
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_ENGINE_OPTIONS = _engine_options_for(SQLALCHEMY_DATABASE_URI)
+    # ترحيل البنية عند بدء التشغيل (app/db_manager.py): يُتخطى إذا طابقت بصمة البنية المخزنة.
+    # في الإنتاج اضبط AUTO_MIGRATE=0 وشغّل `flask schema-migrate` كخطوة إصدار قبل العمال؛
+    # مهلة انتظار قفل الترحيل، وعمر القفل الذي يُعد بعده متروكاً (عملية ماتت أثناء الترحيل)
+    AUTO_MIGRATE = os.environ.get('AUTO_MIGRATE', '1') == '1'
+    SCHEMA_LOCK_TIMEOUT = int(os.environ.get('SCHEMA_LOCK_TIMEOUT', 300))
+    SCHEMA_LOCK_STALE_SECONDS = int(os.environ.get('SCHEMA_LOCK_STALE_SECONDS', 600))
+    # دمج سجلات الحضور المكررة يحذف صفوفاً: لا يعمل إلا بطلب صريح
+    # (`flask schema-migrate --merge-attendance` أو MERGE_DUPLICATE_ATTENDANCE=1)، والصفوف قبل الدمج
+    # تُصدّر JSON Lines إلى MERGE_EXPORT_DIR (افتراضياً instance/merged_rows)
+    MERGE_DUPLICATE_ATTENDANCE = os.environ.get('MERGE_DUPLICATE_ATTENDANCE', '0') == '1'
+    MERGE_EXPORT_DIR = os.environ.get('MERGE_EXPORT_DIR', '')
     WTF_CSRF_ENABLED = True
     WTF_CSRF_TIME_LIMIT = None
     WTF_CSRF_CHECK_DEFAULT = False  # Don't check CSRF on all requests by default
@@ -69,6 +80,19 @@ class Config:
     SENDGRID_API_KEY = os.environ.get('SENDGRID_API_KEY', '')
     # Optional: dynamic template for password changed notification
     SENDGRID_PASSWORD_CHANGED_TEMPLATE_ID = os.environ.get('SENDGRID_PASSWORD_CHANGED_TEMPLATE_ID', '')
+    # Email outbox (app/utils/emailer.py): pooled SMTP connections / HTTP sessions, batch size,
+    # retry with backoff on throttling and transient errors, messages per SMTP connection,
+    # idle seconds before a pooled connection is re-checked (NOOP), stale claims, max wait for deferred mail
+    EMAIL_SEND_WORKERS = int(os.environ.get('EMAIL_SEND_WORKERS', 4))
+    EMAIL_OUTBOX_BATCH = int(os.environ.get('EMAIL_OUTBOX_BATCH', 200))
+    EMAIL_SEND_MAX_ATTEMPTS = int(os.environ.get('EMAIL_SEND_MAX_ATTEMPTS', 8))
+    EMAIL_SEND_BACKOFF_SECONDS = float(os.environ.get('EMAIL_SEND_BACKOFF_SECONDS', 30))
+    EMAIL_SEND_BACKOFF_MAX = float(os.environ.get('EMAIL_SEND_BACKOFF_MAX', 3600))
+    EMAIL_SEND_TIMEOUT = float(os.environ.get('EMAIL_SEND_TIMEOUT', 15))
+    EMAIL_SMTP_MAX_MESSAGES = int(os.environ.get('EMAIL_SMTP_MAX_MESSAGES', 100))
+    EMAIL_SMTP_IDLE_SECONDS = float(os.environ.get('EMAIL_SMTP_IDLE_SECONDS', 30))
+    EMAIL_OUTBOX_STALE_SECONDS = int(os.environ.get('EMAIL_OUTBOX_STALE_SECONDS', 300))
+    EMAIL_OUTBOX_MAX_WAIT = float(os.environ.get('EMAIL_OUTBOX_MAX_WAIT', 60))
     # Password reset security knobs
     PASSWORD_RESET_CODE_TTL_MIN = int(os.environ.get('PASSWORD_RESET_CODE_TTL_MIN', 10))
     PASSWORD_RESET_MAX_ATTEMPTS = int(os.environ.get('PASSWORD_RESET_MAX_ATTEMPTS', 5))
@@ -88,6 +112,85 @@ class Config:
     PAYROLL_LATE_DEDUCTION_PER_HOUR = float(os.environ.get('PAYROLL_LATE_DEDUCTION_PER_HOUR', 0.0))  # خصم بالساعة
     # قسط السلف/القروض تلقائياً ضمن الراتب
     PAYROLL_AUTO_LOAN_DEDUCTION = os.environ.get('PAYROLL_AUTO_LOAN_DEDUCTION', '1') == '1'
+    # المهام الخلفية (app/utils/jobs.py): طابور على قاعدة البيانات بدون وسيط خارجي
+    JOBS_EAGER = os.environ.get('JOBS_EAGER', '0') == '1'  # تنفيذ داخل الطلب (اختبارات)
+    JOBS_IN_PROCESS = os.environ.get('JOBS_IN_PROCESS', '1') == '1'  # 0 عند تشغيل scripts/job_worker.py
+    JOBS_WORKERS = int(os.environ.get('JOBS_WORKERS', 2))
+    JOBS_POLL_INTERVAL = float(os.environ.get('JOBS_POLL_INTERVAL', 2.0))
+    JOBS_STALE_SECONDS = int(os.environ.get('JOBS_STALE_SECONDS', 900))
+    # أقصى تأخر (ثوانٍ) لرؤية إبطال كاش الصلاحيات/الإعدادات من عملية أخرى
+    CACHE_GENERATION_TTL = float(os.environ.get('CACHE_GENERATION_TTL', 5.0))
+    # مدة صلاحية هوية المستخدم المخزنة لكل عملية (load_user)
+    IDENTITY_CACHE_TTL = float(os.environ.get('IDENTITY_CACHE_TTL', 30.0))
+    # تجميع طلبات الحضور المتزامنة في commit واحد (app/utils/checkin.py)
+    CHECKIN_GROUP_COMMIT = os.environ.get('CHECKIN_GROUP_COMMIT', '0') == '1'
+    CHECKIN_GROUP_MAX_BATCH = int(os.environ.get('CHECKIN_GROUP_MAX_BATCH', 64))
+    CHECKIN_GROUP_MAX_WAIT_MS = float(os.environ.get('CHECKIN_GROUP_MAX_WAIT_MS', 0.0))  # 0 = ما تراكم أثناء الـ commit السابق
+    CHECKIN_SUBMIT_TIMEOUT = float(os.environ.get('CHECKIN_SUBMIT_TIMEOUT', 10.0))
+    # عدد أسطر CSV في كل جزء (commit) أثناء استيراد الحضور
+    ATTENDANCE_IMPORT_CHUNK = int(os.environ.get('ATTENDANCE_IMPORT_CHUNK', 2000))
+    # مجلد ملفات الاستيراد المنتظرة (افتراضياً instance/imports)؛ مشترك مع scripts/job_worker.py عند فصله
+    ATTENDANCE_IMPORT_SPOOL_DIR = os.environ.get('ATTENDANCE_IMPORT_SPOOL_DIR', '')
+    # تقارير الحضور المجمّعة (app/utils/report_engine.py): موظفون لكل جزء، ومجمع العمليات
+    # يُستخدم من ATTENDANCE_REPORT_POOL_MIN موظف (ليس على SQLite)؛ 0 عمال = min(CPU, 4)
+    ATTENDANCE_REPORT_CHUNK = int(os.environ.get('ATTENDANCE_REPORT_CHUNK', 2000))
+    ATTENDANCE_REPORT_WORKERS = int(os.environ.get('ATTENDANCE_REPORT_WORKERS', 0))
+    ATTENDANCE_REPORT_POOL_MIN = int(os.environ.get('ATTENDANCE_REPORT_POOL_MIN', 5000))
+    # مزامنة الحضور Offline (app/utils/attendance_sync.py): حجم الدفعة والخيوط (0 = min(CPU, 4)،
+    # وخيط واحد على SQLite)، والتراجع الأُسّي بين المحاولات وحدّها الأقصى
+    ATTENDANCE_SYNC_BATCH = int(os.environ.get('ATTENDANCE_SYNC_BATCH', 5000))
+    ATTENDANCE_SYNC_WORKERS = int(os.environ.get('ATTENDANCE_SYNC_WORKERS', 0))
+    ATTENDANCE_SYNC_MAX_ATTEMPTS = int(os.environ.get('ATTENDANCE_SYNC_MAX_ATTEMPTS', 8))
+    ATTENDANCE_SYNC_BACKOFF_SECONDS = float(os.environ.get('ATTENDANCE_SYNC_BACKOFF_SECONDS', 30))
+    ATTENDANCE_SYNC_BACKOFF_MAX = float(os.environ.get('ATTENDANCE_SYNC_BACKOFF_MAX', 3600))
+    ATTENDANCE_SYNC_MAX_RECORDS = int(os.environ.get('ATTENDANCE_SYNC_MAX_RECORDS', 10000))
+    # تفريغ الطابور تلقائياً كمهمة خلفية بعد كل إدراج
+    ATTENDANCE_SYNC_AUTO = os.environ.get('ATTENDANCE_SYNC_AUTO', '1') == '1'
+    # صندوق وارد WhatsApp (app/utils/whatsapp_inbox.py): حمولات لكل دفعة، وتحميل الوسائط بالتوازي
+    # بمهلة اتصال/قراءة (ثوانٍ)، والمحاولات قبل failed، وإعادة المحجوز لعامل توقف، ومدة الاحتفاظ
+    WHATSAPP_INBOX_BATCH = int(os.environ.get('WHATSAPP_INBOX_BATCH', 50))
+    WHATSAPP_MEDIA_WORKERS = int(os.environ.get('WHATSAPP_MEDIA_WORKERS', 8))
+    WHATSAPP_HTTP_CONNECT_TIMEOUT = float(os.environ.get('WHATSAPP_HTTP_CONNECT_TIMEOUT', 5))
+    WHATSAPP_MEDIA_TIMEOUT = float(os.environ.get('WHATSAPP_MEDIA_TIMEOUT', 30))
+    # الوسائط المخزنة بالبصمة (app/utils/media_store.py): أقصى حجم للمرفق الوارد، ومدة التخزين المؤقت
+    # في المتصفح بالثواني (الملف لا يتغير بعد كتابته)
+    WHATSAPP_MEDIA_MAX_BYTES = int(os.environ.get('WHATSAPP_MEDIA_MAX_BYTES', 100 * 1024 * 1024))
+    WHATSAPP_MEDIA_MAX_AGE = int(os.environ.get('WHATSAPP_MEDIA_MAX_AGE', 31536000))
+    WHATSAPP_INBOX_MAX_ATTEMPTS = int(os.environ.get('WHATSAPP_INBOX_MAX_ATTEMPTS', 5))
+    WHATSAPP_INBOX_STALE_SECONDS = int(os.environ.get('WHATSAPP_INBOX_STALE_SECONDS', 600))
+    WHATSAPP_INBOX_RETENTION_DAYS = int(os.environ.get('WHATSAPP_INBOX_RETENTION_DAYS', 7))
+    # تأجيل الحمولة الفاشلة قبل إعادة المحاولة: الأساس × 2^(المحاولات-1) حتى الحد الأقصى (ثوانٍ)
+    WHATSAPP_INBOX_BACKOFF_SECONDS = float(os.environ.get('WHATSAPP_INBOX_BACKOFF_SECONDS', 30))
+    WHATSAPP_INBOX_BACKOFF_MAX = float(os.environ.get('WHATSAPP_INBOX_BACKOFF_MAX', 3600))
+    # الإرسال الصادر (app/utils/whatsapp_outbox.py): خيوط/حجم مجمع الاتصالات، المعدل بحد Graph API
+    # (رسالة/ث لرقم الإرسال)، حجم الدفعة، إعادة المحاولة عند 429/5xx، مهلة القراءة، الحجز المعلّق،
+    # وأقصى انتظار (ثوانٍ) لرسائل مؤجلة قبل إنهاء المهمة
+    WHATSAPP_SEND_WORKERS = int(os.environ.get('WHATSAPP_SEND_WORKERS', 8))
+    WHATSAPP_SEND_RATE = float(os.environ.get('WHATSAPP_SEND_RATE', 80))
+    WHATSAPP_SEND_BURST = float(os.environ.get('WHATSAPP_SEND_BURST', 80))
+    WHATSAPP_OUTBOX_BATCH = int(os.environ.get('WHATSAPP_OUTBOX_BATCH', 500))
+    WHATSAPP_SEND_MAX_ATTEMPTS = int(os.environ.get('WHATSAPP_SEND_MAX_ATTEMPTS', 6))
+    WHATSAPP_SEND_BACKOFF_SECONDS = float(os.environ.get('WHATSAPP_SEND_BACKOFF_SECONDS', 2))
+    WHATSAPP_SEND_BACKOFF_MAX = float(os.environ.get('WHATSAPP_SEND_BACKOFF_MAX', 600))
+    WHATSAPP_SEND_TIMEOUT = float(os.environ.get('WHATSAPP_SEND_TIMEOUT', 15))
+    WHATSAPP_OUTBOX_STALE_SECONDS = int(os.environ.get('WHATSAPP_OUTBOX_STALE_SECONDS', 300))
+    WHATSAPP_OUTBOX_MAX_WAIT = float(os.environ.get('WHATSAPP_OUTBOX_MAX_WAIT', 120))
+    # حجم خلية شبكة فهرس السياج الجغرافي بالدرجات (≈ 1.1 كم)
+    GEOFENCE_CELL_DEG = float(os.environ.get('GEOFENCE_CELL_DEG', 0.01))
+    # مخزن التواجد (app/utils/presence.py): تفريغ النبضات كل N ثانية (0 = كتابة مباشرة)
+    PRESENCE_FLUSH_SECONDS = float(os.environ.get('PRESENCE_FLUSH_SECONDS', 5.0))
+    PRESENCE_SYNC_SECONDS = float(os.environ.get('PRESENCE_SYNC_SECONDS', 60.0))
+    PRESENCE_BUFFER_MAX = int(os.environ.get('PRESENCE_BUFFER_MAX', 10000))
+    # البث المباشر SSE (app/utils/feed.py)
+    FEED_POLL_SECONDS = float(os.environ.get('FEED_POLL_SECONDS', 1.0))  # SQLite؛ PostgreSQL يستخدم LISTEN
+    FEED_KEEPALIVE_SECONDS = float(os.environ.get('FEED_KEEPALIVE_SECONDS', 15.0))
+    FEED_STREAM_MAX_SECONDS = float(os.environ.get('FEED_STREAM_MAX_SECONDS', 300.0))
+    FEED_SUBSCRIBER_QUEUE = int(os.environ.get('FEED_SUBSCRIBER_QUEUE', 500))
+    FEED_RETENTION_SECONDS = int(os.environ.get('FEED_RETENTION_SECONDS', 3600))
+    # مدة انتظار معرّف ناقص (معاملة لم تُنهَ بعد) قبل اعتباره متراجعاً
+    FEED_GAP_SECONDS = float(os.environ.get('FEED_GAP_SECONDS', 30.0))
+    # اتصالات SSE المفتوحة لكل عامل (البث + تقدم المهام، app/utils/sse.py)؛ أقل من خيوط gunicorn
+    SSE_MAX_STREAMS = int(os.environ.get('SSE_MAX_STREAMS', 4))
     # Leave defaults and policy
     LEAVE_ANNUAL_DEFAULT_DAYS = int(os.environ.get('LEAVE_ANNUAL_DEFAULT_DAYS', 21))
     LEAVE_CASUAL_DEFAULT_DAYS = int(os.environ.get('LEAVE_CASUAL_DEFAULT_DAYS', 6))
@@ -3,7 +3,20 @@
 يقوم بإنشاء وتحديث الجداول تلقائياً بناءً على Models
 """
 
-from sqlalchemy import inspect, text
+import hashlib
+import json
+import os
+import socket
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from inspect import getsource
+
+import click
+from flask import current_app
+from sqlalchemy import func, inspect, select, text, update
+from sqlalchemy.exc import DBAPIError
 from app import db
 
 
@@ -20,10 +33,18 @@ def add_column_if_not_exists(table_name, column_name, column_type):
     existing_columns = get_table_columns(table_name)
     
     if column_name not in existing_columns:
+        # SQLite لا تقبل ADD COLUMN ... UNIQUE: العمود ثم فهرس فريد منفصل (يعمل على كل المحركات)
+        unique = ' UNIQUE' in f' {column_type.upper()}'
+        if unique:
+            column_type = ' '.join(part for part in column_type.split() if part.upper() != 'UNIQUE')
         try:
             with db.engine.connect() as connection:
                 query = text(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}")
                 connection.execute(query)
+                if unique:
+                    connection.execute(text(
+                        f"CREATE UNIQUE INDEX IF NOT EXISTS uq_{table_name}_{column_name} ON {table_name} ({column_name})"
+                    ))
                 connection.commit()
                 return True, f"[+] Added {column_name} to {table_name}"
         except Exception as e:
@@ -124,6 +145,19 @@ def update_database_schema():
             ('timestamp', 'DATETIME'),
             ('location', 'VARCHAR(128)')
         ],
+        'background_job': [
+            ('run_after', 'DATETIME')
+        ],
+        'schema_version': [
+            ('pending', 'TEXT')
+        ],
+        'attendance_sync': [
+            ('next_attempt_at', 'DATETIME'),
+            ('idempotency_key', 'VARCHAR(64)')
+        ],
+        'whatsapp_inbox': [
+            ('next_attempt_at', 'DATETIME')
+        ],
         'whatsapp_messages': [
             ('complaint_id', 'INTEGER'),
             ('customer_phone', 'VARCHAR(20)'),
@@ -132,7 +166,8 @@ def update_database_schema():
             ('direction', "VARCHAR(32) DEFAULT 'incoming'"),
             ('message_date', 'DATETIME'),
             ('sent_by', 'INTEGER'),
-            ('status', "VARCHAR(32) DEFAULT 'sent'")
+            ('status', "VARCHAR(32) DEFAULT 'sent'"),
+            ('updated_at', 'DATETIME')
         ],
         'customer_complaint': [
             ('customer_name', 'VARCHAR(128)'),
@@ -206,35 +241,56 @@ def update_database_schema():
         ]
     }
     
-    # تطبيق التحديثات
+    # تطبيق التحديثات (قراءة أعمدة كل جدول مرة واحدة بدل inspect() لكل عمود)
+    inspector = inspect(db.engine)
+    tables = set(inspector.get_table_names())
     for table_name, columns in schema_updates.items():
+        if table_name not in tables:
+            continue
+        existing_columns = {col['name'] for col in inspector.get_columns(table_name)}
         for column_name, column_type in columns:
+            if column_name in existing_columns:
+                continue
             success, message = add_column_if_not_exists(table_name, column_name, column_type)
-            if success:
+            if success or message.startswith('[-]'):
                 updates_log.append(message)
     
     return updates_log
 
 
+def import_all_models():
+    """استيراد كل النماذج حتى تكتمل db.metadata (لـ create_all وبصمة البنية)"""
+    from app.models.employee import Employee
+    from app.models.user import User
+    from app.models.payroll import Payroll
+    from app.models.attendance import Attendance
+    from app.models.leave import Leave
+    from app.models.performance import Performance
+    from app.models.audit import Audit
+    from app.models.support import SupportTicket
+    from app.models.presence import EmployeePresence, PresenceHeartbeat
+    from app.models.settings import Settings
+    from app.models.whatsapp_models import WhatsAppMessage, WhatsAppInbox, WhatsAppOutbox
+    from app.models.search import SearchDocument
+    from app.models.client_support import ClientSupport, ClientTransferHistory
+    from app.models.password_reset import PasswordResetCode
+    from app.models.email_outbox import EmailOutbox
+    # نماذج نظام الصلاحيات المتقدم
+    from app.models.permission import Role, Permission, RolePermission, UserRole, PermissionLog
+    # جداول البنية: المهام الخلفية وأجيال الكاش
+    from app.models.job import BackgroundJob
+    from app.models.cache_generation import CacheGeneration
+    from app.models.geofence import GeofenceSite
+    from app.models.feed import FeedEvent
+    from app.models.attendance import AttendanceDaily
+    from app.models.holiday import PublicHoliday
+    from app.models.schema import SchemaVersion, SchemaLock
+
+
 def create_missing_tables():
     """إنشاء الجداول المفقودة"""
     try:
-        # استيراد جميع النماذج
-        from app.models.employee import Employee
-        from app.models.user import User
-        from app.models.payroll import Payroll
-        from app.models.attendance import Attendance
-        from app.models.leave import Leave
-        from app.models.performance import Performance
-        from app.models.audit import Audit
-        from app.models.support import SupportTicket
-        from app.models.presence import EmployeePresence
-        from app.models.settings import Settings
-        from app.models.whatsapp_models import WhatsAppMessage
-        from app.models.client_support import ClientSupport, ClientTransferHistory
-        from app.models.password_reset import PasswordResetCode
-        # نماذج نظام الصلاحيات المتقدم
-        from app.models.permission import Role, Permission, RolePermission, UserRole, PermissionLog
+        import_all_models()
         
         # إنشاء جميع الجداول
         db.create_all()
@@ -243,6 +299,296 @@ def create_missing_tables():
         return False, f"[-] Error creating tables: {e}"
 
 
+def _first_duplicate(connection, table_name, columns):
+    """أول مفتاح مكرر يمنع إنشاء الفهرس الفريد (الصفوف ذات NULL في أي عمود لا تتعارض)."""
+    cols = ', '.join(columns)
+    not_null = ' AND '.join(f'{c} IS NOT NULL' for c in columns)
+    return connection.execute(text(
+        f"SELECT {cols} FROM {table_name} WHERE {not_null} GROUP BY {cols} HAVING COUNT(*) > 1 LIMIT 1"
+    )).first()
+
+
+# ==================== دمج الصفوف المكررة قبل الفهارس الفريدة ====================
+# كل دالة دمج تعمل على اتصال معاملة ensure_unique_indexes وترجع (مجموعات، صفوف محذوفة).
+
+def _duplicate_groups(connection, table, columns):
+    """صفوف كل مفتاح مكرر على أعمدة الفهرس الفريد، مرتبة بالـ id."""
+    key_columns = [table.c[name] for name in columns]
+    keys = connection.execute(
+        select(*key_columns).where(*[c.isnot(None) for c in key_columns])
+        .group_by(*key_columns).having(func.count() > 1)
+    ).all()
+    for key in keys:
+        yield connection.execute(
+            select(table).where(*[c == value for c, value in zip(key_columns, key)]).order_by(table.c.id)
+        ).mappings().all()
+
+
+def _delete_ids(connection, table, ids):
+    connection.execute(table.delete().where(table.c.id.in_(ids)))
+
+
+def _repoint(connection, column, ids, target):
+    """نقل المراجع من الصفوف المحذوفة إلى الصف الباقي."""
+    connection.execute(update(column.table).where(column.in_(ids)).values({column.name: target}))
+
+
+def _latest(rows, column):
+    return max(rows, key=lambda r: (r[column] is not None, r[column] or datetime.min, r['id']))
+
+
+# حقول الانصراف تؤخذ من السجل ذي آخر check_out_time، والباقي من السجل ذي أبكر check_in_time
+_ATTENDANCE_OUT_FIELDS = ('check_out_time', 'lat_out', 'lng_out', 'address_out')
+
+
+def _export_rows(table_name, groups):
+    """كتابة صفوف كل مجموعة مدمجة كما كانت قبل الدمج (سطر JSON لكل صف) لاسترجاعها يدوياً."""
+    directory = current_app.config.get('MERGE_EXPORT_DIR') or os.path.join(current_app.instance_path, 'merged_rows')
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{table_name}-{datetime.utcnow():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:6]}.jsonl")
+    with open(path, 'w', encoding='utf-8') as f:
+        for rows in groups:
+            for row in rows:
+                f.write(json.dumps({'kept_id': rows[0]['id'], **row}, default=str, ensure_ascii=False) + '\n')
+    return path
+
+
+def merge_duplicate_attendance(connection):
+    """سجلات الحضور المكررة (employee_id, date): يبقى أصغر id بأبكر دخول وآخر خروج،
+    ثم يُعاد حساب صفوف attendance_daily المتأثرة وتُعلَّم رواتب أشهرها لإعادة الحساب.
+    كل صفوف المجموعات تُصدّر قبل التعديل (_export_rows) وتُسجل في السجل."""
+    from app.models.attendance import Attendance
+    from app.utils.attendance_daily import refresh_daily
+    from app.utils.payroll_dirty import mark_payroll_dirty
+    table = Attendance.__table__
+    groups = [[dict(r) for r in rows] for rows in _duplicate_groups(connection, table, ('employee_id', 'date'))]
+    if groups:
+        path = _export_rows('attendance', groups)
+        for rows in groups:
+            current_app.logger.warning('[DB] Merging attendance ids %s into %s (employee %s, %s); exported to %s',
+                                       [r['id'] for r in rows[1:]], rows[0]['id'], rows[0]['employee_id'],
+                                       rows[0]['date'], path)
+    keys, removed = [], 0
+    for rows in groups:
+        first_in = min((r for r in rows if r['check_in_time']), key=lambda r: r['check_in_time'], default=rows[0])
+        last_out = max((r for r in rows if r['check_out_time']), key=lambda r: r['check_out_time'], default=None)
+        values = {name: value for name, value in first_in.items() if name != 'id'}
+        if last_out is not None:
+            values.update({name: last_out[name] for name in _ATTENDANCE_OUT_FIELDS})
+            values['status'] = 'outside'
+        connection.execute(update(table).where(table.c.id == rows[0]['id']).values(**values))
+        _delete_ids(connection, table, [r['id'] for r in rows[1:]])
+        keys.append((rows[0]['employee_id'], rows[0]['date']))
+        removed += len(rows) - 1
+    mark_payroll_dirty(keys, source='attendance', connection=connection)
+    refresh_daily(connection, keys)
+    return len(keys), removed
+
+
+def _link_rank(link):
+    # الربط المعتمد يغلب، ثم الأحدث (آخر حساب للمبالغ)
+    return bool(link['approved']), link['id']
+
+
+def merge_duplicate_reports(connection):
+    """تقارير الفترة المكررة (توليد التقرير قديماً كان يُدرج تقريراً جديداً في كل مرة): يبقى الأحدث،
+    وتُنقل إليه روابط الرواتب (رابط واحد لكل راتب) وعلامة الربط."""
+    from app.models.attendance_advanced import AttendanceReport, PayrollAttendanceLink
+    table = AttendanceReport.__table__
+    links = PayrollAttendanceLink.__table__
+    groups = removed = 0
+    for rows in _duplicate_groups(connection, table, ('employee_id', 'period_type', 'period_start', 'period_end')):
+        kept, stale = rows[-1], [r['id'] for r in rows[:-1]]
+        best = {}
+        for link in connection.execute(select(links).where(
+                links.c.report_id.in_([r['id'] for r in rows]))).mappings():
+            if link['payroll_id'] not in best or _link_rank(link) > _link_rank(best[link['payroll_id']]):
+                best[link['payroll_id']] = link
+        connection.execute(links.delete().where(
+            links.c.report_id.in_([r['id'] for r in rows]),
+            links.c.id.notin_([link['id'] for link in best.values()]),
+        ))
+        _repoint(connection, links.c.report_id, stale, kept['id'])
+        connection.execute(update(table).where(table.c.id == kept['id']).values(
+            payroll_id=next((r['payroll_id'] for r in reversed(rows) if r['payroll_id']), None),
+            linked_to_payroll=any(r['linked_to_payroll'] for r in rows),
+        ))
+        _delete_ids(connection, table, stale)
+        groups += 1
+        removed += len(stale)
+    return groups, removed
+
+
+def merge_duplicate_payroll_links(connection):
+    """روابط راتب/تقرير مكررة: يبقى المعتمد ثم الأحدث."""
+    from app.models.attendance_advanced import PayrollAttendanceLink
+    table = PayrollAttendanceLink.__table__
+    groups = removed = 0
+    for rows in _duplicate_groups(connection, table, ('payroll_id', 'report_id')):
+        kept = max(rows, key=_link_rank)
+        _delete_ids(connection, table, [r['id'] for r in rows if r['id'] != kept['id']])
+        groups += 1
+        removed += len(rows) - 1
+    return groups, removed
+
+
+def merge_duplicate_sync_records(connection):
+    """ضغطات الطابور المكررة بنفس idempotency_key هي نفس الضغطة: يبقى المُطبَّق إن وُجد، وإلا الأقدم."""
+    from app.models.attendance_advanced import AttendanceSync
+    table = AttendanceSync.__table__
+    groups = removed = 0
+    for rows in _duplicate_groups(connection, table, ('idempotency_key',)):
+        kept = next((r for r in rows if r['sync_status'] == 'synced'), rows[0])
+        _delete_ids(connection, table, [r['id'] for r in rows if r['id'] != kept['id']])
+        groups += 1
+        removed += len(rows) - 1
+    return groups, removed
+
+
+def merge_duplicate_whatsapp_messages(connection):
+    """رسائل WhatsApp المكررة بنفس message_id (إعادة إرسال الـ webhook): يبقى أصغر id
+    بآخر حالة، وتُنقل إليه مراجع الطابور الصادر."""
+    from app.models.whatsapp_models import WhatsAppMessage, WhatsAppOutbox
+    table = WhatsAppMessage.__table__
+    groups = removed = 0
+    for rows in _duplicate_groups(connection, table, ('message_id',)):
+        kept, stale = rows[0], [r['id'] for r in rows[1:]]
+        latest = _latest(rows, 'updated_at')
+        connection.execute(update(table).where(table.c.id == kept['id']).values(
+            status=latest['status'], updated_at=latest['updated_at']))
+        _repoint(connection, WhatsAppOutbox.__table__.c.message_row_id, stale, kept['id'])
+        _delete_ids(connection, table, stale)
+        groups += 1
+        removed += len(stale)
+    return groups, removed
+
+
+def merge_duplicate_whatsapp_conversations(connection):
+    """محادثات WhatsApp المكررة لنفس الرقم: يبقى أصغر id، وتُنقل إليه الرسائل والطابور الصادر،
+    وتؤخذ آخر رسالة وحالتها من آخر محادثة تحدّثت، ويُجمع عدد غير المقروء."""
+    from app.models.whatsapp_models import WhatsAppConversation, WhatsAppMessage, WhatsAppOutbox
+    table = WhatsAppConversation.__table__
+    groups = removed = 0
+    for rows in _duplicate_groups(connection, table, ('customer_phone',)):
+        kept, stale = rows[0], [r['id'] for r in rows[1:]]
+        latest = _latest(rows, 'updated_at')
+        connection.execute(update(table).where(table.c.id == kept['id']).values(
+            customer_name=next((r['customer_name'] for r in rows if r['customer_name']), None),
+            assigned_to=next((r['assigned_to'] for r in rows if r['assigned_to']), None),
+            unread_count=sum(r['unread_count'] or 0 for r in rows),
+            **{name: latest[name] for name in ('last_message', 'last_message_type', 'last_message_direction',
+                                                'status', 'updated_at')},
+        ))
+        _repoint(connection, WhatsAppMessage.__table__.c.conversation_id, stale, kept['id'])
+        _repoint(connection, WhatsAppOutbox.__table__.c.conversation_id, stale, kept['id'])
+        _delete_ids(connection, table, stale)
+        groups += 1
+        removed += len(stale)
+    return groups, removed
+
+
+# دمج يحذف بيانات تشغيلية (حضور الموظفين): لا يعمل ضمنياً من create_app
+_EXPLICIT_MERGES = {'attendance': 'MERGE_DUPLICATE_ATTENDANCE'}
+
+
+def ensure_unique_indexes():
+    """إنشاء الفهارس الفريدة على الجداول القديمة (create_all لا يعدّل جدولاً موجوداً).
+    الصفوف المكررة تُدمج أولاً بدالة الدمج الخاصة بالجدول في نفس المعاملة مع إنشاء الفهرس،
+    فلا يبقى فهرس مُتخطى يعيد الترحيل في كل تشغيل. إذا بقي تكرار بعد الدمج يُتخطى الفهرس مع تحذير.
+    جداول _EXPLICIT_MERGES لا تُدمج إلا إذا فُعّل إعدادها؛ وإلا يُتخطى الفهرس حتى يُشغّل الدمج صراحة.
+    """
+    messages = []
+    unique_indexes = [
+        ('attendance', 'uq_attendance_employee_date', ('employee_id', 'date'), merge_duplicate_attendance),
+        ('attendance_report', 'uq_attendance_report_period', ('employee_id', 'period_type', 'period_start', 'period_end'),
+         merge_duplicate_reports),
+        ('payroll_attendance_link', 'uq_payroll_attendance_link', ('payroll_id', 'report_id'),
+         merge_duplicate_payroll_links),
+        ('attendance_sync', 'uq_attendance_sync_idempotency_key', ('idempotency_key',), merge_duplicate_sync_records),
+        ('whatsapp_messages', 'uq_whatsapp_message_id', ('message_id',), merge_duplicate_whatsapp_messages),
+        ('whatsapp_conversations', 'uq_whatsapp_conversation_phone', ('customer_phone',),
+         merge_duplicate_whatsapp_conversations),
+    ]
+    inspector = inspect(db.engine)
+    tables = set(inspector.get_table_names())
+    for table_name, index_name, columns, merge in unique_indexes:
+        if table_name not in tables:
+            continue
+        if index_name in {ix['name'] for ix in inspector.get_indexes(table_name)}:
+            continue
+        cols = ', '.join(columns)
+        try:
+            with db.engine.connect() as connection:
+                duplicate = _first_duplicate(connection, table_name, columns)
+                flag = _EXPLICIT_MERGES.get(table_name)
+                if duplicate and flag and not current_app.config.get(flag):
+                    messages.append(f"[!] Skipped {index_name}: duplicate rows in {table_name} ({cols}) e.g. "
+                                    f"{tuple(duplicate)}; run `flask schema-migrate --merge-{table_name}` "
+                                    f"or set {flag}=1 to merge them")
+                    continue
+                if duplicate:
+                    groups, removed = merge(connection)
+                    messages.append(f"[+] Merged {removed} duplicate rows into {groups} in {table_name} ({cols})")
+                    duplicate = _first_duplicate(connection, table_name, columns)
+                if duplicate:
+                    messages.append(f"[!] Skipped {index_name}: duplicate rows in {table_name} ({cols}) e.g. {tuple(duplicate)}")
+                    continue
+                connection.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS {index_name} ON {table_name} ({cols})"))
+                connection.commit()
+                messages.append(f"[+] Created unique index {index_name} on {table_name}")
+        except Exception as e:
+            messages.append(f"[-] Error creating {index_name}: {e}")
+    return messages
+
+
+_unique_indexes_seen = set()
+
+
+def has_unique_index(connection, table_name, index_name):
+    """هل يوجد الفهرس الفريد الذي يعتمد عليه INSERT ... ON CONFLICT؟ قد يغيب في قاعدة قديمة
+    لم تُرحّل بعد أو فشل فيها إنشاؤه، فيعود المستدعي إلى القراءة ثم الكتابة.
+    الوجود يُحفظ في العملية (الفهرس لا يُحذف)؛ الغياب يُعاد فحصه في كل استدعاء."""
+    key = (str(connection.engine.url), index_name)
+    if key in _unique_indexes_seen:
+        return True
+    if index_name not in {ix['name'] for ix in inspect(connection).get_indexes(table_name)}:
+        return False
+    _unique_indexes_seen.add(key)
+    return True
+
+
+def ensure_indexes():
+    """فهارس الاستعلامات على الجداول القديمة (create_all لا يضيف فهرساً لجدول موجود)."""
+    messages = []
+    indexes = [
+        # مسح نطاق تاريخ لكل الموظفين (تقارير التأخير والتجميعات الشهرية)
+        ('attendance', 'idx_attendance_date', ('date',)),
+        # طابور المزامنة Offline: السجلات المستحقة للمعالجة
+        ('attendance_sync', 'idx_attendance_sync_due', ('sync_status', 'next_attempt_at')),
+        # صفحات دردشة WhatsApp (keyset) ووضع since
+        ('whatsapp_conversations', 'idx_whatsapp_conversation_updated', ('updated_at', 'id')),
+        ('whatsapp_messages', 'idx_whatsapp_message_history', ('conversation_id', 'timestamp', 'id')),
+        ('whatsapp_messages', 'idx_whatsapp_message_changes', ('conversation_id', 'updated_at')),
+    ]
+    inspector = inspect(db.engine)
+    tables = set(inspector.get_table_names())
+    for table_name, index_name, columns in indexes:
+        if table_name not in tables:
+            continue
+        if index_name in {ix['name'] for ix in inspector.get_indexes(table_name)}:
+            continue
+        try:
+            with db.engine.connect() as connection:
+                connection.execute(text(
+                    f"CREATE INDEX IF NOT EXISTS {index_name} ON {table_name} ({', '.join(columns)})"
+                ))
+                connection.commit()
+            messages.append(f"[+] Created index {index_name} on {table_name}")
+        except Exception as e:
+            messages.append(f"[-] Error creating {index_name}: {e}")
+    return messages
+
+
 def create_default_admin_user():
     """إنشاء مستخدم admin افتراضي بدون كلمة مرور ضعيفة.
     - اسم المستخدم الافتراضي '1' (ليطابق غالباً رقم الموظف المدير)
@@ -273,14 +619,28 @@ def create_default_admin_user():
         else:
             return False, "[+] Admin user already exists"
     except Exception as e:
-        return False, f"[!] Could not create admin user: {e}"
+        return False, f"[-] Could not create admin user: {e}"
+
+
+def step_failures(messages):
+    """رسائل الخطوات التي فشلت ([-] خطأ): البصمة لا تُسجل ويُعاد الترحيل."""
+    return [m for m in messages if m.startswith('[-]')]
 
 
-def auto_migrate_database():
+def step_warnings(messages):
+    """خطوات تُخطيت عمداً ([!] مثل فهرس فريد ينتظر دمج المكرر): لا تمنع تسجيل البصمة،
+    وتُحفظ معها في schema_version.pending ليُحذّر منها كل بدء تشغيل حتى تُعالج."""
+    return [m for m in messages if m.startswith('[!]')]
+
+
+def auto_migrate_database(warnings=None):
     """
     دالة رئيسية للتحديث التلقائي لقاعدة البيانات
     تستدعى عند بدء تشغيل التطبيق
+    ترجع رسائل الخطوات الفاشلة (قائمة فارغة عند النجاح)؛ رسائل [!] تُضاف إلى warnings إن مُررت
     """
+    failures = []
+    warnings = warnings if warnings is not None else []
     print("\n" + "="*60)
     print("[*] Starting Database Auto-Migration...")
     print("="*60)
@@ -288,24 +648,34 @@ def auto_migrate_database():
     # إنشاء الجداول المفقودة
     success, message = create_missing_tables()
     print(message)
+    if not success:
+        failures.append(message)
     
     # تحديث البنية
     updates = update_database_schema()
+    failures += step_failures(updates)
+    warnings += step_warnings(updates)
     
     if updates:
         print("\n[+] Schema Updates Applied:")
-        for update in updates:
-            print(f"  {update}")
+        for message in updates:
+            print(f"  {message}")
     else:
         print("\n[+] No schema updates needed - database is up to date")
+
+    # الفهارس الفريدة (مثل سجل حضور واحد لكل موظف/يوم)
+    from app.utils.search_index import ensure_search_index
+    for step in (ensure_unique_indexes, ensure_indexes, ensure_search_index):
+        messages = step()
+        for message in messages:
+            print(message)
+        failures += step_failures(messages)
+        warnings += step_warnings(messages)
     
     # إنشاء مستخدم افتراضي
     success, message = create_default_admin_user()
     print(message)
-    
-    print("="*60)
-    print("[+] Database Migration Completed Successfully")
-    print("="*60 + "\n")
+    failures += step_failures([message])
 
     # Seed/initialize default permissions and roles (idempotent)
     try:
@@ -319,4 +689,203 @@ def auto_migrate_database():
         assign_admin_permissions()
         print("[+] Permissions and roles initialized (idempotent)")
     except Exception as e:
-        print(f"[!] Permission initialization skipped due to error: {e}")
+        db.session.rollback()
+        message = f"[-] Permission initialization failed: {e}"
+        print(message)
+        failures.append(message)
+    
+    print("="*60)
+    if failures:
+        print(f"[-] Database Migration Finished With {len(failures)} Failed Step(s)")
+    elif warnings:
+        print(f"[!] Database Migration Completed With {len(warnings)} Pending Step(s)")
+    else:
+        print("[+] Database Migration Completed Successfully")
+    print("="*60 + "\n")
+    return failures
+
+
+class SchemaMigrationError(RuntimeError):
+    """خطوة ترحيل فشلت: البصمة لا تُسجل حتى يُعاد الترحيل في التشغيل التالي."""
+
+    def __init__(self, failures):
+        self.failures = list(failures)
+        super().__init__(f"{len(self.failures)} migration step(s) failed: " + '; '.join(self.failures))
+
+
+# ==================== بصمة البنية والترحيل مرة واحدة ====================
+# بدء التشغيل (create_app) لا يعيد الترحيل كاملاً: يحسب بصمة البنية المتوقعة (تعريف الجداول والأعمدة
+# والفهارس في النماذج + شيفرة خطوات الترحيل والبيانات الافتراضية) ويقارنها بآخر بصمة في schema_version.
+# عند الاختلاف يُرحّل تحت قفل schema_lock (AUTO_MIGRATE=1) أو يكتفي بتحذير ليشغّل خطوة الإصدار
+# `flask schema-migrate` / scripts/migrate_db.py الترحيل مرة واحدة قبل تشغيل العمال (AUTO_MIGRATE=0).
+
+MIGRATION_LOCK = 'schema_migrate'
+
+
+def _migration_steps():
+    from app.models.permission import (
+        initialize_default_permissions,
+        initialize_default_roles,
+        assign_admin_permissions,
+    )
+    from app.utils.search_index import ensure_search_index
+    return (update_database_schema, ensure_unique_indexes, ensure_indexes, ensure_search_index,
+            create_default_admin_user, initialize_default_permissions, initialize_default_roles,
+            assign_admin_permissions)
+
+
+def schema_fingerprint():
+    """SHA-256 لتعريف كل الجداول (الأعمدة وأنواعها والفهارس) وشيفرة خطوات الترحيل:
+    أي نموذج أو عمود أو فهرس أو صلاحية افتراضية جديدة تغيّر البصمة فيُعاد الترحيل."""
+    import_all_models()
+    digest = hashlib.sha256()
+    for table in sorted(db.metadata.tables.values(), key=lambda t: t.name):
+        digest.update(f'table {table.name}\n'.encode())
+        for column in table.columns:
+            digest.update(f'  {column.name} {column.type!r} null={column.nullable} pk={column.primary_key}\n'.encode())
+        for index in sorted(table.indexes, key=lambda ix: ix.name or ''):
+            columns = ','.join(c.name for c in index.columns)
+            digest.update(f'  index {index.name} ({columns}) unique={index.unique}\n'.encode())
+    for step in _migration_steps():
+        digest.update(getsource(step).encode())
+    return digest.hexdigest()
+
+
+def stored_version():
+    """(آخر بصمة مُرحّلة، الخطوات المعلقة معها)، أو (None, None) لقاعدة جديدة أو قبل وجود schema_version."""
+    from app.models.schema import SchemaVersion
+    table = SchemaVersion.__table__  # Core: لا تهيئة لكل الـ mappers عند بدء التشغيل
+    try:
+        row = db.session.execute(
+            select(table.c.fingerprint, table.c.pending).order_by(table.c.id.desc()).limit(1)
+        ).first()
+    except Exception:
+        return None, None
+    finally:
+        db.session.rollback()
+    return (row[0], row[1]) if row else (None, None)
+
+
+def stored_fingerprint():
+    """آخر بصمة مُرحّلة، أو None (قاعدة جديدة أو قبل وجود schema_version)."""
+    return stored_version()[0]
+
+
+@contextmanager
+def migration_lock(timeout=300, stale_seconds=600):
+    """قفل بين العمليات بصف في schema_lock (يعمل على SQLite وPostgreSQL).
+    من ينتظر يعيد المحاولة حتى timeout ثانية؛ قفل أقدم من stale_seconds (عملية ماتت) يُستولى عليه."""
+    from app.models.schema import SchemaLock
+    table = SchemaLock.__table__
+    table.create(db.engine, checkfirst=True)
+    owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+    deadline = time.monotonic() + timeout
+    while True:
+        now = datetime.utcnow()
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(table.insert().values(name=MIGRATION_LOCK, owner=owner, acquired_at=now))
+            break
+        except DBAPIError:
+            # مأخوذ (أو SQLite مشغولة): استيلاء على قفل قديم فقط
+            try:
+                with db.engine.begin() as connection:
+                    taken = connection.execute(update(table).where(
+                        table.c.name == MIGRATION_LOCK,
+                        table.c.acquired_at < now - timedelta(seconds=stale_seconds),
+                    ).values(owner=owner, acquired_at=now)).rowcount
+                if taken:
+                    break
+            except DBAPIError:
+                pass
+        if time.monotonic() > deadline:
+            raise TimeoutError(f'Timed out after {timeout}s waiting for the schema migration lock')
+        time.sleep(0.25)
+    try:
+        yield owner
+    finally:
+        with db.engine.begin() as connection:
+            connection.execute(table.delete().where(table.c.name == MIGRATION_LOCK, table.c.owner == owner))
+
+
+def migrate_database(force=False, fingerprint=None, timeout=300, stale_seconds=600):
+    """الترحيل الكامل مرة واحدة: بعد أخذ القفل تُفحص البصمة مجدداً (ربما رحّلت عملية أخرى أثناء الانتظار).
+    ترجع True إذا نُفذ الترحيل. إذا فشلت خطوة ترفع SchemaMigrationError دون تسجيل البصمة.
+    الخطوات المتخطاة ([!]) تُسجل مع البصمة في pending ويُحذّر منها: بيانات تحتاج تنظيفاً يدوياً
+    لا تمنع الإصدار ولا تعيد الترحيل الكامل في كل تشغيل."""
+    from app.models.schema import SchemaVersion
+    fingerprint = fingerprint or schema_fingerprint()
+    if not force and stored_fingerprint() == fingerprint:
+        return False
+    with migration_lock(timeout=timeout, stale_seconds=stale_seconds):
+        if not force and stored_fingerprint() == fingerprint:
+            return False
+        started = time.perf_counter()
+        warnings = []
+        failures = auto_migrate_database(warnings)
+        if failures:
+            raise SchemaMigrationError(failures)
+        db.session.add(SchemaVersion(
+            fingerprint=fingerprint,
+            applied_by=f'{socket.gethostname()}:{os.getpid()}',
+            duration_ms=int((time.perf_counter() - started) * 1000),
+            pending='\n'.join(warnings) or None,
+        ))
+        db.session.commit()
+    _warn_pending('\n'.join(warnings))
+    return True
+
+
+def _warn_pending(pending):
+    for message in (pending or '').splitlines():
+        current_app.logger.warning('[DB] Pending migration step: %s', message)
+
+
+def ensure_schema(app):
+    """فحص بدء التشغيل: بصمة واحدة من قاعدة البيانات، والترحيل فقط عند الاختلاف."""
+    fingerprint = schema_fingerprint()
+    stored, pending = stored_version()
+    if stored == fingerprint:
+        _warn_pending(pending)
+        return False
+    if not app.config.get('AUTO_MIGRATE', True):
+        app.logger.warning('[DB] Schema is out of date (fingerprint %s); run "flask schema-migrate" '
+                           'or scripts/migrate_db.py before starting the workers', fingerprint[:12])
+        return False
+    try:
+        return migrate_database(
+            fingerprint=fingerprint,
+            timeout=app.config.get('SCHEMA_LOCK_TIMEOUT', 300),
+            stale_seconds=app.config.get('SCHEMA_LOCK_STALE_SECONDS', 600),
+        )
+    except SchemaMigrationError as e:
+        # التطبيق يعمل بالبنية الحالية، والترحيل يُعاد في التشغيل التالي
+        app.logger.error('[DB] Schema migration incomplete, fingerprint not recorded: %s', e)
+        return False
+
+
+def register_schema_cli(app):
+    """أمر خطوة الإصدار: flask schema-migrate [--force] [--merge-attendance]"""
+    @app.cli.command('schema-migrate')
+    @click.option('--force', is_flag=True, help='Run every migration step even if the fingerprint matches.')
+    @click.option('--merge-attendance', is_flag=True,
+                  help='Merge duplicate attendance rows (exported to MERGE_EXPORT_DIR first) before the unique index.')
+    def schema_migrate(force, merge_attendance):
+        """Migrate the database schema once (locked against concurrent runs)."""
+        if merge_attendance:
+            # البصمة مسجلة غالباً مع الفهرس المعلق: تشغيل كل الخطوات
+            app.config['MERGE_DUPLICATE_ATTENDANCE'] = True
+            force = True
+        fingerprint = schema_fingerprint()
+        try:
+            migrated = migrate_database(force=force, fingerprint=fingerprint,
+                                        timeout=app.config.get('SCHEMA_LOCK_TIMEOUT', 300),
+                                        stale_seconds=app.config.get('SCHEMA_LOCK_STALE_SECONDS', 600))
+        except SchemaMigrationError as e:
+            raise click.ClickException(str(e))
+        if migrated:
+            click.echo(f'[+] Schema migrated ({fingerprint[:12]})')
+        else:
+            click.echo(f'[+] Schema already up to date ({fingerprint[:12]})')
+        for message in (stored_version()[1] or '').splitlines():
+            click.echo(f'{message}', err=True)
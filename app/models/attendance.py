@@ -23,6 +23,12 @@ class Attendance(db.Model):
     device_verified = db.Column(db.Boolean, default=False)  # هل الجهاز مسجل؟
     verification_notes = db.Column(db.Text)  # ملاحظات التحقق
 
+    __table_args__ = (
+        # سجل واحد لكل موظف في اليوم: يفرضه القيد بدلاً من الفحص قبل الإدراج
+        db.Index('uq_attendance_employee_date', 'employee_id', 'date', unique=True),
+        db.Index('idx_attendance_date', 'date'),
+    )
+
 
 class AttendanceSettings(db.Model):
     """إعدادات نظام الحضور والانصراف"""
@@ -63,3 +69,29 @@ class RegisteredDevice(db.Model):
     # علاقة مع الموظف
     employee = db.relationship('Employee', backref='registered_devices')
 
+
+
+class AttendanceDaily(db.Model):
+    """تجميع يومي للحضور: صف واحد لكل موظف في اليوم (app/utils/attendance_daily.py).
+    يُحدَّث تزايدياً مع كل حضور/انصراف/استيراد/تعديل، ويُعاد بناؤه بـ scripts/rebuild_attendance_daily.py.
+    """
+    __tablename__ = 'attendance_daily'
+
+    employee_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    date = db.Column(db.Date, primary_key=True)
+    day_status = db.Column(db.String(16), nullable=False)  # present / leave (الغياب يُشتق عند القراءة)
+    first_in = db.Column(db.DateTime)
+    last_out = db.Column(db.DateTime)
+    worked_minutes = db.Column(db.Integer, default=0)
+    late_minutes = db.Column(db.Integer, default=0)  # بعد نهاية وقت الحضور (قبل فترة السماح)
+    overtime_minutes = db.Column(db.Integer, default=0)
+    location_verified = db.Column(db.Boolean)
+    time_verified = db.Column(db.Boolean)
+    device_verified = db.Column(db.Boolean)
+    leave_type = db.Column(db.String(32))
+    leave_paid = db.Column(db.Boolean)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('idx_attendance_daily_date', 'date', 'day_status'),
+    )
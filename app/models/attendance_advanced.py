@@ -7,6 +7,11 @@ from sqlalchemy import func
 
 class AttendanceReport(db.Model):
     """تقارير الحضور المجمّعة"""
+    __table_args__ = (
+        # تقرير واحد لكل موظف وفترة: إعادة التوليد تحدّث الصف (app/utils/report_engine.py)
+        db.Index('uq_attendance_report_period', 'employee_id', 'period_type', 'period_start', 'period_end', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     employee_id = db.Column(db.Integer, db.ForeignKey('employee.id'), nullable=False)
     
@@ -46,7 +51,13 @@ class AttendanceReport(db.Model):
 
 
 class AttendanceSync(db.Model):
-    """قائمة انتظار المزامنة للوضع Offline"""
+    """قائمة انتظار المزامنة للوضع Offline (المعالجة في app/utils/attendance_sync.py)"""
+    __table_args__ = (
+        # السجلات المستحقة: pending و next_attempt_at فارغ أو مضى
+        db.Index('idx_attendance_sync_due', 'sync_status', 'next_attempt_at'),
+        db.Index('uq_attendance_sync_idempotency_key', 'idempotency_key', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     
     # معلومات السجل
@@ -67,7 +78,10 @@ class AttendanceSync(db.Model):
     sync_status = db.Column(db.String(20), default='pending')  # pending, synced, failed
     sync_attempts = db.Column(db.Integer, default=0)
     last_sync_attempt = db.Column(db.DateTime)
+    next_attempt_at = db.Column(db.DateTime)  # إعادة المحاولة بتراجع أُسّي بعد الفشل
     error_message = db.Column(db.Text)
+    # مفتاح منع التكرار: من العميل (idempotency_key/client_id) أو بصمة بيانات الضغطة
+    idempotency_key = db.Column(db.String(64))
     
     # البيانات الأصلية (JSON)
     original_data = db.Column(db.Text)  # JSON string
@@ -115,6 +129,10 @@ class AttendanceRBAC(db.Model):
 
 class PayrollAttendanceLink(db.Model):
     """ربط الحضور بالرواتب - التحويل التلقائي"""
+    __table_args__ = (
+        db.Index('uq_payroll_attendance_link', 'payroll_id', 'report_id', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     
     payroll_id = db.Column(db.Integer, db.ForeignKey('payroll.id'), nullable=False)
@@ -0,0 +1,20 @@
+"""
+أجيال الكاش المشتركة بين العمليات
+كل كاش داخل العملية (الصلاحيات، الإعدادات...) يرتبط باسم هنا؛ أي تعديل على بياناته
+يزيد الإصدار ويغيّر الرمز، فتعيد كل عمليات gunicorn بناء نسختها عند أول فحص.
+"""
+from app import db
+from datetime import datetime
+
+
+class CacheGeneration(db.Model):
+    __tablename__ = 'cache_generation'
+
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    # رمز عشوائي لكل زيادة حتى لا يتطابق إصدار معاملة أُلغيت مع إصدار لاحق
+    token = db.Column(db.String(32))
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<CacheGeneration {self.name}={self.version}>'
@@ -0,0 +1,49 @@
+from app import db
+from datetime import datetime
+
+
+class EmailOutbox(db.Model):
+    """صندوق البريد الصادر: رسائل تنتظر الإرسال بدفعات عبر مهمة email.outbox_drain (app/utils/emailer.py)"""
+    __tablename__ = 'email_outbox'
+    __table_args__ = (
+        db.Index('idx_email_outbox_due', 'status', 'next_attempt_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    to_email = db.Column(db.String(255), nullable=False)
+    subject = db.Column(db.String(500))
+    body = db.Column(db.Text)
+    html = db.Column(db.Text)
+    provider_options = db.Column(db.Text)  # JSON (قالب SendGrid وبياناته)
+    category = db.Column(db.String(50))  # password_reset, password_changed, ...
+
+    status = db.Column(db.String(16), default='queued', nullable=False)  # queued, sending, sent, failed
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    provider = db.Column(db.String(16))
+    provider_message_id = db.Column(db.String(255))
+    claim_token = db.Column(db.String(32))
+    claimed_at = db.Column(db.DateTime)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'to_email': self.to_email,
+            'subject': self.subject,
+            'category': self.category,
+            'status': self.status,
+            'attempts': self.attempts or 0,
+            'next_attempt_at': self.next_attempt_at.isoformat() if self.next_attempt_at else None,
+            'last_error': self.last_error,
+            'provider': self.provider,
+            'provider_message_id': self.provider_message_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'sent_at': self.sent_at.isoformat() if self.sent_at else None,
+        }
+
+    def __repr__(self):
+        return f'<EmailOutbox {self.id} {self.status}>'
@@ -0,0 +1,20 @@
+"""
+أحداث البث المباشر (Server-Sent Events)
+كل تغيير يُبث (انتقال تواجد، حضور/انصراف، تعيين تذكرة) يُكتب صفاً هنا في نفس معاملة
+التغيير؛ كل عملية gunicorn تتابع الجدول بالمعرّف (وتُوقظ بـ LISTEN/NOTIFY على PostgreSQL)
+وتوزع الأحداث على اتصالات SSE المفتوحة لديها (app/utils/feed.py).
+"""
+from app import db
+from datetime import datetime
+
+
+class FeedEvent(db.Model):
+    __tablename__ = 'feed_event'
+
+    id = db.Column(db.Integer, primary_key=True)
+    channel = db.Column(db.String(32), nullable=False)  # presence / attendance / support
+    payload = db.Column(db.Text, nullable=False)  # JSON
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f'<FeedEvent {self.id} {self.channel}>'
@@ -0,0 +1,47 @@
+"""
+مواقع السياج الجغرافي (Geofence sites)
+كل فرع أو موقع ميداني مسموح التسجيل منه: دائرة (مركز + نصف قطر) أو مضلع (رؤوس lat/lng).
+يُبنى منها فهرس مكاني داخل كل عملية (app/utils/geofence.py).
+"""
+from app import db
+from datetime import datetime
+import json
+
+
+class GeofenceSite(db.Model):
+    __tablename__ = 'geofence_site'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(128), nullable=False)
+    site_type = db.Column(db.String(16), nullable=False, default='circle')  # circle / polygon
+    center_lat = db.Column(db.Float)
+    center_lng = db.Column(db.Float)
+    radius_meters = db.Column(db.Float, default=100)
+    polygon = db.Column(db.Text)  # JSON: [[lat, lng], ...]
+    is_active = db.Column(db.Boolean, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    SITE_TYPES = ('circle', 'polygon')
+
+    def get_polygon(self):
+        return json.loads(self.polygon) if self.polygon else []
+
+    def set_polygon(self, points):
+        self.polygon = json.dumps([[float(lat), float(lng)] for lat, lng in points]) if points else None
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'site_type': self.site_type,
+            'center_lat': self.center_lat,
+            'center_lng': self.center_lng,
+            'radius_meters': self.radius_meters,
+            'polygon': self.get_polygon(),
+            'is_active': bool(self.is_active),
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+        }
+
+    def __repr__(self):
+        return f'<GeofenceSite {self.name} ({self.site_type})>'
@@ -0,0 +1,26 @@
+"""
+العطل الرسمية (Public holidays)
+يوم العطلة ليس يوم عمل في تقويم الرواتب والتقارير (app/utils/work_calendar.py)
+حتى لو كان يوم الأسبوع ضمن Settings.work_days.
+"""
+from app import db
+from datetime import datetime
+
+
+class PublicHoliday(db.Model):
+    __tablename__ = 'public_holiday'
+
+    id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.Date, nullable=False, unique=True, index=True)
+    name = db.Column(db.String(128), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'date': self.date.isoformat() if self.date else None,
+            'name': self.name,
+        }
+
+    def __repr__(self):
+        return f'<PublicHoliday {self.date} {self.name}>'
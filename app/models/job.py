@@ -0,0 +1,62 @@
+"""
+نموذج المهام الخلفية (Background jobs)
+العمليات الطويلة (دفعات الرواتب، إعادة الحساب، التقارير، استيراد CSV) تُسجَّل هنا
+وتنفذها مجموعة خيوط داخل العملية أو عملية عامل منفصلة (scripts/job_worker.py).
+"""
+from app import db
+from datetime import datetime
+import json
+
+
+class BackgroundJob(db.Model):
+    __tablename__ = 'background_job'
+
+    id = db.Column(db.Integer, primary_key=True)
+    job_type = db.Column(db.String(64), nullable=False)
+    # queued, running, succeeded, failed, cancelled
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    progress = db.Column(db.Integer, default=0)  # 0-100
+    progress_message = db.Column(db.String(255))
+    payload = db.Column(db.Text)  # JSON
+    result = db.Column(db.Text)  # JSON
+    error = db.Column(db.Text)
+    cancel_requested = db.Column(db.Boolean, default=False)
+    worker_id = db.Column(db.String(64))
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    run_after = db.Column(db.DateTime)  # مهمة مؤجلة: لا تُحجز قبل هذا الوقت (UTC)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_background_job_status_created', 'status', 'created_at'),
+    )
+
+    TERMINAL_STATUSES = ('succeeded', 'failed', 'cancelled')
+
+    @property
+    def is_finished(self):
+        return self.status in self.TERMINAL_STATUSES
+
+    def get_payload(self):
+        return json.loads(self.payload) if self.payload else {}
+
+    def get_result(self):
+        return json.loads(self.result) if self.result else None
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'job_type': self.job_type,
+            'status': self.status,
+            'progress': self.progress or 0,
+            'progress_message': self.progress_message,
+            'result': self.get_result(),
+            'error': self.error,
+            'cancel_requested': bool(self.cancel_requested),
+            'created_by': self.created_by,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
@@ -1,6 +1,9 @@
 from app import db
 from datetime import datetime
 from flask import current_app
+import numpy as np
+
+from app.utils.payroll_kernel import rates_from_config, allowances_total, deductions_total, compute_net_arrays
 
 
 class Payroll(db.Model):
@@ -209,6 +212,49 @@ class Payroll(db.Model):
         }
         return breakdown
 
+    @staticmethod
+    def compute_net_many(payrolls, apply_rules=True, cfg=None):
+        """حساب الصافي لمجموعة رواتب دفعة واحدة عبر النواة العمودية (NumPy).
+        يضبط نفس الحقول التي يضبطها compute_net لكل سجل دون بناء قاموس التفصيل،
+        ويقرأ الإعدادات مرة واحدة للدفعة.
+        """
+        payrolls = list(payrolls)
+        if not payrolls:
+            return payrolls
+
+        def col(name):
+            return np.array([float(getattr(p, name) or 0.0) for p in payrolls], dtype=np.float64)
+
+        allowances = allowances_total(
+            col('housing_allowance'), col('transport_allowance'), col('food_allowance'),
+            col('phone_allowance'), col('other_allowances'), col('allowances')
+        )
+        deductions = deductions_total(
+            col('absence_deduction'), col('late_deduction'), col('loan_deduction'),
+            col('unpaid_leave_deduction'), col('other_deductions')
+        )
+        if cfg is None:
+            cfg = current_app.config if current_app else {}
+        result = compute_net_arrays(
+            col('basic'), allowances, col('bonus'), col('commission'),
+            col('overtime_amount'), col('incentives'), deductions,
+            apply_rules=apply_rules, **rates_from_config(cfg)
+        )
+
+        allowances = allowances.tolist()
+        deductions = deductions.tolist()
+        out = {k: v.tolist() for k, v in result.items()}
+        for i, p in enumerate(payrolls):
+            p.allowances = allowances[i]
+            p.deductions = deductions[i]
+            p.gross_salary = out['gross'][i]
+            p.tax = out['tax'][i]
+            p.insurance = out['insurance'][i]
+            p.health_insurance = out['health_insurance'][i]
+            p.total_deductions = out['total_deductions'][i]
+            p.net = out['net'][i]
+        return payrolls
+
     def to_dict(self):
         """تحويل إلى قاموس"""
         return {
@@ -365,3 +411,25 @@ class PayrollBatch(db.Model):
 
     def __repr__(self):
         return f'<PayrollBatch {self.year}-{self.month:02d}>'
+
+
+class PayrollDirtyMark(db.Model):
+    """علامة تغيّر مدخلات راتب موظف لشهر محدد (حضور/إجازة/سلفة).
+    تُسجَّل تلقائياً عبر أحداث ORM وتُستهلك عند إعادة الحساب التزايدية.
+    """
+    __tablename__ = 'payroll_dirty_mark'
+
+    id = db.Column(db.Integer, primary_key=True)
+    employee_id = db.Column(db.Integer, db.ForeignKey('employee.id'), nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+    month = db.Column(db.Integer, nullable=False)
+    source = db.Column(db.String(32))                     # attendance/leave/loan
+    marked_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('employee_id', 'year', 'month', name='unique_payroll_dirty_mark'),
+        db.Index('ix_payroll_dirty_mark_period', 'year', 'month'),
+    )
+
+    def __repr__(self):
+        return f'<PayrollDirtyMark emp={self.employee_id} {self.year}-{self.month:02d}>'
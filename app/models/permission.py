@@ -231,11 +231,16 @@ def assign_admin_permissions():
         return
     
     permissions = Permission.query.all()
+    added = 0
     for perm in permissions:
         rp = RolePermission.query.filter_by(role_id=admin_role.id, permission_id=perm.id).first()
         if not rp:
             rp = RolePermission(role_id=admin_role.id, permission_id=perm.id, granted=True)
             db.session.add(rp)
+            added += 1
     
+    if added:
+        from app.utils.permission_cache import invalidate_permissions
+        invalidate_permissions()
     db.session.commit()
     print(f"✅ تم تعيين {len(permissions)} صلاحية للمدير")
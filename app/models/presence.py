@@ -1,5 +1,7 @@
 from app import db
 from datetime import datetime
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.schema import CreateTable
 
 class EmployeePresence(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -9,3 +11,25 @@ class EmployeePresence(db.Model):
     session_start = db.Column(db.DateTime, default=datetime.utcnow)
     ip_address = db.Column(db.String(45))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class PresenceHeartbeat(db.Model):
+    """مخزن نبضات التواجد المشترك بين عمليات gunicorn (app/utils/presence.py).
+    بيانات مؤقتة يعاد بناؤها من النبضات التالية، لذا الجدول UNLOGGED على PostgreSQL
+    (بدون WAL)، ويُنقل منه إلى EmployeePresence على دفعات دورية.
+    """
+    __tablename__ = 'presence_heartbeat'
+    __table_args__ = {'info': {'unlogged': True}}
+
+    employee_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    last_seen = db.Column(db.DateTime, nullable=False, index=True)
+    session_start = db.Column(db.DateTime)
+    ip_address = db.Column(db.String(45))
+
+
+@compiles(CreateTable, 'postgresql')
+def _create_unlogged_table(element, compiler, **kw):
+    sql = compiler.visit_create_table(element, **kw)
+    if element.element.info.get('unlogged'):
+        sql = sql.replace('CREATE TABLE', 'CREATE UNLOGGED TABLE', 1)
+    return sql
@@ -0,0 +1,30 @@
+"""
+حالة بنية قاعدة البيانات (app/db_manager.py)
+SchemaVersion: بصمة البنية بعد كل ترحيل ناجح؛ بدء التشغيل يقارن آخر بصمة فقط ويتخطى الترحيل عند التطابق.
+  pending: خطوات تُخطيت ([!] مثل فهرس فريد ينتظر دمج المكرر) تُسجل مع البصمة ويُحذّر منها عند بدء التشغيل.
+SchemaLock: قفل على مستوى قاعدة البيانات حتى لا تُرحّل عدة عمليات (عمال gunicorn) في نفس الوقت.
+"""
+from app import db
+from datetime import datetime
+
+
+class SchemaVersion(db.Model):
+    __tablename__ = 'schema_version'
+
+    id = db.Column(db.Integer, primary_key=True)
+    fingerprint = db.Column(db.String(64), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+    applied_by = db.Column(db.String(128))  # host:pid
+    duration_ms = db.Column(db.Integer)
+    pending = db.Column(db.Text)  # رسائل [!] مفصولة بسطر جديد
+
+    def __repr__(self):
+        return f'<SchemaVersion {self.fingerprint[:12]}>'
+
+
+class SchemaLock(db.Model):
+    __tablename__ = 'schema_lock'
+
+    name = db.Column(db.String(64), primary_key=True)
+    owner = db.Column(db.String(128), nullable=False)
+    acquired_at = db.Column(db.DateTime, nullable=False)
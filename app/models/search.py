@@ -0,0 +1,29 @@
+"""
+فهرس البحث الموحد (رسائل WhatsApp، تذاكر الدعم، الشكاوى)
+صف لكل مستند مصدر بنص مطبّع (توحيد الألف/الياء/التاء المربوطة وحذف التشكيل) يُحدَّث في نفس
+معاملة التغيير؛ الفهرس النصي فوقه FTS5 على SQLite أو tsvector + GIN على PostgreSQL
+(app/utils/search_index.py).
+"""
+from app import db
+from datetime import datetime
+
+
+class SearchDocument(db.Model):
+    __tablename__ = 'search_documents'
+    __table_args__ = (
+        db.Index('uq_search_document_source', 'source', 'source_id', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    source = db.Column(db.String(16), nullable=False)  # whatsapp, client_support, complaint, ticket
+    source_id = db.Column(db.Integer, nullable=False)
+    title = db.Column(db.Text)  # اسم العميل (مطبّع)
+    body = db.Column(db.Text)   # نص الرسالة/المشكلة (مطبّع)
+    phone = db.Column(db.Text)  # أرقام الهاتف بالصيغة الدولية والمحلية
+    display_name = db.Column(db.String(128))
+    preview = db.Column(db.String(300))  # بداية النص الأصلي للعرض
+    source_created_at = db.Column(db.DateTime)
+    indexed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<SearchDocument {self.source}:{self.source_id}>'
@@ -41,33 +41,14 @@ class User(UserMixin, db.Model):
         return False
     
     def check_permission(self, module, action):
-        """فحص صلاحية محددة"""
-        from app.models.permission import Permission, RolePermission, UserRole
-        
-        # جلب الأدوار المعينة للمستخدم
-        user_roles = UserRole.query.filter_by(user_id=self.id).all()
-        
-        for user_role in user_roles:
-            role = user_role.role
-            if not role.is_active:
-                continue
-            
-            # البحث عن الصلاحية
-            perm = Permission.query.filter_by(module=module, action=action).first()
-            if not perm:
-                continue
-            
-            # فحص إذا كان الدور يمتلك هذه الصلاحية
-            role_perm = RolePermission.query.filter_by(
-                role_id=role.id,
-                permission_id=perm.id,
-                granted=True
-            ).first()
-            
-            if role_perm:
-                return True
-        
-        return False
+        """فحص صلاحية محددة (بحث في مجموعة الصلاحيات المخزنة مؤقتاً، بدون استعلامات)"""
+        from app.utils.permission_cache import effective_permissions
+        return (module, action) in effective_permissions(self.id)
+    
+    def get_effective_permissions(self):
+        """مجموعة (module, action) الممنوحة للمستخدم عبر أدواره النشطة"""
+        from app.utils.permission_cache import effective_permissions
+        return effective_permissions(self.id)
     
     def get_roles(self):
         """الحصول على قائمة الأدوار المعينة"""
@@ -91,7 +72,5 @@ class User(UserMixin, db.Model):
     
     def has_any_permission(self, module, actions):
         """فحص إذا كان المستخدم يمتلك أي من الصلاحيات المطلوبة"""
-        for action in actions:
-            if self.check_permission(module, action):
-                return True
-        return False
+        perms = self.get_effective_permissions()
+        return any((module, action) in perms for action in actions)
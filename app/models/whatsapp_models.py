@@ -8,9 +8,15 @@ from datetime import datetime
 class WhatsAppConversation(db.Model):
     """محادثات واتساب مع العملاء"""
     __tablename__ = 'whatsapp_conversations'
+    __table_args__ = (
+        # محادثة واحدة لكل رقم (مستهلك صندوق الوارد ينشئ المحادثات بالدفعات)
+        db.Index('uq_whatsapp_conversation_phone', 'customer_phone', unique=True),
+        # صفحات القائمة بالأحدث نشاطاً (keyset على updated_at, id) ووضع since
+        db.Index('idx_whatsapp_conversation_updated', 'updated_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
-    customer_phone = db.Column(db.String(20), nullable=False, index=True)
+    customer_phone = db.Column(db.String(20), nullable=False)
     customer_name = db.Column(db.String(100))
     last_message = db.Column(db.Text)
     last_message_type = db.Column(db.String(20))  # text, audio, image, document
@@ -45,6 +51,13 @@ class WhatsAppConversation(db.Model):
 class WhatsAppMessage(db.Model):
     """رسائل واتساب الفردية"""
     __tablename__ = 'whatsapp_messages'
+    __table_args__ = (
+        # Meta تعيد إرسال نفس الـ webhook عند التأخر: معرّف الرسالة يمنع التكرار
+        db.Index('uq_whatsapp_message_id', 'message_id', unique=True),
+        # صفحات المحادثة (keyset على timestamp, id) والتغييرات منذ آخر استطلاع (since)
+        db.Index('idx_whatsapp_message_history', 'conversation_id', 'timestamp', 'id'),
+        db.Index('idx_whatsapp_message_changes', 'conversation_id', 'updated_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     conversation_id = db.Column(db.Integer, db.ForeignKey('whatsapp_conversations.id'), nullable=False)
@@ -63,6 +76,7 @@ class WhatsAppMessage(db.Model):
     status = db.Column(db.String(20), default='sent')  # sent, delivered, read, failed
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # تغيّر الحالة (since)
     
     def to_dict(self):
         """تحويل إلى قاموس للـ JSON"""
@@ -84,6 +98,56 @@ class WhatsAppMessage(db.Model):
         }
 
 
+class WhatsAppInbox(db.Model):
+    """صندوق الوارد: حمولات webhook الخام كما وصلت، تُعالج في الخلفية (app/utils/whatsapp_inbox.py)"""
+    __tablename__ = 'whatsapp_inbox'
+    __table_args__ = (
+        db.Index('idx_whatsapp_inbox_status', 'status', 'id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    payload = db.Column(db.Text, nullable=False)  # جسم الطلب JSON كما هو
+    status = db.Column(db.String(16), default='queued', nullable=False)  # queued, processing, done, failed
+    attempts = db.Column(db.Integer, default=0)
+    error = db.Column(db.Text)
+    claim_token = db.Column(db.String(32))
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
+    claimed_at = db.Column(db.DateTime)
+    next_attempt_at = db.Column(db.DateTime)  # إعادة المحاولة بعد فشل (تراجع أُسّي)
+    processed_at = db.Column(db.DateTime)
+
+
+class WhatsAppOutbox(db.Model):
+    """صندوق الصادر: رسائل تنتظر الإرسال عبر Graph API بالترتيب لكل رقم (app/utils/whatsapp_outbox.py)"""
+    __tablename__ = 'whatsapp_outbox'
+    __table_args__ = (
+        db.Index('idx_whatsapp_outbox_due', 'status', 'next_attempt_at'),
+        db.Index('idx_whatsapp_outbox_phone', 'phone', 'id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    phone = db.Column(db.String(20), nullable=False)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('whatsapp_conversations.id'))
+    message_row_id = db.Column(db.Integer, db.ForeignKey('whatsapp_messages.id'))  # رسالة المحادثة (إن أُنشئت مسبقاً)
+    message_type = db.Column(db.String(20), default='text')  # text, audio
+    body = db.Column(db.Text)
+    media_path = db.Column(db.String(500))  # ملف محلي يُرفع قبل الإرسال
+    media_url = db.Column(db.String(500))   # الرابط المعروض في المحادثة
+    broadcast_id = db.Column(db.String(32), index=True)
+    
+    status = db.Column(db.String(16), default='queued', nullable=False)  # queued, sending, sent, failed
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    wa_message_id = db.Column(db.String(255))
+    claim_token = db.Column(db.String(32))
+    claimed_at = db.Column(db.DateTime)
+    
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+
 class WhatsAppTemplate(db.Model):
     """قوالب الردود الجاهزة"""
     __tablename__ = 'whatsapp_templates'
@@ -79,11 +79,7 @@ def check_any_permission(module, actions):
     if current_user.username == '1' or current_user.role == 'admin':
         return True
     
-    for action in actions:
-        if current_user.check_permission(module, action):
-            return True
-    
-    return False
+    return current_user.has_any_permission(module, actions)
 
 
 def get_user_permissions(user=None):
@@ -99,21 +95,8 @@ def get_user_permissions(user=None):
     
     permissions = {}
     
-    for user_role in user.user_roles:
-        if not user_role.role.is_active:
-            continue
-        
-        for role_perm in user_role.role.permissions:
-            if role_perm.granted:
-                perm = role_perm.permission
-                module = perm.module
-                action = perm.action
-                
-                if module not in permissions:
-                    permissions[module] = []
-                
-                if action not in permissions[module]:
-                    permissions[module].append(action)
+    for module, action in sorted(user.get_effective_permissions()):
+        permissions.setdefault(module, []).append(action)
     
     return permissions
 
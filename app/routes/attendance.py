@@ -1,15 +1,29 @@
 from flask import Blueprint, render_template, request, session, current_app, jsonify
 from flask_login import login_required, current_user
 from app.models.attendance import Attendance, AttendanceSettings, RegisteredDevice
-from sqlalchemy import inspect, text
+from sqlalchemy import false, inspect, text
 from app import db, csrf
 from app.models.employee import Employee
 from app.permissions import has_permission
+from app.utils.jobs import job_handler, submit_job
+from app.utils.attendance_import import import_attendance_rows, read_header
+from app.utils.attendance_daily import (
+    daily_rules, date_chunks, history_bounds, mark_rollup_built, rebuild_range, rollup_ready, rules_signature
+)
+from app.utils.identity import current_employee
+from app.utils.settings_cache import attendance_settings
+from app.utils.geofence import get_geofence_index
+from app.utils.checkin import (
+    CheckinRequest, record_checkin, CHECK_IN, CHECK_OUT,
+    CREATED, ALREADY_CHECKED_IN, NOT_CHECKED_IN, ALREADY_CHECKED_OUT, PENDING
+)
 from flask_wtf.csrf import CSRFError
 from flask import flash, redirect, url_for
 from datetime import datetime, date, time
+import os
+import time as time_module
+import uuid
 from math import radians, cos, sin, asin, sqrt
-import csv
 from io import StringIO
 
 attendance_bp = Blueprint('attendance', __name__)
@@ -35,16 +49,12 @@ def calculate_distance(lat1, lon1, lat2, lon2):
     return c * r * 1000
 
 
-def verify_location(lat, lng):
+def verify_location(lat, lng, settings=None):
     """
-    التحقق من أن الموقع داخل النطاق المسموح
+    التحقق من أن الموقع داخل أحد المواقع المسموحة (السياج الجغرافي)
     """
-    settings = AttendanceSettings.query.first()
-    if not settings:
-        # إنشاء إعدادات افتراضية
-        settings = AttendanceSettings()
-        db.session.add(settings)
-        db.session.commit()
+    if settings is None:
+        settings = attendance_settings()
     
     if not settings.require_location_verification:
         return True, "التحقق من الموقع معطل"
@@ -52,28 +62,30 @@ def verify_location(lat, lng):
     if not lat or not lng:
         return False, "الموقع غير متوفر"
     
-    distance = calculate_distance(
-        settings.company_lat,
-        settings.company_lng,
-        lat,
-        lng
-    )
-    
-    if distance <= settings.max_distance_meters:
-        return True, f"الموقع صحيح (المسافة: {int(distance)} متر)"
-    else:
-        return False, f"الموقع بعيد عن الشركة (المسافة: {int(distance)} متر، المسموح: {settings.max_distance_meters} متر)"
+    index = get_geofence_index()
+    match = index.locate(lat, lng)
+    if match is None:
+        return False, "لم يتم تعريف أي موقع مسموح"
+    distance = int(match.distance_meters)
+
+    if index.fallback:
+        # موقع الشركة الوحيد من إعدادات الحضور (بدون مواقع معرّفة)
+        if match.inside:
+            return True, f"الموقع صحيح (المسافة: {distance} متر)"
+        return False, f"الموقع بعيد عن الشركة (المسافة: {distance} متر، المسموح: {int(match.allowed_meters)} متر)"
 
+    if match.inside:
+        return True, f"الموقع صحيح - {match.site_name} (المسافة: {distance} متر)"
+    allowed = f"، المسموح: {int(match.allowed_meters)} متر" if match.allowed_meters is not None else ""
+    return False, f"الموقع خارج المواقع المسموحة (أقرب موقع: {match.site_name}، المسافة: {distance} متر{allowed})"
 
-def verify_time(action):
+
+def verify_time(action, settings=None):
     """
     التحقق من أن الوقت ضمن ساعات العمل المسموحة
     """
-    settings = AttendanceSettings.query.first()
-    if not settings:
-        settings = AttendanceSettings()
-        db.session.add(settings)
-        db.session.commit()
+    if settings is None:
+        settings = attendance_settings()
     
     if not settings.require_time_verification:
         return True, "التحقق من الوقت معطل"
@@ -99,12 +111,13 @@ def verify_time(action):
     return True, ""
 
 
-def verify_device(employee_id, mac_address):
+def verify_device(employee_id, mac_address, settings=None):
     """
     التحقق من أن الجهاز مسجل للموظف
     """
-    settings = AttendanceSettings.query.first()
-    if not settings or not settings.require_device_verification:
+    if settings is None:
+        settings = attendance_settings()
+    if not settings.require_device_verification:
         return True, "التحقق من الجهاز معطل"
     
     if not mac_address:
@@ -117,9 +130,7 @@ def verify_device(employee_id, mac_address):
     ).first()
     
     if device:
-        # تحديث آخر استخدام
-        device.last_used = datetime.now()
-        db.session.commit()
+        # last_used يُحدَّث مع سجل الحضور في نفس المعاملة (app/utils/checkin.py)
         return True, f"الجهاز مسجل: {device.device_name or mac_address}"
     else:
         return False, f"الجهاز غير مسجل للموظف (MAC: {mac_address})"
@@ -139,7 +150,8 @@ def attendance():
 
     # إذا كان المستخدم لديه صلاحية عرض سجلاته فقط
     if not current_user.has_permission(module='attendance', action='view'):
-        query = query.filter(Attendance.employee_id == current_user.id)
+        employee = current_employee()
+        query = query.filter(Attendance.employee_id == employee.id) if employee is not None else query.filter(false())
     
     if search_date:
         from datetime import datetime
@@ -171,28 +183,10 @@ def attendance():
         # المدير يمكنه تسجيل حضور جميع الموظفين
         employees = Employee.query.filter_by(active=True).order_by(Employee.name).all()
     else:
-        # الموظف العادي يسجل حضوره فقط
-        # محاولة الحصول على معلومات الموظف من session أو username
-        employee_id = session.get('employee_id')
-        if employee_id:
-            employee = Employee.query.get(employee_id)
-            if employee:
-                employees = [employee]
-        elif current_user.username.startswith('emp_'):
-            # استخراج ID الموظف من username
-            try:
-                emp_id = int(current_user.username.split('_')[1])
-                employee = Employee.query.get(emp_id)
-                if employee:
-                    employees = [employee]
-            except:
-                pass
-        
-        # إذا لم نجد الموظف بعد، نحاول البحث برقم المستخدم
-        if not employees and current_user.username.isdigit():
-            employee = Employee.query.get(int(current_user.username))
-            if employee:
-                employees = [employee]
+        # الموظف العادي يسجل حضوره فقط (الموظف المرتبط محلول مسبقاً في هوية الطلب)
+        employee = current_employee()
+        if employee:
+            employees = [employee]
     
     # حساب إحصائيات اليوم
     from datetime import date
@@ -217,7 +211,7 @@ def attendance():
 @attendance_bp.route('/api/attendance/import', methods=['POST'])
 @login_required
 def import_attendance_csv():
-    """استيراد سجلات الحضور من ملف CSV.
+    """استيراد سجلات الحضور من ملف CSV كمهمة خلفية؛ يرجع رقم المهمة فوراً (202).
     تنسيقات الأعمدة المدعومة (case-insensitive):
       - date, employee_id, check_in, check_out
       - date, employee_code, check_in, check_out
@@ -234,104 +228,104 @@ def import_attendance_csv():
     if not f or f.filename == '':
         return jsonify({'status': 'error', 'message': 'اسم الملف غير صالح'}), 400
 
+    # الملف يُنسخ للقرص بالتدفق ويُقرأ منه سطراً بسطر؛ مع عامل منفصل (JOBS_IN_PROCESS=0)
+    # يجب أن يكون ATTENDANCE_IMPORT_SPOOL_DIR مجلداً مشتركاً بين الويب والعامل
+    path = os.path.join(_import_spool_dir(), f'{uuid.uuid4().hex}.csv')
+    f.save(path)
+    payload = {'filename': f.filename, 'path': path}
+
+    open_source = _import_source(payload)
     try:
-        content = f.read().decode('utf-8-sig')
-        reader = csv.DictReader(StringIO(content))
-        required_cols = set([c.lower() for c in reader.fieldnames or []])
-        if not required_cols:
-            return jsonify({'status': 'error', 'message': 'ملف CSV فارغ أو بدون رأس'}), 400
-
-        count_created = 0
-        count_updated = 0
-        errors = []
-
-        for i, row in enumerate(reader, start=2):  # يبدأ العد من 2 (بعد الرأس)
-            try:
-                # قراءة الحقول مع عدة احتمالات للأسماء
-                date_str = row.get('date') or row.get('Date') or row.get('DATE')
-                emp_id = row.get('employee_id') or row.get('emp_id')
-                emp_code = row.get('employee_code') or row.get('code')
-                check_in = row.get('check_in') or row.get('in') or row.get('checkin')
-                check_out = row.get('check_out') or row.get('out') or row.get('checkout')
-
-                if not date_str or not (emp_id or emp_code):
-                    errors.append(f'سطر {i}: بيانات ناقصة (date/employee)')
-                    continue
-
-                # حدد الموظف
-                employee = None
-                if emp_id:
-                    try:
-                        employee = Employee.query.get(int(emp_id))
-                    except Exception:
-                        employee = None
-                if not employee and emp_code:
-                    employee = Employee.query.filter_by(code=str(emp_code).strip()).first()
-                if not employee:
-                    errors.append(f'سطر {i}: لم يتم العثور على الموظف (id/code)')
-                    continue
-
-                # تحويل التاريخ والأوقات
-                d = datetime.strptime(date_str.strip(), '%Y-%m-%d').date()
-
-                def parse_time(t):
-                    if not t or str(t).strip() == '':
-                        return None
-                    t = str(t).strip()
-                    fmts = ['%H:%M:%S', '%H:%M']
-                    for fmt in fmts:
-                        try:
-                            tt = datetime.strptime(t, fmt).time()
-                            return tt
-                        except Exception:
-                            pass
-                    return None
-
-                tin = parse_time(check_in)
-                tout = parse_time(check_out)
-
-                # ابحث أو أنشئ السجل
-                att = Attendance.query.filter_by(employee_id=employee.id, date=d).first()
-                if not att:
-                    att = Attendance(employee_id=employee.id, date=d)
-                    db.session.add(att)
-                    created = True
-                else:
-                    created = False
-
-                # حدّث الحقول
-                if tin:
-                    att.check_in_time = datetime.combine(d, tin)
-                if tout:
-                    att.check_out_time = datetime.combine(d, tout)
-
-                # حالة داخل/خارج حسب توافر check_out
-                if att.check_out_time:
-                    att.status = 'outside'
-                elif att.check_in_time:
-                    att.status = 'inside'
-
-                if created:
-                    count_created += 1
-                else:
-                    count_updated += 1
-
-            except Exception as row_err:
-                errors.append(f'سطر {i}: {row_err}')
+        header = read_header(open_source)
+    except UnicodeDecodeError:
+        header = None
+    if not header:
+        _discard_import_file(payload)
+        if header is None:
+            return jsonify({'status': 'error', 'message': 'الملف ليس نصاً بترميز UTF-8'}), 400
+        return jsonify({'status': 'error', 'message': 'ملف CSV فارغ أو بدون رأس'}), 400
+
+    job = submit_job('attendance.import_csv', payload, user_id=current_user.id)
+    return jsonify({'status': 'accepted', 'job_id': job.id, 'job': job.to_dict()}), 202
+
+
+_SPOOL_MAX_AGE = 24 * 3600  # ملفات مهام أُلغيت قبل تشغيلها
+
+
+def _import_spool_dir():
+    spool_dir = current_app.config.get('ATTENDANCE_IMPORT_SPOOL_DIR') or os.path.join(current_app.instance_path, 'imports')
+    os.makedirs(spool_dir, exist_ok=True)
+    cutoff = time_module.time() - _SPOOL_MAX_AGE
+    for name in os.listdir(spool_dir):
+        stale = os.path.join(spool_dir, name)
+        try:
+            if os.path.getmtime(stale) < cutoff:
+                os.remove(stale)
+        except OSError:
+            pass
+    return spool_dir
+
+
+def _import_source(payload):
+    """دالة تفتح مصدر الاستيراد كملف نصي (ملف على القرص، أو محتوى مهام قديمة حُفظ مع المهمة)."""
+    if payload.get('path'):
+        return lambda: open(payload['path'], 'r', encoding='utf-8-sig', newline='')
+    content = payload.get('content') or ''
+    return lambda: StringIO(content)
 
+
+def _discard_import_file(payload):
+    if payload.get('path'):
+        try:
+            os.remove(payload['path'])
+        except OSError:
+            pass
+
+
+@job_handler('attendance.daily_rebuild')
+def _run_daily_rebuild(ctx):
+    """إعادة بناء التجميع اليومي على أجزاء أسبوعية مع commit بعد كل جزء.
+    بدون start: كامل التاريخ ثم تفعيل القراءة من التجميع (mark_rollup_built).
+    """
+    full = not ctx.payload.get('start')
+    if full:
+        bounds = history_bounds(db.session.connection())
+        db.session.commit()
+        if bounds is None:
+            mark_rollup_built()
+            db.session.commit()
+            return {'status': 'success', 'rows': 0}
+        first, last = bounds
+    else:
+        first = date.fromisoformat(ctx.payload['start'])
+        last = date.fromisoformat(ctx.payload.get('end') or ctx.payload['start'])
+    chunks = list(date_chunks(first, last))
+    rules = daily_rules()
+    rows = 0
+    for n, (start, end) in enumerate(chunks, start=1):
+        with db.engine.begin() as connection:
+            rows += rebuild_range(connection, start, end, rules=rules)
+        ctx.progress(100 * n // len(chunks), f'{end.isoformat()} ({rows} صف)')
+    if full:
+        mark_rollup_built()
         db.session.commit()
+    return {'status': 'success', 'rows': rows, 'start': first.isoformat(), 'end': last.isoformat()}
 
-        return jsonify({
-            'status': 'success',
-            'created': count_created,
-            'updated': count_updated,
-            'errors': errors
-        })
 
-    except Exception as e:
-        db.session.rollback()
-        current_app.logger.error(f"CSV import error: {e}")
-        return jsonify({'status': 'error', 'message': str(e)}), 500
+@job_handler('attendance.import_csv', transient_payload=True)
+def _run_import_attendance_csv(ctx):
+    """تنفيذ الاستيراد بالتدفق على أجزاء مع commit بعد كل جزء (app/utils/attendance_import.py).
+    عند الإلغاء تبقى الأجزاء التي حُفظت قبلها.
+    """
+    try:
+        return import_attendance_rows(
+            _import_source(ctx.payload), ctx,
+            chunk_size=int(current_app.config.get('ATTENDANCE_IMPORT_CHUNK', 2000))
+        )
+    except UnicodeDecodeError:
+        raise ValueError('الملف ليس نصاً بترميز UTF-8')
+    finally:
+        _discard_import_file(ctx.payload)
 
 @attendance_bp.route('/api/attendance', methods=['POST'])
 @csrf.exempt  # تعطيل CSRF لهذا الـ API
@@ -372,21 +366,27 @@ def api_attendance():
     
     if not employee_id or not action:
         return jsonify({'status': 'error', 'message': 'بيانات الطلب غير مكتملة'}), 400
+    try:
+        employee_id = int(employee_id)
+    except (TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'رقم الموظف غير صالح'}), 400
+
+    # لقطة واحدة من الإعدادات لكل الفحوصات (بدون استعلام عند وجودها في الكاش)
+    settings = attendance_settings()
 
     # التحقق من الموقع
-    location_ok, location_msg = verify_location(lat, lng)
+    location_ok, location_msg = verify_location(lat, lng, settings)
     
     # التحقق من الوقت
-    time_ok, time_msg = verify_time(action)
+    time_ok, time_msg = verify_time(action, settings)
     
     # التحقق من الجهاز
-    device_ok, device_msg = verify_device(employee_id, mac_address)
+    device_ok, device_msg = verify_device(employee_id, mac_address, settings)
     
     # جمع الملاحظات
     verification_notes = f"الموقع: {location_msg}\nالوقت: {time_msg}\nالجهاز: {device_msg}"
     
     # إذا فشل أي تحقق، إرجاع خطأ
-    settings = AttendanceSettings.query.first()
     if settings:
         if settings.require_location_verification and not location_ok:
             return jsonify({
@@ -421,74 +421,35 @@ def api_attendance():
                 }
             }), 403
     
-    today = date.today()
-    
-    # ابحث عن سجل حضور موجود اليوم
-    existing_attendance = Attendance.query.filter_by(employee_id=employee_id, date=today).first()
+    if action not in (CHECK_IN, CHECK_OUT):
+        return jsonify({'status': 'error', 'message': 'نوع العملية غير معروف'}), 400
+
+    # كتابة واحدة: الفهرس الفريد (employee_id, date) يمنع التكرار بدل الفحص المسبق
+    outcome = record_checkin(CheckinRequest(
+        employee_id, action, lat=lat, lng=lng, address=address, mac_address=mac_address,
+        device_info=device_info, location_ok=location_ok, time_ok=time_ok, device_ok=device_ok,
+        notes=verification_notes
+    ))
+    if outcome == ALREADY_CHECKED_IN:
+        return jsonify({'status': 'error', 'message': 'تم تسجيل الحضور لهذا الموظف اليوم بالفعل'}), 409
+    if outcome == NOT_CHECKED_IN:
+        return jsonify({'status': 'error', 'message': 'لا يمكن تسجيل الانصراف قبل تسجيل الحضور'}), 404
+    if outcome == ALREADY_CHECKED_OUT:
+        return jsonify({'status': 'error', 'message': 'تم تسجيل الانصراف لهذا الموظف اليوم بالفعل'}), 409
+    if outcome == PENDING:
+        # الطلب في طابور الكتابة وسيُسجَّل: إعادة المحاولة غير مطلوبة
+        return jsonify({'status': 'success', 'pending': True,
+                        'message': 'تم استلام الطلب وجارٍ تسجيله، لا داعي لإعادة المحاولة'}), 202
 
-    if action == 'حضور':
-        if existing_attendance:
-            return jsonify({'status': 'error', 'message': 'تم تسجيل الحضور لهذا الموظف اليوم بالفعل'}), 409
-        
-        new_attendance = Attendance(
-            employee_id=employee_id,
-            date=today,
-            check_in_time=datetime.now(),
-            lat=lat,
-            lng=lng,
-            address=address,
-            mac_address=mac_address,
-            device_info=device_info,
-            location_verified=location_ok,
-            time_verified=time_ok,
-            device_verified=device_ok,
-            verification_notes=verification_notes,
-            status='inside'
-        )
-        db.session.add(new_attendance)
-        db.session.commit()
-        
-        return jsonify({
-            'status': 'success', 
-            'message': 'تم تسجيل الحضور بنجاح',
-            'verification_details': {
-                'location': {'verified': location_ok, 'message': location_msg},
-                'time': {'verified': time_ok, 'message': time_msg},
-                'device': {'verified': device_ok, 'message': device_msg}
-            }
-        })
-
-    elif action == 'انصراف':
-        if not existing_attendance:
-            return jsonify({'status': 'error', 'message': 'لا يمكن تسجيل الانصراف قبل تسجيل الحضور'}), 404
-        
-        if existing_attendance.check_out_time:
-            return jsonify({'status': 'error', 'message': 'تم تسجيل الانصراف لهذا الموظف اليوم بالفعل'}), 409
-            
-        existing_attendance.check_out_time = datetime.now()
-        existing_attendance.lat_out = lat
-        existing_attendance.lng_out = lng
-        existing_attendance.address_out = address
-        existing_attendance.status = 'outside'
-        
-        # تحديث معلومات التحقق عند الانصراف
-        if not existing_attendance.verification_notes:
-            existing_attendance.verification_notes = ""
-        existing_attendance.verification_notes += f"\n\nعند الانصراف:\n{verification_notes}"
-        
-        db.session.commit()
-        
-        return jsonify({
-            'status': 'success', 
-            'message': 'تم تسجيل الانصراف بنجاح',
-            'verification_details': {
-                'location': {'verified': location_ok, 'message': location_msg},
-                'time': {'verified': time_ok, 'message': time_msg},
-                'device': {'verified': device_ok, 'message': device_msg}
-            }
-        })
-
-    return jsonify({'status': 'error', 'message': 'نوع العملية غير معروف'}), 400
+    return jsonify({
+        'status': 'success', 
+        'message': 'تم تسجيل الحضور بنجاح' if outcome == CREATED else 'تم تسجيل الانصراف بنجاح',
+        'verification_details': {
+            'location': {'verified': location_ok, 'message': location_msg},
+            'time': {'verified': time_ok, 'message': time_msg},
+            'device': {'verified': device_ok, 'message': device_msg}
+        }
+    })
 
 @attendance_bp.route('/attendance-map', methods=['GET'])
 @login_required
@@ -517,7 +478,9 @@ def attendance_map():
 def delete_attendance(attendance_id):
     """حذف سجل الحضور والانصراف"""
     attendance_record = Attendance.query.get_or_404(attendance_id)
-    if not has_permission(['admin', 'manager']) and attendance_record.employee_id != current_user.id:
+    employee = current_employee()
+    own = employee is not None and attendance_record.employee_id == employee.id
+    if not own and not has_permission(['admin', 'manager']):
         return {'error': 'Unauthorized'}, 403
     db.session.delete(attendance_record)
     db.session.commit()
@@ -635,11 +598,7 @@ def toggle_device(device_id):
 @login_required
 def get_attendance_settings():
     """الحصول على إعدادات الحضور"""
-    settings = AttendanceSettings.query.first()
-    if not settings:
-        settings = AttendanceSettings()
-        db.session.add(settings)
-        db.session.commit()
+    settings = attendance_settings()
     
     return jsonify({
         'id': settings.id,
@@ -665,6 +624,7 @@ def update_attendance_settings():
         return jsonify({'status': 'error', 'message': 'غير مصرح لك'}), 403
     
     data = request.get_json()
+    previous_rules = rules_signature()
     settings = AttendanceSettings.query.first()
     
     if not settings:
@@ -700,6 +660,10 @@ def update_attendance_settings():
     settings.updated_at = datetime.now()
     db.session.commit()
     
+    # صفوف التجميع اليومي محسوبة على القواعد السابقة (check_in_end)
+    if rules_signature() != previous_rules and rollup_ready():
+        submit_job('attendance.daily_rebuild', {}, user_id=current_user.id)
+    
     return jsonify({
         'status': 'success',
         'message': 'تم تحديث الإعدادات بنجاح'
@@ -1,19 +1,27 @@
 """
 Routes للتقارير المتقدمة والتكامل مع الرواتب
 """
-from flask import Blueprint, render_template, request, jsonify, session
+from flask import Blueprint, current_app, render_template, request, jsonify, session
 from flask_login import login_required, current_user
 from app import db, csrf
-from app.models.attendance import Attendance, AttendanceSettings
+from app.models.attendance import Attendance, AttendanceDaily
 from app.models.attendance_advanced import (
-    AttendanceReport, AttendanceSync, AttendanceRBAC, PayrollAttendanceLink
+    AttendanceReport, AttendanceRBAC, PayrollAttendanceLink
 )
-from app.models.employee import Employee
+from app.models.job import BackgroundJob
 from app.models.payroll import Payroll
 from app.permissions import has_permission
+from app.utils.attendance_daily import PRESENT, rollup_ready
+from app.utils.attendance_sync import drain_sync_queue, enqueue_sync_records, next_retry_in, pending_count
+from app.utils.jobs import job_handler, submit_job, submit_once
+from app.utils.late_stats import late_statistics as late_statistics_query
+from app.utils.report_engine import (
+    build_report_rows, compute_report_stats, compute_stats_parallel, link_reports_to_payroll,
+    report_employee_ids, upsert_reports
+)
+from app.utils.settings_cache import attendance_settings
 from datetime import datetime, date, timedelta
-from sqlalchemy import func, and_, or_
-import json
+from sqlalchemy import case, func, and_, or_
 
 attendance_reports_bp = Blueprint('attendance_reports', __name__)
 
@@ -46,25 +54,36 @@ def reports_dashboard():
         start_date = today
         end_date = today
     
-    # بناء الاستعلام
-    query = Attendance.query.filter(
-        Attendance.date >= start_date,
-        Attendance.date <= end_date
-    )
-    
+    # الإحصائيات العامة باستعلام تجميعي واحد (من التجميع اليومي إن كان مبنياً)
+    if rollup_ready():
+        source = AttendanceDaily
+        check_in, check_out = AttendanceDaily.first_in, AttendanceDaily.last_out
+        conditions = [AttendanceDaily.day_status == PRESENT]
+    else:
+        source = Attendance
+        check_in, check_out = Attendance.check_in_time, Attendance.check_out_time
+        conditions = []
+    conditions += [source.date >= start_date, source.date <= end_date]
     if employee_id:
-        query = query.filter_by(employee_id=employee_id)
+        conditions.append(source.employee_id == employee_id)
+
+    def violations(column):
+        return func.coalesce(func.sum(case((column == False, 1), else_=0)), 0)
+
+    totals = db.session.query(
+        func.count(check_in), func.count(check_out),
+        violations(source.location_verified), violations(source.time_verified), violations(source.device_verified)
+    ).filter(*conditions).one()
     
-    # الإحصائيات العامة
     stats = {
         'period': period,
         'start_date': start_date.isoformat(),
         'end_date': end_date.isoformat(),
-        'total_checkins': query.filter(Attendance.check_in_time.isnot(None)).count(),
-        'total_checkouts': query.filter(Attendance.check_out_time.isnot(None)).count(),
-        'location_violations': query.filter(Attendance.location_verified == False).count(),
-        'time_violations': query.filter(Attendance.time_verified == False).count(),
-        'device_violations': query.filter(Attendance.device_verified == False).count(),
+        'total_checkins': totals[0],
+        'total_checkouts': totals[1],
+        'location_violations': totals[2],
+        'time_violations': totals[3],
+        'device_violations': totals[4],
     }
     
     return render_template('attendance_reports.html', 
@@ -81,7 +100,10 @@ def late_statistics():
         return jsonify({'error': 'Unauthorized'}), 403
     
     period = request.args.get('period', 'month')
-    limit = int(request.args.get('limit', 10))
+    try:
+        limit = min(max(int(request.args.get('limit', 10)), 0), 1000)
+    except ValueError:
+        return jsonify({'error': 'Invalid limit'}), 400
     
     # تحديد الفترة
     today = date.today()
@@ -93,66 +115,19 @@ def late_statistics():
         start_date = today - timedelta(days=30)
     
     # الحصول على إعدادات النظام
-    settings = AttendanceSettings.query.first()
+    settings = attendance_settings()
     if not settings:
         return jsonify({'error': 'Settings not found'}), 404
     
-    # حساب التأخير لكل موظف
-    late_employees = []
-    
-    employees = Employee.query.filter_by(active=True).all()
-    for emp in employees:
-        attendances = Attendance.query.filter(
-            Attendance.employee_id == emp.id,
-            Attendance.date >= start_date,
-            Attendance.check_in_time.isnot(None)
-        ).all()
-        
-        if not attendances:
-            continue
-        
-        total_late_minutes = 0
-        late_count = 0
-        
-        for att in attendances:
-            check_in_time = att.check_in_time.time()
-            if settings.check_in_end and check_in_time > settings.check_in_end:
-                # حساب دقائق التأخير
-                expected = datetime.combine(att.date, settings.check_in_end)
-                actual = att.check_in_time
-                late_minutes = int((actual - expected).total_seconds() / 60)
-                
-                # فترة السماح
-                grace_period = getattr(settings, 'grace_period_minutes', 15)
-                if late_minutes > grace_period:
-                    total_late_minutes += late_minutes
-                    late_count += 1
-        
-        if late_count > 0:
-            late_employees.append({
-                'id': emp.id,
-                'name': emp.name,
-                'department': emp.department,
-                'total_late_minutes': total_late_minutes,
-                'late_count': late_count,
-                'average_late_minutes': round(total_late_minutes / late_count, 2)
-            })
-    
-    # ترتيب حسب إجمالي التأخير
-    late_employees.sort(key=lambda x: x['total_late_minutes'], reverse=True)
-    
-    # حساب المتوسط العام
-    if late_employees:
-        overall_average = sum(e['average_late_minutes'] for e in late_employees) / len(late_employees)
-    else:
-        overall_average = 0
+    # التجميع والترتيب و Top-N داخل قاعدة البيانات (app/utils/late_stats.py)
+    top_late, late_employee_count, overall_average = late_statistics_query(start_date, limit=limit, settings=settings)
     
     return jsonify({
         'period': period,
         'start_date': start_date.isoformat(),
         'overall_average_late_minutes': round(overall_average, 2),
-        'total_late_employees': len(late_employees),
-        'top_late_employees': late_employees[:limit]
+        'total_late_employees': late_employee_count,
+        'top_late_employees': top_late
     })
 
 
@@ -160,7 +135,7 @@ def late_statistics():
 @csrf.exempt
 @login_required
 def generate_report():
-    """توليد تقرير حضور مجمّع"""
+    """توليد تقرير حضور مجمّع كمهمة خلفية؛ يرجع رقم المهمة فوراً (202)"""
     if not current_user.has_permission(module='attendance', action='view'):
         return jsonify({'error': 'Unauthorized'}), 403
     
@@ -169,106 +144,121 @@ def generate_report():
         return jsonify({'error': 'No data provided'}), 400
         
     employee_id = data.get('employee_id')
-    period_type = data.get('period_type', 'monthly')
-    period_start = datetime.strptime(data.get('period_start'), '%Y-%m-%d').date()
-    period_end = datetime.strptime(data.get('period_end'), '%Y-%m-%d').date()
-    
     if not employee_id:
         return jsonify({'error': 'Employee ID required'}), 400
+    try:
+        employee_id = int(employee_id)
+        period_start = datetime.strptime(data.get('period_start'), '%Y-%m-%d').date()
+        period_end = datetime.strptime(data.get('period_end'), '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid employee or period dates'}), 400
+
+    job = submit_job('attendance.report_generate', {
+        'employee_id': employee_id,
+        'period_type': data.get('period_type', 'monthly'),
+        'period_start': period_start.isoformat(),
+        'period_end': period_end.isoformat()
+    }, user_id=current_user.id)
+    return jsonify({'status': 'accepted', 'job_id': job.id, 'job': job.to_dict()}), 202
+
+
+@job_handler('attendance.report_generate')
+def _run_generate_report(ctx):
+    """حساب إحصائيات التقرير ثم حفظه؛ النتيجة بنفس شكل الاستجابة السابقة.
+    إعادة التوليد لنفس الفترة تحدّث التقرير الموجود بدل إنشاء نسخة جديدة.
+    """
+    employee_id = ctx.payload['employee_id']
+    period_type = ctx.payload.get('period_type', 'monthly')
+    period_start = date.fromisoformat(ctx.payload['period_start'])
+    period_end = date.fromisoformat(ctx.payload['period_end'])
+
+    ctx.progress(10, 'تحميل سجلات الحضور')
+    stats = compute_report_stats([employee_id], period_start, period_end)
+    rows = build_report_rows(stats, period_type, period_start, period_end, generated_by=ctx.user_id)
     
-    # جلب سجلات الحضور
-    attendances = Attendance.query.filter(
-        Attendance.employee_id == employee_id,
-        Attendance.date >= period_start,
-        Attendance.date <= period_end
-    ).all()
-    
-    # حساب الإحصائيات
-    settings = AttendanceSettings.query.first()
-    
-    total_days = (period_end - period_start).days + 1
-    present_days = len(set(att.date for att in attendances if att.check_in_time))
-    absent_days = total_days - present_days
-    
-    total_late_minutes = 0
-    late_days = 0
-    total_work_minutes = 0
-    total_overtime_minutes = 0
-    location_violations = 0
-    time_violations = 0
-    device_violations = 0
-    
-    for att in attendances:
-        # التأخير
-        if settings and att.check_in_time:
-            check_in_time = att.check_in_time.time()
-            if settings.check_in_end and check_in_time > settings.check_in_end:
-                expected = datetime.combine(att.date, settings.check_in_end)
-                late_minutes = int((att.check_in_time - expected).total_seconds() / 60)
-                grace_period = getattr(settings, 'grace_period_minutes', 15)
-                if late_minutes > grace_period:
-                    total_late_minutes += late_minutes
-                    late_days += 1
-        
-        # ساعات العمل
-        if att.check_in_time and att.check_out_time:
-            work_minutes = int((att.check_out_time - att.check_in_time).total_seconds() / 60)
-            total_work_minutes += work_minutes
-            
-            # الساعات الإضافية
-            min_work_hours = getattr(settings, 'min_work_hours_per_day', 8) if settings else 8
-            if work_minutes > (min_work_hours * 60):
-                total_overtime_minutes += (work_minutes - min_work_hours * 60)
-        
-        # المخالفات
-        if not att.location_verified:
-            location_violations += 1
-        if not att.time_verified:
-            time_violations += 1
-        if not att.device_verified:
-            device_violations += 1
-    
-    average_late_minutes = total_late_minutes / late_days if late_days > 0 else 0
-    
-    # إنشاء التقرير
-    report = AttendanceReport(
-        employee_id=employee_id,
-        period_type=period_type,
-        period_start=period_start,
-        period_end=period_end,
-        total_days=total_days,
-        present_days=present_days,
-        absent_days=absent_days,
-        late_days=late_days,
-        total_work_minutes=total_work_minutes,
-        total_late_minutes=total_late_minutes,
-        total_overtime_minutes=total_overtime_minutes,
-        average_late_minutes=average_late_minutes,
-        location_violations=location_violations,
-        time_violations=time_violations,
-        device_violations=device_violations,
-        generated_by=current_user.id
-    )
-    
-    db.session.add(report)
+    ctx.progress(80, 'حفظ التقرير')
+    report_ids = upsert_reports(db.session.connection(), rows)
     db.session.commit()
+    report = rows[0]
     
-    return jsonify({
+    return {
         'status': 'success',
         'message': 'تم إنشاء التقرير بنجاح',
         'report': {
-            'id': report.id,
-            'employee_id': report.employee_id,
-            'period_type': report.period_type,
-            'total_days': report.total_days,
-            'present_days': report.present_days,
-            'absent_days': report.absent_days,
-            'late_days': report.late_days,
-            'average_late_minutes': round(report.average_late_minutes, 2),
-            'total_work_hours': round(report.total_work_minutes / 60, 2),
-            'total_overtime_hours': round(report.total_overtime_minutes / 60, 2)
+            'id': report_ids[employee_id],
+            'employee_id': employee_id,
+            'period_type': period_type,
+            'total_days': report['total_days'],
+            'present_days': report['present_days'],
+            'absent_days': report['absent_days'],
+            'late_days': report['late_days'],
+            'average_late_minutes': round(report['average_late_minutes'], 2),
+            'total_work_hours': round(report['total_work_minutes'] / 60, 2),
+            'total_overtime_hours': round(report['total_overtime_minutes'] / 60, 2)
         }
-    })
+    }
+
+
+@attendance_reports_bp.route('/api/attendance/reports/generate-bulk', methods=['POST'])
+@csrf.exempt
+@login_required
+def generate_reports_bulk():
+    """توليد تقارير الفترة لكل الموظفين النشطين (أو لقسم) كمهمة خلفية واحدة (202)"""
+    if not has_permission(['admin', 'manager']):
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        period_start = datetime.strptime(data.get('period_start'), '%Y-%m-%d').date()
+        period_end = datetime.strptime(data.get('period_end'), '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid period dates'}), 400
+    if period_end < period_start:
+        return jsonify({'error': 'period_end before period_start'}), 400
+    link_payroll = bool(data.get('link_payroll'))
+    if link_payroll and (period_start.year, period_start.month) != (period_end.year, period_end.month):
+        return jsonify({'error': 'Payroll linking requires a period within one month'}), 400
+
+    job = submit_job('attendance.report_bulk_generate', {
+        'period_type': data.get('period_type', 'monthly'),
+        'period_start': period_start.isoformat(),
+        'period_end': period_end.isoformat(),
+        'department': data.get('department') or None,
+        'link_payroll': link_payroll,
+    }, user_id=current_user.id)
+    return jsonify({'status': 'accepted', 'job_id': job.id, 'job': job.to_dict()}), 202
+
+
+@job_handler('attendance.report_bulk_generate')
+def _run_generate_reports_bulk(ctx):
+    """إحصائيات كل الموظفين (app/utils/report_engine.py) ثم upsert مجمّع وربط الرواتب في commit واحد."""
+    period_type = ctx.payload.get('period_type', 'monthly')
+    period_start = date.fromisoformat(ctx.payload['period_start'])
+    period_end = date.fromisoformat(ctx.payload['period_end'])
+
+    employee_ids = report_employee_ids(department=ctx.payload.get('department'))
+    db.session.commit()
+    ctx.progress(5, f'{len(employee_ids)} موظف')
+    stats = compute_stats_parallel(
+        employee_ids, period_start, period_end,
+        progress=lambda n, total: ctx.progress(5 + 75 * n // total, f'حساب الإحصائيات {n}/{total}')
+    )
+    rows = build_report_rows(stats, period_type, period_start, period_end, generated_by=ctx.user_id)
+
+    ctx.progress(80, 'حفظ التقارير')
+    connection = db.session.connection()
+    report_ids = upsert_reports(connection, rows)
+    linked = 0
+    if ctx.payload.get('link_payroll'):
+        linked = link_reports_to_payroll(connection, report_ids, rows, period_start.month, period_start.year)
+    db.session.commit()
+    return {
+        'status': 'success',
+        'reports': len(report_ids),
+        'linked_to_payroll': linked,
+        'present_days': sum(r['present_days'] for r in rows),
+        'late_days': sum(r['late_days'] for r in rows),
+    }
 
 
 # ==================== التكامل مع الرواتب ====================
@@ -296,7 +286,7 @@ def link_to_payroll():
         return jsonify({'error': 'Employee mismatch'}), 400
     
     # الحصول على الإعدادات
-    settings = AttendanceSettings.query.first()
+    settings = attendance_settings()
     
     late_deduction_rate = getattr(settings, 'late_deduction_per_minute', 1.0) if settings else 1.0
     absence_deduction_rate = getattr(settings, 'absence_deduction_per_day', 100.0) if settings else 100.0
@@ -381,7 +371,9 @@ def link_to_payroll():
 @csrf.exempt
 @login_required
 def queue_for_sync():
-    """إضافة سجل إلى قائمة المزامنة (للوضع Offline)"""
+    """إضافة سجل (أو {"records": [...]} دفعة) إلى قائمة المزامنة (للوضع Offline).
+    إعادة إرسال نفس الضغطة ترجع رقم السجل الموجود مع duplicate=true.
+    """
     try:
         data = request.get_json(force=True)
     except Exception as e:
@@ -390,91 +382,79 @@ def queue_for_sync():
     if not data:
         return jsonify({'error': 'No data provided'}), 400
     
-    sync_record = AttendanceSync(
-        employee_id=data.get('employee_id'),
-        action=data.get('action'),
-        timestamp=datetime.fromisoformat(data.get('timestamp')),
-        lat=data.get('lat'),
-        lng=data.get('lng'),
-        address=data.get('address'),
-        mac_address=data.get('mac_address'),
-        device_info=data.get('device_info'),
-        original_data=json.dumps(data)
-    )
+    bulk = isinstance(data, list) or isinstance(data.get('records'), list)
+    records = data if isinstance(data, list) else (data['records'] if bulk else [data])
+    if len(records) > current_app.config.get('ATTENDANCE_SYNC_MAX_RECORDS', 10000):
+        return jsonify({'error': 'عدد السجلات أكبر من المسموح في طلب واحد'}), 413
     
-    db.session.add(sync_record)
+    results = enqueue_sync_records(records)
     db.session.commit()
+    queued = sum(1 for r in results if 'sync_id' in r and not r['duplicate'])
+    if queued:
+        _schedule_sync_drain()
+    
+    if not bulk:
+        result = results[0]
+        if 'error' in result:
+            return jsonify({'error': result['error']}), 400
+        return jsonify({
+            'status': 'success',
+            'message': 'السجل موجود مسبقاً في قائمة المزامنة' if result['duplicate'] else 'تم إضافة السجل لقائمة المزامنة',
+            'sync_id': result['sync_id'],
+            'duplicate': result['duplicate']
+        })
     
     return jsonify({
         'status': 'success',
-        'message': 'تم إضافة السجل لقائمة المزامنة',
-        'sync_id': sync_record.id
+        'queued': queued,
+        'duplicates': sum(1 for r in results if r.get('duplicate')),
+        'errors': sum(1 for r in results if 'error' in r),
+        'results': results
     })
 
 
+def _schedule_sync_drain(delay=None, user_id=None):
+    """تشغيل مهمة تفريغ الطابور ما لم تكن هناك مهمة منتظرة تبدأ بحلول الموعد (الجارية تلتقط الجديد في دفعتها التالية).
+    delay: ثوانٍ قبل بدء المهمة (متابعة الضغطات المؤجلة بالتراجع)."""
+    if not current_app.config.get('ATTENDANCE_SYNC_AUTO', True):
+        return None
+    if user_id is None:
+        user_id = getattr(current_user, 'id', None)
+    return submit_once('attendance.sync_drain', {}, user_id=user_id, delay=delay)
+
+
+@job_handler('attendance.sync_drain')
+def _run_sync_drain(ctx):
+    """تفريغ كل السجلات المستحقة (app/utils/attendance_sync.py)."""
+    total = max(pending_count(), 1)
+    db.session.commit()
+    totals = drain_sync_queue(progress=lambda done, message: ctx.progress(min(99, 100 * done // total), message))
+    # ضغطات مؤجلة بالتراجع: مهمة لاحقة عند أقربها بدل انتظار ضغطة جديدة
+    wait = next_retry_in()
+    if wait is not None:
+        _schedule_sync_drain(delay=wait, user_id=ctx.user_id)
+    return totals
+
+
 @attendance_reports_bp.route('/api/attendance/sync/process', methods=['POST'])
 @csrf.exempt
 @login_required
 def process_sync_queue():
-    """معالجة قائمة المزامنة"""
+    """معالجة قائمة المزامنة: تشغيل مهمة التفريغ الخلفية (أو إرجاع المنتظرة) بدل التفريغ داخل الطلب.
+    النتيجة (processed, failed, deferred, remaining) في نتيجة المهمة: GET /api/jobs/<id>
+    """
     if not has_permission(['admin']):
         return jsonify({'error': 'Unauthorized'}), 403
     
-    # جلب السجلات المعلقة
-    pending_syncs = AttendanceSync.query.filter_by(sync_status='pending').limit(100).all()
-    
-    processed = 0
-    failed = 0
-    
-    for sync in pending_syncs:
-        try:
-            # محاولة إنشاء سجل الحضور
-            attendance = Attendance(
-                employee_id=sync.employee_id,
-                date=sync.timestamp.date(),
-                lat=sync.lat,
-                lng=sync.lng,
-                address=sync.address,
-                mac_address=sync.mac_address,
-                device_info=sync.device_info
-            )
-            
-            if sync.action == 'check_in':
-                attendance.check_in_time = sync.timestamp
-            else:
-                # البحث عن سجل حضور موجود
-                existing = Attendance.query.filter_by(
-                    employee_id=sync.employee_id,
-                    date=sync.timestamp.date()
-                ).first()
-                
-                if existing:
-                    existing.check_out_time = sync.timestamp
-                    existing.lat_out = sync.lat
-                    existing.lng_out = sync.lng
-                    existing.address_out = sync.address
-                else:
-                    attendance.check_out_time = sync.timestamp
-            
-            if sync.action == 'check_in' or not existing:
-                db.session.add(attendance)
-            
-            sync.sync_status = 'synced'
-            sync.synced_at = datetime.now()
-            processed += 1
-            
-        except Exception as e:
-            sync.sync_status = 'failed'
-            sync.error_message = str(e)
-            sync.sync_attempts += 1
-            sync.last_sync_attempt = datetime.now()
-            failed += 1
-    
-    db.session.commit()
-    
+    job = BackgroundJob.query.filter(
+        BackgroundJob.job_type == 'attendance.sync_drain', BackgroundJob.status == 'queued',
+        or_(BackgroundJob.run_after.is_(None), BackgroundJob.run_after <= datetime.utcnow())
+    ).order_by(BackgroundJob.id).first()
+    if job is None:
+        job = submit_job('attendance.sync_drain', {}, user_id=current_user.id)
     return jsonify({
-        'status': 'success',
-        'processed': processed,
-        'failed': failed,
-        'remaining': AttendanceSync.query.filter_by(sync_status='pending').count()
-    })
+        'status': 'accepted',
+        'job_id': job.id,
+        'job': job.to_dict(),
+        'pending': pending_count()
+    }), 202
@@ -9,6 +9,7 @@ from app.models.audit import Audit
 from app.models.password_reset import PasswordResetCode
 from datetime import datetime, timedelta
 from app.utils.emailer import send_email
+from app.utils.identity import load_identity, identity_stats
 from sqlalchemy import func
 from app.constants import REGISTRATION_DEPARTMENTS
 
@@ -19,7 +20,8 @@ ALLOWED_REG_DEPARTMENT_KEYS = {d['key'] for d in REGISTRATION_DEPARTMENTS}
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # هوية الطلب من الكاش (المستخدم + الموظف المرتبط + الأدوار) بدون استعلامات عند الإصابة
+    return load_identity(int(user_id))
 
 @auth_bp.route('/login', methods=['GET', 'POST'])
 @csrf.exempt  # Exempt login from CSRF protection temporarily
@@ -136,6 +138,15 @@ def login():
     form = LoginForm()
     return render_template('login.html', form=form, lang=session.get('lang', 'ar'), admins=admins, employees=employees, reg_departments=REGISTRATION_DEPARTMENTS)
 
+@auth_bp.route('/api/auth/identity-stats')
+@login_required
+def identity_cache_stats():
+    """إحصائيات كاش الهوية: الإصابات والاستعلامات الموفرة (للمدير)"""
+    if not current_user.has_permission(required_roles='admin'):
+        return jsonify({'error': 'Unauthorized'}), 403
+    return jsonify(identity_stats())
+
+
 @auth_bp.route('/logout')
 @login_required
 def logout():
@@ -277,7 +288,7 @@ def forgot_password_request():
         company = current_app.config.get('COMPANY_NAME', 'Quick Sale HR')
         subject = f"{company} - رمز إعادة تعيين كلمة المرور"
         body = f"مرحباً {employee.name},\n\nرمز التحقق الخاص بك هو: {reset.code}\nصلاحيته {ttl} دقائق.\n\n{company}"
-        sent = send_email(current_app, email, subject, body)
+        sent = send_email(current_app, email, subject, body, category='password_reset')
         # سجل تدقيق
         audit = Audit(
             user_id=None,
@@ -378,8 +389,8 @@ def forgot_password_verify():
             # Determine provider (DB settings has priority)
             provider = (current_app.config.get('EMAIL_PROVIDER') or 'SMTP').upper()
             try:
-                from app.models.settings import Settings
-                s = Settings.get_settings()
+                from app.utils.settings_cache import system_settings
+                s = system_settings()
                 if s and s.email_provider:
                     provider = (s.email_provider or 'SMTP').upper()
             except Exception:
@@ -388,8 +399,8 @@ def forgot_password_verify():
             if provider == 'SENDGRID':
                 tpl = None
                 try:
-                    from app.models.settings import Settings
-                    s = Settings.get_settings()
+                    from app.utils.settings_cache import system_settings
+                    s = system_settings()
                     if s and s.sendgrid_password_changed_template_id:
                         tpl = s.sendgrid_password_changed_template_id
                 except Exception:
@@ -407,7 +418,8 @@ def forgot_password_verify():
                         }
                     }
             # أرسل الإشعار (لا يؤثر على نتيجة الطلب)
-            send_email(current_app, employee.email, subject, body, provider_options=provider_options)
+            send_email(current_app, employee.email, subject, body, provider_options=provider_options,
+                       category='password_changed')
         except Exception as _e:
             current_app.logger.warning('Password-changed email notify failed: %s', _e)
         return jsonify({'success': True})
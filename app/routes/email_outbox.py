@@ -0,0 +1,67 @@
+"""
+Routes لمتابعة صندوق البريد الصادر: الأعداد حسب الحالة، حالة رسالة، وإعادة إرسال الفاشلة
+(الإرسال نفسه في مهمة email.outbox_drain - app/utils/emailer.py)
+"""
+from flask import Blueprint, jsonify, request
+from flask_login import login_required
+
+from app import csrf, db
+from app.models.email_outbox import EmailOutbox
+from app.permissions import has_permission
+from app.utils.emailer import FAILED, QUEUED, outbox_status, schedule_drain
+
+email_outbox_bp = Blueprint('email_outbox', __name__)
+
+_MAX_LIMIT = 200
+
+
+@email_outbox_bp.route('/api/email/outbox', methods=['GET'])
+@login_required
+def list_outbox():
+    """الأعداد حسب الحالة وآخر الرسائل: ?status=failed&limit=50"""
+    if not has_permission(['admin']):
+        return jsonify({'error': 'Unauthorized'}), 403
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), _MAX_LIMIT)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'invalid limit'}), 400
+    query = EmailOutbox.query
+    status = request.args.get('status')
+    if status:
+        query = query.filter(EmailOutbox.status == status)
+    items = query.order_by(EmailOutbox.id.desc()).limit(limit).all()
+    return jsonify({'status': outbox_status(), 'items': [item.to_dict() for item in items]})
+
+
+@email_outbox_bp.route('/api/email/outbox/<int:email_id>', methods=['GET'])
+@login_required
+def get_outbox_item(email_id):
+    if not has_permission(['admin']):
+        return jsonify({'error': 'Unauthorized'}), 403
+    item = db.session.get(EmailOutbox, email_id)
+    if item is None:
+        return jsonify({'error': 'Not found'}), 404
+    return jsonify(item.to_dict())
+
+
+@email_outbox_bp.route('/api/email/outbox/<int:email_id>/retry', methods=['POST'])
+@csrf.exempt
+@login_required
+def retry_outbox_item(email_id):
+    """إعادة رسالة فاشلة إلى الطابور (بعد تصحيح إعدادات البريد مثلاً)"""
+    if not has_permission(['admin']):
+        return jsonify({'error': 'Unauthorized'}), 403
+    item = db.session.get(EmailOutbox, email_id)
+    if item is None:
+        return jsonify({'error': 'Not found'}), 404
+    if item.status != FAILED:
+        return jsonify({'error': 'Only failed messages can be retried'}), 409
+    if item.body is None and item.html is None and item.provider_options is None:
+        # رسالة حساسة (رمز استعادة كلمة المرور) حُذف محتواها بعد فشلها: يطلب المستخدم رمزاً جديداً
+        return jsonify({'error': 'Message content was discarded; request a new one'}), 409
+    item.status = QUEUED
+    item.attempts = 0
+    item.next_attempt_at = None
+    db.session.commit()
+    schedule_drain()
+    return jsonify(db.session.get(EmailOutbox, email_id).to_dict()), 202
@@ -1,17 +1,21 @@
 from flask import Blueprint, render_template, session, abort
-from flask_login import login_required, current_user
+from flask_login import login_required
+from app import db
 from app.models.employee import Employee
 from app.permissions import has_permission
+from app.utils.identity import current_employee
 
 employee_profile_bp = Blueprint('employee_profile', __name__)
 
 @employee_profile_bp.route('/employee/<int:emp_id>')
 @login_required
 def employee_profile(emp_id):
-    employee = Employee.query.get(emp_id)
-    if not employee:
-        abort(404)
+    own = current_employee()
+    own = own if own is not None and own.id == emp_id else None
     # الموظف يرى صفحته فقط، المدير/HR يرى الجميع
-    if not has_permission(['admin', 'manager']) and current_user.id != emp_id:
+    if own is None and not has_permission(['admin', 'manager']):
         abort(403)
+    employee = own or db.session.get(Employee, emp_id)
+    if not employee:
+        abort(404)
     return render_template('employee_profile.html', employee=employee, lang=session.get('lang', 'ar'))
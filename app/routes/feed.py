@@ -0,0 +1,102 @@
+"""
+Routes البث المباشر (Server-Sent Events): انتقالات التواجد، الحضور/الانصراف، وتعيين التذاكر
+"""
+import queue
+import time
+
+from flask import Blueprint, Response, current_app, jsonify, request
+from flask_login import current_user, login_required
+
+from app.permissions import has_permission
+from app.utils.feed import ATTENDANCE, CHANNELS, PRESENCE, SUPPORT, fetch_events, format_event, get_feed_hub
+from app.utils.identity import current_employee
+from app.utils.sse import acquire_stream, release_stream, streams_busy
+
+feed_bp = Blueprint('feed', __name__)
+
+
+def _audience():
+    """المدير/المسؤول يرى كل الأحداث؛ الموظف يرى أحداثه فقط.
+    التواجد والحضور مربوطان بمعرّف الموظف المرتبط، والتذاكر بمعرّف المستخدم (assigned_to)."""
+    if has_permission(['admin', 'manager']):
+        return None
+    employee = current_employee()
+    own = {employee.id} if employee is not None else set()
+    return {
+        PRESENCE: own,
+        SUPPORT: {current_user.id},
+        ATTENDANCE: own,
+    }
+
+
+@feed_bp.route('/api/feed/stream', methods=['GET'])
+@login_required
+def stream():
+    """?channels=presence,attendance,support — إعادة الاتصال ترسل Last-Event-ID تلقائياً"""
+    requested = [c for c in (request.args.get('channels') or ','.join(CHANNELS)).split(',') if c]
+    channels = [c for c in requested if c in CHANNELS]
+    if not channels:
+        return jsonify({'status': 'error', 'message': 'قنوات غير صالحة'}), 400
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+
+    config = current_app.config
+    keepalive = float(config.get('FEED_KEEPALIVE_SECONDS', 15.0))
+    max_seconds = float(config.get('FEED_STREAM_MAX_SECONDS', 300.0))
+    audience = _audience()
+    if not acquire_stream():
+        return streams_busy()
+    hub = get_feed_hub()
+    # الاشتراك قبل الـ replay حتى لا يضيع حدث بينهما؛ المكرر يُتخطى بالمعرّف
+    sub = hub.subscribe(channels, audience)
+
+    def close():
+        hub.unsubscribe(sub)
+        release_stream()
+
+    replay = []
+    if last_event_id is not None:
+        # كل معرّف حتى حد الموزع ظاهر الآن؛ ما فوقه قد يُنهى متأخراً فلا يتقدم معرّف SSE بعده
+        contiguous = hub.cursor or 0
+        try:
+            replay = [(e[0], e[1], e[2], max(last_event_id, min(e[0], contiguous)))
+                      for e in fetch_events(last_event_id) if sub.accepts(e[1], e[2])]
+        except Exception:
+            close()
+            raise
+
+    def generate():
+        cursor = last_event_id or 0
+        replayed = {item[0] for item in replay}
+        try:
+            yield f'retry: {int(config.get("FEED_RETRY_MS", 3000))}\n\n'
+            for item in replay:
+                cursor = max(cursor, item[3])
+                yield format_event(item[:3] + (cursor,))
+            # اتصال محدود المدة: يحرر العامل دورياً والمتصفح يعيد الاتصال ويكمل من Last-Event-ID
+            deadline = time.monotonic() + max_seconds
+            while time.monotonic() < deadline:
+                try:
+                    item = sub.queue.get(timeout=keepalive)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                if item is None:
+                    break
+                if item[0] in replayed:
+                    continue
+                # الأحداث الحية قد تصل بغير ترتيب المعرّف (commit متأخر)؛ معرّف SSE هو الحد المتصل
+                cursor = max(cursor, item[3])
+                yield format_event(item[:3] + (cursor,))
+        finally:
+            hub.unsubscribe(sub)
+
+    response = Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+    response.call_on_close(close)
+    return response
@@ -0,0 +1,137 @@
+"""
+Routes لمواقع السياج الجغرافي: إدارة الفروع والمواقع الميدانية، والتحقق الدفعي من الإحداثيات
+"""
+from flask import Blueprint, jsonify, request
+from flask_login import login_required
+
+from app import db, csrf
+from app.models.geofence import GeofenceSite
+from app.permissions import has_permission
+from app.utils.geofence import validate_points
+
+geofence_bp = Blueprint('geofence', __name__)
+
+_MAX_BATCH_POINTS = 50000
+
+
+def _apply_site_data(site, data):
+    """تحديث حقول الموقع من JSON والتحقق منها. يرجع رسالة خطأ أو None."""
+    if 'name' in data:
+        site.name = (data.get('name') or '').strip()
+    if 'site_type' in data:
+        site.site_type = data.get('site_type') or 'circle'
+    if site.site_type not in GeofenceSite.SITE_TYPES:
+        return 'نوع الموقع يجب أن يكون circle أو polygon'
+    if not site.name:
+        return 'اسم الموقع مطلوب'
+    try:
+        if 'center_lat' in data:
+            site.center_lat = float(data['center_lat']) if data['center_lat'] is not None else None
+        if 'center_lng' in data:
+            site.center_lng = float(data['center_lng']) if data['center_lng'] is not None else None
+        if 'radius_meters' in data:
+            site.radius_meters = float(data['radius_meters'])
+        if 'polygon' in data:
+            site.set_polygon(data.get('polygon') or [])
+    except (TypeError, ValueError):
+        return 'إحداثيات غير صالحة'
+    if 'is_active' in data:
+        site.is_active = bool(data['is_active'])
+
+    if site.site_type == 'circle':
+        if site.center_lat is None or site.center_lng is None:
+            return 'مركز الدائرة مطلوب'
+        if not site.radius_meters or site.radius_meters <= 0:
+            return 'نصف القطر يجب أن يكون أكبر من صفر'
+    elif len(site.get_polygon()) < 3:
+        return 'المضلع يحتاج ثلاث نقاط على الأقل'
+    return None
+
+
+@geofence_bp.route('/api/geofence/sites', methods=['GET'])
+@login_required
+def list_sites():
+    """قائمة المواقع المسموحة"""
+    sites = GeofenceSite.query.order_by(GeofenceSite.name).all()
+    return jsonify([s.to_dict() for s in sites])
+
+
+@geofence_bp.route('/api/geofence/sites', methods=['POST'])
+@csrf.exempt
+@login_required
+def create_site():
+    """إضافة موقع (دائرة أو مضلع)"""
+    if not has_permission(['admin']):
+        return jsonify({'status': 'error', 'message': 'غير مصرح لك'}), 403
+    data = request.get_json(silent=True) or {}
+    site = GeofenceSite(site_type=data.get('site_type') or 'circle', is_active=True)
+    error = _apply_site_data(site, data)
+    if error:
+        return jsonify({'status': 'error', 'message': error}), 400
+    db.session.add(site)
+    db.session.commit()
+    return jsonify({'status': 'success', 'site': site.to_dict()}), 201
+
+
+@geofence_bp.route('/api/geofence/sites/<int:site_id>', methods=['PUT'])
+@csrf.exempt
+@login_required
+def update_site(site_id):
+    """تعديل موقع"""
+    if not has_permission(['admin']):
+        return jsonify({'status': 'error', 'message': 'غير مصرح لك'}), 403
+    site = GeofenceSite.query.get_or_404(site_id)
+    error = _apply_site_data(site, request.get_json(silent=True) or {})
+    if error:
+        db.session.rollback()
+        return jsonify({'status': 'error', 'message': error}), 400
+    db.session.commit()
+    return jsonify({'status': 'success', 'site': site.to_dict()})
+
+
+@geofence_bp.route('/api/geofence/sites/<int:site_id>', methods=['DELETE'])
+@csrf.exempt
+@login_required
+def delete_site(site_id):
+    """حذف موقع"""
+    if not has_permission(['admin']):
+        return jsonify({'status': 'error', 'message': 'غير مصرح لك'}), 403
+    site = GeofenceSite.query.get_or_404(site_id)
+    db.session.delete(site)
+    db.session.commit()
+    return jsonify({'status': 'success'})
+
+
+@geofence_bp.route('/api/geofence/validate', methods=['POST'])
+@csrf.exempt
+@login_required
+def validate_batch():
+    """التحقق الدفعي: {"points": [[lat, lng], ...]} أو [{"lat":..,"lng":..}, ...]"""
+    if not has_permission(['admin', 'manager']):
+        return jsonify({'status': 'error', 'message': 'غير مصرح لك'}), 403
+    points = (request.get_json(silent=True) or {}).get('points') or []
+    if len(points) > _MAX_BATCH_POINTS:
+        return jsonify({'status': 'error', 'message': f'الحد الأقصى {_MAX_BATCH_POINTS} نقطة لكل طلب'}), 400
+    try:
+        pairs = [(p.get('lat'), p.get('lng')) if isinstance(p, dict) else (p[0], p[1]) for p in points]
+        matches = validate_points(pairs)
+    except (TypeError, ValueError, IndexError):
+        return jsonify({'status': 'error', 'message': 'إحداثيات غير صالحة'}), 400
+
+    results = []
+    for match in matches:
+        if match is None:
+            results.append({'inside': False, 'site_id': None, 'site_name': None, 'distance_meters': None})
+        else:
+            results.append({
+                'inside': match.inside,
+                'site_id': match.site_id,
+                'site_name': match.site_name,
+                'distance_meters': round(match.distance_meters, 1),
+            })
+    return jsonify({
+        'status': 'success',
+        'count': len(results),
+        'inside_count': sum(1 for r in results if r['inside']),
+        'results': results,
+    })
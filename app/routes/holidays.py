@@ -0,0 +1,90 @@
+"""
+Routes للعطل الرسمية: أيام لا تُحتسب أيام عمل في الرواتب والتقارير (app/utils/work_calendar.py)
+"""
+from datetime import date
+
+from flask import Blueprint, jsonify, request
+from flask_login import login_required
+
+from app import db, csrf
+from app.models.holiday import PublicHoliday
+from app.permissions import has_permission
+from app.utils.work_calendar import period_calendar
+
+holidays_bp = Blueprint('holidays', __name__)
+
+
+def _parse_date(value):
+    try:
+        return date.fromisoformat(str(value or '').strip())
+    except ValueError:
+        return None
+
+
+@holidays_bp.route('/api/holidays', methods=['GET'])
+@login_required
+def list_holidays():
+    """العطل الرسمية (اختيارياً لسنة محددة ?year=2025)"""
+    query = PublicHoliday.query
+    year = request.args.get('year', type=int)
+    if year:
+        query = query.filter(PublicHoliday.date >= date(year, 1, 1), PublicHoliday.date <= date(year, 12, 31))
+    return jsonify([h.to_dict() for h in query.order_by(PublicHoliday.date).all()])
+
+
+@holidays_bp.route('/api/holidays', methods=['POST'])
+@csrf.exempt
+@login_required
+def create_holidays():
+    """إضافة عطلة {"date", "name"} أو عدة عطل {"holidays": [...]}؛ التاريخ الموجود يُحدَّث اسمه"""
+    if not has_permission(['admin']):
+        return jsonify({'status': 'error', 'message': 'غير مصرح لك'}), 403
+    data = request.get_json(silent=True) or {}
+    items = data.get('holidays') if isinstance(data.get('holidays'), list) else [data]
+    parsed = {}
+    for item in items:
+        day = _parse_date(item.get('date')) if isinstance(item, dict) else None
+        name = (item.get('name') or '').strip() if isinstance(item, dict) else ''
+        if day is None or not name:
+            return jsonify({'status': 'error', 'message': 'التاريخ (YYYY-MM-DD) والاسم مطلوبان لكل عطلة'}), 400
+        parsed[day] = name[:128]
+
+    existing = {h.date: h for h in PublicHoliday.query.filter(PublicHoliday.date.in_(list(parsed))).all()}
+    for day, name in parsed.items():
+        if day in existing:
+            existing[day].name = name
+        else:
+            db.session.add(PublicHoliday(date=day, name=name))
+    db.session.commit()
+    return jsonify({'status': 'success', 'count': len(parsed)}), 201
+
+
+@holidays_bp.route('/api/holidays/<int:holiday_id>', methods=['DELETE'])
+@csrf.exempt
+@login_required
+def delete_holiday(holiday_id):
+    """حذف عطلة"""
+    if not has_permission(['admin']):
+        return jsonify({'status': 'error', 'message': 'غير مصرح لك'}), 403
+    holiday = PublicHoliday.query.get_or_404(holiday_id)
+    db.session.delete(holiday)
+    db.session.commit()
+    return jsonify({'status': 'success'})
+
+
+@holidays_bp.route('/api/holidays/working-days', methods=['GET'])
+@login_required
+def working_days():
+    """أيام العمل في فترة ?start=&end= (بعد أيام الأسبوع والعطل)"""
+    start = _parse_date(request.args.get('start'))
+    end = _parse_date(request.args.get('end'))
+    if start is None or end is None or end < start or (end - start).days > 366:
+        return jsonify({'status': 'error', 'message': 'فترة غير صالحة (حتى سنة واحدة)'}), 400
+    calendar = period_calendar(start, end)
+    return jsonify({
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'working_days': calendar.working_count,
+        'dates': [d.isoformat() for d in calendar.working_dates],
+        'holidays': [d.isoformat() for d in calendar.dates(calendar.holidays)],
+    })
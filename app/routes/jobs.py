@@ -0,0 +1,105 @@
+"""
+Routes لمتابعة المهام الخلفية: الحالة، الإلغاء، وبث التقدم (Server-Sent Events)
+"""
+import json
+import time
+
+from flask import Blueprint, jsonify, current_app, Response, stream_with_context, abort
+from flask_login import login_required, current_user
+
+from app import db, csrf
+from app.models.job import BackgroundJob
+from app.utils.jobs import cancel_job, get_runner
+from app.utils.sse import acquire_stream, release_stream, streams_busy
+
+jobs_bp = Blueprint('jobs', __name__)
+
+_SSE_MAX_SECONDS = 300  # يعيد المتصفح الاتصال تلقائياً بعدها
+
+
+def _get_visible_job(job_id):
+    """المهمة متاحة لمن أنشأها وللمدير فقط."""
+    job = db.session.get(BackgroundJob, job_id)
+    if job is None:
+        abort(404)
+    if job.created_by != current_user.id and not current_user.has_permission(required_roles='admin'):
+        abort(403)
+    return job
+
+
+def _ensure_runner():
+    # عند إعادة تشغيل العامل قد تبقى مهام منتظرة؛ الاستعلام عنها يعيد تشغيل الموزّع
+    app = current_app._get_current_object()
+    if not app.config.get('JOBS_EAGER') and app.config.get('JOBS_IN_PROCESS', True):
+        get_runner(app)
+
+
+@jobs_bp.route('/api/jobs', methods=['GET'])
+@login_required
+def list_jobs():
+    """آخر مهام المستخدم الحالي"""
+    jobs = BackgroundJob.query.filter_by(created_by=current_user.id) \
+        .order_by(BackgroundJob.created_at.desc()).limit(20).all()
+    return jsonify([j.to_dict() for j in jobs])
+
+
+@jobs_bp.route('/api/jobs/<int:job_id>', methods=['GET'])
+@login_required
+def get_job(job_id):
+    """حالة المهمة ونتيجتها"""
+    job = _get_visible_job(job_id)
+    if not job.is_finished:
+        _ensure_runner()
+    return jsonify(job.to_dict())
+
+
+@jobs_bp.route('/api/jobs/<int:job_id>/cancel', methods=['POST'])
+@csrf.exempt
+@login_required
+def cancel(job_id):
+    """إلغاء مهمة منتظرة أو طلب إيقاف مهمة جارية"""
+    job = _get_visible_job(job_id)
+    outcome = cancel_job(job.id)
+    if outcome is None:
+        return jsonify({'error': 'Job already finished', 'job': job.to_dict()}), 409
+    db.session.expire(job)
+    return jsonify({'success': True, 'outcome': outcome, 'job': job.to_dict()})
+
+
+@jobs_bp.route('/api/jobs/<int:job_id>/events', methods=['GET'])
+@login_required
+def job_events(job_id):
+    """بث تقدم المهمة كـ text/event-stream حتى تنتهي"""
+    job = _get_visible_job(job_id)
+    if not job.is_finished:
+        _ensure_runner()
+    job_id = job.id
+    db.session.rollback()
+    if not acquire_stream():
+        return streams_busy()
+
+    @stream_with_context
+    def stream():
+        last = None
+        deadline = time.monotonic() + _SSE_MAX_SECONDS
+        yield 'retry: 2000\n\n'
+        while time.monotonic() < deadline:
+            current = db.session.get(BackgroundJob, job_id)
+            data = current.to_dict() if current else {'id': job_id, 'status': 'failed', 'error': 'Job not found'}
+            # إنهاء معاملة القراءة حتى يرى الاستعلام التالي أحدث تقدم
+            db.session.rollback()
+            payload = json.dumps(data, ensure_ascii=False)
+            if payload != last:
+                last = payload
+                yield f'data: {payload}\n\n'
+            if data['status'] in BackgroundJob.TERMINAL_STATUSES:
+                yield 'event: done\ndata: {}\n\n'
+                return
+            time.sleep(1.0)
+
+    response = Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    response.call_on_close(release_stream)
+    return response
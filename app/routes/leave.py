@@ -6,6 +6,7 @@ from app.models.audit import Audit
 from app.models.leave_balance import LeaveBalance
 from app import db
 from app.permissions import has_permission
+from app.utils.identity import current_employee
 from datetime import datetime, timedelta
 
 leave_bp = Blueprint('leave', __name__)
@@ -47,8 +48,12 @@ def _get_or_create_balance(employee_id):
 @leave_bp.route('/leave', methods=['GET', 'POST'])
 @login_required
 def leave():
+    employee = current_employee()
     # إرسال طلب إجازة (الموظف)
     if request.method == 'POST':
+        if employee is None:
+            flash('حسابك غير مرتبط بموظف', 'danger')
+            return redirect(url_for('leave.leave'))
         leave_type = (request.form.get('leave_type') or '').strip()
         start = request.form.get('start_date')
         end = request.form.get('end_date')
@@ -67,7 +72,7 @@ def leave():
             return redirect(url_for('leave.leave'))
         # تحقق من الرصيد للاسنوية/العارضة
         days = _days_inclusive(start_date, end_date)
-        bal = _get_or_create_balance(current_user.id)
+        bal = _get_or_create_balance(employee.id)
         if leave_type == 'annual' and days > bal.annual_available:
             flash('لا يوجد رصيد كافٍ للإجازة السنوية', 'warning')
             return redirect(url_for('leave.leave'))
@@ -77,7 +82,7 @@ def leave():
 
         meta = LT[leave_type]
         l = Leave(
-            employee_id=current_user.id,
+            employee_id=employee.id,
             leave_type=leave_type,
             start_date=start_date,
             end_date=end_date,
@@ -98,7 +103,8 @@ def leave():
     if has_permission(['admin', 'manager']):
         records = Leave.query.order_by(Leave.requested_at.desc()).all()
     else:
-        records = Leave.query.filter_by(employee_id=current_user.id).order_by(Leave.requested_at.desc()).all()
+        records = (Leave.query.filter_by(employee_id=employee.id).order_by(Leave.requested_at.desc()).all()
+                   if employee is not None else [])
 
     rows = []
     for r in records:
@@ -115,8 +121,8 @@ def leave():
         })
     # رصيد الموظف الحالي (إن كان موظفاً عادياً)
     bal = None
-    if not has_permission(['admin', 'manager']):
-        bal = _get_or_create_balance(current_user.id)
+    if not has_permission(['admin', 'manager']) and employee is not None:
+        bal = _get_or_create_balance(employee.id)
     return render_template('leave.html', leaves=rows, lang=session.get('lang', 'ar'), leave_types=get_leave_types(), balance=bal)
 
 
@@ -1,12 +1,17 @@
 ﻿from flask import Blueprint, render_template, request, jsonify, current_app, make_response
 from flask_login import login_required, current_user
 from app.models.employee import Employee
-from app.models.attendance import Attendance
-from app.models.settings import Settings
 from app.models.leave import Leave
 from app.models.payroll import Payroll, PayrollTemplate, EmployeeLoan, PayrollBatch
 from app import db
 from app.permissions import has_permission
+from app.utils.payroll_engine import (
+    leave_dates_from_rows, loan_due_from_rows, loan_monthly_due,
+    build_batch_payrolls, bulk_insert_payrolls, recalculate_payrolls, load_period_inputs
+)
+from app.utils.payroll_dirty import dirty_employees, clear_dirty_marks
+from app.utils.identity import current_employee
+from app.utils.jobs import job_handler, submit_job
 from datetime import datetime, date
 from dateutil.relativedelta import relativedelta
 import csv
@@ -14,60 +19,15 @@ from io import StringIO
 
 payroll_bp = Blueprint('payroll', __name__)
 
+_JOB_CHUNK = 1000  # عدد الموظفين بين تحديثين للتقدم في المهام الخلفية
+
 
 def _compute_attendance_metrics(emp_id: int, period_start: date, period_end: date):
     """احسب الغياب والتأخير للموظف خلال الفترة المحددة بالاعتماد على جدول الحضور.
-    - الغياب: أيام العمل التي لا يوجد لها سجل حضور
+    - الغياب: أيام العمل (تقويم العمل بعد العطل الرسمية) التي لا يوجد لها سجل حضور ولا إجازة
     - التأخير: دقائق التأخير مقارنة بوقت بداية الدوام من الإعدادات
     """
-    settings = Settings.get_settings()
-    # أيام العمل من الإعدادات كنص "0,1,2,3,4" (0=Sunday)
-    work_days = set((settings.work_days or '0,1,2,3,4').split(','))
-    # وقت بداية الدوام من الإعدادات
-    work_start_str = settings.work_start or current_app.config.get('WORK_START', '08:00')
-    try:
-        work_start_time = datetime.strptime(work_start_str, '%H:%M').time()
-    except Exception:
-        work_start_time = datetime.strptime('08:00', '%H:%M').time()
-
-    # جلب حضور الموظف ضمن الفترة
-    recs = Attendance.query.filter(
-        Attendance.employee_id == emp_id,
-        Attendance.date >= period_start,
-        Attendance.date <= period_end
-    ).all()
-    # تجميع حسب اليوم
-    by_date = {}
-    for r in recs:
-        by_date.setdefault(r.date, []).append(r)
-
-    # اجتياز أيام الفترة
-    cur = period_start
-    absence_days = 0
-    total_late_minutes = 0
-    working_days_count = 0
-    while cur <= period_end:
-        weekday = (cur.weekday() + 1) % 7  # Python: Monday=0; mapping to Sunday=0
-        if str(weekday) in work_days:
-            working_days_count += 1
-            day_recs = by_date.get(cur)
-            if not day_recs:
-                absence_days += 1
-            else:
-                # احسب أول دخول لليوم
-                first_in = None
-                for rec in day_recs:
-                    if rec.check_in_time and (first_in is None or rec.check_in_time < first_in):
-                        first_in = rec.check_in_time
-                if first_in:
-                    # دقائق التأخير
-                    scheduled_dt = datetime.combine(first_in.date(), work_start_time)
-                    if first_in > scheduled_dt:
-                        delta = first_in - scheduled_dt
-                        total_late_minutes += max(0, int(delta.total_seconds() // 60))
-        cur += relativedelta(days=1)
-
-    return absence_days, total_late_minutes, working_days_count
+    return load_period_inputs(period_start, period_end, {emp_id}).attendance_metrics(emp_id)
 
 
 def _get_leave_dates(emp_id: int, period_start: date, period_end: date):
@@ -81,32 +41,7 @@ def _get_leave_dates(emp_id: int, period_start: date, period_end: date):
         Leave.end_date >= period_start,
         Leave.start_date <= period_end
     ).all()
-    paid_dates = set()
-    unpaid_dates = set()
-    for lv in leaves:
-        cur = max(lv.start_date, period_start)
-        end = min(lv.end_date, period_end)
-        # اجمع كل الأيام أولاً
-        dates = []
-        while cur <= end:
-            dates.append(cur)
-            cur += relativedelta(days=1)
-        # توزيع الأيام على مدفوعة/غير مدفوعة
-        if lv.leave_type == 'sick' and lv.paid_days is not None:
-            paid_portion = max(0, min(len(dates), int(lv.paid_days or 0)))
-            for d in dates[:paid_portion]:
-                paid_dates.add(d)
-            for d in dates[paid_portion:]:
-                unpaid_dates.add(d)
-        else:
-            # حالات عامة: paid=True → كل الأيام مدفوعة، وإلا غير مدفوعة
-            if lv.paid:
-                for d in dates:
-                    paid_dates.add(d)
-            else:
-                for d in dates:
-                    unpaid_dates.add(d)
-    return paid_dates, unpaid_dates
+    return leave_dates_from_rows(leaves, period_start, period_end)
 
 
 def _compute_loan_due_amount(emp_id: int, period_end: date) -> float:
@@ -118,31 +53,11 @@ def _compute_loan_due_amount(emp_id: int, period_end: date) -> float:
     if not current_app.config.get('PAYROLL_AUTO_LOAN_DEDUCTION', True):
         return 0.0
 
-    total_due = 0.0
     loans = EmployeeLoan.query.filter(
         EmployeeLoan.employee_id == emp_id,
         EmployeeLoan.status == 'active'
     ).all()
-
-    for loan in loans:
-        # تجاهل القروض التي لم يبدأ سدادها بعد
-        if loan.start_date and loan.start_date > period_end:
-            continue
-        remaining = float(loan.remaining_amount if loan.remaining_amount is not None else (loan.amount or 0.0))
-        if remaining <= 0:
-            continue
-        monthly = loan.monthly_deduction
-        if (monthly is None or monthly == 0) and loan.amount and loan.installments:
-            try:
-                monthly = round(float(loan.amount) / float(loan.installments), 2)
-            except Exception:
-                monthly = 0.0
-        monthly = float(monthly or 0.0)
-        if monthly <= 0:
-            continue
-        total_due += min(remaining, monthly)
-
-    return round(total_due, 2)
+    return loan_due_from_rows(loans, period_end)
 
 
 def _compute_loan_due_breakdown(emp_id: int, period_end: date):
@@ -156,21 +71,9 @@ def _compute_loan_due_breakdown(emp_id: int, period_end: date):
     ).order_by(EmployeeLoan.issued_date.asc()).all()
 
     for loan in loans:
-        if loan.start_date and loan.start_date > period_end:
-            continue
-        remaining = float(loan.remaining_amount if loan.remaining_amount is not None else (loan.amount or 0.0))
-        if remaining <= 0:
+        due, remaining, monthly = loan_monthly_due(loan, period_end)
+        if due <= 0:
             continue
-        monthly = loan.monthly_deduction
-        if (monthly is None or monthly == 0) and loan.amount and loan.installments:
-            try:
-                monthly = round(float(loan.amount) / float(loan.installments), 2)
-            except Exception:
-                monthly = 0.0
-        monthly = float(monthly or 0.0)
-        if monthly <= 0:
-            continue
-        due = min(remaining, monthly)
         breakdown.append({
             'id': loan.id,
             'type': loan.loan_type,
@@ -225,11 +128,13 @@ def payslip(payroll_id):
     payroll = Payroll.query.get_or_404(payroll_id)
     
     # التحقق من الصلاحية: إما أن يكون الموظف نفسه أو مدير لديه صلاحية العرض
-    if not (current_user.id == payroll.employee_id or current_user.has_permission(module='payroll', action='view')):
+    own = current_employee()
+    own = own if own is not None and own.id == payroll.employee_id else None
+    if not (own is not None or current_user.has_permission(module='payroll', action='view')):
         return render_template('unauthorized.html')
         
     from flask import session
-    emp = Employee.query.get(payroll.employee_id)
+    emp = own or Employee.query.get(payroll.employee_id)
     # تفصيل أقساط السُلف/القروض لهذا الشهر
     period_end = payroll.period_end or date(payroll.year, payroll.month, 1) + relativedelta(months=1, days=-1)
     loan_breakdown = _compute_loan_due_breakdown(payroll.employee_id, period_end)
@@ -411,13 +316,9 @@ def create_payroll():
         # Auto compute absence/late from attendance if not supplied
         if (data.get('absence_days') is None) or (data.get('late_minutes') is None):
             abs_days, late_mins, working_days = _compute_attendance_metrics(payroll.employee_id, payroll.period_start, payroll.period_end)
-            # استبعاد أيام الإجازة من الغياب وإضافة خصم للإجازات غير المدفوعة
+            # الغياب محسوب باستبعاد أيام الإجازة (تقاطع الأقنعة)؛ الإجازات غير المدفوعة لها خصم مستقل
             paid_dates, unpaid_dates = _get_leave_dates(payroll.employee_id, payroll.period_start, payroll.period_end)
-            # إعادة حساب الغياب باستثناء أي يوم به إجازة (مدفوعة أو غير مدفوعة)
-            # نحسب الغياب من جديد على مستوى الأيام
-            # لبساطة التنفيذ: إنقاص عدد الأيام غير المدفوعة والمدفوعة من الغياب إن كانت محسوبة ضمن الغياب
-            # (دون الدخول في تفاصيل الحضور اليومي)
-            adj_absence = max(0, int(abs_days) - len(paid_dates) - len(unpaid_dates))
+            adj_absence = max(0, int(abs_days))
             payroll.absence_days = adj_absence
             payroll.late_minutes = late_mins
             # Compute deductions based on config
@@ -428,7 +329,7 @@ def create_payroll():
                 payroll.basic = float(emp.salary or 0.0) if emp else 0.0
             daily_rate = (float(payroll.basic) / float(working_days or 30)) if (working_days or 0) > 0 else (float(payroll.basic) / 30.0)
             absence_rate = float(cfg.get('PAYROLL_ABSENCE_DEDUCTION_RATE', 1.0))
-            payroll.absence_deduction = round(daily_rate * abs_days * absence_rate, 2)
+            payroll.absence_deduction = round(daily_rate * adj_absence * absence_rate, 2)
             # late
             hourly_basic = (float(payroll.basic) / 240.0) if payroll.basic else 0.0
             per_hour = float(cfg.get('PAYROLL_LATE_DEDUCTION_PER_HOUR', 0.0)) or hourly_basic
@@ -504,7 +405,7 @@ def update_payroll(payroll_id):
             period_end = period_start + relativedelta(months=1, days=-1)
             abs_days, late_mins, working_days = _compute_attendance_metrics(payroll.employee_id, period_start, period_end)
             paid_dates, unpaid_dates = _get_leave_dates(payroll.employee_id, period_start, period_end)
-            adj_absence = max(0, int(abs_days) - len(paid_dates) - len(unpaid_dates))
+            adj_absence = max(0, int(abs_days))
             payroll.absence_days = adj_absence
             payroll.late_minutes = late_mins
             cfg = current_app.config
@@ -529,6 +430,7 @@ def update_payroll(payroll_id):
             after_net = float(payroll.net or 0.0)
             payroll.last_recalc_net_diff = round(after_net - before_net, 2)
             payroll.last_recalc_at = datetime.utcnow()
+            clear_dirty_marks(payroll.year, payroll.month, [payroll.employee_id])
         
         db.session.commit()
         
@@ -681,166 +583,155 @@ def get_employee_template(employee_id):
 @payroll_bp.route('/api/payroll/batch', methods=['POST'])
 @login_required
 def generate_batch():
-    """إنشاء دفعة رواتب شهرية"""
+    """إنشاء دفعة رواتب شهرية كمهمة خلفية؛ يرجع رقم المهمة فوراً (202)"""
     if not current_user.has_permission(module='payroll', action='create'):
         return jsonify({'error': 'Unauthorized'}), 403
-    
+
     try:
-        data = request.get_json()
-        month = data['month']
-        year = data['year']
-        
-        # Check if batch already exists
-        existing_count = Payroll.query.filter_by(month=month, year=year).count()
-        if existing_count > 0:
-            return jsonify({'error': f'Payroll batch already exists for this period ({existing_count} records)'}), 400
-        
-        # Get all active employees with templates
-        templates = PayrollTemplate.query.join(Employee).filter(
-            Employee.active == True,
-            PayrollTemplate.is_active == True
-        ).all()
-        
-        if not templates:
-            return jsonify({'error': 'No active employee templates found'}), 400
-        
-        count = 0
-        period_start = date(year, month, 1)
-        period_end = period_start + relativedelta(months=1, days=-1)
-        
-        for template in templates:
-            payroll = Payroll(
-                employee_id=template.employee_id,
-                month=month,
-                year=year,
-                period_start=period_start,
-                period_end=period_end,
-                basic=template.basic_salary,
-                housing_allowance=template.housing_allowance,
-                transport_allowance=template.transport_allowance,
-                food_allowance=template.food_allowance,
-                phone_allowance=template.phone_allowance,
-                other_allowances=template.other_allowances,
-                status='pending',
-                generated_by=current_user.id,
-                generated_at=datetime.utcnow()
-            )
-            
-            # Auto compute attendance-based metrics
-            abs_days, late_mins, working_days = _compute_attendance_metrics(template.employee_id, period_start, period_end)
-            paid_dates, unpaid_dates = _get_leave_dates(template.employee_id, period_start, period_end)
-            adj_absence = max(0, int(abs_days) - len(paid_dates) - len(unpaid_dates))
-            payroll.absence_days = adj_absence
-            payroll.late_minutes = late_mins
-            cfg = current_app.config
-            daily_rate = (float(payroll.basic) / float(working_days or 30)) if (working_days or 0) > 0 else (float(payroll.basic) / 30.0)
-            absence_rate = float(cfg.get('PAYROLL_ABSENCE_DEDUCTION_RATE', 1.0))
-            payroll.absence_deduction = round(daily_rate * adj_absence * absence_rate, 2)
-            hourly_basic = (float(payroll.basic) / 240.0) if payroll.basic else 0.0
-            per_hour = float(cfg.get('PAYROLL_LATE_DEDUCTION_PER_HOUR', 0.0)) or hourly_basic
-            payroll.late_deduction = round(per_hour * (late_mins or 0) / 60.0, 2)
-            payroll.unpaid_leave_days = len(unpaid_dates)
-            payroll.unpaid_leave_deduction = round(daily_rate * payroll.unpaid_leave_days, 2)
-            
-            # Auto compute loan/advance deduction per employee
-            payroll.loan_deduction = _compute_loan_due_amount(template.employee_id, period_end)
-
-            # Calculate net
-            payroll.compute_net()
-            
-            db.session.add(payroll)
-            count += 1
-        
-        # Create batch record
-        batch = PayrollBatch(
-            month=month,
-            year=year,
-            period_start=period_start,
-            period_end=period_end,
-            total_employees=count,
-            status='draft',
-            generated_by=current_user.id
+        data = request.get_json() or {}
+        month = int(data['month'])
+        year = int(data['year'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'Month and year are required'}), 400
+
+    # فحوصات سريعة قبل الإرسال حتى تظهر الأخطاء الواضحة مباشرة
+    existing_count = Payroll.query.filter_by(month=month, year=year).count()
+    if existing_count > 0:
+        return jsonify({'error': f'Payroll batch already exists for this period ({existing_count} records)'}), 400
+    if _active_templates_query().first() is None:
+        return jsonify({'error': 'No active employee templates found'}), 400
+
+    job = submit_job('payroll.batch_generate', {'month': month, 'year': year}, user_id=current_user.id)
+    return jsonify({'success': True, 'job_id': job.id, 'job': job.to_dict()}), 202
+
+
+def _active_templates_query():
+    return PayrollTemplate.query.join(Employee).filter(
+        Employee.active == True,
+        PayrollTemplate.is_active == True
+    )
+
+
+@job_handler('payroll.batch_generate')
+def _run_generate_batch(ctx):
+    """تنفيذ إنشاء الدفعة: قراءة وحساب على أجزاء مع تحديث التقدم، ثم كتابة واحدة قصيرة."""
+    month, year = ctx.payload['month'], ctx.payload['year']
+
+    existing_count = Payroll.query.filter_by(month=month, year=year).count()
+    if existing_count > 0:
+        raise ValueError(f'Payroll batch already exists for this period ({existing_count} records)')
+    templates = _active_templates_query().all()
+    if not templates:
+        raise ValueError('No active employee templates found')
+
+    period_start = date(year, month, 1)
+    period_end = period_start + relativedelta(months=1, days=-1)
+
+    # العلامات تُقرأ قبل تحميل المدخلات: ما يُعلَّم بعدها يبقى لإعادة الحساب التالية
+    _, mark_ids = dirty_employees(year, month)
+    ctx.progress(5, 'تحميل الحضور والإجازات والسلف')
+    inputs = load_period_inputs(period_start, period_end, {t.employee_id for t in templates})
+
+    rows = []
+    totals = {'gross': 0.0, 'deductions': 0.0, 'net': 0.0}
+    total = len(templates)
+    for i in range(0, total, _JOB_CHUNK):
+        part_rows, part_totals = build_batch_payrolls(
+            templates[i:i + _JOB_CHUNK], month, year, generated_by=ctx.user_id, inputs=inputs
         )
-        db.session.add(batch)
-        
-        db.session.commit()
-        
-        return jsonify({'success': True, 'count': count})
-    except Exception as e:
-        db.session.rollback()
-        current_app.logger.error(f"Error generating batch: {e}")
-        return jsonify({'error': str(e)}), 500
+        rows.extend(part_rows)
+        for key in totals:
+            totals[key] += part_totals[key]
+        done = min(i + _JOB_CHUNK, total)
+        ctx.progress(10 + 80 * done // total, f'تم حساب {done} من {total}')
+    totals = {k: round(v, 2) for k, v in totals.items()}
+
+    # مرحلة الكتابة: إدراج مجمّع + سجل الدفعة في معاملة واحدة قصيرة
+    ctx.progress(92, 'حفظ الرواتب')
+    count = bulk_insert_payrolls(rows)
+    # الرواتب محسوبة للتو من أحدث البيانات، فلا حاجة لعلامات سابقة لهذا الشهر
+    clear_dirty_marks(year, month, mark_ids=mark_ids)
+
+    batch = PayrollBatch(
+        month=month,
+        year=year,
+        period_start=period_start,
+        period_end=period_end,
+        total_employees=count,
+        total_gross=totals['gross'],
+        total_deductions=totals['deductions'],
+        total_net=totals['net'],
+        status='draft',
+        generated_by=ctx.user_id
+    )
+    db.session.add(batch)
+    db.session.commit()
+
+    return {'success': True, 'count': count, 'batch_id': batch.id, 'totals': totals}
 
 
 @payroll_bp.route('/api/payroll/recalc/batch', methods=['POST'])
 @login_required
 def batch_recalculate_payrolls():
-    """إعادة حساب جميع رواتب شهر/سنة محددين (غير المدفوعة) من الحضور وتحديث خصم السلف.
-    ترجع عدد السجلات التي تم تحديثها والمجموع الكلي للفروقات في الصافي.
+    """إعادة حساب رواتب شهر/سنة محددين (غير المدفوعة) من الحضور وتحديث خصم السلف.
+    افتراضياً تُعاد معالجة الموظفين الذين تغيّر حضورهم/إجازاتهم/سلفهم فقط منذ آخر إعادة حساب
+    (جدول payroll_dirty_mark)؛ أرسل full=true لإعادة حساب الشهر كاملاً.
+    تعمل كمهمة خلفية؛ نتيجتها عدد السجلات المحدثة والمجموع الكلي للفروقات في الصافي.
     """
     if not current_user.has_permission(module='payroll', action='edit'):
         return jsonify({'error': 'Unauthorized'}), 403
 
+    data = request.get_json() or {}
     try:
-        data = request.get_json() or {}
         month = int(data.get('month')) if data.get('month') is not None else None
         year = int(data.get('year')) if data.get('year') is not None else None
-        if not month or not year:
-            return jsonify({'error': 'Month and year are required'}), 400
-
-        period_start = date(year, month, 1)
-        period_end = period_start + relativedelta(months=1, days=-1)
-
-        qs = Payroll.query.filter(
-            Payroll.month == month,
-            Payroll.year == year,
-            Payroll.status.in_(['pending', 'approved'])
-        ).all()
-
-        updated = 0
-        total_diff = 0.0
-        cfg = current_app.config
-
-        for p in qs:
-            before_net = float(p.net or 0.0)
-
-            abs_days, late_mins, working_days = _compute_attendance_metrics(p.employee_id, period_start, period_end)
-            paid_dates, unpaid_dates = _get_leave_dates(p.employee_id, period_start, period_end)
-            adj_absence = max(0, int(abs_days) - len(paid_dates) - len(unpaid_dates))
-            p.absence_days = adj_absence
-            p.late_minutes = late_mins
-
-            daily_rate = (float(p.basic or 0.0) / float(working_days or 30)) if (working_days or 0) > 0 else (float(p.basic or 0.0) / 30.0)
-            absence_rate = float(cfg.get('PAYROLL_ABSENCE_DEDUCTION_RATE', 1.0))
-            p.absence_deduction = round(daily_rate * adj_absence * absence_rate, 2)
-
-            hourly_basic = (float(p.basic or 0.0) / 240.0) if p.basic else 0.0
-            per_hour = float(cfg.get('PAYROLL_LATE_DEDUCTION_PER_HOUR', 0.0)) or hourly_basic
-            p.late_deduction = round(per_hour * (late_mins or 0) / 60.0, 2)
-
-            # Update loan deduction
-            p.loan_deduction = _compute_loan_due_amount(p.employee_id, period_end)
-            # Update unpaid leave
-            p.unpaid_leave_days = len(unpaid_dates)
-            p.unpaid_leave_deduction = round(daily_rate * p.unpaid_leave_days, 2)
-
-            # Recompute net
-            p.compute_net()
-
-            after_net = float(p.net or 0.0)
-            diff = round(after_net - before_net, 2)
-            p.last_recalc_net_diff = diff
-            p.last_recalc_at = datetime.utcnow()
-            updated += 1
-            total_diff = round(total_diff + diff, 2)
-
-        db.session.commit()
-
-        return jsonify({'success': True, 'updated': updated, 'total_diff': total_diff})
-    except Exception as e:
-        db.session.rollback()
-        current_app.logger.error(f"Error batch recalculating payrolls: {e}")
-        return jsonify({'error': str(e)}), 500
+    except (TypeError, ValueError):
+        month = year = None
+    if not month or not year:
+        return jsonify({'error': 'Month and year are required'}), 400
+
+    job = submit_job('payroll.batch_recalc', {
+        'month': month, 'year': year, 'full': bool(data.get('full'))
+    }, user_id=current_user.id)
+    return jsonify({'success': True, 'job_id': job.id, 'job': job.to_dict()}), 202
+
+
+@job_handler('payroll.batch_recalc')
+def _run_batch_recalculate(ctx):
+    """تنفيذ إعادة الحساب: العلامات تُقرأ أولاً وتُحذف مع الكتابة حتى لا يضيع تغيير يقع أثناء التشغيل."""
+    month, year, full = ctx.payload['month'], ctx.payload['year'], ctx.payload.get('full', False)
+    mode = 'full' if full else 'incremental'
+    period_start = date(year, month, 1)
+    period_end = period_start + relativedelta(months=1, days=-1)
+
+    query = Payroll.query.filter(
+        Payroll.month == month,
+        Payroll.year == year,
+        Payroll.status.in_(['pending', 'approved'])
+    )
+    dirty_ids, mark_ids = dirty_employees(year, month)
+    if not full:
+        if not dirty_ids:
+            return {'success': True, 'updated': 0, 'total_diff': 0.0, 'mode': mode}
+        query = query.filter(Payroll.employee_id.in_(dirty_ids))
+    qs = query.all()
+
+    ctx.progress(10, 'تحميل الحضور والإجازات والسلف')
+    inputs = load_period_inputs(period_start, period_end, {p.employee_id for p in qs})
+
+    # التعديلات في الذاكرة فقط حتى commit (لا استعلامات بينها فلا autoflush)
+    updated, total_diff = 0, 0.0
+    for i in range(0, len(qs), _JOB_CHUNK):
+        count, diff = recalculate_payrolls(qs[i:i + _JOB_CHUNK], period_start, period_end, inputs=inputs)
+        updated += count
+        total_diff = round(total_diff + diff, 2)
+        done = min(i + _JOB_CHUNK, len(qs))
+        ctx.progress(15 + 75 * done // len(qs), f'تمت إعادة حساب {done} من {len(qs)}')
+
+    clear_dirty_marks(year, month, mark_ids=mark_ids)
+    db.session.commit()
+
+    return {'success': True, 'updated': updated, 'total_diff': total_diff, 'mode': mode}
 
 
 @payroll_bp.route('/api/payroll/<int:payroll_id>/payslip', methods=['GET'])
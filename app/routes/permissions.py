@@ -5,6 +5,7 @@ from app.models.permission import initialize_default_permissions, initialize_def
 from app.models.user import User
 from app import db
 from app.permissions import has_permission
+from app.utils.permission_cache import invalidate_permissions
 from datetime import datetime
 
 permissions_bp = Blueprint('permissions', __name__)
@@ -113,6 +114,7 @@ def create_role():
         )
         db.session.add(log)
         
+        invalidate_permissions()
         db.session.commit()
         
         return jsonify({'success': True, 'id': role.id}), 201
@@ -174,6 +176,7 @@ def update_role(role_id):
         )
         db.session.add(log)
         
+        invalidate_permissions()
         db.session.commit()
         
         return jsonify({'success': True})
@@ -212,6 +215,7 @@ def delete_role(role_id):
         db.session.add(log)
         
         db.session.delete(role)
+        invalidate_permissions()
         db.session.commit()
         
         return jsonify({'success': True})
@@ -352,6 +356,7 @@ def assign_user_role():
         )
         db.session.add(log)
         
+        invalidate_permissions()
         db.session.commit()
         
         return jsonify({'success': True})
@@ -382,6 +387,7 @@ def remove_user_role(user_role_id):
         db.session.add(log)
         
         db.session.delete(user_role)
+        invalidate_permissions()
         db.session.commit()
         
         return jsonify({'success': True})
@@ -1,85 +1,71 @@
-from flask import Blueprint, request, jsonify, session
-from flask_login import login_required, current_user
-from app.models.presence import EmployeePresence
-from app.models.employee import Employee
-from app import db
+from flask import Blueprint, request, jsonify, make_response
+from flask_login import login_required
 from app.permissions import has_permission
-from datetime import datetime, timedelta
+from app.utils.identity import current_employee
+from app.utils.presence import (
+    AWAY, OFFLINE, ONLINE, dashboard_etag, dashboard_page, employee_status, presence_windows, record_heartbeat,
+)
 
 presence_bp = Blueprint('presence', __name__)
 
-# Cache for last update times to prevent too frequent updates
-_last_updates = {}
-UPDATE_INTERVAL = timedelta(minutes=30)  # Only allow updates every 30 minutes
+_DEFAULT_PAGE = 100
+_MAX_PAGE = 500
 
 @presence_bp.route('/api/presence/update', methods=['POST'])
 @login_required
 def update_presence():
-    data = request.get_json() or {}
-    employee_id = data.get('employee_id') or current_user.id
-    
-    # Rate limiting: check if last update was recent
-    cache_key = f"presence_{employee_id}"
-    now = datetime.utcnow()
-    
-    if cache_key in _last_updates:
-        last_update = _last_updates[cache_key]
-        if now - last_update < UPDATE_INTERVAL:
-            # Too soon, return success without updating database
-            return jsonify({'status': 'success', 'cached': True})
-    
-    # Update cache
-    _last_updates[cache_key] = now
-    
-    # Update database
-    ip_address = request.remote_addr
-    presence = EmployeePresence.query.filter_by(employee_id=employee_id).first()
-    
+    data = request.get_json(silent=True) or {}
+    # التواجد بمعرّف الموظف المرتبط بالحساب (Employee.id)، لا بمعرّف المستخدم
+    employee = current_employee()
+    own_id = employee.id if employee is not None else None
     try:
-        if not presence:
-            presence = EmployeePresence(
-                employee_id=employee_id, 
-                status='online', 
-                last_activity=now, 
-                session_start=now, 
-                ip_address=ip_address
-            )
-            db.session.add(presence)
-        else:
-            presence.last_activity = now
-            presence.status = 'online'
-            presence.ip_address = ip_address
-        
-        db.session.commit()
-        return jsonify({'status': 'success', 'updated': True})
+        employee_id = int(data.get('employee_id') or 0) or own_id
+    except (TypeError, ValueError):
+        employee_id = own_id
+    if employee_id is None:
+        return jsonify({'status': 'error', 'error': 'no linked employee'}), 400
+    # تسجيل نبضة لموظف آخر للمدير فقط
+    if employee_id != own_id and not has_permission(['admin']):
+        return jsonify({'status': 'error', 'error': 'unauthorized'}), 403
+
+    # النبضة تُحفظ في ذاكرة العملية وتُكتب لاحقاً على دفعات (app/utils/presence.py)
+    try:
+        record_heartbeat(employee_id, request.remote_addr)
     except Exception as e:
-        db.session.rollback()
         # Return success anyway to avoid client-side errors
         return jsonify({'status': 'success', 'error': str(e)})
+    interval, _, _ = presence_windows()
+    return jsonify({'status': 'success', 'interval_seconds': int(interval.total_seconds())})
 
 @presence_bp.route('/api/presence/status/<int:employee_id>', methods=['GET'])
 @login_required
 def get_employee_status(employee_id):
-    presence = EmployeePresence.query.filter_by(employee_id=employee_id).first()
-    if not presence:
-        return jsonify({'status': 'offline', 'last_activity': None})
-    return jsonify({'status': presence.status, 'last_activity': presence.last_activity})
+    return jsonify(employee_status(employee_id))
 
 @presence_bp.route('/api/presence/dashboard', methods=['GET'])
 @login_required
 def get_presence_dashboard():
+    """لوحة التواجد: ?department=&status=online|away|offline&after=<آخر معرّف>&limit=
+    استعلام واحد للصفحة، و 304 إذا طابق If-None-Match البصمة الحالية."""
     # Only admin/manager can view dashboard
     if not has_permission(['admin', 'manager']):
         return jsonify({'error': 'unauthorized'}), 403
-    employees = Employee.query.all()
-    dashboard = []
-    for emp in employees:
-        presence = EmployeePresence.query.filter_by(employee_id=emp.id).first()
-        dashboard.append({
-            'name': emp.name,
-            'department': emp.department,
-            'status': presence.status if presence else 'offline',
-            'last_activity': presence.last_activity if presence else None,
-            'session_start': presence.session_start if presence else None
-        })
-    return jsonify(dashboard)
+    department = (request.args.get('department') or '').strip() or None
+    status = (request.args.get('status') or '').strip() or None
+    if status and status not in (ONLINE, AWAY, OFFLINE):
+        return jsonify({'error': 'invalid status'}), 400
+    try:
+        after = request.args.get('after', type=int)
+        limit = min(max(int(request.args.get('limit', _DEFAULT_PAGE)), 1), _MAX_PAGE)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'invalid pagination'}), 400
+
+    etag = dashboard_etag(department, status, after, limit)
+    if request.if_none_match.contains_weak(etag):
+        response = make_response('', 304)
+    else:
+        items, next_cursor = dashboard_page(department, status, after, limit)
+        response = jsonify({'items': items, 'next_cursor': next_cursor, 'count': len(items)})
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
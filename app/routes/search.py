@@ -0,0 +1,70 @@
+"""
+Routes للبحث الموحد في رسائل WhatsApp وتذاكر الدعم والشكاوى (app/utils/search_index.py)
+"""
+import time
+
+from flask import Blueprint, jsonify, request
+from flask_login import current_user, login_required
+
+from app import csrf, db
+from app.permissions import has_permission
+from app.utils.jobs import job_handler, submit_job
+from app.utils.search_index import DEFAULT_LIMIT, SOURCES, rebuild_search_index, search, source_row_count
+
+search_bp = Blueprint('search', __name__)
+
+
+def _can_search():
+    return has_permission(['admin', 'manager']) or has_permission(module='support', action='view')
+
+
+@search_bp.route('/api/search', methods=['GET'])
+@login_required
+def unified_search():
+    """بحث مرتب بالصلة: ?q=<كلمات أو رقم هاتف>&sources=whatsapp,client_support,complaint,ticket&limit=20"""
+    if not _can_search():
+        return jsonify({'error': 'Unauthorized'}), 403
+    query = (request.args.get('q') or '').strip()
+    if not query:
+        return jsonify({'error': 'q is required'}), 400
+    sources = [s.strip() for s in (request.args.get('sources') or '').split(',') if s.strip()]
+    unknown = [s for s in sources if s not in SOURCES]
+    if unknown:
+        return jsonify({'error': f"Unknown sources: {', '.join(unknown)}"}), 400
+    try:
+        limit = int(request.args.get('limit', DEFAULT_LIMIT))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'invalid limit'}), 400
+
+    started = time.perf_counter()
+    items = search(query, sources, limit)
+    return jsonify({
+        'items': items,
+        'count': len(items),
+        'took_ms': round((time.perf_counter() - started) * 1000, 2),
+    })
+
+
+@search_bp.route('/api/search/rebuild', methods=['POST'])
+@csrf.exempt
+@login_required
+def rebuild_index():
+    """إعادة بناء الفهرس في الخلفية (بعد الترقية أو استيراد بيانات بعبارات SQL مباشرة)"""
+    if not has_permission(['admin']):
+        return jsonify({'error': 'Unauthorized'}), 403
+    data = request.get_json(silent=True) or {}
+    sources = data.get('sources') or list(SOURCES)
+    if not isinstance(sources, list) or any(s not in SOURCES for s in sources):
+        return jsonify({'error': 'Unknown sources'}), 400
+    job = submit_job('search.rebuild', {'sources': sources}, user_id=current_user.id)
+    return jsonify({'status': 'accepted', 'job_id': job.id, 'job': job.to_dict()}), 202
+
+
+@job_handler('search.rebuild')
+def _run_rebuild(ctx):
+    """فهرسة كل سجلات المصادر المطلوبة بدفعات."""
+    sources = ctx.payload.get('sources') or SOURCES
+    total = max(source_row_count(sources), 1)
+    db.session.commit()
+    return rebuild_search_index(
+        sources, progress=lambda done, message: ctx.progress(min(99, 100 * done // total), message))
@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session
-from flask_login import login_required, current_user
+from flask_login import login_required
 from app.models.support import SupportTicket
+from app.utils.identity import current_employee
 from app import db
 from datetime import datetime
 
@@ -9,14 +10,18 @@ support_bp = Blueprint('support', __name__)
 @support_bp.route('/support', methods=['GET', 'POST'])
 @login_required
 def support():
+    employee = current_employee()
     if request.method == 'POST':
+        if employee is None:
+            flash('حسابك غير مرتبط بموظف', 'danger')
+            return redirect(url_for('support.support'))
         client_phone = request.form['client_phone']
         issue = request.form['issue']
         resolved = 'resolved' in request.form
         escalated = 'escalated' in request.form
         time_spent = int(request.form['time_spent'])
         ticket = SupportTicket(
-            employee_id=current_user.id,
+            employee_id=employee.id,
             client_phone=client_phone,
             issue=issue,
             resolved=resolved,
@@ -29,5 +34,5 @@ def support():
         db.session.commit()
         flash('تم تسجيل الدعم بنجاح', 'success')
         return redirect(url_for('support.support'))
-    tickets = SupportTicket.query.filter_by(employee_id=current_user.id).all()
+    tickets = SupportTicket.query.filter_by(employee_id=employee.id).all() if employee is not None else []
     return render_template('support.html', tickets=tickets, lang=session.get('lang', 'ar'))
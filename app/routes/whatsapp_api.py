@@ -4,11 +4,23 @@
 from flask import Blueprint, request, jsonify, render_template, session, current_app
 from flask_login import login_required, current_user
 from app import db
+from app.models.employee import Employee
 from app.models.whatsapp_models import WhatsAppConversation, WhatsAppMessage, WhatsAppTemplate
 from app.whatsapp_config import WhatsAppConfig
 from app.permissions import has_permission
+from app.utils.jobs import job_handler, submit_once
+from app.utils.media_store import MediaTooLarge, media_path, media_url, send_media, store_file
+from app.utils.whatsapp_history import (
+    DEFAULT_PAGE, MAX_PAGE, conversation_changes, conversation_page, decode_cursor, message_changes, message_page,
+    parse_since,
+)
+from app.utils.whatsapp_inbox import drain_inbox, enqueue_webhook, next_retry_in as inbox_retry_in, queued_count
+from app.utils.whatsapp_outbox import (
+    GraphError, broadcast_status, drain_outbox, enqueue_message, get_graph_client, next_retry_in, queue_broadcast,
+    queued_count as outbox_queued_count,
+)
+from sqlalchemy import select, update
 from datetime import datetime
-import requests
 import os
 import json
 from werkzeug.utils import secure_filename
@@ -39,191 +51,44 @@ def whatsapp_webhook():
             current_app.logger.warning('Webhook verification failed')
             return 'Verification failed', 403
     
-    # POST - استقبال الرسائل
+    # POST - حفظ الحمولة في صندوق الوارد والرد فوراً؛ المعالجة في مهمة خلفية
     try:
-        data = request.get_json()
+        raw_body = request.get_data(as_text=True)
+        data = json.loads(raw_body) if raw_body else None
         
-        if not data or 'entry' not in data:
+        if not isinstance(data, dict) or 'entry' not in data:
             return jsonify({'error': 'Invalid data'}), 400
         
-        # معالجة كل إدخال
-        for entry in data.get('entry', []):
-            for change in entry.get('changes', []):
-                value = change.get('value', {})
-                
-                # التحقق من وجود رسائل
-                if 'messages' in value:
-                    for message in value['messages']:
-                        process_incoming_message(message, value)
-                
-                # معالجة حالة الرسالة (delivered, read, etc.)
-                if 'statuses' in value:
-                    for status in value['statuses']:
-                        update_message_status(status)
+        enqueue_webhook(raw_body)
+        db.session.commit()
+        _schedule_inbox_drain()
         
         return jsonify({'status': 'success'}), 200
         
+    except ValueError:
+        return jsonify({'error': 'Invalid data'}), 400
     except Exception as e:
+        db.session.rollback()
         current_app.logger.error(f'Webhook error: {str(e)}')
         return jsonify({'error': str(e)}), 500
 
 
-def process_incoming_message(message_data, value):
-    """معالجة الرسالة الواردة"""
-    try:
-        customer_phone = message_data.get('from')
-        message_id = message_data.get('id')
-        message_type = message_data.get('type')
-        timestamp = datetime.fromtimestamp(int(message_data.get('timestamp', 0)))
-        
-        # الحصول على المحادثة أو إنشاء واحدة جديدة
-        conversation = WhatsAppConversation.query.filter_by(
-            customer_phone=customer_phone
-        ).first()
-        
-        if not conversation:
-            # إنشاء محادثة جديدة
-            customer_name = value.get('contacts', [{}])[0].get('profile', {}).get('name', customer_phone)
-            conversation = WhatsAppConversation(
-                customer_phone=customer_phone,
-                customer_name=customer_name,
-                status='active'
-            )
-            db.session.add(conversation)
-            db.session.flush()
-        
-        # استخراج محتوى الرسالة
-        message_content = ''
-        media_url = None
-        caption = None
-        
-        if message_type == 'text':
-            message_content = message_data['text']['body']
-        
-        elif message_type == 'audio':
-            audio_id = message_data['audio']['id']
-            media_url = download_whatsapp_media(audio_id)
-            message_content = 'رسالة صوتية'
-        
-        elif message_type == 'image':
-            image_id = message_data['image']['id']
-            media_url = download_whatsapp_media(image_id)
-            caption = message_data['image'].get('caption', '')
-            message_content = caption or 'صورة'
-        
-        elif message_type == 'document':
-            doc_id = message_data['document']['id']
-            media_url = download_whatsapp_media(doc_id)
-            caption = message_data['document'].get('caption', '')
-            message_content = caption or 'مستند'
-        
-        elif message_type == 'video':
-            video_id = message_data['video']['id']
-            media_url = download_whatsapp_media(video_id)
-            caption = message_data['video'].get('caption', '')
-            message_content = caption or 'فيديو'
-        
-        # حفظ الرسالة
-        new_message = WhatsAppMessage(
-            conversation_id=conversation.id,
-            message_id=message_id,
-            message_type=message_type,
-            message_content=message_content,
-            audio_url=media_url if message_type == 'audio' else None,
-            image_url=media_url if message_type == 'image' else None,
-            document_url=media_url if message_type == 'document' else None,
-            video_url=media_url if message_type == 'video' else None,
-            caption=caption,
-            direction='incoming',
-            timestamp=timestamp
-        )
-        db.session.add(new_message)
-        
-        # تحديث المحادثة
-        conversation.last_message = message_content
-        conversation.last_message_type = message_type
-        conversation.last_message_direction = 'incoming'
-        conversation.unread_count += 1
-        conversation.updated_at = datetime.utcnow()
-        
-        db.session.commit()
-        
-        current_app.logger.info(f'Message saved: {message_id} from {customer_phone}')
-        
-    except Exception as e:
-        db.session.rollback()
-        current_app.logger.error(f'Error processing message: {str(e)}')
-
-
-def download_whatsapp_media(media_id):
-    """تحميل الوسائط من WhatsApp"""
-    try:
-        # الحصول على رابط الوسائط
-        url = WhatsAppConfig.get_api_url(media_id)
-        headers = {
-            'Authorization': f'Bearer {WhatsAppConfig.ACCESS_TOKEN}'
-        }
-        
-        response = requests.get(url, headers=headers)
-        
-        if response.status_code == 200:
-            media_info = response.json()
-            media_url = media_info.get('url')
-            mime_type = media_info.get('mime_type')
-            
-            if media_url:
-                # تحميل الملف
-                media_response = requests.get(media_url, headers=headers)
-                
-                if media_response.status_code == 200:
-                    # حفظ الملف
-                    filename = f"{media_id}_{datetime.now().timestamp()}.{get_extension_from_mime(mime_type)}"
-                    filepath = os.path.join(WhatsAppConfig.MEDIA_UPLOAD_FOLDER, filename)
-                    
-                    # التأكد من وجود المجلد
-                    os.makedirs(WhatsAppConfig.MEDIA_UPLOAD_FOLDER, exist_ok=True)
-                    
-                    with open(filepath, 'wb') as f:
-                        f.write(media_response.content)
-                    
-                    # إرجاع الرابط النسبي
-                    return f'/static/whatsapp_media/{filename}'
-        
-        return None
-        
-    except Exception as e:
-        current_app.logger.error(f'Error downloading media: {str(e)}')
-        return None
-
-
-def get_extension_from_mime(mime_type):
-    """الحصول على الامتداد من نوع MIME"""
-    extensions = {
-        'audio/mpeg': 'mp3',
-        'audio/ogg': 'ogg',
-        'audio/wav': 'wav',
-        'image/jpeg': 'jpg',
-        'image/png': 'png',
-        'image/gif': 'gif',
-        'video/mp4': 'mp4',
-        'application/pdf': 'pdf',
-    }
-    return extensions.get(mime_type, 'bin')
+def _schedule_inbox_drain(delay=None):
+    """تشغيل مهمة معالجة الصندوق ما لم تكن هناك مهمة منتظرة تبدأ بحلول الموعد (الجارية تلتقط الجديد في دفعتها التالية).
+    delay: ثوانٍ قبل بدء المهمة (متابعة الحمولات المؤجلة)."""
+    return submit_once('whatsapp.inbox_drain', {}, delay=delay)
 
 
-def update_message_status(status_data):
-    """تحديث حالة الرسالة (delivered, read, etc.)"""
-    try:
-        message_id = status_data.get('id')
-        status = status_data.get('status')
-        
-        message = WhatsAppMessage.query.filter_by(message_id=message_id).first()
-        if message:
-            message.status = status
-            db.session.commit()
-            
-    except Exception as e:
-        current_app.logger.error(f'Error updating status: {str(e)}')
+@job_handler('whatsapp.inbox_drain')
+def _run_inbox_drain(ctx):
+    """معالجة حمولات webhook المنتظرة (app/utils/whatsapp_inbox.py)."""
+    total = max(queued_count(), 1)
+    db.session.commit()
+    totals = drain_inbox(progress=lambda done, message: ctx.progress(min(99, 100 * done // total), message))
+    wait = inbox_retry_in()
+    if wait is not None:
+        _schedule_inbox_drain(delay=wait)
+    return totals
 
 
 # ==================== API للإرسال ====================
@@ -231,7 +96,7 @@ def update_message_status(status_data):
 @whatsapp_bp.route('/api/whatsapp/send-message', methods=['POST'])
 @login_required
 def send_whatsapp_message():
-    """إرسال رسالة نصية"""
+    """إرسال رسالة نصية (تُضاف لصندوق الصادر وتُرسل في الخلفية)"""
     if not has_permission(['admin', 'manager']):
         return jsonify({'error': 'Unauthorized'}), 403
     
@@ -245,32 +110,28 @@ def send_whatsapp_message():
         
         conversation = WhatsAppConversation.query.get_or_404(conversation_id)
         
-        # إرسال الرسالة
-        result = send_text_message(conversation.customer_phone, message)
+        # حفظ في قاعدة البيانات بحالة queued؛ معرف واتساب يُسجل عند الإرسال
+        new_message = WhatsAppMessage(
+            conversation_id=conversation_id,
+            message_type='text',
+            message_content=message,
+            direction='outgoing',
+            status='queued'
+        )
+        db.session.add(new_message)
+        db.session.flush()
+        enqueue_message(conversation, new_message, body=message, user_id=current_user.id)
         
-        if result['success']:
-            # حفظ في قاعدة البيانات
-            new_message = WhatsAppMessage(
-                conversation_id=conversation_id,
-                message_id=result['message_id'],
-                message_type='text',
-                message_content=message,
-                direction='outgoing',
-                status='sent'
-            )
-            db.session.add(new_message)
-            
-            # تحديث المحادثة
-            conversation.last_message = message
-            conversation.last_message_type = 'text'
-            conversation.last_message_direction = 'outgoing'
-            conversation.updated_at = datetime.utcnow()
-            
-            db.session.commit()
-            
-            return jsonify({'success': True, 'message': new_message.to_dict()})
-        else:
-            return jsonify({'success': False, 'error': result['error']}), 500
+        # تحديث المحادثة
+        conversation.last_message = message
+        conversation.last_message_type = 'text'
+        conversation.last_message_direction = 'outgoing'
+        conversation.updated_at = datetime.utcnow()
+        
+        db.session.commit()
+        _schedule_outbox_drain()
+        
+        return jsonify({'success': True, 'message': new_message.to_dict()})
             
     except Exception as e:
         db.session.rollback()
@@ -280,7 +141,7 @@ def send_whatsapp_message():
 @whatsapp_bp.route('/api/whatsapp/send-audio', methods=['POST'])
 @login_required
 def send_whatsapp_audio():
-    """إرسال رسالة صوتية"""
+    """إرسال رسالة صوتية (الرفع والإرسال في الخلفية)"""
     if not has_permission(['admin', 'manager']):
         return jsonify({'error': 'Unauthorized'}), 403
     
@@ -293,165 +154,185 @@ def send_whatsapp_audio():
         
         conversation = WhatsAppConversation.query.get_or_404(conversation_id)
         
-        # حفظ الملف الصوتي
-        filename = secure_filename(f"{datetime.now().timestamp()}_{audio_file.filename}")
-        filepath = os.path.join(WhatsAppConfig.MEDIA_UPLOAD_FOLDER, filename)
+        # حفظ الملف الصوتي بالتدفق وبعنوان المحتوى (نفس التسجيل لا يُخزن مرتين)
+        extension = os.path.splitext(secure_filename(audio_file.filename or ''))[1].lstrip('.') or 'mp3'
+        try:
+            stored = store_file(audio_file.stream, extension, max_bytes=WhatsAppConfig.MAX_AUDIO_SIZE)
+        except MediaTooLarge:
+            return jsonify({'error': 'File too large'}), 413
+        
+        new_message = WhatsAppMessage(
+            conversation_id=conversation_id,
+            message_type='audio',
+            message_content='رسالة صوتية',
+            audio_url=media_url(stored.relpath),
+            direction='outgoing',
+            status='queued'
+        )
+        db.session.add(new_message)
+        db.session.flush()
+        enqueue_message(conversation, new_message, media_path=media_path(stored.relpath), user_id=current_user.id)
         
-        os.makedirs(WhatsAppConfig.MEDIA_UPLOAD_FOLDER, exist_ok=True)
-        audio_file.save(filepath)
+        # تحديث المحادثة
+        conversation.last_message = 'رسالة صوتية'
+        conversation.last_message_type = 'audio'
+        conversation.last_message_direction = 'outgoing'
+        conversation.updated_at = datetime.utcnow()
         
-        # رفع إلى WhatsApp
-        audio_url = upload_media_to_whatsapp(filepath, 'audio')
+        db.session.commit()
+        _schedule_outbox_drain()
         
-        if audio_url:
-            # إرسال الرسالة الصوتية
-            result = send_audio_message(conversation.customer_phone, audio_url)
+        return jsonify({'success': True, 'message': new_message.to_dict()})
             
-            if result['success']:
-                # حفظ في قاعدة البيانات
-                new_message = WhatsAppMessage(
-                    conversation_id=conversation_id,
-                    message_id=result['message_id'],
-                    message_type='audio',
-                    message_content='رسالة صوتية',
-                    audio_url=f'/static/whatsapp_media/{filename}',
-                    direction='outgoing',
-                    status='sent'
-                )
-                db.session.add(new_message)
-                
-                # تحديث المحادثة
-                conversation.last_message = 'رسالة صوتية'
-                conversation.last_message_type = 'audio'
-                conversation.last_message_direction = 'outgoing'
-                conversation.updated_at = datetime.utcnow()
-                
-                db.session.commit()
-                
-                return jsonify({'success': True, 'message': new_message.to_dict()})
-            else:
-                return jsonify({'success': False, 'error': result['error']}), 500
-        else:
-            return jsonify({'success': False, 'error': 'Failed to upload media'}), 500
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+
+@whatsapp_bp.route('/api/whatsapp/broadcast', methods=['POST'])
+@login_required
+def broadcast_whatsapp_message():
+    """بث رسالة أو قالب (WhatsAppTemplate) لعدد كبير من الموظفين.
+    JSON: template_id أو message، و employee_ids أو department (بدونهما: كل الموظفين النشطين).
+    المتغيرات {name} و {code} و {department} و {job_title} تُستبدل لكل موظف.
+    """
+    if not has_permission(['admin', 'manager']):
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    try:
+        data = request.get_json() or {}
+        content = data.get('message')
+        if data.get('template_id'):
+            content = db.get_or_404(WhatsAppTemplate, data['template_id']).content
+        if not content:
+            return jsonify({'error': 'Missing parameters'}), 400
+        
+        query = select(Employee.id, Employee.code, Employee.name, Employee.department, Employee.job_title,
+                       Employee.phone).where(Employee.active.is_(True))
+        if data.get('employee_ids'):
+            query = query.where(Employee.id.in_([int(i) for i in data['employee_ids']]))
+        elif data.get('department'):
+            query = query.where(Employee.department == data['department'])
+        employees = [dict(row._mapping) for row in db.session.execute(query)]
+        
+        broadcast_id, queued = queue_broadcast(employees, content, user_id=current_user.id)
+        db.session.commit()
+        if queued:
+            _schedule_outbox_drain()
+        
+        return jsonify({
+            'success': True,
+            'broadcast_id': broadcast_id,
+            'queued': queued,
+            'skipped': len(employees) - queued,  # بلا رقم أو رقم مكرر
+        }), 202
             
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 
+@whatsapp_bp.route('/api/whatsapp/broadcast/<broadcast_id>', methods=['GET'])
+@login_required
+def get_broadcast_status(broadcast_id):
+    """حالة البث: عدد الرسائل لكل حالة (queued, sending, sent, failed)"""
+    if not has_permission(['admin', 'manager']):
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    counts = broadcast_status(broadcast_id)
+    if not counts:
+        return jsonify({'error': 'Not found'}), 404
+    return jsonify({'broadcast_id': broadcast_id, 'total': sum(counts.values()), 'status': counts})
+
+
+def _schedule_outbox_drain(delay=None):
+    """تشغيل مهمة الإرسال ما لم تكن هناك مهمة منتظرة تبدأ بحلول الموعد (الجارية تلتقط الجديد في دفعتها التالية).
+    delay: ثوانٍ قبل بدء المهمة (متابعة الرسائل المؤجلة بعد 429/5xx)."""
+    return submit_once('whatsapp.outbox_drain', {}, delay=delay)
+
+
+@job_handler('whatsapp.outbox_drain')
+def _run_outbox_drain(ctx):
+    """إرسال رسائل صندوق الصادر (app/utils/whatsapp_outbox.py)."""
+    total = max(outbox_queued_count(), 1)
+    db.session.commit()
+    totals = drain_outbox(progress=lambda done, message: ctx.progress(min(99, 100 * done // total), message))
+    # رسائل مؤجلة بعد WHATSAPP_OUTBOX_MAX_WAIT: مهمة لاحقة عند موعدها بدل انتظار رسالة جديدة
+    wait = next_retry_in()
+    if wait is not None:
+        _schedule_outbox_drain(delay=wait)
+    return totals
+
+
 # ==================== وظائف الإرسال ====================
+# إرسال متزامن عبر عميل Graph API المشترك (جلسة ومجمع اتصالات دائمين)
 
 def send_text_message(phone, message):
     """إرسال رسالة نصية"""
     try:
-        url = WhatsAppConfig.get_api_url(WhatsAppConfig.get_messages_endpoint())
-        headers = {
-            'Authorization': f'Bearer {WhatsAppConfig.ACCESS_TOKEN}',
-            'Content-Type': 'application/json'
-        }
-        
-        payload = {
-            'messaging_product': 'whatsapp',
-            'to': phone,
-            'type': 'text',
-            'text': {'body': message}
-        }
-        
-        response = requests.post(url, json=payload, headers=headers)
-        
-        if response.status_code == 200:
-            result = response.json()
-            return {
-                'success': True,
-                'message_id': result['messages'][0]['id']
-            }
-        else:
-            return {
-                'success': False,
-                'error': response.text
-            }
-            
-    except Exception as e:
+        return {'success': True, 'message_id': get_graph_client().send_text(phone, message)}
+    except GraphError as e:
         return {'success': False, 'error': str(e)}
 
 
-def send_audio_message(phone, audio_url):
-    """إرسال رسالة صوتية"""
+def send_audio_message(phone, media_id):
+    """إرسال رسالة صوتية (media_id من upload_media_to_whatsapp)"""
     try:
-        url = WhatsAppConfig.get_api_url(WhatsAppConfig.get_messages_endpoint())
-        headers = {
-            'Authorization': f'Bearer {WhatsAppConfig.ACCESS_TOKEN}',
-            'Content-Type': 'application/json'
-        }
-        
-        payload = {
-            'messaging_product': 'whatsapp',
-            'to': phone,
-            'type': 'audio',
-            'audio': {'link': audio_url}
-        }
-        
-        response = requests.post(url, json=payload, headers=headers)
-        
-        if response.status_code == 200:
-            result = response.json()
-            return {
-                'success': True,
-                'message_id': result['messages'][0]['id']
-            }
-        else:
-            return {
-                'success': False,
-                'error': response.text
-            }
-            
-    except Exception as e:
+        return {'success': True, 'message_id': get_graph_client().send_audio(phone, media_id)}
+    except GraphError as e:
         return {'success': False, 'error': str(e)}
 
 
 def upload_media_to_whatsapp(filepath, media_type):
     """رفع وسائط إلى WhatsApp"""
     try:
-        url = WhatsAppConfig.get_api_url(WhatsAppConfig.get_media_endpoint())
-        headers = {
-            'Authorization': f'Bearer {WhatsAppConfig.ACCESS_TOKEN}'
-        }
-        
-        with open(filepath, 'rb') as f:
-            files = {
-                'file': (os.path.basename(filepath), f, f'audio/mpeg'),
-                'messaging_product': (None, 'whatsapp'),
-                'type': (None, media_type)
-            }
-            
-            response = requests.post(url, files=files, headers=headers)
-            
-            if response.status_code == 200:
-                result = response.json()
-                return result.get('id')
-        
-        return None
-        
-    except Exception as e:
+        return get_graph_client().upload_media(filepath, media_type)
+    except (GraphError, OSError) as e:
         current_app.logger.error(f'Error uploading media: {str(e)}')
         return None
 
-
 # ==================== API للعرض ====================
 
+def _page_args():
+    """limit و before و since من الطلب؛ ValueError إذا كانت غير صالحة."""
+    limit = min(max(int(request.args.get('limit', DEFAULT_PAGE)), 1), MAX_PAGE)
+    before = request.args.get('before') or None
+    since = request.args.get('since') or None
+    if before:
+        decode_cursor(before)
+    if since:
+        parse_since(since)
+    return limit, before, since
+
+
 @whatsapp_bp.route('/api/whatsapp/conversations', methods=['GET'])
 @login_required
 def get_conversations():
-    """الحصول على قائمة المحادثات"""
+    """الحصول على قائمة المحادثات: ?limit=&before=<next_cursor> للصفحات، ?since=<since> للتغييرات فقط"""
     if not has_permission(['admin', 'manager']):
         return jsonify({'error': 'Unauthorized'}), 403
     
     try:
-        conversations = WhatsAppConversation.query.order_by(
-            WhatsAppConversation.updated_at.desc()
-        ).all()
+        limit, before, since = _page_args()
+    except (TypeError, ValueError):
+        return jsonify({'error': 'invalid pagination'}), 400
+    
+    try:
+        now = datetime.utcnow()
+        if since:
+            conversations, truncated = conversation_changes(since)
+            next_cursor = None
+        else:
+            conversations, next_cursor = conversation_page(before, limit)
+            truncated = False
         
-        return jsonify([conv.to_dict() for conv in conversations])
+        return jsonify({
+            'items': [conv.to_dict() for conv in conversations],
+            'next_cursor': next_cursor,
+            'count': len(conversations),
+            'since': now.isoformat(),
+            'reload': truncated,
+        })
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -460,22 +341,41 @@ def get_conversations():
 @whatsapp_bp.route('/api/whatsapp/messages/<int:conversation_id>', methods=['GET'])
 @login_required
 def get_messages(conversation_id):
-    """الحصول على رسائل محادثة محددة"""
+    """الحصول على رسائل محادثة محددة: آخر limit رسالة، ?before=<next_cursor> للأقدم،
+    ?since=<since> للرسائل الجديدة وتغيّرات الحالة فقط"""
     if not has_permission(['admin', 'manager']):
         return jsonify({'error': 'Unauthorized'}), 403
     
+    try:
+        limit, before, since = _page_args()
+    except (TypeError, ValueError):
+        return jsonify({'error': 'invalid pagination'}), 400
+    
     try:
         conversation = WhatsAppConversation.query.get_or_404(conversation_id)
+        now = datetime.utcnow()
+        if since:
+            messages, truncated = message_changes(conversation_id, since)
+            next_cursor = None
+        else:
+            messages, next_cursor = message_page(conversation_id, before, limit)
+            truncated = False
+        
+        # تحديث عداد غير المقروءة (بدون تغيير updated_at حتى لا تقفز المحادثة لأعلى القائمة)
+        if conversation.unread_count:
+            conversations = WhatsAppConversation.__table__
+            db.session.execute(update(conversations).where(conversations.c.id == conversation_id).values(
+                unread_count=0, updated_at=conversations.c.updated_at))
+            db.session.commit()
         
-        messages = WhatsAppMessage.query.filter_by(
-            conversation_id=conversation_id
-        ).order_by(WhatsAppMessage.timestamp.asc()).all()
-        
-        # تحديث عداد غير المقروءة
-        conversation.unread_count = 0
-        db.session.commit()
-        
-        return jsonify([msg.to_dict() for msg in messages])
+        return jsonify({
+            'conversation': conversation.to_dict() if not before else None,
+            'items': [msg.to_dict() for msg in messages],
+            'next_cursor': next_cursor,
+            'count': len(messages),
+            'since': now.isoformat(),
+            'reload': truncated,
+        })
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -493,6 +393,16 @@ def get_templates():
         return jsonify({'error': str(e)}), 500
 
 
+@whatsapp_bp.route('/whatsapp/media/<path:name>', methods=['GET'])
+@login_required
+def get_whatsapp_media(name):
+    """ملفات وسائط المحادثات (تدعم Range وتُخزن مؤقتاً في المتصفح لأنها لا تتغير)"""
+    if not has_permission(['admin', 'manager']):
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    return send_media(name, max_age=current_app.config.get('WHATSAPP_MEDIA_MAX_AGE', 31536000))
+
+
 # ==================== واجهة HTML ====================
 
 @whatsapp_bp.route('/whatsapp/chat')
@@ -0,0 +1,92 @@
+// Background jobs: wait for a job submitted by a long-running endpoint (202 + job_id)
+// Uses Server-Sent Events for live progress and falls back to polling.
+(function () {
+    const TERMINAL = ['succeeded', 'failed', 'cancelled'];
+
+    function settle(job, resolve, reject) {
+        if (job.status === 'succeeded') {
+            resolve(job.result || {});
+        } else {
+            const err = new Error(job.error || (job.status === 'cancelled' ? 'Cancelled' : 'Job failed'));
+            err.job = job;
+            reject(err);
+        }
+    }
+
+    function poll(jobId, onProgress, resolve, reject) {
+        const tick = async function () {
+            try {
+                const res = await fetch(`/api/jobs/${jobId}`, { headers: { 'Accept': 'application/json' } });
+                const job = await res.json();
+                if (!res.ok) return reject(new Error(job.error || 'Job status error'));
+                if (onProgress) onProgress(job);
+                if (TERMINAL.includes(job.status)) return settle(job, resolve, reject);
+                setTimeout(tick, 1500);
+            } catch (e) {
+                reject(e);
+            }
+        };
+        tick();
+    }
+
+    // Returns a Promise resolved with job.result on success, rejected on failure/cancel.
+    window.waitForJob = function (jobId, onProgress) {
+        return new Promise(function (resolve, reject) {
+            if (!window.EventSource) return poll(jobId, onProgress, resolve, reject);
+            let finished = false;
+            const source = new EventSource(`/api/jobs/${jobId}/events`);
+            source.onmessage = function (ev) {
+                const job = JSON.parse(ev.data);
+                if (!job || !job.status) return;
+                if (onProgress) onProgress(job);
+                if (TERMINAL.includes(job.status)) {
+                    finished = true;
+                    source.close();
+                    settle(job, resolve, reject);
+                }
+            };
+            source.onerror = function () {
+                if (finished) return;
+                // stream closed by the server (timeout), refused (503: too many streams) or blocked by a proxy: continue by polling
+                source.close();
+                poll(jobId, onProgress, resolve, reject);
+            };
+        });
+    };
+
+    window.cancelJob = function (jobId) {
+        return fetch(`/api/jobs/${jobId}/cancel`, { method: 'POST' }).then(r => r.json());
+    };
+
+    // Submit to an endpoint that answers 202 {job_id}; resolves with the job result.
+    window.submitJob = async function (url, options, onProgress) {
+        const res = await fetch(url, options);
+        const data = await res.json();
+        if (res.status !== 202 || !data.job_id) {
+            const err = new Error(data.error || data.message || 'Error');
+            err.response = data;
+            throw err;
+        }
+        return window.waitForJob(data.job_id, onProgress);
+    };
+
+    window.formatJobProgress = function (job) {
+        const pct = job.progress || 0;
+        return `${pct}%` + (job.progress_message ? ` - ${job.progress_message}` : '');
+    };
+
+    // onProgress callback that renders into a Bootstrap .progress element (and optional text element)
+    window.jobProgressRenderer = function (container, textEl) {
+        return function (job) {
+            if (container) {
+                container.classList.remove('d-none');
+                const bar = container.querySelector('.progress-bar');
+                if (bar) {
+                    bar.style.width = `${job.progress || 0}%`;
+                    bar.textContent = `${job.progress || 0}%`;
+                }
+            }
+            if (textEl) textEl.textContent = job.progress_message || '';
+        };
+    };
+})();
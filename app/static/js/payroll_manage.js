@@ -526,18 +526,12 @@ async function generateBatch() {
     if (!confirm(`${lang === 'en' ? 'Generate payroll for' : 'إنشاء كشف الرواتب لـ'} ${formatPeriod(month, year)}?`)) return;
     
     try {
-        const response = await fetch('/api/payroll/batch', {
+        // Runs as a background job: the request returns a job id, progress is streamed
+        const result = await submitJob('/api/payroll/batch', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({ month, year })
-        });
-        
-        if (!response.ok) {
-            const error = await response.json();
-            throw new Error(error.error || 'Failed to generate batch');
-        }
-        
-        const result = await response.json();
+        }, jobProgressRenderer(document.getElementById('batchProgress'), document.getElementById('batchProgressText')));
         showNotification(
             `${lang === 'en' ? 'Generated payroll for' : 'تم إنشاء رواتب لـ'} ${result.count} ${lang === 'en' ? 'employees' : 'موظف'}`,
             'success'
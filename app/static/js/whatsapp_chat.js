@@ -10,52 +10,40 @@ let recordingStartTime = null;
 let recordingInterval = null;
 let autoRefreshInterval = null;
 
+// حالة الصفحات (keyset): المؤشر للصفحة التالية و since لآخر استطلاع
+const PAGE_SIZE = 50;
+let conversationsById = new Map();
+let conversationsCursor = null;
+let conversationsSince = null;
+let loadingConversations = false;
+let messagesById = new Map();
+let messagesCursor = null;
+let messagesSince = null;
+let loadingOlderMessages = false;
+
 // ==================== تحميل البيانات ====================
 
-// تحميل المحادثات
-function loadConversations() {
-    fetch('/api/whatsapp/conversations')
+// تحميل المحادثات (الصفحة الأولى، أو التالية عند append)
+function loadConversations(append = false) {
+    if (loadingConversations || (append && !conversationsCursor)) {
+        return;
+    }
+    loadingConversations = true;
+    const params = new URLSearchParams({ limit: PAGE_SIZE });
+    if (append) {
+        params.set('before', conversationsCursor);
+    }
+    
+    fetch(`/api/whatsapp/conversations?${params}`)
         .then(response => response.json())
-        .then(conversations => {
-            const container = document.getElementById('conversations-list');
-            container.innerHTML = '';
-            
-            if (conversations.length === 0) {
-                container.innerHTML = `
-                    <div class="text-center text-muted p-3">
-                        <i class="bi bi-chat-dots fs-1"></i>
-                        <p class="mt-2">لا توجد محادثات حالياً</p>
-                    </div>
-                `;
-                return;
+        .then(page => {
+            if (!append) {
+                conversationsById = new Map();
+                conversationsSince = page.since;
             }
-            
-            conversations.forEach(conv => {
-                const unreadBadge = conv.unread_count > 0 
-                    ? `<span class="badge bg-success">${conv.unread_count}</span>` 
-                    : '';
-                
-                const convElement = document.createElement('div');
-                convElement.className = 'conversation-item';
-                convElement.onclick = () => loadConversation(conv.id);
-                convElement.innerHTML = `
-                    <div class="d-flex align-items-center">
-                        <div class="avatar me-2">
-                            <i class="bi bi-person-circle fs-3"></i>
-                        </div>
-                        <div class="flex-grow-1">
-                            <div class="d-flex justify-content-between">
-                                <strong>${conv.customer_name || conv.customer_phone}</strong>
-                                ${unreadBadge}
-                            </div>
-                            <div class="text-muted small">${conv.customer_phone}</div>
-                            <div class="text-muted small text-truncate">${conv.last_message || 'لا توجد رسائل'}</div>
-                        </div>
-                    </div>
-                `;
-                
-                container.appendChild(convElement);
-            });
+            page.items.forEach(conv => conversationsById.set(conv.id, conv));
+            conversationsCursor = page.next_cursor;
+            renderConversations();
         })
         .catch(error => {
             console.error('Error loading conversations:', error);
@@ -64,10 +52,83 @@ function loadConversations() {
                     خطأ في تحميل المحادثات
                 </div>
             `;
+        })
+        .finally(() => {
+            loadingConversations = false;
         });
 }
 
-// تحميل محادثة محددة
+// تحديث المحادثات: ما تغيّر منذ آخر استطلاع فقط
+function refreshConversations() {
+    if (!conversationsSince) {
+        loadConversations();
+        return;
+    }
+    fetch(`/api/whatsapp/conversations?since=${encodeURIComponent(conversationsSince)}`)
+        .then(response => response.json())
+        .then(page => {
+            if (page.reload) {
+                loadConversations();
+                return;
+            }
+            conversationsSince = page.since;
+            if (page.items.length > 0) {
+                page.items.forEach(conv => conversationsById.set(conv.id, conv));
+                renderConversations();
+            }
+        })
+        .catch(error => console.error('Error refreshing conversations:', error));
+}
+
+// عرض المحادثات (الأحدث نشاطاً أولاً)
+function renderConversations() {
+    const container = document.getElementById('conversations-list');
+    container.innerHTML = '';
+    
+    const conversations = [...conversationsById.values()].sort((a, b) =>
+        (b.updated_at || '').localeCompare(a.updated_at || '') || b.id - a.id);
+    
+    if (conversations.length === 0) {
+        container.innerHTML = `
+            <div class="text-center text-muted p-3">
+                <i class="bi bi-chat-dots fs-1"></i>
+                <p class="mt-2">لا توجد محادثات حالياً</p>
+            </div>
+        `;
+        return;
+    }
+    
+    conversations.forEach(conv => {
+        const unreadBadge = conv.unread_count > 0 
+            ? `<span class="badge bg-success">${conv.unread_count}</span>` 
+            : '';
+        
+        const convElement = document.createElement('div');
+        convElement.className = 'conversation-item';
+        convElement.onclick = () => loadConversation(conv.id);
+        convElement.innerHTML = `
+            <div class="d-flex align-items-center">
+                <div class="avatar me-2">
+                    <i class="bi bi-person-circle fs-3"></i>
+                </div>
+                <div class="flex-grow-1">
+                    <div class="d-flex justify-content-between">
+                        <strong>${conv.customer_name || conv.customer_phone}</strong>
+                        ${unreadBadge}
+                    </div>
+                    <div class="text-muted small">${conv.customer_phone}</div>
+                    <div class="text-muted small text-truncate">${conv.last_message || 'لا توجد رسائل'}</div>
+                </div>
+            </div>
+        `;
+        
+        container.appendChild(convElement);
+    });
+    
+    applyConversationSearch();
+}
+
+// تحميل محادثة محددة (آخر PAGE_SIZE رسالة)
 function loadConversation(conversationId) {
     currentConversationId = conversationId;
     
@@ -75,23 +136,25 @@ function loadConversation(conversationId) {
     document.getElementById('chat-header').style.display = 'flex';
     document.getElementById('input-area').style.display = 'flex';
     
-    fetch(`/api/whatsapp/messages/${conversationId}`)
+    fetch(`/api/whatsapp/messages/${conversationId}?limit=${PAGE_SIZE}`)
         .then(response => response.json())
-        .then(messages => {
-            displayMessages(messages);
+        .then(page => {
+            if (conversationId !== currentConversationId) {
+                return;
+            }
+            messagesById = new Map();
+            messagesCursor = page.next_cursor;
+            messagesSince = page.since;
+            displayMessages(page.items);
             
             // تحديث معلومات العميل في الرأس
-            if (messages.length > 0) {
-                const firstMessage = messages[0];
-                fetch(`/api/whatsapp/conversations`)
-                    .then(res => res.json())
-                    .then(convs => {
-                        const conv = convs.find(c => c.id === conversationId);
-                        if (conv) {
-                            document.getElementById('customer-name').textContent = conv.customer_name || conv.customer_phone;
-                            document.getElementById('customer-phone').textContent = conv.customer_phone;
-                        }
-                    });
+            const conv = page.conversation;
+            if (conv) {
+                document.getElementById('customer-name').textContent = conv.customer_name || conv.customer_phone;
+                document.getElementById('customer-phone').textContent = conv.customer_phone;
+                conv.unread_count = 0;
+                conversationsById.set(conv.id, conv);
+                renderConversations();
             }
         })
         .catch(error => {
@@ -104,6 +167,80 @@ function loadConversation(conversationId) {
         });
 }
 
+// تحميل رسائل أقدم عند التمرير لأعلى المحادثة
+function loadOlderMessages() {
+    if (loadingOlderMessages || !messagesCursor || !currentConversationId) {
+        return;
+    }
+    loadingOlderMessages = true;
+    const conversationId = currentConversationId;
+    const params = new URLSearchParams({ limit: PAGE_SIZE, before: messagesCursor });
+    
+    fetch(`/api/whatsapp/messages/${conversationId}?${params}`)
+        .then(response => response.json())
+        .then(page => {
+            if (conversationId !== currentConversationId) {
+                return;
+            }
+            messagesCursor = page.next_cursor;
+            const container = document.getElementById('messages-container');
+            const previousHeight = container.scrollHeight;
+            const first = container.firstChild;
+            page.items.forEach(msg => {
+                if (!messagesById.has(msg.id)) {
+                    container.insertBefore(renderMessage(msg), first);
+                }
+            });
+            // الحفاظ على موضع القراءة بعد إضافة الرسائل فوقه
+            container.scrollTop += container.scrollHeight - previousHeight;
+        })
+        .catch(error => console.error('Error loading older messages:', error))
+        .finally(() => {
+            loadingOlderMessages = false;
+        });
+}
+
+// تحديث المحادثة المفتوحة: الرسائل الجديدة وتغيّرات الحالة فقط
+function refreshMessages() {
+    if (!currentConversationId || !messagesSince) {
+        return;
+    }
+    const conversationId = currentConversationId;
+    fetch(`/api/whatsapp/messages/${conversationId}?since=${encodeURIComponent(messagesSince)}`)
+        .then(response => response.json())
+        .then(page => {
+            if (conversationId !== currentConversationId) {
+                return;
+            }
+            if (page.reload) {
+                loadConversation(conversationId);
+                return;
+            }
+            messagesSince = page.since;
+            if (page.items.length === 0) {
+                return;
+            }
+            const container = document.getElementById('messages-container');
+            const atBottom = container.scrollHeight - container.scrollTop - container.clientHeight < 40;
+            if (messagesById.size === 0) {
+                container.innerHTML = '';
+            }
+            page.items.forEach(msg => {
+                const existing = messagesById.get(msg.id);
+                const element = renderMessage(msg);
+                if (existing) {
+                    existing.replaceWith(element);
+                } else {
+                    container.appendChild(element);
+                }
+            });
+            if (atBottom) {
+                container.scrollTop = container.scrollHeight;
+            }
+        })
+        .catch(error => console.error('Error refreshing messages:', error));
+}
+
 // عرض الرسائل
 function displayMessages(messages) {
     const container = document.getElementById('messages-container');
@@ -118,74 +255,79 @@ function displayMessages(messages) {
         return;
     }
     
-    messages.forEach(msg => {
-        const messageDiv = document.createElement('div');
-        messageDiv.className = `message ${msg.direction}`;
-        
-        let content = '';
-        const timestamp = new Date(msg.timestamp).toLocaleTimeString('ar-EG', { 
-            hour: '2-digit', 
-            minute: '2-digit' 
-        });
-        
-        switch(msg.message_type) {
-            case 'text':
-                content = `
-                    <div class="message-bubble">
-                        <div class="message-text">${escapeHtml(msg.message_content)}</div>
-                        <div class="message-time">${timestamp}</div>
-                    </div>
-                `;
-                break;
-                
-            case 'audio':
-                content = `
-                    <div class="message-bubble">
-                        <div class="audio-message">
-                            <audio controls>
-                                <source src="${msg.audio_url}" type="audio/mpeg">
-                                متصفحك لا يدعم تشغيل الصوت
-                            </audio>
-                        </div>
-                        <div class="message-time">${timestamp}</div>
+    messages.forEach(msg => container.appendChild(renderMessage(msg)));
+    
+    // التمرير لآخر رسالة
+    container.scrollTop = container.scrollHeight;
+}
+
+// عنصر رسالة واحدة (مسجل في messagesById لاستبداله عند تغيّر حالته)
+function renderMessage(msg) {
+    const messageDiv = document.createElement('div');
+    messageDiv.className = `message ${msg.direction}`;
+    messageDiv.dataset.id = msg.id;
+    
+    let content = '';
+    const timestamp = new Date(msg.timestamp).toLocaleTimeString('ar-EG', { 
+        hour: '2-digit', 
+        minute: '2-digit' 
+    });
+    
+    switch(msg.message_type) {
+        case 'text':
+            content = `
+                <div class="message-bubble">
+                    <div class="message-text">${escapeHtml(msg.message_content)}</div>
+                    <div class="message-time">${timestamp}</div>
+                </div>
+            `;
+            break;
+            
+        case 'audio':
+            content = `
+                <div class="message-bubble">
+                    <div class="audio-message">
+                        <audio controls preload="none">
+                            <source src="${msg.audio_url}" type="audio/mpeg">
+                            متصفحك لا يدعم تشغيل الصوت
+                        </audio>
                     </div>
-                `;
-                break;
-                
-            case 'image':
-                content = `
-                    <div class="message-bubble">
-                        <div class="image-message">
-                            <img src="${msg.image_url}" alt="صورة" class="img-fluid rounded" 
-                                 onclick="window.open('${msg.image_url}', '_blank')">
-                            ${msg.caption ? `<div class="mt-2">${escapeHtml(msg.caption)}</div>` : ''}
-                        </div>
-                        <div class="message-time">${timestamp}</div>
+                    <div class="message-time">${timestamp}</div>
+                </div>
+            `;
+            break;
+            
+        case 'image':
+            content = `
+                <div class="message-bubble">
+                    <div class="image-message">
+                        <img src="${msg.image_url}" alt="صورة" class="img-fluid rounded" loading="lazy"
+                             onclick="window.open('${msg.image_url}', '_blank')">
+                        ${msg.caption ? `<div class="mt-2">${escapeHtml(msg.caption)}</div>` : ''}
                     </div>
-                `;
-                break;
-                
-            case 'document':
-                content = `
-                    <div class="message-bubble">
-                        <div class="document-message">
-                            <i class="bi bi-file-earmark-text fs-1"></i>
-                            <a href="${msg.document_url}" target="_blank" class="btn btn-sm btn-link">
-                                تحميل المستند
-                            </a>
-                        </div>
-                        <div class="message-time">${timestamp}</div>
+                    <div class="message-time">${timestamp}</div>
+                </div>
+            `;
+            break;
+            
+        case 'document':
+            content = `
+                <div class="message-bubble">
+                    <div class="document-message">
+                        <i class="bi bi-file-earmark-text fs-1"></i>
+                        <a href="${msg.document_url}" target="_blank" class="btn btn-sm btn-link">
+                            تحميل المستند
+                        </a>
                     </div>
-                `;
-                break;
-        }
-        
-        messageDiv.innerHTML = content;
-        container.appendChild(messageDiv);
-    });
+                    <div class="message-time">${timestamp}</div>
+                </div>
+            `;
+            break;
+    }
     
-    // التمرير لآخر رسالة
-    container.scrollTop = container.scrollHeight;
+    messageDiv.innerHTML = content;
+    messagesById.set(msg.id, messageDiv);
+    return messageDiv;
 }
 
 // ==================== إرسال الرسائل ====================
@@ -218,8 +360,8 @@ function sendMessage() {
     .then(result => {
         if (result.success) {
             input.value = '';
-            loadConversation(currentConversationId);
-            loadConversations(); // تحديث قائمة المحادثات
+            refreshMessages();
+            refreshConversations(); // تحديث قائمة المحادثات
         } else {
             alert('فشل إرسال الرسالة: ' + (result.error || 'خطأ غير معروف'));
         }
@@ -333,8 +475,8 @@ function sendAudioMessage(audioBlob) {
     .then(response => response.json())
     .then(result => {
         if (result.success) {
-            loadConversation(currentConversationId);
-            loadConversations();
+            refreshMessages();
+            refreshConversations();
         } else {
             alert('فشل إرسال الرسالة الصوتية: ' + (result.error || 'خطأ غير معروف'));
         }
@@ -415,7 +557,7 @@ function escapeHtml(text) {
     return div.innerHTML;
 }
 
-// تحديث الدردشة
+// تحديث الدردشة (إعادة تحميل كاملة)
 function refreshChat() {
     if (currentConversationId) {
         loadConversation(currentConversationId);
@@ -423,27 +565,27 @@ function refreshChat() {
     loadConversations();
 }
 
-// البحث في المحادثات
-document.getElementById('search-conversations')?.addEventListener('input', function(e) {
-    const searchTerm = e.target.value.toLowerCase();
+// البحث في المحادثات المحمّلة
+function applyConversationSearch() {
+    const searchTerm = (document.getElementById('search-conversations')?.value || '').toLowerCase();
     const conversations = document.querySelectorAll('.conversation-item');
     
     conversations.forEach(conv => {
         const text = conv.textContent.toLowerCase();
         conv.style.display = text.includes(searchTerm) ? 'block' : 'none';
     });
-});
+}
+
+document.getElementById('search-conversations')?.addEventListener('input', applyConversationSearch);
 
 // ==================== التحديث التلقائي ====================
 
 // بدء التحديث التلقائي
 function startAutoRefresh() {
-    // تحديث كل 5 ثواني
+    // تحديث كل 5 ثواني (التغييرات فقط عبر since)
     autoRefreshInterval = setInterval(() => {
-        if (currentConversationId) {
-            loadConversation(currentConversationId);
-        }
-        loadConversations();
+        refreshMessages();
+        refreshConversations();
     }, 5000);
 }
 
@@ -461,6 +603,18 @@ document.addEventListener('DOMContentLoaded', function() {
     loadConversations();
     startAutoRefresh();
     
+    // التحميل الكسول: رسائل أقدم عند الوصول لأعلى المحادثة، ومحادثات أكثر عند أسفل القائمة
+    document.getElementById('messages-container')?.addEventListener('scroll', function() {
+        if (this.scrollTop < 80) {
+            loadOlderMessages();
+        }
+    });
+    document.getElementById('conversations-list')?.addEventListener('scroll', function() {
+        if (this.scrollHeight - this.scrollTop - this.clientHeight < 80) {
+            loadConversations(true);
+        }
+    });
+    
     // إيقاف التحديث عند مغادرة الصفحة
     window.addEventListener('beforeunload', stopAutoRefresh);
 });
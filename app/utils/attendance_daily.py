@@ -0,0 +1,356 @@
+"""
+التجميع اليومي للحضور (attendance_daily): صف واحد لكل موظف في اليوم
+- present: أول دخول، آخر خروج، دقائق العمل/التأخير/الإضافي، وأعلام التحقق.
+  التأخير = بعد AttendanceSettings.check_in_end (فترة السماح تُطبق عند القراءة)،
+  والإضافي = ما زاد عن AttendanceSettings.min_work_hours_per_day (نفس تعريف التقرير الخام).
+  أعلام التحقق ثلاثية: False إذا خالف أي سجل، None إذا لم يُحدد، وإلا True.
+- leave: يوم ضمن إجازة موافق عليها (النوع وهل هو مدفوع).
+الغياب لا يُخزن: القراءات تشتقه من تقويم العمل (work_calendar: working & ~present & ~leave)،
+فلا يحتاج صف يوم مضى إلى إعادة بناء ليلية، ولا تؤثر العطل وأيام العمل على الصفوف المخزنة.
+التحديث التزايدي: refresh_daily() لمفاتيح (employee_id, date) في نفس معاملة التغيير،
+من كاتب الحضور والاستيراد (كتابة Core) ومن مستمع after_flush لتعديلات ORM على
+Attendance و Leave. إعادة البناء: rebuild_range() لكل جزء تواريخ
+(scripts/rebuild_attendance_daily.py، أو مهمة عند تغيير قواعد الحساب: rules_signature)؛ البناء الكامل يزيد الجيل 'attendance_daily'،
+وحتى ذلك تعود القراءات إلى جدول الحضور الخام (rollup_ready).
+"""
+from collections import Counter, namedtuple
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import delete, event, inspect as sa_inspect, select, tuple_
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models.attendance import Attendance, AttendanceDaily, AttendanceSettings
+from app.models.leave import Leave
+from app.utils.cache_generation import bump_generation, get_generation
+from app.utils.late_stats import late_minutes
+from app.utils.settings_cache import attendance_settings
+
+DAILY_GENERATION = 'attendance_daily'
+
+PRESENT = 'present'
+LEAVE = 'leave'
+ABSENT = 'absent'  # قيمة قديمة: تحذفها إعادة البناء ولا تُكتب بعد الآن
+
+_IN_CHUNK = 500
+_INSERT_BATCH = 5000
+_MAX_LEAVE_DAYS = 366
+DEFAULT_WORK_HOURS = 8
+
+DailyRules = namedtuple('DailyRules', 'check_in_end overtime_after')
+
+_COLUMNS = [c.key for c in AttendanceDaily.__table__.columns]
+
+
+def overtime_after_minutes(settings):
+    """دقائق العمل التي يبدأ بعدها الإضافي (min_work_hours_per_day، وإلا 8 ساعات)."""
+    hours = getattr(settings, 'min_work_hours_per_day', None)
+    return int(float(hours if hours is not None else DEFAULT_WORK_HOURS) * 60)
+
+
+def daily_rules(connection=None):
+    """القواعد المستخدمة في حساب الصفوف: من لقطات الإعدادات، أو بقراءة مباشرة على
+    connection (داخل معاملة مفتوحة حيث لا يجوز لتحميل اللقطة إنشاء صف افتراضي و commit؛
+    لذلك هي الافتراضية في refresh_daily و rebuild_range إذا لم تُمرر القواعد)."""
+    if connection is None:
+        att_settings = attendance_settings()
+    else:
+        att = AttendanceSettings.__table__
+        att_settings = connection.execute(select(att).order_by(att.c.id).limit(1)).first()
+    return DailyRules(getattr(att_settings, 'check_in_end', None), overtime_after_minutes(att_settings))
+
+
+def rules_signature(rules=None):
+    """ما يؤثر على الصفوف المخزنة من الإعدادات؛ تغيّره بعد الحفظ يستدعي إعادة بناء كاملة."""
+    rules = rules or daily_rules()
+    return rules.check_in_end, rules.overtime_after
+
+
+def rollup_ready():
+    """هل بُني الجدول كاملاً مرة واحدة على الأقل؟ (وإلا تقرأ التقارير الجدول الخام)"""
+    return get_generation(DAILY_GENERATION)[0] > 0
+
+
+def _leave_day(leave, day):
+    """(النوع، مدفوع؟) ليوم داخل الإجازة؛ المرضية ذات paid_days تُدفع أيامها الأولى فقط."""
+    if leave.leave_type == 'sick' and leave.paid_days is not None:
+        return leave.leave_type, (day - leave.start_date).days < int(leave.paid_days or 0)
+    return leave.leave_type, bool(leave.paid)
+
+
+def _combined_flag(values):
+    """علم اليوم من أعلام سجلاته: False إذا خالف أي سجل، None إذا لم يُحدد أحدها، وإلا True
+    (حتى يطابق عدّ "== False" في لوحة الإحصائيات و "not flag" في التقرير عدّهما على الجدول الخام)."""
+    values = list(values)
+    if any(v is not None and not v for v in values):
+        return False
+    if any(v is None for v in values):
+        return None
+    return True
+
+
+def build_row(employee_id, day, records, leave, rules, now):
+    """صف التجميع لمفتاح واحد أو None (لا حضور ولا إجازة: لا شيء يُخزن لهذا اليوم).
+    records: سجلات الحضور لليوم (عادة سجل واحد بفضل الفهرس الفريد)."""
+    row = dict.fromkeys(_COLUMNS)
+    row.update(employee_id=employee_id, date=day, updated_at=now,
+               worked_minutes=0, late_minutes=0, overtime_minutes=0)
+    if records:
+        ins = [r.check_in_time for r in records if r.check_in_time]
+        outs = [r.check_out_time for r in records if r.check_out_time]
+        first_in = min(ins) if ins else None
+        last_out = max(outs) if outs else None
+        worked = int((last_out - first_in).total_seconds() // 60) if first_in and last_out and last_out > first_in else 0
+        row.update(
+            day_status=PRESENT, first_in=first_in, last_out=last_out, worked_minutes=worked,
+            late_minutes=max(0, late_minutes(first_in, day, rules.check_in_end)),
+            overtime_minutes=max(0, worked - rules.overtime_after) if worked else 0,
+            location_verified=_combined_flag(r.location_verified for r in records),
+            time_verified=_combined_flag(r.time_verified for r in records),
+            device_verified=_combined_flag(r.device_verified for r in records),
+        )
+        return row
+    if leave is not None:
+        leave_type, paid = _leave_day(leave, day)
+        row.update(day_status=LEAVE, leave_type=leave_type, leave_paid=paid)
+        return row
+    return None
+
+
+def _fetch_attendance(connection, employee_ids, first, last):
+    table = Attendance.__table__
+    cols = (table.c.employee_id, table.c.date, table.c.check_in_time, table.c.check_out_time,
+            table.c.location_verified, table.c.time_verified, table.c.device_verified)
+    by_key = {}
+    conditions = [table.c.date >= first, table.c.date <= last]
+    chunks = [None] if employee_ids is None else [employee_ids[i:i + _IN_CHUNK]
+                                                  for i in range(0, len(employee_ids), _IN_CHUNK)]
+    for chunk in chunks:
+        where = conditions if chunk is None else conditions + [table.c.employee_id.in_(chunk)]
+        for r in connection.execute(select(*cols).where(*where)):
+            if r.employee_id is not None and r.date is not None:
+                by_key.setdefault((r.employee_id, r.date), []).append(r)
+    return by_key
+
+
+def _fetch_leaves(connection, employee_ids, first, last):
+    """{employee_id: [Leave rows]} للإجازات الموافق عليها المتقاطعة مع الفترة."""
+    table = Leave.__table__
+    conditions = [table.c.status == 'Approved', table.c.start_date <= last, table.c.end_date >= first]
+    chunks = [None] if employee_ids is None else [employee_ids[i:i + _IN_CHUNK]
+                                                  for i in range(0, len(employee_ids), _IN_CHUNK)]
+    leaves = {}
+    for chunk in chunks:
+        where = conditions if chunk is None else conditions + [table.c.employee_id.in_(chunk)]
+        for r in connection.execute(select(table).where(*where).order_by(table.c.start_date)):
+            leaves.setdefault(r.employee_id, []).append(r)
+    return leaves
+
+
+def _leave_for(leaves, employee_id, day):
+    for leave in leaves.get(employee_id, ()):
+        if leave.start_date <= day <= (leave.end_date or leave.start_date):
+            return leave
+    return None
+
+
+def _upsert(connection, rows):
+    if not rows:
+        return
+    table = AttendanceDaily.__table__
+    dialect = connection.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['employee_id', 'date'],
+            set_={c: stmt.excluded[c] for c in _COLUMNS if c not in ('employee_id', 'date')},
+        )
+        for i in range(0, len(rows), _INSERT_BATCH):
+            connection.execute(stmt, rows[i:i + _INSERT_BATCH])
+        return
+    _delete_keys(connection, [(r['employee_id'], r['date']) for r in rows])
+    for i in range(0, len(rows), _INSERT_BATCH):
+        connection.execute(table.insert(), rows[i:i + _INSERT_BATCH])
+
+
+def _delete_keys(connection, keys):
+    table = AttendanceDaily.__table__
+    keys = list(keys)
+    for i in range(0, len(keys), _IN_CHUNK):
+        connection.execute(delete(table).where(
+            tuple_(table.c.employee_id, table.c.date).in_(keys[i:i + _IN_CHUNK])
+        ))
+
+
+def refresh_daily(connection, keys, rules=None):
+    """إعادة حساب صفوف مفاتيح (employee_id, date) من الحضور والإجازات، داخل معاملة الاتصال.
+    ترجع عدد الصفوف المكتوبة."""
+    keys = {(emp_id, d) for emp_id, d in keys if emp_id is not None and d is not None}
+    if not keys:
+        return 0
+    rules = rules or daily_rules(connection)
+    now = datetime.utcnow()
+    employee_ids = sorted({k[0] for k in keys})
+    first = min(k[1] for k in keys)
+    last = max(k[1] for k in keys)
+    records = _fetch_attendance(connection, employee_ids, first, last)
+    leaves = _fetch_leaves(connection, employee_ids, first, last)
+
+    rows, empty = [], []
+    for emp_id, day in sorted(keys):
+        row = build_row(emp_id, day, records.get((emp_id, day)), _leave_for(leaves, emp_id, day), rules, now)
+        if row is None:
+            empty.append((emp_id, day))
+        else:
+            rows.append(row)
+    _upsert(connection, rows)
+    if empty:
+        _delete_keys(connection, empty)
+    return len(rows)
+
+
+def _row_counts(rows):
+    return Counter(tuple(r) for r in rows)
+
+
+def _changed_keys(before, after, first, last):
+    """مفاتيح تغيّرت مصادرها بين قراءتين: before/after = (سجلات الحضور، الإجازات)."""
+    (records, leaves), (records_now, leaves_now) = before, after
+    keys = {k for k in records.keys() | records_now.keys()
+            if _row_counts(records.get(k, ())) != _row_counts(records_now.get(k, ()))}
+    for emp_id in leaves.keys() | leaves_now.keys():
+        old, new = leaves.get(emp_id, []), leaves_now.get(emp_id, [])
+        if _row_counts(old) == _row_counts(new):
+            continue
+        for leave in old + new:
+            day = max(leave.start_date, first)
+            end = min(leave.end_date or leave.start_date, last)
+            while day <= end:
+                keys.add((emp_id, day))
+                day += timedelta(days=1)
+    return keys
+
+
+def rebuild_range(connection, first, last, employee_ids=None, rules=None):
+    """إعادة بناء كل صفوف الفترة [first, last] (لموظفين محددين أو للجميع). ترجع عدد الصفوف.
+    الصفوف تُكتب بـ upsert وتُحذف فقط المفاتيح التي لم يعد لها صف؛ ثم تُعاد قراءة المصادر
+    ويُعاد حساب ما تغيّر منذ القراءة الأولى (refresh_daily) حتى لا يضيع تحديث متزامن
+    (تسجيل حضور أو إجازة) التُزم أثناء إعادة البناء.
+    """
+    rules = rules or daily_rules(connection)
+    now = datetime.utcnow()
+    ids = sorted(set(employee_ids)) if employee_ids is not None else None
+    records = _fetch_attendance(connection, ids, first, last)
+    leaves = _fetch_leaves(connection, ids, first, last)
+
+    rows = {}
+    for (emp_id, day), recs in records.items():
+        rows[(emp_id, day)] = build_row(emp_id, day, recs, None, rules, now)
+    for emp_id, emp_leaves in leaves.items():
+        for leave in emp_leaves:
+            day = max(leave.start_date, first)
+            end = min(leave.end_date or leave.start_date, last)
+            while day <= end:
+                if (emp_id, day) not in rows:
+                    rows[(emp_id, day)] = build_row(emp_id, day, None, leave, rules, now)
+                day += timedelta(days=1)
+
+    values = [r for r in rows.values() if r is not None]
+    _upsert(connection, values)
+    table = AttendanceDaily.__table__
+    stored = select(table.c.employee_id, table.c.date).where(table.c.date >= first, table.c.date <= last)
+    chunks = [None] if ids is None else [ids[i:i + _IN_CHUNK] for i in range(0, len(ids), _IN_CHUNK)]
+    stale = set()
+    for chunk in chunks:
+        query = stored if chunk is None else stored.where(table.c.employee_id.in_(chunk))
+        stale.update((emp_id, d) for emp_id, d in connection.execute(query)
+                     if rows.get((emp_id, d)) is None)
+    if stale:
+        _delete_keys(connection, stale)
+
+    # القراءة الثانية بعد الكتابة: ما التُزم بعد القراءة الأولى يُعاد حسابه من حالته الحالية
+    touched = _changed_keys((records, leaves), (_fetch_attendance(connection, ids, first, last),
+                                                _fetch_leaves(connection, ids, first, last)), first, last)
+    if touched:
+        refresh_daily(connection, touched, rules=rules)
+    return len(values)
+
+
+def history_bounds(connection):
+    """(أقدم تاريخ، اليوم) لإعادة البناء الكاملة، أو None إذا لا بيانات."""
+    first_att = connection.execute(select(db.func.min(Attendance.date))).scalar()
+    first_leave = connection.execute(
+        select(db.func.min(Leave.start_date)).where(Leave.status == 'Approved')
+    ).scalar()
+    starts = [d for d in (first_att, first_leave) if d is not None]
+    if not starts:
+        return None
+    return min(starts), date.today()
+
+
+def date_chunks(first, last, days=7):
+    """تقسيم [first, last] إلى فترات متتالية من days يوماً (وحدة العمل لإعادة البناء)."""
+    days = max(int(days), 1)
+    while first <= last:
+        end = min(first + timedelta(days=days - 1), last)
+        yield first, end
+        first = end + timedelta(days=1)
+
+
+def mark_rollup_built(connection=None):
+    """يُستدعى بعد بناء كامل للتاريخ (يلزم commit): تبدأ التقارير والرواتب بالقراءة من الجدول."""
+    bump_generation(DAILY_GENERATION, connection=connection)
+
+
+# --- التحديث التزايدي لتعديلات ORM ---
+
+def _history_values(obj, attr):
+    hist = sa_inspect(obj).attrs[attr].history
+    values = list(hist.added or ()) + list(hist.unchanged or ()) + list(hist.deleted or ())
+    if not values:
+        values = [getattr(obj, attr, None)]
+    return [v for v in values if v is not None]
+
+
+def _keys_for_object(obj):
+    keys = set()
+    if isinstance(obj, Attendance):
+        for emp_id in _history_values(obj, 'employee_id'):
+            for d in _history_values(obj, 'date'):
+                keys.add((emp_id, d))
+    elif isinstance(obj, Leave):
+        starts = _history_values(obj, 'start_date')
+        ends = _history_values(obj, 'end_date') or starts
+        if not starts:
+            return keys
+        first, last = min(starts), max(ends)
+        last = min(last, first + timedelta(days=_MAX_LEAVE_DAYS))
+        for emp_id in _history_values(obj, 'employee_id'):
+            day = first
+            while day <= last:
+                keys.add((emp_id, day))
+                day += timedelta(days=1)
+    return keys
+
+
+def _after_flush(orm_session, flush_context):
+    keys = set()
+    for obj in list(orm_session.new) + list(orm_session.dirty) + list(orm_session.deleted):
+        if not isinstance(obj, (Attendance, Leave)):
+            continue
+        if obj in orm_session.dirty and not orm_session.is_modified(obj, include_collections=False):
+            continue
+        keys |= _keys_for_object(obj)
+    if keys:
+        connection = orm_session.connection()
+        refresh_daily(connection, keys)
+
+
+def register_attendance_daily():
+    """تسجيل مستمع التحديث التزايدي مرة واحدة."""
+    if not event.contains(Session, 'after_flush', _after_flush):
+        event.listen(Session, 'after_flush', _after_flush)
@@ -0,0 +1,280 @@
+"""
+استيراد الحضور من CSV بالتدفق (Streaming bulk import)
+- الملف يُقرأ سطراً بسطر (لا يُحمّل كاملاً في الذاكرة) في مرورين:
+  1) مرور سريع لأعمدة التاريخ فقط: عدد الأسطر ونطاق التواريخ.
+  2) مرور المعالجة على أجزاء من ATTENDANCE_IMPORT_CHUNK سطر.
+- خريطة الموظفين (id/code -> id) تُبنى مرة واحدة، ومفاتيح (employee_id, date) الموجودة
+  لنطاق تواريخ الملف تُجلب باستعلام واحد؛ بعدها لا يوجد استعلام لكل سطر.
+- كل جزء يُكتب بعبارتين مجمّعتين (إدراج الجديد + تحديث الموجود) ثم commit،
+  مع علامات إعادة حساب الرواتب وصفوف التجميع اليومي (الكتابة المجمّعة لا تمر بأحداث ORM).
+  الإدراج يدمج بـ ON CONFLICT فقط إذا وُجد الفهرس الفريد (employee_id, date)؛ في قاعدة قديمة
+  بدونه يكفي الإدراج العادي لأن المفاتيح الموجودة جُلبت مسبقاً.
+- التقدم (الأسطر/ث وعدد الأخطاء) يُنشر بعد كل جزء عبر JobContext.progress.
+"""
+import csv
+import time
+from datetime import datetime, date
+
+from sqlalchemy import and_, bindparam, case, func, select, update
+
+from app import db
+from app.db_manager import has_unique_index
+from app.models.attendance import Attendance
+from app.models.employee import Employee
+from app.utils.attendance_daily import daily_rules, refresh_daily
+from app.utils.payroll_dirty import mark_payroll_dirty
+
+DEFAULT_CHUNK = 2000
+MAX_REPORTED_ERRORS = 1000  # تُحفظ أول الأخطاء فقط في نتيجة المهمة
+
+_DATE_KEYS = ('date',)
+_ID_KEYS = ('employee_id', 'emp_id')
+_CODE_KEYS = ('employee_code', 'code')
+_IN_KEYS = ('check_in', 'in', 'checkin')
+_OUT_KEYS = ('check_out', 'out', 'checkout')
+
+
+def parse_csv_time(t):
+    if not t or str(t).strip() == '':
+        return None
+    t = str(t).strip()
+    for fmt in ('%H:%M:%S', '%H:%M'):
+        try:
+            return datetime.strptime(t, fmt).time()
+        except ValueError:
+            pass
+    return None
+
+
+def _parse_date(value):
+    value = value.strip()
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def _first(row, keys):
+    for key in keys:
+        value = row.get(key)
+        if value:
+            return value
+    return None
+
+
+def _normalized_rows(open_source):
+    """أسطر CSV كقواميس بأسماء أعمدة صغيرة (case-insensitive) مع رقم السطر في الملف."""
+    with open_source() as stream:
+        reader = csv.reader(stream)
+        header = next(reader, None)
+        if not header:
+            return
+        names = [(h or '').strip().lower() for h in header]
+        for line_no, values in enumerate(reader, start=2):  # يبدأ العد من 2 (بعد الرأس)
+            if not values:
+                continue
+            yield line_no, dict(zip(names, values))
+
+
+def read_header(open_source):
+    """أسماء الأعمدة (أو [] لملف فارغ)؛ للتحقق قبل إرسال المهمة."""
+    with open_source() as stream:
+        header = next(csv.reader(stream), None)
+    return [(h or '').strip().lower() for h in header or []]
+
+
+def _scan(open_source):
+    """المرور الأول: عدد الأسطر وأصغر/أكبر تاريخ صالح."""
+    total = 0
+    first = last = None
+    for _, row in _normalized_rows(open_source):
+        total += 1
+        value = _first(row, _DATE_KEYS)
+        if not value:
+            continue
+        try:
+            d = _parse_date(value)
+        except ValueError:
+            continue
+        if first is None or d < first:
+            first = d
+        if last is None or d > last:
+            last = d
+    return total, first, last
+
+
+def _employee_index():
+    ids = set()
+    codes = {}
+    for emp_id, code in db.session.execute(select(Employee.id, Employee.code)):
+        ids.add(emp_id)
+        if code:
+            codes[str(code).strip()] = emp_id
+    return ids, codes
+
+
+def _existing_keys(first, last):
+    if first is None:
+        return set()
+    rows = db.session.execute(
+        select(Attendance.employee_id, Attendance.date).where(
+            Attendance.date >= first, Attendance.date <= last
+        )
+    )
+    return {(emp_id, d) for emp_id, d in rows}
+
+
+def merged_status(table, new_in, new_out):
+    """الحالة بعد الدمج: خارج إذا وُجد انصراف، داخل إذا وُجد حضور فقط، وإلا كما هي."""
+    return case(
+        (func.coalesce(new_out, table.c.check_out_time).isnot(None), 'outside'),
+        (func.coalesce(new_in, table.c.check_in_time).isnot(None), 'inside'),
+        else_=table.c.status,
+    )
+
+
+def _write_chunk(pending, existing, rules=None):
+    """كتابة جزء: pending = {(employee_id, date): (check_in, check_out)}. ترجع (جديد، محدّث)."""
+    table = Attendance.__table__
+    inserts, updates = [], []
+    for (emp_id, d), (tin, tout) in pending.items():
+        if (emp_id, d) in existing:
+            updates.append({'k_emp': emp_id, 'k_date': d, 'n_in': tin, 'n_out': tout})
+        else:
+            inserts.append({
+                'employee_id': emp_id, 'date': d, 'check_in_time': tin, 'check_out_time': tout,
+                'status': 'outside' if tout else ('inside' if tin else None),
+            })
+
+    connection = db.session.connection()
+    if inserts:
+        dialect = connection.dialect.name
+        if dialect in ('sqlite', 'postgresql') and has_unique_index(
+                connection, 'attendance', 'uq_attendance_employee_date'):
+            if dialect == 'sqlite':
+                from sqlalchemy.dialects.sqlite import insert as dialect_insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert as dialect_insert
+            stmt = dialect_insert(table)
+            # سجل أُنشئ بعد جلب المفاتيح (تسجيل حضور متزامن) يُدمج بدل فشل الجزء كاملاً
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['employee_id', 'date'],
+                set_={
+                    'check_in_time': func.coalesce(stmt.excluded.check_in_time, table.c.check_in_time),
+                    'check_out_time': func.coalesce(stmt.excluded.check_out_time, table.c.check_out_time),
+                    'status': merged_status(table, stmt.excluded.check_in_time, stmt.excluded.check_out_time),
+                }
+            )
+            connection.execute(stmt, inserts)
+        else:
+            connection.execute(table.insert(), inserts)
+    if updates:
+        new_in = bindparam('n_in', type_=table.c.check_in_time.type)
+        new_out = bindparam('n_out', type_=table.c.check_out_time.type)
+        connection.execute(
+            update(table).where(and_(
+                table.c.employee_id == bindparam('k_emp'), table.c.date == bindparam('k_date')
+            )).values(
+                check_in_time=func.coalesce(new_in, table.c.check_in_time),
+                check_out_time=func.coalesce(new_out, table.c.check_out_time),
+                status=merged_status(table, new_in, new_out),
+            ),
+            updates,
+        )
+    mark_payroll_dirty(pending.keys(), source='import')
+    refresh_daily(connection, pending.keys(), rules=rules)
+    existing.update(pending.keys())
+    return len(inserts), len(updates)
+
+
+def import_attendance_rows(open_source, ctx=None, chunk_size=DEFAULT_CHUNK):
+    """استيراد ملف CSV. open_source: دالة بدون معاملات ترجع ملفاً نصياً مفتوحاً (تُستدعى مرتين).
+    ctx: JobContext لنشر التقدم والإلغاء (اختياري).
+    """
+    started = time.monotonic()
+    total, first, last = _scan(open_source)
+    ids, codes = _employee_index()
+    existing = _existing_keys(first, last)
+    # القواعد تُحمّل هنا مرة واحدة: تحميل لقطة الإعدادات لأول مرة قد يُنشئ صفاً افتراضياً
+    # و commit، وهذا لا يجوز داخل معاملة جزء مفتوحة
+    rules = daily_rules()
+    db.session.commit()  # إنهاء معاملة القراءة قبل نشر التقدم (قفل SQLite)
+
+    created = updated = processed = 0
+    errors = []
+    error_count = 0
+    pending = {}
+
+    def error(line_no, message):
+        nonlocal error_count
+        error_count += 1
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append(f'سطر {line_no}: {message}')
+
+    def flush():
+        nonlocal created, updated
+        if pending:
+            c, u = _write_chunk(pending, existing, rules)
+            created += c
+            updated += u
+            pending.clear()
+        db.session.commit()
+        if ctx is not None:
+            elapsed = max(time.monotonic() - started, 1e-6)
+            ctx.progress(min(99, 100 * processed // max(total, 1)),
+                         f'تمت معالجة {processed} من {total} سطر ({int(processed / elapsed)} سطر/ث، '
+                         f'{error_count} خطأ)')
+
+    for line_no, row in _normalized_rows(open_source):
+        processed += 1
+        try:
+            date_str = _first(row, _DATE_KEYS)
+            emp_id = _first(row, _ID_KEYS)
+            emp_code = _first(row, _CODE_KEYS)
+            if not date_str or not (emp_id or emp_code):
+                error(line_no, 'بيانات ناقصة (date/employee)')
+                continue
+
+            # تحديد الموظف من الخريطة المحمّلة مسبقاً
+            employee_id = None
+            if emp_id:
+                try:
+                    candidate = int(str(emp_id).strip())
+                    employee_id = candidate if candidate in ids else None
+                except ValueError:
+                    employee_id = None
+            if employee_id is None and emp_code:
+                employee_id = codes.get(str(emp_code).strip())
+            if employee_id is None:
+                error(line_no, 'لم يتم العثور على الموظف (id/code)')
+                continue
+
+            d = _parse_date(date_str)
+            tin = parse_csv_time(_first(row, _IN_KEYS))
+            tout = parse_csv_time(_first(row, _OUT_KEYS))
+            tin = datetime.combine(d, tin) if tin else None
+            tout = datetime.combine(d, tout) if tout else None
+
+            # تكرار نفس (الموظف، اليوم) داخل الجزء: القيم الأحدث غير الفارغة تغلب
+            key = (employee_id, d)
+            if key in pending:
+                prev_in, prev_out = pending[key]
+                tin, tout = tin or prev_in, tout or prev_out
+            pending[key] = (tin, tout)
+        except Exception as row_err:
+            error(line_no, row_err)
+        finally:
+            if processed % chunk_size == 0:
+                flush()
+
+    flush()
+    elapsed = max(time.monotonic() - started, 1e-6)
+    return {
+        'status': 'success',
+        'created': created,
+        'updated': updated,
+        'errors': errors,
+        'error_count': error_count,
+        'rows': processed,
+        'rows_per_second': int(processed / elapsed),
+    }
@@ -0,0 +1,440 @@
+"""
+مزامنة الحضور المسجّل بدون اتصال (طابور AttendanceSync)
+- enqueue_sync_records() يُدرج الضغطات المخزنة على الجهاز مع مفتاح منع تكرار
+  (idempotency_key/client_id من العميل، وإلا بصمة الموظف/الإجراء/الوقت/الجهاز)؛ إعادة
+  إرسال نفس الضغطات بعد انقطاع الشبكة ترجع السجلات الموجودة بدل إنشاء نسخ جديدة.
+- drain_sync_queue() يسحب السجلات المستحقة على دفعات (ATTENDANCE_SYNC_BATCH) مرتبة
+  بالموظف ثم الوقت، ويقسمها على مجموعة خيوط حسب employee_id % العمال؛ ضغطات الموظف
+  الواحد في قسم واحد فتُطبَّق بترتيبها.
+- كل قسم معاملة واحدة: حجز شرطي (pending -> synced) يمنع معالجة السجل مرتين، ثم دمج
+  أزواج الحضور/الانصراف لكل (موظف، يوم) في الذاكرة وكتابتها بعبارة INSERT ... ON CONFLICT
+  مجمّعة على الفهرس الفريد (employee_id, date). القيمة الموجودة تغلب، فإعادة تطبيق نفس
+  الضغطة لا تغيّر شيئاً. إذا غاب الفهرس (قاعدة قديمة لم تكتمل ترحيلاتها) تُقرأ المفاتيح
+  الموجودة ثم يُحدَّث أو يُدرج، كما في قواعد البيانات الأخرى، بدل فشل ON CONFLICT وتأجيل الضغطات.
+- فشل قسم يعيد كل موظف في معاملته الخاصة؛ الموظف الفاشل يُؤجَّل بتراجع أُسّي
+  (ATTENDANCE_SYNC_BACKOFF_SECONDS × 2^(المحاولات-1) حتى ATTENDANCE_SYNC_BACKOFF_MAX)
+  وتُحجب ضغطاته اللاحقة حتى يحين موعده، وبعد ATTENDANCE_SYNC_MAX_ATTEMPTS يصبح failed.
+  مهمة التفريغ تجدول نفسها عند موعد أقرب ضغطة مؤجَّلة (next_retry_in).
+"""
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, bindparam, func, or_, select, update
+
+from app import db
+from app.db_manager import has_unique_index
+from app.models.attendance import Attendance
+from app.models.attendance_advanced import AttendanceSync
+from app.models.employee import Employee
+from app.utils.attendance_daily import daily_rules, refresh_daily
+from app.utils.attendance_import import merged_status
+from app.utils.feed import ATTENDANCE, publish_many
+from app.utils.payroll_dirty import mark_payroll_dirty
+
+CHECK_IN = 'check_in'
+CHECK_OUT = 'check_out'
+ACTIONS = (CHECK_IN, CHECK_OUT)
+
+PENDING = 'pending'
+SYNCED = 'synced'
+FAILED = 'failed'
+
+_IN_CHUNK = 500  # حد معاملات IN لكل استعلام
+_ERROR_MAX = 1000
+
+_ROW_COLUMNS = ('id', 'employee_id', 'action', 'timestamp', 'lat', 'lng', 'address',
+                'mac_address', 'device_info', 'sync_attempts')
+_IN_FIELDS = ('check_in_time', 'lat', 'lng', 'address', 'mac_address', 'device_info')
+_OUT_FIELDS = ('check_out_time', 'lat_out', 'lng_out', 'address_out')
+
+
+class _AlreadyClaimed(Exception):
+    """بعض سجلات القسم عالجها مُفرِّغ آخر بالتزامن."""
+
+
+def _chunks(values, size=_IN_CHUNK):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def idempotency_key(employee_id, action, timestamp, data):
+    """مفتاح منع التكرار (sha256 بطول 64): مفتاح العميل ضمن نطاق الموظف، وإلا بصمة الضغطة."""
+    client_key = str(data.get('idempotency_key') or data.get('client_id') or '').strip()
+    if client_key:
+        basis = f'client:{employee_id}:{client_key}'
+    else:
+        basis = f"punch:{employee_id}:{action}:{timestamp.isoformat()}:{data.get('mac_address') or ''}"
+    return hashlib.sha256(basis.encode('utf-8')).hexdigest()
+
+
+def parse_sync_record(data):
+    """تحويل ضغطة من الجهاز إلى قيم صف AttendanceSync؛ ترفع ValueError برسالة للمستخدم."""
+    if not isinstance(data, dict):
+        raise ValueError('سجل غير صالح')
+    try:
+        employee_id = int(data.get('employee_id'))
+    except (TypeError, ValueError):
+        raise ValueError('employee_id مطلوب')
+    action = data.get('action')
+    if action not in ACTIONS:
+        raise ValueError('action يجب أن يكون check_in أو check_out')
+    try:
+        timestamp = datetime.fromisoformat(str(data.get('timestamp')))
+    except ValueError:
+        raise ValueError('timestamp بصيغة ISO مطلوب')
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone().replace(tzinfo=None)
+    return {
+        'employee_id': employee_id,
+        'action': action,
+        'timestamp': timestamp,
+        'lat': data.get('lat'),
+        'lng': data.get('lng'),
+        'address': data.get('address'),
+        'mac_address': data.get('mac_address'),
+        'device_info': data.get('device_info'),
+        'sync_status': PENDING,
+        'sync_attempts': 0,
+        'idempotency_key': idempotency_key(employee_id, action, timestamp, data),
+        'original_data': json.dumps(data, ensure_ascii=False, default=str),
+        'created_at': datetime.utcnow(),
+    }
+
+
+def _insert_ignore_duplicates(connection, rows):
+    table = AttendanceSync.__table__
+    dialect = connection.dialect.name
+    if dialect in ('sqlite', 'postgresql') and has_unique_index(
+            connection, 'attendance_sync', 'uq_attendance_sync_idempotency_key'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        # إرسال متزامن لنفس الضغطة (إعادة محاولة العميل) يفوز به طلب واحد
+        connection.execute(dialect_insert(table).on_conflict_do_nothing(index_elements=['idempotency_key']), rows)
+    else:
+        connection.execute(table.insert(), rows)
+
+
+def _ids_for_keys(connection, keys):
+    table = AttendanceSync.__table__
+    found = {}
+    for chunk in _chunks(keys):
+        found.update(connection.execute(
+            select(table.c.idempotency_key, table.c.id).where(table.c.idempotency_key.in_(chunk))
+        ).all())
+    return found
+
+
+def enqueue_sync_records(records):
+    """إدراج ضغطات في الطابور (لا commit هنا).
+    ترجع قائمة لكل سجل: {'sync_id', 'duplicate'} أو {'error'} بنفس ترتيب المدخلات.
+    """
+    parsed = []
+    for data in records:
+        try:
+            parsed.append(parse_sync_record(data))
+        except ValueError as e:
+            parsed.append(str(e))
+
+    employee_ids = {p['employee_id'] for p in parsed if isinstance(p, dict)}
+    known = set()
+    for chunk in _chunks(employee_ids):
+        known.update(db.session.execute(select(Employee.id).where(Employee.id.in_(chunk))).scalars())
+
+    connection = db.session.connection()
+    keys = [p['idempotency_key'] for p in parsed if isinstance(p, dict) and p['employee_id'] in known]
+    existing = _ids_for_keys(connection, set(keys))
+    new_rows = {}
+    for p in parsed:
+        if isinstance(p, dict) and p['employee_id'] in known and p['idempotency_key'] not in existing:
+            new_rows.setdefault(p['idempotency_key'], p)
+    if new_rows:
+        _insert_ignore_duplicates(connection, list(new_rows.values()))
+        ids = _ids_for_keys(connection, new_rows.keys())
+    else:
+        ids = {}
+
+    results = []
+    seen = set()
+    for p in parsed:
+        if not isinstance(p, dict):
+            results.append({'error': p})
+        elif p['employee_id'] not in known:
+            results.append({'error': 'لم يتم العثور على الموظف'})
+        else:
+            key = p['idempotency_key']
+            duplicate = key in existing or key in seen or key not in ids
+            seen.add(key)
+            results.append({'sync_id': existing.get(key) or ids.get(key), 'duplicate': duplicate})
+    return results
+
+
+def _backoff(attempts, cfg):
+    base = float(cfg.get('ATTENDANCE_SYNC_BACKOFF_SECONDS', 30))
+    cap = float(cfg.get('ATTENDANCE_SYNC_BACKOFF_MAX', 3600))
+    return timedelta(seconds=min(base * 2 ** max(attempts - 1, 0), cap))
+
+
+def _due_condition(table, now):
+    """pending ومستحق، وليس لموظفه سجل مؤجَّل لم يحن موعده (حفظ ترتيب ضغطات الموظف)."""
+    deferred = select(table.c.employee_id).where(table.c.sync_status == PENDING, table.c.next_attempt_at > now)
+    return and_(
+        table.c.sync_status == PENDING,
+        or_(table.c.next_attempt_at.is_(None), table.c.next_attempt_at <= now),
+        table.c.employee_id.not_in(deferred),
+    )
+
+
+def _fetch_due(limit, now):
+    table = AttendanceSync.__table__
+    columns = [table.c[name] for name in _ROW_COLUMNS]
+    rows = db.session.execute(
+        select(*columns).where(_due_condition(table, now))
+        .order_by(table.c.employee_id, table.c.timestamp, table.c.id).limit(limit)
+    ).all()
+    return [dict(row._mapping) for row in rows]
+
+
+def pending_count():
+    return db.session.execute(
+        select(func.count()).select_from(AttendanceSync).where(AttendanceSync.sync_status == PENDING)
+    ).scalar() or 0
+
+
+def next_retry_in(now=None):
+    """ثوانٍ حتى أقرب ضغطة مؤجَّلة تصبح مستحقة (لجدولة تفريغ لاحق)، أو None إذا لا يوجد مؤجَّل."""
+    now = now or datetime.now()
+    table = AttendanceSync.__table__
+    earliest = db.session.execute(
+        select(func.min(table.c.next_attempt_at)).where(table.c.sync_status == PENDING, table.c.next_attempt_at > now)
+    ).scalar()
+    db.session.rollback()
+    if earliest is None:
+        return None
+    return max((earliest - now).total_seconds(), 0.0)
+
+
+def _claim(connection, ids, now):
+    """pending -> synced لكل سجلات القسم في معاملته؛ ترفع _AlreadyClaimed إذا سبقنا مُفرِّغ آخر."""
+    table = AttendanceSync.__table__
+    claimed = 0
+    for chunk in _chunks(ids):
+        claimed += connection.execute(update(table).where(
+            table.c.id.in_(chunk), table.c.sync_status == PENDING
+        ).values(
+            sync_status=SYNCED, synced_at=now, last_sync_attempt=now, next_attempt_at=None, error_message=None,
+            sync_attempts=func.coalesce(table.c.sync_attempts, 0) + 1,
+        )).rowcount
+    if claimed != len(ids):
+        raise _AlreadyClaimed()
+
+
+def merge_punches(rows):
+    """دمج الضغطات المرتبة زمنياً لكل (موظف، يوم): أول حضور وآخر انصراف مع موقع كل منهما."""
+    merged = {}
+    for row in sorted(rows, key=lambda r: (r['employee_id'], r['timestamp'], r['id'])):
+        key = (row['employee_id'], row['timestamp'].date())
+        values = merged.get(key)
+        if values is None:
+            values = merged[key] = dict.fromkeys(_IN_FIELDS + _OUT_FIELDS)
+        if row['action'] == CHECK_IN:
+            if values['check_in_time'] is None:
+                values.update(check_in_time=row['timestamp'], lat=row['lat'], lng=row['lng'],
+                              address=row['address'], mac_address=row['mac_address'],
+                              device_info=row['device_info'])
+        else:
+            values.update(check_out_time=row['timestamp'], lat_out=row['lat'], lng_out=row['lng'],
+                          address_out=row['address'])
+    return merged
+
+
+def _write_attendance(connection, merged):
+    """كتابة الأزواج المدمجة؛ الحقول الموجودة في السجل تغلب (COALESCE) فالتطبيق متكرر الأمان."""
+    table = Attendance.__table__
+    rows = [{
+        'employee_id': emp_id, 'date': day, **values,
+        'status': 'outside' if values['check_out_time'] else 'inside',
+    } for (emp_id, day), values in merged.items()]
+    dialect = connection.dialect.name
+    if dialect in ('sqlite', 'postgresql') and has_unique_index(connection, 'attendance', 'uq_attendance_employee_date'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(table)
+        keep = {name: func.coalesce(table.c[name], stmt.excluded[name]) for name in _IN_FIELDS + _OUT_FIELDS}
+        keep['status'] = merged_status(table, stmt.excluded.check_in_time, stmt.excluded.check_out_time)
+        connection.execute(stmt.on_conflict_do_update(index_elements=['employee_id', 'date'], set_=keep), rows)
+        return
+    existing = set()
+    for chunk in _chunks(sorted({r['employee_id'] for r in rows})):
+        existing.update(connection.execute(select(table.c.employee_id, table.c.date).where(
+            table.c.employee_id.in_(chunk), table.c.date.in_({r['date'] for r in rows})
+        )).all())
+    inserts = [r for r in rows if (r['employee_id'], r['date']) not in existing]
+    updates = [r for r in rows if (r['employee_id'], r['date']) in existing]
+    if inserts:
+        connection.execute(table.insert(), inserts)
+    if updates:
+        params = [{'k_' + k: v for k, v in r.items() if k != 'status'} for r in updates]
+        values = {
+            name: func.coalesce(table.c[name], bindparam('k_' + name, type_=table.c[name].type))
+            for name in _IN_FIELDS + _OUT_FIELDS
+        }
+        values['status'] = merged_status(table, bindparam('k_check_in_time', type_=table.c.check_in_time.type),
+                                         bindparam('k_check_out_time', type_=table.c.check_out_time.type))
+        connection.execute(update(table).where(and_(
+            table.c.employee_id == bindparam('k_employee_id'), table.c.date == bindparam('k_date')
+        )).values(**values), params)
+
+
+def _apply(connection, rows, now, rules):
+    """تطبيق ضغطات قسم داخل معاملة الاتصال. ترجع (مُطبَّق، فاشل نهائياً)."""
+    _claim(connection, [r['id'] for r in rows], now)
+    known = set()
+    for chunk in _chunks({r['employee_id'] for r in rows}):
+        known.update(connection.execute(select(Employee.__table__.c.id).where(
+            Employee.__table__.c.id.in_(chunk))).scalars())
+    invalid = [r for r in rows if r['employee_id'] not in known or r['action'] not in ACTIONS]
+    if invalid:
+        # سجلات قديمة بلا موظف أو بإجراء غير معروف: لا فائدة من إعادة المحاولة
+        table = AttendanceSync.__table__
+        for chunk in _chunks([r['id'] for r in invalid]):
+            connection.execute(update(table).where(table.c.id.in_(chunk)).values(
+                sync_status=FAILED, synced_at=None, error_message='موظف غير موجود أو إجراء غير معروف'))
+        rows = [r for r in rows if r['employee_id'] in known and r['action'] in ACTIONS]
+
+    merged = merge_punches(rows)
+    if merged:
+        _write_attendance(connection, merged)
+        # كتابة Core لا تمر بأحداث ORM
+        mark_payroll_dirty(merged.keys(), source='offline_sync', connection=connection)
+        refresh_daily(connection, merged.keys(), rules=rules)
+        publish_many(connection, ATTENDANCE, [{
+            'type': r['action'],
+            'employee_id': r['employee_id'],
+            'date': r['timestamp'].date().isoformat(),
+            'at': r['timestamp'].isoformat(timespec='seconds'),
+            'offline': True,
+        } for r in rows])
+    return len(rows), len(invalid)
+
+
+def _defer(rows, error, now, cfg):
+    """تأجيل ضغطات موظف فشلت: المحاولة التالية بتراجع أُسّي، أو failed بعد الحد الأقصى."""
+    table = AttendanceSync.__table__
+    max_attempts = int(cfg.get('ATTENDANCE_SYNC_MAX_ATTEMPTS', 8))
+    params = []
+    for row in rows:
+        attempts = (row['sync_attempts'] or 0) + 1
+        params.append({
+            'b_id': row['id'],
+            'b_status': FAILED if attempts >= max_attempts else PENDING,
+            'b_attempts': attempts,
+            'b_next': now + _backoff(attempts, cfg),
+        })
+    with db.engine.begin() as connection:
+        connection.execute(update(table).where(
+            table.c.id == bindparam('b_id'), table.c.sync_status == PENDING
+        ).values(
+            sync_status=bindparam('b_status'), sync_attempts=bindparam('b_attempts'),
+            next_attempt_at=bindparam('b_next'), last_sync_attempt=now,
+            error_message=str(error)[:_ERROR_MAX],
+        ), params)
+    return sum(1 for p in params if p['b_status'] == FAILED)
+
+
+def _process_partition(app, rows, now, rules):
+    """قسم من الموظفين؛ ترجع عدادات {'processed', 'failed', 'deferred', 'skipped'}."""
+    counts = {'processed': 0, 'failed': 0, 'deferred': 0, 'skipped': 0}
+    with app.app_context():
+        try:
+            try:
+                with db.engine.begin() as connection:
+                    applied, invalid = _apply(connection, rows, now, rules)
+                counts['processed'] += applied
+                counts['failed'] += invalid
+                return counts
+            except _AlreadyClaimed:
+                pass
+            except Exception as e:
+                app.logger.warning(f"Attendance sync partition failed ({len(rows)} rows): {e}")
+
+            # عزل السبب: كل موظف في معاملته الخاصة
+            by_employee = {}
+            for row in rows:
+                by_employee.setdefault(row['employee_id'], []).append(row)
+            for employee_rows in by_employee.values():
+                try:
+                    with db.engine.begin() as connection:
+                        applied, invalid = _apply(connection, employee_rows, now, rules)
+                    counts['processed'] += applied
+                    counts['failed'] += invalid
+                except _AlreadyClaimed:
+                    counts['skipped'] += len(employee_rows)
+                except Exception as e:
+                    failed = _defer(employee_rows, e, now, app.config)
+                    counts['failed'] += failed
+                    counts['deferred'] += len(employee_rows) - failed
+            return counts
+        finally:
+            db.session.remove()
+
+
+def _worker_count(cfg):
+    if db.engine.dialect.name == 'sqlite':
+        return 1  # كاتب واحد في SQLite: الخيوط الإضافية تنتظر القفل فقط
+    return int(cfg.get('ATTENDANCE_SYNC_WORKERS', 0)) or min(os.cpu_count() or 1, 4)
+
+
+def drain_sync_queue(progress=None, max_batches=None):
+    """تفريغ السجلات المستحقة دفعة بعد دفعة حتى لا يبقى شيء مستحق.
+    progress(done, message): اختياري لنشر التقدم بين الدفعات.
+    """
+    app = current_app._get_current_object()
+    cfg = app.config
+    batch_size = int(cfg.get('ATTENDANCE_SYNC_BATCH', 5000))
+    workers = _worker_count(cfg)
+    rules = daily_rules()
+    totals = {'processed': 0, 'failed': 0, 'deferred': 0, 'skipped': 0, 'batches': 0}
+    started = time.monotonic()
+
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='attendance-sync') if workers > 1 else None
+    try:
+        while max_batches is None or totals['batches'] < max_batches:
+            now = datetime.now()
+            rows = _fetch_due(batch_size, now)
+            db.session.commit()  # إنهاء معاملة القراءة قبل الكتابة (قفل SQLite)
+            if not rows:
+                break
+            partitions = {}
+            for row in rows:
+                partitions.setdefault(row['employee_id'] % workers, []).append(row)
+            if executor is None or len(partitions) == 1:
+                results = [_process_partition(app, part, now, rules) for part in partitions.values()]
+            else:
+                results = list(executor.map(lambda part: _process_partition(app, part, now, rules),
+                                            partitions.values()))
+            for counts in results:
+                for name, value in counts.items():
+                    totals[name] += value
+            totals['batches'] += 1
+            if progress is not None:
+                elapsed = max(time.monotonic() - started, 1e-6)
+                progress(totals['processed'], f"تمت مزامنة {totals['processed']} سجل "
+                                              f"({int(totals['processed'] / elapsed)} سجل/ث)")
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    totals['remaining'] = pending_count()
+    totals['seconds'] = round(time.monotonic() - started, 3)
+    db.session.commit()
+    return totals
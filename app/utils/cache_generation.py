@@ -0,0 +1,56 @@
+"""
+إبطال الكاش بالإصدارات (generation counters) عبر جدول cache_generation
+- get_generation(name): الإصدار الحالي، يُقرأ من القاعدة مرة كل CACHE_GENERATION_TTL ثانية
+  على الأكثر لكل عملية (صفر استعلامات بين القراءتين).
+- bump_generation(name): زيادة الإصدار ضمن معاملة الجلسة الحالية، فيُحفظ مع commit التعديل نفسه.
+العملية التي أجرت التعديل ترى الإصدار الجديد فوراً، وبقية العمليات خلال مدة TTL.
+"""
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import select
+
+from app import db
+from app.models.cache_generation import CacheGeneration
+
+_local = {}  # name -> ((version, token), checked_at)
+_lock = threading.Lock()
+
+
+def get_generation(name, ttl=None):
+    """(version, token) الحالي للاسم؛ (0, None) إذا لم يُزد بعد."""
+    if ttl is None:
+        ttl = float(current_app.config.get('CACHE_GENERATION_TTL', 5.0))
+    now = time.monotonic()
+    entry = _local.get(name)
+    if entry is not None and now - entry[1] < ttl:
+        return entry[0]
+    table = CacheGeneration.__table__
+    with db.session.no_autoflush:
+        row = db.session.execute(
+            select(table.c.version, table.c.token).where(table.c.name == name)
+        ).first()
+    generation = (row[0], row[1]) if row else (0, None)
+    with _lock:
+        _local[name] = (generation, now)
+    return generation
+
+
+def bump_generation(name, connection=None):
+    """زيادة إصدار الاسم داخل المعاملة الحالية (يلزم commit من المستدعي).
+    connection: اتصال المعاملة عند الاستدعاء من أحداث الجلسة (after_flush).
+    """
+    executor = connection if connection is not None else db.session
+    table = CacheGeneration.__table__
+    values = {'token': uuid.uuid4().hex, 'updated_at': datetime.utcnow()}
+    res = executor.execute(
+        table.update().where(table.c.name == name).values(version=table.c.version + 1, **values)
+    )
+    if res.rowcount == 0:
+        executor.execute(table.insert().values(name=name, version=1, **values))
+    # القراءة التالية في هذه العملية تذهب للقاعدة مباشرة
+    with _lock:
+        _local.pop(name, None)
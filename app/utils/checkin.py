@@ -0,0 +1,284 @@
+"""
+خط تسجيل الحضور/الانصراف عالي الإنتاجية (/api/attendance)
+- التحقق يتم في الذاكرة من لقطة الإعدادات (settings_cache) قبل أي كتابة.
+- الكتابة في معاملة واحدة: سجل الحضور + last_used للجهاز + علامة إعادة حساب الراتب
+  + صف التجميع اليومي (attendance_daily) + حدث البث المباشر (feed_event).
+- منع التكرار بالفهرس الفريد (employee_id, date): INSERT ... ON CONFLICT DO NOTHING
+  للحضور، و UPDATE شرطي (check_out_time IS NULL) للانصراف، بدون قراءة ثم كتابة.
+  إذا غاب الفهرس (قاعدة قديمة لم تكتمل ترحيلاتها) يُفحص وجود السجل قبل الإدراج.
+- اختيارياً (CHECKIN_GROUP_COMMIT): كاتب خلفي لكل عملية يجمع الطلبات المتزامنة
+  (حتى CHECKIN_GROUP_MAX_BATCH أو CHECKIN_GROUP_MAX_WAIT_MS) في commit واحد،
+  فتُدفع كلفة المزامنة مع القرص مرة واحدة لكل دفعة بدل كل طلب.
+  عند انتهاء مهلة الانتظار يبقى الطلب في الطابور ويُكتب لاحقاً، لذا يُعاد قراءة السجل
+  وتُرجع النتيجة المكتوبة أو PENDING بدل إبلاغ المستخدم بالفشل.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import and_, func, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.db_manager import has_unique_index
+from app.models.attendance import Attendance, RegisteredDevice
+from app.utils.attendance_daily import refresh_daily
+from app.utils.feed import ATTENDANCE, publish_many
+from app.utils.payroll_dirty import mark_payroll_dirty
+
+# نتائج الكتابة
+CREATED = 'created'
+CHECKED_OUT = 'checked_out'
+ALREADY_CHECKED_IN = 'already_checked_in'
+NOT_CHECKED_IN = 'not_checked_in'
+ALREADY_CHECKED_OUT = 'already_checked_out'
+PENDING = 'pending'  # ما زال في طابور الكاتب الخلفي بعد انتهاء المهلة
+
+CHECK_IN = 'حضور'
+CHECK_OUT = 'انصراف'
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+class CheckinRequest:
+    """طلب حضور/انصراف تم التحقق منه ويُنتظر كتابته. الوقت يُثبت عند استلام الطلب."""
+
+    __slots__ = ('employee_id', 'action', 'at', 'lat', 'lng', 'address', 'mac_address',
+                 'device_info', 'location_ok', 'time_ok', 'device_ok', 'notes')
+
+    def __init__(self, employee_id, action, lat=None, lng=None, address=None, mac_address=None,
+                 device_info=None, location_ok=False, time_ok=False, device_ok=False, notes='', at=None):
+        self.employee_id = employee_id
+        self.action = action
+        self.at = at or datetime.now()
+        self.lat = lat
+        self.lng = lng
+        self.address = address
+        self.mac_address = mac_address
+        self.device_info = device_info
+        self.location_ok = location_ok
+        self.time_ok = time_ok
+        self.device_ok = device_ok
+        self.notes = notes
+
+    @property
+    def day(self):
+        return self.at.date()
+
+
+def _insert_check_in(connection, item):
+    table = Attendance.__table__
+    values = {
+        'employee_id': item.employee_id, 'date': item.day, 'check_in_time': item.at,
+        'lat': item.lat, 'lng': item.lng, 'address': item.address,
+        'mac_address': item.mac_address, 'device_info': item.device_info,
+        'location_verified': item.location_ok, 'time_verified': item.time_ok,
+        'device_verified': item.device_ok, 'verification_notes': item.notes, 'status': 'inside',
+    }
+    if not has_unique_index(connection, 'attendance', 'uq_attendance_employee_date'):
+        # لا قيد يمنع التكرار: فحص ثم إدراج (أي تكرار متزامن يدمجه الترحيل قبل إنشاء الفهرس)
+        exists = connection.execute(select(table.c.id).where(
+            table.c.employee_id == item.employee_id, table.c.date == item.day
+        ).limit(1)).first()
+        if exists:
+            return False
+        connection.execute(table.insert().values(**values))
+        return True
+    dialect = connection.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(table).values(**values).on_conflict_do_nothing(
+            index_elements=['employee_id', 'date']
+        )
+        return connection.execute(stmt).rowcount == 1
+    savepoint = connection.begin_nested()
+    try:
+        connection.execute(table.insert().values(**values))
+    except IntegrityError:
+        savepoint.rollback()
+        return False
+    savepoint.commit()
+    return True
+
+
+def _update_check_out(connection, item):
+    table = Attendance.__table__
+    key = and_(table.c.employee_id == item.employee_id, table.c.date == item.day)
+    res = connection.execute(
+        update(table).where(key, table.c.check_out_time.is_(None)).values(
+            check_out_time=item.at, lat_out=item.lat, lng_out=item.lng,
+            address_out=item.address, status='outside',
+            verification_notes=func.coalesce(table.c.verification_notes, '')
+            + f"\n\nعند الانصراف:\n{item.notes}",
+        )
+    )
+    if res.rowcount:
+        return CHECKED_OUT
+    # فشل التحديث فقط: التمييز بين عدم وجود حضور وانصراف مكرر
+    exists = connection.execute(select(table.c.id).where(key).limit(1)).first()
+    return ALREADY_CHECKED_OUT if exists else NOT_CHECKED_IN
+
+
+def apply_checkins(connection, items):
+    """كتابة مجموعة طلبات على اتصال معاملة واحد (لا commit هنا). ترجع نتيجة لكل طلب."""
+    outcomes = []
+    written = []
+    for item in items:
+        if item.action == CHECK_IN:
+            outcome = CREATED if _insert_check_in(connection, item) else ALREADY_CHECKED_IN
+        else:
+            outcome = _update_check_out(connection, item)
+        outcomes.append(outcome)
+        if outcome in (CREATED, CHECKED_OUT):
+            written.append(item)
+
+    devices = [i for i in written if i.device_ok and i.mac_address]
+    if devices:
+        table = RegisteredDevice.__table__
+        for item in devices:
+            connection.execute(update(table).where(
+                table.c.employee_id == item.employee_id,
+                table.c.mac_address == item.mac_address,
+                table.c.is_active == True
+            ).values(last_used=item.at))
+    if written:
+        # كتابة Core لا تمر بأحداث ORM
+        mark_payroll_dirty({(i.employee_id, i.day) for i in written}, source='attendance',
+                           connection=connection)
+        refresh_daily(connection, {(i.employee_id, i.day) for i in written})
+        publish_many(connection, ATTENDANCE, [{
+            'type': 'check_in' if i.action == CHECK_IN else 'check_out',
+            'employee_id': i.employee_id,
+            'date': i.day.isoformat(),
+            'at': i.at.isoformat(timespec='seconds'),
+        } for i in written])
+    return outcomes
+
+
+class CheckinWriter:
+    """كاتب خلفي يجمع طلبات الحضور المتزامنة في معاملات مشتركة (group commit)."""
+
+    def __init__(self, app, max_batch=None, max_wait_ms=None):
+        self.app = app
+        self.max_batch = int(max_batch or app.config.get('CHECKIN_GROUP_MAX_BATCH', 64))
+        self.max_wait = float(max_wait_ms if max_wait_ms is not None
+                              else app.config.get('CHECKIN_GROUP_MAX_WAIT_MS', 0.0)) / 1000.0
+        self.pid = os.getpid()
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {'batches': 0, 'items': 0, 'max_batch_seen': 0}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name='checkin-writer', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._queue.put(None)
+
+    def submit(self, item):
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def _next_batch(self):
+        first = self._queue.get()
+        if first is None:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is None:
+                self._stop.set()
+                break
+            batch.append(entry)
+        return batch
+
+    def _loop(self):
+        while not self._stop.is_set():
+            batch = self._next_batch()
+            if batch:
+                with self.app.app_context():
+                    self._write(batch)
+
+    def _write(self, batch):
+        items = [item for item, _ in batch]
+        try:
+            with db.engine.begin() as connection:
+                outcomes = apply_checkins(connection, items)
+        except Exception as e:
+            self.app.logger.error(f"Check-in group commit failed ({len(batch)} items): {e}")
+            # طلب معطوب لا يُفشل بقية الدفعة: إعادة كل طلب في معاملته الخاصة
+            for item, future in batch:
+                try:
+                    with db.engine.begin() as connection:
+                        future.set_result(apply_checkins(connection, [item])[0])
+                except Exception as item_error:
+                    future.set_exception(item_error)
+            return
+        for (_, future), outcome in zip(batch, outcomes):
+            future.set_result(outcome)
+        self.stats['batches'] += 1
+        self.stats['items'] += len(batch)
+        self.stats['max_batch_seen'] = max(self.stats['max_batch_seen'], len(batch))
+
+
+def get_checkin_writer(app):
+    """كاتب هذه العملية (يُنشأ عند أول استخدام وبعد fork لعمال gunicorn)."""
+    global _writer
+    with _writer_lock:
+        if _writer is None or _writer.pid != os.getpid() or _writer.app is not app:
+            if _writer is not None and _writer.pid == os.getpid():
+                _writer.stop()
+            _writer = CheckinWriter(app).start()
+        return _writer
+
+
+def written_outcome(item):
+    """CREATED/CHECKED_OUT إذا كان هذا الطلب نفسه مكتوباً في السجل (بمطابقة وقته)، وإلا None."""
+    table = Attendance.__table__
+    row = db.session.execute(select(table.c.check_in_time, table.c.check_out_time).where(
+        table.c.employee_id == item.employee_id, table.c.date == item.day
+    )).first()
+    if row is None:
+        return None
+    if item.action == CHECK_IN and row.check_in_time == item.at:
+        return CREATED
+    if item.action == CHECK_OUT and row.check_out_time == item.at:
+        return CHECKED_OUT
+    return None
+
+
+def record_checkin(item):
+    """كتابة طلب حضور/انصراف وإرجاع النتيجة (CREATED, CHECKED_OUT, ... أو PENDING)."""
+    app = current_app._get_current_object()
+    if app.config.get('CHECKIN_GROUP_COMMIT'):
+        timeout = float(app.config.get('CHECKIN_SUBMIT_TIMEOUT', 10.0))
+        future = get_checkin_writer(app).submit(item)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            app.logger.warning(f"Check-in for employee {item.employee_id} still queued after {timeout}s")
+            return written_outcome(item) or PENDING
+    try:
+        outcome = apply_checkins(db.session.connection(), [item])[0]
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return outcome
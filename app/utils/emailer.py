@@ -1,141 +1,636 @@
+"""Outgoing email through a durable outbox.
+
+send_email() / queue_email() write a row to email_outbox and return at once; the
+background job email.outbox_drain claims due rows in batches (queued -> sending
+with a claim token) and delivers them:
+  - SMTP: a per-process pool of authenticated connections. STARTTLS and login
+    happen once per connection, which is reused for up to EMAIL_SMTP_MAX_MESSAGES
+    messages and checked with NOOP after EMAIL_SMTP_IDLE_SECONDS of idleness.
+    Each sending thread (EMAIL_SEND_WORKERS) holds one connection.
+  - Mailgun / SendGrid: one requests.Session with a pooled HTTPAdapter.
+  - Provider settings (DB Settings over config) are resolved once per batch.
+Throttling (SMTP 4xx, HTTP 429), 5xx and network errors are retried with
+exponential backoff up to EMAIL_SEND_MAX_ATTEMPTS; other errors are final.
+Mail deferred past EMAIL_OUTBOX_MAX_WAIT is picked up by a delayed follow-up job
+submitted for its retry time.
+The results of a batch are written in one commit. Messages in SENSITIVE_CATEGORIES
+(password reset codes) lose their body, html and provider options once they are sent
+or finally failed, so the outbox keeps no usable code and such a row cannot be retried.
+
+send_email_now() sends synchronously over the same transports (scripts/test_email.py).
+"""
+import json
+import os
+import queue
 import smtplib
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
+from email.utils import make_msgid
+
 import requests
+from flask import current_app
+from requests.adapters import HTTPAdapter
+from sqlalchemy import bindparam, func, or_, select, update
 
+from app import db
+from app.models.email_outbox import EmailOutbox
+from app.utils.jobs import job_handler, submit_once
 
-def _send_via_smtp(app, sender: str, sender_name: str, to_email: str, subject: str, body: str) -> bool:
-    server = app.config.get('SMTP_SERVER', '')
-    port = app.config.get('SMTP_PORT', 587)
-    username = app.config.get('SMTP_USERNAME', '')
-    password = app.config.get('SMTP_PASSWORD', '')
-    use_tls = app.config.get('SMTP_USE_TLS', True)
-    use_ssl = app.config.get('SMTP_USE_SSL', False)
+QUEUED = 'queued'
+SENDING = 'sending'
+SENT = 'sent'
+FAILED = 'failed'
+_RETRY = 'retry'
+_RELEASE = 'release'
 
-    if not server or not username or not password:
-        app.logger.warning('[Email][SMTP] Not configured. Skipping send to %s. Subject: %s Body: %s', to_email, subject, body)
-        return False
-    try:
-        msg = MIMEText(body, 'plain', 'utf-8')
-        msg['Subject'] = subject
-        msg['From'] = f"{sender_name} <{sender}>" if sender_name else sender
-        msg['To'] = to_email
-
-        if use_ssl:
-            with smtplib.SMTP_SSL(server, port, timeout=15) as smtp:
-                smtp.login(username, password)
-                smtp.sendmail(sender, [to_email], msg.as_string())
-        else:
-            with smtplib.SMTP(server, port, timeout=15) as smtp:
-                if use_tls:
-                    smtp.starttls()
-                smtp.login(username, password)
-                smtp.sendmail(sender, [to_email], msg.as_string())
-        return True
-    except Exception as e:
-        app.logger.error('[Email][SMTP] Failed to send email to %s: %s', to_email, e)
-        return False
+MAILGUN_API_URL = 'https://api.mailgun.net/v3'
+SENDGRID_API_URL = 'https://api.sendgrid.com/v3'
 
+SENSITIVE_CATEGORIES = ('password_reset',)
 
-def _send_via_mailgun(app, sender: str, sender_name: str, to_email: str, subject: str, body: str) -> bool:
-    domain = app.config.get('MAILGUN_DOMAIN', '')
-    api_key = app.config.get('MAILGUN_API_KEY', '')
-    if not domain or not api_key:
-        app.logger.warning('[Email][Mailgun] Not configured.')
-        return False
-    try:
-        resp = requests.post(
-            f'https://api.mailgun.net/v3/{domain}/messages',
-            auth=('api', api_key),
-            data={
-                'from': f"{sender_name} <{sender}>" if sender_name else sender,
-                'to': [to_email],
-                'subject': subject,
-                'text': body,
-            }, timeout=15
-        )
-        if resp.status_code in (200, 202):
-            return True
-        app.logger.error('[Email][Mailgun] Failed status=%s body=%s', resp.status_code, resp.text)
-        return False
-    except Exception as e:
-        app.logger.error('[Email][Mailgun] Exception: %s', e)
-        return False
+_IN_CHUNK = 500
+_ERROR_MAX = 1000
+
+_transport = None
+_transport_lock = threading.Lock()
 
 
-def _send_via_sendgrid(app, sender: str, sender_name: str, to_email: str, subject: str, body: str, *, html: str | None = None, template_id: str | None = None, dynamic_data: dict | None = None) -> bool:
-    # Prefer DB-stored key from settings if available
-    api_key = app.config.get('SENDGRID_API_KEY', '')
+class MailError(Exception):
+    """A failed delivery. retryable: throttling, 4xx SMTP replies, 5xx and network errors."""
+
+    def __init__(self, message, retryable=False, retry_after=None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+# ==================== Settings and message ====================
+
+def mail_settings(app=None):
+    """Sender and provider settings; DB Settings (email_provider, sendgrid_api_key) override config."""
+    cfg = (app or current_app).config
+    provider = (cfg.get('EMAIL_PROVIDER') or 'SMTP').upper()
+    sendgrid_api_key = cfg.get('SENDGRID_API_KEY', '')
     try:
-        from app.models.settings import Settings  # local import to avoid circular at module load
-        with app.app_context():
-            s = Settings.get_settings()
-            if s and s.sendgrid_api_key:
-                api_key = s.sendgrid_api_key
+        from app.utils.settings_cache import system_settings  # local import to avoid circular at module load
+        s = system_settings()
+        if s and s.email_provider:
+            provider = s.email_provider.upper()
+        if s and s.sendgrid_api_key:
+            sendgrid_api_key = s.sendgrid_api_key
     except Exception:
         pass
-    if not api_key:
-        app.logger.warning('[Email][SendGrid] Not configured.')
-        return False
-    try:
+    return {
+        'provider': provider,
+        'sender': cfg.get('MAIL_SENDER', 'no-reply@example.com'),
+        'sender_name': cfg.get('MAIL_SENDER_NAME', ''),
+        'smtp_server': cfg.get('SMTP_SERVER', ''),
+        'smtp_port': int(cfg.get('SMTP_PORT', 587)),
+        'smtp_username': cfg.get('SMTP_USERNAME', ''),
+        'smtp_password': cfg.get('SMTP_PASSWORD', ''),
+        'smtp_use_tls': bool(cfg.get('SMTP_USE_TLS', True)),
+        'smtp_use_ssl': bool(cfg.get('SMTP_USE_SSL', False)),
+        'mailgun_domain': cfg.get('MAILGUN_DOMAIN', ''),
+        'mailgun_api_key': cfg.get('MAILGUN_API_KEY', ''),
+        'sendgrid_api_key': sendgrid_api_key,
+    }
+
+
+def _configured(settings):
+    provider = settings['provider']
+    if provider == 'MAILGUN':
+        return bool(settings['mailgun_domain'] and settings['mailgun_api_key'])
+    if provider == 'SENDGRID':
+        return bool(settings['sendgrid_api_key'])
+    return bool(settings['smtp_server'])
+
+
+def _from_header(settings):
+    return f"{settings['sender_name']} <{settings['sender']}>" if settings['sender_name'] else settings['sender']
+
+
+def build_message(settings, row):
+    """MIME message for an outbox row (plain text, or multipart/alternative when html is set)."""
+    if row.get('html'):
+        msg = MIMEMultipart('alternative')
+        msg.attach(MIMEText(row.get('body') or '', 'plain', 'utf-8'))
+        msg.attach(MIMEText(row['html'], 'html', 'utf-8'))
+    else:
+        msg = MIMEText(row.get('body') or '', 'plain', 'utf-8')
+    msg['Subject'] = row.get('subject') or ''
+    msg['From'] = _from_header(settings)
+    msg['To'] = row['to_email']
+    msg['Message-ID'] = make_msgid(domain=settings['sender'].rpartition('@')[2] or None)
+    return msg
+
+
+# ==================== Transports ====================
+
+def _smtp_error(e):
+    if isinstance(e, smtplib.SMTPRecipientsRefused):
+        code = min((code for code, _ in e.recipients.values()), default=550)
+        return MailError(f'Recipient refused: {e.recipients}', retryable=400 <= code < 500)
+    if isinstance(e, smtplib.SMTPAuthenticationError):
+        # credentials/config problem, not the message: keep it queued until fixed
+        return MailError(f'SMTP authentication failed: {e.smtp_code} {e.smtp_error!r}', retryable=True)
+    if isinstance(e, smtplib.SMTPResponseException):
+        return MailError(f'SMTP {e.smtp_code}: {e.smtp_error!r}', retryable=400 <= e.smtp_code < 500)
+    return MailError(f'SMTP connection error: {e!r}', retryable=True)
+
+
+class _Connection:
+    __slots__ = ('smtp', 'sent', 'last_used')
+
+    def __init__(self, smtp):
+        self.smtp = smtp
+        self.sent = 0
+        self.last_used = time.monotonic()
+
+
+class SMTPPool:
+    """Authenticated SMTP connections kept open across messages and batches (thread-safe)."""
+
+    def __init__(self, host, port, username='', password='', use_tls=True, use_ssl=False, size=4,
+                 timeout=15, max_messages=100, idle_seconds=30):
+        self.host = host
+        self.port = int(port)
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.use_ssl = use_ssl
+        self.size = max(int(size), 1)
+        self.timeout = timeout
+        self.max_messages = max(int(max_messages), 1)
+        self.idle_seconds = idle_seconds
+        self.connects = 0
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self.use_ssl:
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.use_tls and not self.use_ssl:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+        except Exception:
+            self._close(smtp)
+            raise
+        with self._lock:
+            self.connects += 1
+        return _Connection(smtp)
+
+    @staticmethod
+    def _close(smtp):
+        try:
+            smtp.quit()
+        except Exception:
+            try:
+                smtp.close()
+            except Exception:
+                pass
+
+    def _acquire(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if time.monotonic() - conn.last_used < self.idle_seconds:
+                return conn
+            try:
+                if conn.smtp.noop()[0] == 250:
+                    return conn
+            except Exception:
+                pass
+            self._close(conn.smtp)
+
+    def _release(self, conn):
+        if conn.sent >= self.max_messages or self._idle.qsize() >= self.size:
+            self._close(conn.smtp)
+            return
+        conn.last_used = time.monotonic()
+        self._idle.put(conn)
+
+    @contextmanager
+    def session(self, settings):
+        """send(row) -> Message-ID over one pooled connection, rotated after max_messages."""
+        current = None
+
+        def send(row):
+            nonlocal current
+            try:
+                if current is not None and current.sent >= self.max_messages:
+                    self._release(current)
+                    current = None
+                if current is None:
+                    current = self._acquire()
+                message = build_message(settings, row)
+                current.smtp.sendmail(settings['sender'], [row['to_email']], message.as_string())
+            except (smtplib.SMTPException, OSError) as e:
+                error = _smtp_error(e)
+                replied = isinstance(e, (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused))
+                if current is not None and (not replied or getattr(e, 'smtp_code', None) == 421):
+                    # dropped or closing (421): don't hand this connection to anyone else;
+                    # after other replies smtplib has already sent RSET and it stays usable
+                    self._close(current.smtp)
+                    current = None
+                raise error from e
+            current.sent += 1
+            return message['Message-ID']
+
+        try:
+            yield send
+        finally:
+            if current is not None:
+                self._release(current)
+
+    def close(self):
+        while True:
+            try:
+                self._close(self._idle.get_nowait().smtp)
+            except queue.Empty:
+                return
+
+
+class HTTPMailer:
+    """Mailgun / SendGrid over one requests.Session with a connection pool (thread-safe)."""
+
+    def __init__(self, provider, size=4, timeout=(5, 15), mailgun_url=MAILGUN_API_URL,
+                 sendgrid_url=SENDGRID_API_URL):
+        self.provider = provider
+        self.timeout = timeout
+        self.mailgun_url = mailgun_url
+        self.sendgrid_url = sendgrid_url
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=max(int(size), 1), max_retries=0)
+        self.http.mount('https://', adapter)
+        self.http.mount('http://', adapter)
+
+    def _post(self, url, **kwargs):
+        try:
+            response = self.http.post(url, timeout=self.timeout, **kwargs)
+        except requests.RequestException as e:
+            raise MailError(f'{self.provider} request failed: {e}', retryable=True)
+        if response.status_code not in (200, 202):
+            retry_after = response.headers.get('Retry-After')
+            raise MailError(f'{self.provider} {response.status_code}: {response.text[:_ERROR_MAX]}',
+                            retryable=response.status_code == 429 or response.status_code >= 500,
+                            retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None)
+        return response
+
+    def _send_mailgun(self, settings, row):
+        data = {'from': _from_header(settings), 'to': [row['to_email']],
+                'subject': row.get('subject') or '', 'text': row.get('body') or ''}
+        if row.get('html'):
+            data['html'] = row['html']
+        response = self._post(f"{self.mailgun_url}/{settings['mailgun_domain']}/messages",
+                              auth=('api', settings['mailgun_api_key']), data=data)
+        try:
+            return response.json().get('id')
+        except ValueError:
+            return None
+
+    def _send_sendgrid(self, settings, row):
+        options = json.loads(row.get('provider_options') or '{}')
         payload = {
-            'personalizations': [{ 'to': [{ 'email': to_email }] }],
-            'from': { 'email': sender, **({'name': sender_name} if sender_name else {}) }
+            'personalizations': [{'to': [{'email': row['to_email']}]}],
+            'from': {'email': settings['sender'], **({'name': settings['sender_name']} if settings['sender_name'] else {})},
         }
-        if template_id:
-            payload['template_id'] = template_id
-            if dynamic_data:
-                payload['personalizations'][0]['dynamic_template_data'] = dynamic_data
+        if options.get('sendgrid_template_id'):
+            payload['template_id'] = options['sendgrid_template_id']
+            if options.get('sendgrid_dynamic_data'):
+                payload['personalizations'][0]['dynamic_template_data'] = options['sendgrid_dynamic_data']
         else:
-            # non-template content
             contents = []
-            if html:
-                contents.append({ 'type': 'text/html', 'value': html })
-            contents.append({ 'type': 'text/plain', 'value': body or '' })
-            payload['subject'] = subject
+            if row.get('html'):
+                contents.append({'type': 'text/html', 'value': row['html']})
+            contents.append({'type': 'text/plain', 'value': row.get('body') or ''})
+            payload['subject'] = row.get('subject') or ''
             payload['content'] = contents
-        resp = requests.post(
-            'https://api.sendgrid.com/v3/mail/send',
-            headers={'Authorization': f'Bearer {api_key}', 'Content-Type': 'application/json'},
-            json=payload, timeout=15
-        )
-        if resp.status_code in (200, 202):
-            return True
-        app.logger.error('[Email][SendGrid] Failed status=%s body=%s', resp.status_code, resp.text)
-        return False
-    except Exception as e:
-        app.logger.error('[Email][SendGrid] Exception: %s', e)
-        return False
+        response = self._post(f'{self.sendgrid_url}/mail/send', json=payload, headers={
+            'Authorization': f"Bearer {settings['sendgrid_api_key']}"})
+        return response.headers.get('X-Message-Id')
+
+    @contextmanager
+    def session(self, settings):
+        send = self._send_mailgun if self.provider == 'MAILGUN' else self._send_sendgrid
+        yield lambda row: send(settings, row)
 
+    def close(self):
+        self.http.close()
 
-def send_email(app, to_email: str, subject: str, body: str, html: str | None = None, provider_options: dict | None = None) -> bool:
-    """Send an email using the configured provider (SMTP default, Mailgun, SendGrid).
-    Optional html and provider_options can be provided for provider-specific features (e.g., SendGrid dynamic templates).
+
+def _transport_key(settings, cfg):
+    return (os.getpid(), settings['provider'], settings['smtp_server'], settings['smtp_port'],
+            settings['smtp_username'], settings['smtp_password'], settings['smtp_use_tls'],
+            settings['smtp_use_ssl'], int(cfg.get('EMAIL_SEND_WORKERS', 4)))
+
+
+def get_transport(settings, cfg=None):
+    """This process's transport for the current settings (rebuilt after fork or a settings change)."""
+    global _transport
+    cfg = cfg or current_app.config
+    key = _transport_key(settings, cfg)
+    with _transport_lock:
+        if _transport is None or _transport.key != key:
+            if _transport is not None and _transport.key[0] == os.getpid():
+                _transport.close()
+            workers = int(cfg.get('EMAIL_SEND_WORKERS', 4))
+            timeout = float(cfg.get('EMAIL_SEND_TIMEOUT', 15))
+            if settings['provider'] in ('MAILGUN', 'SENDGRID'):
+                _transport = HTTPMailer(settings['provider'], size=workers, timeout=(5, timeout))
+            else:
+                _transport = SMTPPool(
+                    settings['smtp_server'], settings['smtp_port'], settings['smtp_username'],
+                    settings['smtp_password'], use_tls=settings['smtp_use_tls'], use_ssl=settings['smtp_use_ssl'],
+                    size=workers, timeout=timeout,
+                    max_messages=int(cfg.get('EMAIL_SMTP_MAX_MESSAGES', 100)),
+                    idle_seconds=float(cfg.get('EMAIL_SMTP_IDLE_SECONDS', 30)),
+                )
+            _transport.key = key
+        return _transport
+
+
+# ==================== Queueing ====================
+
+def queue_email(to_email, subject, body, html=None, provider_options=None, category=None):
+    """Add a message to the outbox (no commit here)."""
+    item = EmailOutbox(
+        to_email=to_email.strip(),
+        subject=subject,
+        body=body,
+        html=html,
+        provider_options=json.dumps(provider_options, ensure_ascii=False, default=str) if provider_options else None,
+        category=category,
+        status=QUEUED,
+        attempts=0,
+    )
+    db.session.add(item)
+    return item
+
+
+def schedule_drain(delay=None):
+    """Start the sender job unless one is already queued to run by then (a running one picks new mail up
+    in its next batch). delay: seconds until the job may start (follow-up for deferred mail)."""
+    return submit_once('email.outbox_drain', {}, delay=delay)
+
+
+def send_email(app, to_email: str, subject: str, body: str, html: str | None = None,
+               provider_options: dict | None = None, category: str | None = None) -> bool:
+    """Queue an email for the configured provider (SMTP default, Mailgun, SendGrid) and return at once.
+    Returns True once the message is stored in the outbox; delivery happens in the background
+    (status in email_outbox / GET /api/email/outbox/<id>).
     provider_options keys:
       - sendgrid_template_id: str
       - sendgrid_dynamic_data: dict
     """
-    sender = app.config.get('MAIL_SENDER', 'no-reply@example.com')
-    sender_name = app.config.get('MAIL_SENDER_NAME', '')
-    provider = (app.config.get('EMAIL_PROVIDER') or 'SMTP').upper()
-    # Prefer provider from DB settings if available
+    if not (to_email or '').strip():
+        return False
     try:
-        from app.models.settings import Settings  # local import to avoid circular
-        with app.app_context():
-            s = Settings.get_settings()
-            if s and s.email_provider:
-                provider = (s.email_provider or 'SMTP').upper()
-    except Exception:
-        pass
+        queue_email(to_email, subject, body, html=html, provider_options=provider_options, category=category)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error('[Email] Failed to queue email to %s: %s', to_email, e)
+        return False
+    try:
+        schedule_drain()
+    except Exception as e:
+        # the message stays queued and goes out with the next drain
+        app.logger.error('[Email] Failed to schedule the sender job: %s', e)
+    return True
 
-    if provider == 'MAILGUN':
-        return _send_via_mailgun(app, sender, sender_name, to_email, subject, body)
-    if provider == 'SENDGRID':
-        provider_options = provider_options or {}
-        return _send_via_sendgrid(
-            app, sender, sender_name, to_email, subject, body,
-            html=html,
-            template_id=provider_options.get('sendgrid_template_id'),
-            dynamic_data=provider_options.get('sendgrid_dynamic_data')
-        )
-    # default SMTP
-    return _send_via_smtp(app, sender, sender_name, to_email, subject, body)
+
+def send_email_now(app, to_email: str, subject: str, body: str, html: str | None = None,
+                   provider_options: dict | None = None) -> bool:
+    """Send synchronously over the pooled transport (diagnostics; request handlers should use send_email)."""
+    settings = mail_settings(app)
+    if not _configured(settings):
+        app.logger.warning('[Email][%s] Not configured. Skipping send to %s. Subject: %s Body: %s',
+                           settings['provider'], to_email, subject, body)
+        return False
+    row = {'to_email': to_email, 'subject': subject, 'body': body, 'html': html,
+           'provider_options': json.dumps(provider_options) if provider_options else None}
+    try:
+        with get_transport(settings, app.config).session(settings) as send:
+            send(row)
+        return True
+    except MailError as e:
+        app.logger.error('[Email][%s] Failed to send email to %s: %s', settings['provider'], to_email, e)
+        return False
+
+
+# ==================== Sending ====================
+
+def _chunks(values, size=_IN_CHUNK):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _send_chunk(transport, settings, rows):
+    """Rows over one transport session. Returns [(row, outcome, value)]: sent/message id,
+    failed/error, retry/MailError, release/None (not tried because the session hit a retryable error).
+    """
+    results = []
+    with transport.session(settings) as send:
+        for i, row in enumerate(rows):
+            try:
+                results.append((row, SENT, send(row)))
+            except MailError as e:
+                if e.retryable:
+                    results.append((row, _RETRY, e))
+                    results.extend((rest, _RELEASE, None) for rest in rows[i + 1:])
+                    break
+                results.append((row, FAILED, e))
+            except Exception as e:
+                results.append((row, FAILED, e))
+    return results
+
+
+def _claim_batch(limit, now):
+    table = EmailOutbox.__table__
+    ids = db.session.execute(
+        select(table.c.id).where(
+            table.c.status == QUEUED,
+            or_(table.c.next_attempt_at.is_(None), table.c.next_attempt_at <= now),
+        ).order_by(table.c.id).limit(limit)
+    ).scalars().all()
+    if not ids:
+        db.session.rollback()
+        return []
+    token = uuid.uuid4().hex
+    for chunk in _chunks(ids):
+        db.session.execute(update(table).where(table.c.id.in_(chunk), table.c.status == QUEUED).values(
+            status=SENDING, claim_token=token, claimed_at=now))
+    db.session.commit()
+    rows = db.session.execute(
+        select(table.c.id, table.c.to_email, table.c.subject, table.c.body, table.c.html,
+               table.c.provider_options, table.c.attempts)
+        .where(table.c.claim_token == token).order_by(table.c.id)
+    ).all()
+    db.session.rollback()
+    return [dict(r._mapping) for r in rows]
+
+
+def _backoff(attempts, error, cfg):
+    base = float(cfg.get('EMAIL_SEND_BACKOFF_SECONDS', 30))
+    cap = float(cfg.get('EMAIL_SEND_BACKOFF_MAX', 3600))
+    return timedelta(seconds=min(max(base * 2 ** max(attempts - 1, 0), error.retry_after or 0), cap))
+
+
+def _record(results, provider, cfg):
+    """Write a batch's outcomes in one commit. Rows released after a retryable error wait
+    as long as the row that hit it, without counting an attempt."""
+    table = EmailOutbox.__table__
+    now = datetime.utcnow()
+    max_attempts = int(cfg.get('EMAIL_SEND_MAX_ATTEMPTS', 8))
+    updates, released, finished = [], [], []
+    counts = {SENT: 0, FAILED: 0, _RETRY: 0}
+    deferred_until = None
+
+    for row, outcome, value in results:
+        if outcome == _RELEASE:
+            released.append({'b_id': row['id'], 'b_next': deferred_until})
+            continue
+        attempts = (row['attempts'] or 0) + 1
+        values = {'b_id': row['id'], 'b_status': QUEUED, 'b_attempts': attempts, 'b_next': None,
+                  'b_error': None, 'b_provider': provider, 'b_message_id': None, 'b_sent': None}
+        if outcome == SENT:
+            values.update(b_status=SENT, b_message_id=value, b_sent=now)
+        elif outcome == FAILED:
+            values.update(b_status=FAILED, b_error=str(value)[:_ERROR_MAX])
+        else:
+            values['b_error'] = str(value)[:_ERROR_MAX]
+            if attempts >= max_attempts:
+                outcome = FAILED
+                values['b_status'] = FAILED
+            else:
+                deferred_until = values['b_next'] = now + _backoff(attempts, value, cfg)
+        counts[outcome] += 1
+        updates.append(values)
+        if values['b_status'] != QUEUED:
+            finished.append(row['id'])
+
+    if updates:
+        db.session.execute(update(table).where(table.c.id == bindparam('b_id')).values(
+            status=bindparam('b_status'), attempts=bindparam('b_attempts'), next_attempt_at=bindparam('b_next'),
+            last_error=bindparam('b_error'), provider=bindparam('b_provider'),
+            provider_message_id=bindparam('b_message_id'), sent_at=bindparam('b_sent'), claim_token=None,
+        ), updates)
+    if released:
+        db.session.execute(update(table).where(table.c.id == bindparam('b_id')).values(
+            status=QUEUED, next_attempt_at=bindparam('b_next'), claim_token=None,
+        ), released)
+    for chunk in _chunks(finished):
+        db.session.execute(update(table).where(table.c.id.in_(chunk), table.c.category.in_(SENSITIVE_CATEGORIES))
+                           .values(body=None, html=None, provider_options=None))
+    db.session.commit()
+    return counts
+
+
+def _fail_unconfigured(rows, settings):
+    app = current_app
+    for row in rows:
+        app.logger.warning('[Email][%s] Not configured. Skipping send to %s. Subject: %s Body: %s',
+                           settings['provider'], row['to_email'], row['subject'], row['body'])
+    error = MailError(f"{settings['provider']} is not configured")
+    return [(row, FAILED, error) for row in rows]
+
+
+def _requeue_stale(cfg, now):
+    table = EmailOutbox.__table__
+    cutoff = now - timedelta(seconds=int(cfg.get('EMAIL_OUTBOX_STALE_SECONDS', 300)))
+    db.session.execute(update(table).where(table.c.status == SENDING, table.c.claimed_at < cutoff)
+                       .values(status=QUEUED, claim_token=None))
+    db.session.commit()
+
+
+def _next_due_in(now):
+    """Seconds until the earliest deferred message, or None when nothing is waiting."""
+    earliest = db.session.execute(
+        select(func.min(EmailOutbox.next_attempt_at)).where(EmailOutbox.status == QUEUED)
+    ).scalar()
+    db.session.rollback()
+    if earliest is None:
+        return None
+    return max((earliest - now).total_seconds(), 0.0)
+
+
+def queued_count():
+    return db.session.execute(
+        select(func.count()).select_from(EmailOutbox).where(EmailOutbox.status == QUEUED)
+    ).scalar() or 0
+
+
+def outbox_status():
+    """Message count per status."""
+    rows = db.session.execute(select(EmailOutbox.status, func.count()).group_by(EmailOutbox.status)).all()
+    return {status: count for status, count in rows}
+
+
+def drain_outbox(progress=None, transport=None):
+    """Send every due message; waits for soon-deferred ones (up to EMAIL_OUTBOX_MAX_WAIT seconds).
+    progress(done, message) is optional (raises JobCancelled when the job is cancelled).
+    """
+    cfg = current_app.config
+    workers = max(int(cfg.get('EMAIL_SEND_WORKERS', 4)), 1)
+    batch_size = int(cfg.get('EMAIL_OUTBOX_BATCH', 200))
+    max_wait = float(cfg.get('EMAIL_OUTBOX_MAX_WAIT', 60))
+    totals = {SENT: 0, FAILED: 0, _RETRY: 0, 'batches': 0}
+    started = time.monotonic()
+    _requeue_stale(cfg, datetime.utcnow())
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='email-send') as pool:
+        while True:
+            rows = _claim_batch(batch_size, datetime.utcnow())
+            if not rows:
+                wait = _next_due_in(datetime.utcnow())
+                if wait is None or wait > max_wait:
+                    break
+                time.sleep(wait + 0.01)
+                continue
+            settings = mail_settings()
+            db.session.rollback()
+            if not _configured(settings):
+                results = _fail_unconfigured(rows, settings)
+            else:
+                active = transport or get_transport(settings, cfg)
+                size = (len(rows) + workers - 1) // workers
+                results = []
+                for chunk in pool.map(lambda part: _send_chunk(active, settings, part),
+                                      [rows[i:i + size] for i in range(0, len(rows), size)]):
+                    results.extend(chunk)
+            counts = _record(results, settings['provider'], cfg)
+            for name, value in counts.items():
+                totals[name] += value
+            totals['batches'] += 1
+            if progress is not None:
+                elapsed = max(time.monotonic() - started, 1e-6)
+                progress(totals[SENT], f"Sent {totals[SENT]} emails ({totals[SENT] / elapsed:.0f}/s)")
+
+    totals['seconds'] = round(time.monotonic() - started, 3)
+    return totals
+
+
+@job_handler('email.outbox_drain')
+def _run_outbox_drain(ctx):
+    """Deliver queued email (email_outbox)."""
+    total = max(queued_count(), 1)
+    db.session.commit()
+    totals = drain_outbox(progress=lambda done, message: ctx.progress(min(99, 100 * done // total), message))
+    # mail deferred past EMAIL_OUTBOX_MAX_WAIT: a follow-up job at its retry time, not the next send_email()
+    wait = _next_due_in(datetime.utcnow())
+    if wait is not None:
+        schedule_drain(delay=wait)
+    return totals
@@ -0,0 +1,315 @@
+"""
+البث المباشر للتواجد والحضور والتذاكر (Server-Sent Events)
+- publish() يكتب الحدث في feed_event على اتصال المعاملة الحالية، فيظهر فقط إذا تم commit
+  للتغيير نفسه. على PostgreSQL يُرسل أيضاً pg_notify (يُسلَّم عند commit).
+- FeedHub لكل عملية: خيط واحد يتابع feed_event بالمعرّف (id > آخر معرّف) ويوزع الأحداث على
+  طوابير اتصالات SSE المفتوحة في هذه العملية. المعرّفات لا تظهر بترتيب الـ commit على PostgreSQL
+  (معاملة أخذت معرّفاً أصغر قد تُنهي بعد أكبر منه)، لذا تُحفظ الفجوات تحت أعلى معرّف موزَّع
+  وتُعاد قراءتها حتى تظهر أو تمضي FEED_GAP_SECONDS (معاملة تراجعت). معرّف SSE (Last-Event-ID)
+  هو الحد المتصل: كل ما دونه وُزّع، فالـ replay يعيد ما بعده ولا يفوته حدث متأخر (قد يتكرر حدث
+  بعد إعادة الاتصال، لا يضيع). على PostgreSQL ينتظر LISTEN بدل النوم، وعلى SQLite يستعلم كل FEED_POLL_SECONDS. الخيط لا يعمل إلا عند وجود مشتركين.
+  النتيجة: استعلام صغير واحد لكل عامل بدل استعلام كامل لكل متصفح مفتوح.
+- مشترك بطيء يمتلئ طابوره يُفصل؛ EventSource يعيد الاتصال تلقائياً مع Last-Event-ID
+  ويُستكمل من الجدول (replay).
+- الأحداث الأقدم من FEED_RETENTION_SECONDS تُحذف دورياً من مسار النشر.
+- الاتصالات المفتوحة في العملية محدودة بـ SSE_MAX_STREAMS (app/utils/sse.py)؛ ما زاد يُرد بـ 503
+  وتعود الصفحة إلى الاستعلام الدوري.
+"""
+import itertools
+import json
+import os
+import queue
+import select as select_module
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import delete, event, or_, select, text
+from sqlalchemy.orm import Session, attributes
+
+from app import db
+from app.models.feed import FeedEvent
+
+PRESENCE = 'presence'
+ATTENDANCE = 'attendance'
+SUPPORT = 'support'
+CHANNELS = (PRESENCE, ATTENDANCE, SUPPORT)
+
+NOTIFY_CHANNEL = 'feed_event'
+_PURGE_EVERY = 1000  # عدد عمليات النشر بين كل حذف للأحداث القديمة
+_FETCH_LIMIT = 1000
+_MAX_GAPS = 10000  # قفزة أكبر في المعرّفات لا تُتتبع فجواتها
+
+_hub = None
+_hub_lock = threading.Lock()
+_publish_counter = itertools.count(1)
+
+
+def publish_many(connection, channel, payloads):
+    """كتابة مجموعة أحداث في معاملة الاتصال الحالية."""
+    payloads = list(payloads)
+    if not payloads:
+        return
+    now = datetime.utcnow()
+    connection.execute(FeedEvent.__table__.insert(), [
+        {'channel': channel, 'payload': json.dumps(p, default=str, ensure_ascii=False), 'created_at': now}
+        for p in payloads
+    ])
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text('SELECT pg_notify(:channel, :payload)'),
+                           {'channel': NOTIFY_CHANNEL, 'payload': channel})
+    if next(_publish_counter) % _PURGE_EVERY == 0:
+        _purge(connection, now)
+
+
+def publish(channel, payload, connection=None):
+    publish_many(connection if connection is not None else db.session.connection(), channel, [payload])
+
+
+def _purge(connection, now):
+    try:
+        retention = float(current_app.config.get('FEED_RETENTION_SECONDS', 3600))
+    except RuntimeError:
+        retention = 3600.0
+    connection.execute(delete(FeedEvent.__table__).where(
+        FeedEvent.__table__.c.created_at < now - timedelta(seconds=retention)
+    ))
+
+
+def _decode(row, cursor=None):
+    """(معرّف، قناة، payload، معرّف SSE). cursor: الحد المتصل المرسل كـ id (الافتراضي معرّف الحدث)."""
+    try:
+        payload = json.loads(row.payload)
+    except (TypeError, ValueError):
+        payload = {}
+    return row.id, row.channel, payload, row.id if cursor is None else cursor
+
+
+def fetch_events(after_id, limit=_FETCH_LIMIT, include=(), cursor=None):
+    """أحداث بعد معرّف معيّن (للـ replay عند إعادة الاتصال)، ومعها معرّفات include (فجوات سابقة)."""
+    table = FeedEvent.__table__
+    condition = table.c.id > after_id
+    if include:
+        condition = or_(condition, table.c.id.in_(list(include)))
+    rows = db.session.execute(
+        select(table.c.id, table.c.channel, table.c.payload)
+        .where(condition).order_by(table.c.id).limit(limit)
+    ).all()
+    return [_decode(r, cursor) for r in rows]
+
+
+def latest_event_id():
+    return db.session.execute(select(db.func.max(FeedEvent.id))).scalar() or 0
+
+
+class Subscription:
+    """اتصال SSE واحد: القنوات المطلوبة، ومن يُسمح له برؤيته (audience)، وطابور الأحداث.
+    audience: None للمديرين (كل الأحداث)، أو {channel: {ids}} لمطابقة payload['employee_id'].
+    """
+
+    def __init__(self, channels, audience=None, maxsize=500):
+        self.channels = frozenset(channels)
+        self.audience = audience
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.closed = False
+
+    def accepts(self, channel, payload):
+        if channel not in self.channels:
+            return False
+        if self.audience is None:
+            return True
+        return payload.get('employee_id') in self.audience.get(channel, ())
+
+    def offer(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            # مشترك بطيء: يُغلق ويستكمل بعد إعادة الاتصال من الجدول
+            self.closed = True
+            try:
+                self.queue.get_nowait()
+                self.queue.put_nowait(None)
+            except (queue.Empty, queue.Full):
+                pass
+
+
+class FeedHub:
+    """موزع الأحداث لهذه العملية."""
+
+    def __init__(self, app):
+        self.app = app
+        self.pid = os.getpid()
+        self.poll_seconds = float(app.config.get('FEED_POLL_SECONDS', 1.0))
+        self.gap_seconds = float(app.config.get('FEED_GAP_SECONDS', 30.0))
+        self.queue_size = int(app.config.get('FEED_SUBSCRIBER_QUEUE', 500))
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._has_subscribers = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._listener = None
+        self.last_id = None  # أعلى معرّف وُزّع
+        self._gaps = {}  # معرّف لم يظهر بعد تحت last_id -> وقت اكتشافه (monotonic)
+        self.cursor = None  # الحد المتصل بعد آخر توزيع (يُقرأ من خيوط الطلبات)
+        self.stats = {'polls': 0, 'events': 0, 'late': 0, 'abandoned': 0}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name='feed-hub', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._has_subscribers.set()
+
+    def subscribe(self, channels, audience=None):
+        sub = Subscription(channels, audience, self.queue_size)
+        with self._lock:
+            self._subscribers.add(sub)
+            self._has_subscribers.set()
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+            if not self._subscribers:
+                self._has_subscribers.clear()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self._has_subscribers.wait()
+            if self._stop.is_set():
+                break
+            try:
+                with self.app.app_context():
+                    if self.last_id is None:
+                        self.last_id = latest_event_id()
+                    self._wait()
+                    self._dispatch()
+            except Exception as e:
+                self.app.logger.error(f"Feed hub error: {e}")
+                self._close_listener()
+                self._stop.wait(self.poll_seconds)
+            finally:
+                with self.app.app_context():
+                    db.session.remove()
+        self._close_listener()
+
+    def _wait(self):
+        """انتظار حدث جديد: LISTEN على PostgreSQL، أو مهلة الاستعلام الدوري."""
+        if db.engine.dialect.name != 'postgresql':
+            self._stop.wait(self.poll_seconds)
+            return
+        if self._listener is None:
+            raw = db.engine.raw_connection()
+            conn = raw.driver_connection
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f'LISTEN {NOTIFY_CHANNEL}')
+            self._listener = raw
+        conn = self._listener.driver_connection
+        # المهلة تحمي من إشعار فُقد أثناء إعادة الاتصال
+        if select_module.select([conn], [], [], self.poll_seconds * 5) != ([], [], []):
+            conn.poll()
+            conn.notifies.clear()
+
+    def _close_listener(self):
+        if self._listener is not None:
+            try:
+                self._listener.invalidate()
+            except Exception:
+                pass
+            self._listener = None
+
+    @property
+    def watermark(self):
+        """الحد المتصل: كل معرّف حتى هنا وُزّع أو تُخلي عنه."""
+        return min(self._gaps) - 1 if self._gaps else self.last_id
+
+    def _dispatch(self, now=None):
+        now = time.monotonic() if now is None else now
+        cursor = self.watermark  # معرّف SSE آمن لكل أحداث هذه الدفعة
+        events = fetch_events(self.last_id, include=self._gaps, cursor=cursor)
+        self.stats['polls'] += 1
+        if events:
+            self._track(events, now)
+            self.stats['events'] += len(events)
+            with self._lock:
+                subscribers = list(self._subscribers)
+            for item in events:
+                _, channel, payload, _ = item
+                for sub in subscribers:
+                    if not sub.closed and sub.accepts(channel, payload):
+                        sub.offer(item)
+        for event_id, seen_at in list(self._gaps.items()):
+            if now - seen_at >= self.gap_seconds:
+                # معاملة تراجعت (أو معرّف تخطاه التسلسل): لن يظهر
+                del self._gaps[event_id]
+                self.stats['abandoned'] += 1
+        self.cursor = self.watermark
+
+    def _track(self, events, now):
+        ids = {e[0] for e in events}
+        for event_id in ids & self._gaps.keys():
+            del self._gaps[event_id]
+            self.stats['late'] += 1
+        top = max(ids)
+        if top > self.last_id:
+            if top - self.last_id <= _MAX_GAPS:
+                for event_id in range(self.last_id + 1, top):
+                    if event_id not in ids:
+                        self._gaps[event_id] = now
+            self.last_id = top
+
+
+def get_feed_hub(app=None):
+    """موزع هذه العملية (يُنشأ عند أول مشترك وبعد fork لعمال gunicorn)."""
+    global _hub
+    app = app or current_app._get_current_object()
+    with _hub_lock:
+        if _hub is None or _hub.pid != os.getpid() or _hub.app is not app:
+            if _hub is not None and _hub.pid == os.getpid():
+                _hub.stop()
+            _hub = FeedHub(app).start()
+        return _hub
+
+
+def format_event(item):
+    _, channel, payload, cursor = item
+    data = json.dumps(payload, default=str, ensure_ascii=False)
+    return f'id: {cursor}\nevent: {channel}\ndata: {data}\n\n'
+
+
+# --- تعيين التذاكر (أحداث ORM) ---
+
+def _ticket_models():
+    from app.models.client_support import ClientSupport
+    from app.models.customer_complaints import CustomerComplaint
+    return {ClientSupport: 'client_support', CustomerComplaint: 'complaint'}
+
+
+def _after_flush(orm_session, flush_context):
+    models = _ticket_models()
+    payloads = []
+    for obj in list(orm_session.new) + list(orm_session.dirty):
+        kind = models.get(type(obj))
+        if kind is None or obj.assigned_to is None:
+            continue
+        if obj not in orm_session.new and not attributes.get_history(obj, 'assigned_to').has_changes():
+            continue
+        payloads.append({
+            'type': 'ticket_assigned',
+            'kind': kind,
+            'ticket_id': obj.id,
+            'employee_id': obj.assigned_to,
+            'status': getattr(obj, 'status', None),
+        })
+    if payloads:
+        publish_many(orm_session.connection(), SUPPORT, payloads)
+
+
+def register_feed_events():
+    """تسجيل مستمع أحداث التذاكر مرة واحدة."""
+    if not event.contains(Session, 'after_flush', _after_flush):
+        event.listen(Session, 'after_flush', _after_flush)
@@ -0,0 +1,301 @@
+"""
+محرك السياج الجغرافي (Geofence)
+المواقع المسموحة (GeofenceSite: دوائر ومضلعات) تُحمّل مرة واحدة لكل عملية في GeofenceIndex:
+  - شبكة خلايا بدرجة ثابتة (GEOFENCE_CELL_DEG): كل موقع يُسجَّل في الخلايا التي يغطيها
+    مربعه المحيط، فيفحص locate() مواقع خلية النقطة فقط (أجزاء من الملّي ثانية).
+  - validate_batch() يتحقق من آلاف الإحداثيات دفعة واحدة بمصفوفات NumPy
+    (للاستيراد والمزامنة دون اتصال).
+إذا لم تُعرَّف مواقع يُستخدم موقع الشركة من AttendanceSettings كدائرة وحيدة (السلوك السابق).
+الفهرس يُعاد بناؤه عند تغيّر الجيل 'geofence' (أي تعديل على المواقع) أو 'settings'.
+"""
+import math
+import threading
+from collections import namedtuple
+
+import numpy as np
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models.geofence import GeofenceSite
+from app.utils.cache_generation import get_generation, bump_generation
+from app.utils.settings_cache import SETTINGS_GENERATION, attendance_settings
+
+GEOFENCE_GENERATION = 'geofence'
+EARTH_RADIUS_M = 6371000.0
+METERS_PER_DEG = math.radians(1) * EARTH_RADIUS_M
+DEFAULT_CELL_DEG = 0.01  # ≈ 1.1 كم
+_MAX_CELLS_PER_SITE = 4096  # المواقع الأكبر تُفحص دائماً بدل تسجيلها في الشبكة
+_BATCH_CHUNK = 4096
+
+GeofenceMatch = namedtuple('GeofenceMatch', 'site_id site_name inside distance_meters allowed_meters')
+
+_index = None  # (generation, GeofenceIndex)
+_lock = threading.Lock()
+
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    """المسافة بالمتر بين نقطتين (نفس صيغة calculate_distance)."""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def _haversine_matrix(lats, lngs, site_lats, site_lngs):
+    """مسافات (عدد النقاط × عدد الدوائر) بالمتر."""
+    lat1 = np.radians(lats)[:, None]
+    lng1 = np.radians(lngs)[:, None]
+    lat2 = np.radians(site_lats)[None, :]
+    lng2 = np.radians(site_lngs)[None, :]
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+class _Site:
+    """موقع محضّر للفحص: الدائرة بمركزها ونصف قطرها، والمضلع برؤوسه في مستوى محلي بالمتر."""
+
+    __slots__ = ('id', 'name', 'kind', 'lat', 'lng', 'radius', 'xs', 'ys', 'cos_lat', 'bbox')
+
+    def __init__(self, site_id, name, kind, lat=None, lng=None, radius=None, polygon=None):
+        self.id = site_id
+        self.name = name
+        self.kind = kind
+        if kind == 'polygon':
+            pts = np.asarray(polygon, dtype=np.float64)
+            self.lat = float(pts[:, 0].mean())
+            self.lng = float(pts[:, 1].mean())
+            self.cos_lat = math.cos(math.radians(self.lat))
+            self.xs = ((pts[:, 1] - self.lng) * self.cos_lat * METERS_PER_DEG).tolist()
+            self.ys = ((pts[:, 0] - self.lat) * METERS_PER_DEG).tolist()
+            self.radius = None
+            self.bbox = (pts[:, 0].min(), pts[:, 1].min(), pts[:, 0].max(), pts[:, 1].max())
+        else:
+            self.lat, self.lng, self.radius = float(lat), float(lng), float(radius or 0)
+            self.cos_lat = math.cos(math.radians(self.lat))
+            self.xs = self.ys = None
+            dlat = self.radius / METERS_PER_DEG
+            dlng = self.radius / (METERS_PER_DEG * max(self.cos_lat, 1e-6))
+            self.bbox = (self.lat - dlat, self.lng - dlng, self.lat + dlat, self.lng + dlng)
+
+    def _local(self, lat, lng):
+        return (lng - self.lng) * self.cos_lat * METERS_PER_DEG, (lat - self.lat) * METERS_PER_DEG
+
+    def measure(self, lat, lng):
+        """(داخل؟، المسافة المعروضة، البعد عن الحافة) لنقطة واحدة."""
+        if self.kind == 'circle':
+            d = haversine_m(self.lat, self.lng, lat, lng)
+            return d <= self.radius, d, max(0.0, d - self.radius)
+        x, y = self._local(lat, lng)
+        inside = False
+        edge = math.inf
+        xs, ys = self.xs, self.ys
+        n = len(xs)
+        for i in range(n):
+            x1, y1, x2, y2 = xs[i], ys[i], xs[(i + 1) % n], ys[(i + 1) % n]
+            if (y1 > y) != (y2 > y) and x < (x2 - x1) * (y - y1) / (y2 - y1) + x1:
+                inside = not inside
+            dx, dy = x2 - x1, y2 - y1
+            seg = dx * dx + dy * dy
+            t = 0.0 if seg == 0 else min(1.0, max(0.0, ((x - x1) * dx + (y - y1) * dy) / seg))
+            edge = min(edge, math.hypot(x - (x1 + t * dx), y - (y1 + t * dy)))
+        gap = 0.0 if inside else edge
+        return inside, gap, gap
+
+    def measure_many(self, lats, lngs):
+        """نسخة عمودية من measure() للمضلع (الدوائر تُحسب معاً في validate_batch)."""
+        x = (lngs - self.lng) * self.cos_lat * METERS_PER_DEG
+        y = (lats - self.lat) * METERS_PER_DEG
+        inside = np.zeros(len(x), dtype=bool)
+        edge = np.full(len(x), np.inf)
+        xs, ys = self.xs, self.ys
+        n = len(xs)
+        for i in range(n):
+            x1, y1, x2, y2 = xs[i], ys[i], xs[(i + 1) % n], ys[(i + 1) % n]
+            crosses = (y1 > y) != (y2 > y)
+            if y2 != y1:
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    inside ^= crosses & (x < (x2 - x1) * (y - y1) / (y2 - y1) + x1)
+            dx, dy = x2 - x1, y2 - y1
+            seg = dx * dx + dy * dy
+            t = np.zeros(len(x)) if seg == 0 else np.clip(((x - x1) * dx + (y - y1) * dy) / seg, 0.0, 1.0)
+            edge = np.minimum(edge, np.hypot(x - (x1 + t * dx), y - (y1 + t * dy)))
+        gap = np.where(inside, 0.0, edge)
+        return inside, gap, gap
+
+
+class GeofenceIndex:
+    """فهرس شبكي للمواقع المسموحة. sites: قائمة قواميس بمفاتيح GeofenceSite.to_dict()."""
+
+    def __init__(self, sites, cell_deg=DEFAULT_CELL_DEG, fallback=False):
+        self.cell_deg = float(cell_deg)
+        self.fallback = fallback  # موقع الشركة القديم من AttendanceSettings
+        self.sites = []
+        for s in sites:
+            kind = s.get('site_type') or 'circle'
+            if kind == 'polygon' and len(s.get('polygon') or ()) < 3:
+                continue
+            if kind == 'circle' and (s.get('center_lat') is None or s.get('center_lng') is None):
+                continue
+            self.sites.append(_Site(s.get('id'), s.get('name'), kind, s.get('center_lat'),
+                                    s.get('center_lng'), s.get('radius_meters'), s.get('polygon')))
+        self._grid = {}
+        self._always = []
+        for i, site in enumerate(self.sites):
+            min_lat, min_lng, max_lat, max_lng = site.bbox
+            i0, j0 = self._cell(min_lat, min_lng)
+            i1, j1 = self._cell(max_lat, max_lng)
+            if (i1 - i0 + 1) * (j1 - j0 + 1) > _MAX_CELLS_PER_SITE:
+                self._always.append(i)
+                continue
+            for ci in range(i0, i1 + 1):
+                for cj in range(j0, j1 + 1):
+                    self._grid.setdefault((ci, cj), []).append(i)
+        self._grid = {cell: tuple(ids) for cell, ids in self._grid.items()}
+        self._always = tuple(self._always)
+        # الدوائر كمصفوفات لحساب مسافاتها كلها بعملية واحدة في validate_batch
+        circles = [i for i, site in enumerate(self.sites) if site.kind == 'circle']
+        self._circle_idx = np.array(circles, dtype=np.int64)
+        self._circle_lat = np.array([self.sites[i].lat for i in circles])
+        self._circle_lng = np.array([self.sites[i].lng for i in circles])
+        self._circle_radius = np.array([self.sites[i].radius for i in circles])
+        self._polygon_idx = [i for i, site in enumerate(self.sites) if site.kind == 'polygon']
+
+    def __len__(self):
+        return len(self.sites)
+
+    def _cell(self, lat, lng):
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lng / self.cell_deg))
+
+    def _match(self, site, inside, distance):
+        return GeofenceMatch(site.id, site.name, bool(inside), float(distance),
+                             site.radius if site.kind == 'circle' else None)
+
+    def locate(self, lat, lng):
+        """أقرب موقع للنقطة: الموقع الذي يحتويها إن وُجد، وإلا الأقرب لحافته. None بدون مواقع."""
+        if not self.sites:
+            return None
+        lat, lng = float(lat), float(lng)
+        best = None
+        for i in self._grid.get(self._cell(lat, lng), ()) + self._always:
+            site = self.sites[i]
+            inside, distance, gap = site.measure(lat, lng)
+            if inside and (best is None or distance < best[1]):
+                best = (site, distance)
+        if best is not None:
+            return self._match(best[0], True, best[1])
+        # خارج كل المواقع: المسح الكامل مقبول لأنه مسار الرفض فقط
+        nearest = None
+        for site in self.sites:
+            _, distance, gap = site.measure(lat, lng)
+            if nearest is None or gap < nearest[2]:
+                nearest = (site, distance, gap)
+        return self._match(nearest[0], False, nearest[1])
+
+    def validate_batch(self, lats, lngs):
+        """التحقق من مصفوفتي إحداثيات دفعة واحدة.
+        ترجع قاموس مصفوفات: inside (bool)، site (فهرس الموقع في self.sites أو -1)، distance (متر).
+        النقاط بدون إحداثيات (NaN) تُرجع inside=False و site=-1.
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        lngs = np.asarray(lngs, dtype=np.float64)
+        n = len(lats)
+        inside_out = np.zeros(n, dtype=bool)
+        site_out = np.full(n, -1, dtype=np.int64)
+        dist_out = np.full(n, np.nan)
+        if not self.sites or n == 0:
+            return {'inside': inside_out, 'site': site_out, 'distance': dist_out}
+
+        valid = ~(np.isnan(lats) | np.isnan(lngs))
+        for start in range(0, n, _BATCH_CHUNK):
+            sl = slice(start, min(n, start + _BATCH_CHUNK))
+            ok = valid[sl]
+            if not ok.any():
+                continue
+            la, ln = lats[sl][ok], lngs[sl][ok]
+            inside = np.zeros((len(la), len(self.sites)), dtype=bool)
+            distance = np.empty((len(la), len(self.sites)))
+            gap = np.empty((len(la), len(self.sites)))
+            if len(self._circle_idx):
+                d = _haversine_matrix(la, ln, self._circle_lat, self._circle_lng)
+                inside[:, self._circle_idx] = d <= self._circle_radius
+                distance[:, self._circle_idx] = d
+                gap[:, self._circle_idx] = np.maximum(0.0, d - self._circle_radius)
+            for k in self._polygon_idx:
+                inside[:, k], distance[:, k], gap[:, k] = self.sites[k].measure_many(la, ln)
+            # داخل موقع: الأقرب مسافةً بين المواقع المحتوية، وإلا الأقرب للحافة
+            any_inside = inside.any(axis=1)
+            pick = np.where(any_inside,
+                            np.argmin(np.where(inside, distance, np.inf), axis=1),
+                            np.argmin(gap, axis=1))
+            rows = np.arange(len(la))
+            idx = np.nonzero(ok)[0] + start
+            inside_out[idx] = any_inside
+            site_out[idx] = pick
+            dist_out[idx] = distance[rows, pick]
+        return {'inside': inside_out, 'site': site_out, 'distance': dist_out}
+
+    def batch_matches(self, lats, lngs):
+        """validate_batch() بصيغة قائمة GeofenceMatch (None للنقاط بدون إحداثيات)."""
+        res = self.validate_batch(lats, lngs)
+        out = []
+        for inside, k, distance in zip(res['inside'], res['site'], res['distance']):
+            out.append(None if k < 0 else self._match(self.sites[k], inside, distance))
+        return out
+
+
+def _build_index(cell_deg):
+    sites = [s.to_dict() for s in GeofenceSite.query.filter_by(is_active=True).all()]
+    if sites:
+        return GeofenceIndex(sites, cell_deg)
+    settings = attendance_settings()
+    if settings.company_lat is None or settings.company_lng is None:
+        return GeofenceIndex([], cell_deg, fallback=True)
+    return GeofenceIndex([{
+        'id': None, 'name': 'مقر الشركة', 'site_type': 'circle',
+        'center_lat': settings.company_lat, 'center_lng': settings.company_lng,
+        'radius_meters': settings.max_distance_meters,
+    }], cell_deg, fallback=True)
+
+
+def get_geofence_index():
+    """فهرس المواقع الحالي لهذه العملية (يُبنى عند أول استخدام وبعد أي تعديل)."""
+    global _index
+    from flask import current_app
+    generation = (get_generation(GEOFENCE_GENERATION), get_generation(SETTINGS_GENERATION))
+    entry = _index
+    if entry is not None and entry[0] == generation:
+        return entry[1]
+    with db.session.no_autoflush:
+        index = _build_index(float(current_app.config.get('GEOFENCE_CELL_DEG', DEFAULT_CELL_DEG)))
+    with _lock:
+        _index = (generation, index)
+    return index
+
+
+def locate(lat, lng):
+    """أقرب موقع مسموح للنقطة (GeofenceMatch) أو None إذا لم تُعرَّف مواقع."""
+    return get_geofence_index().locate(lat, lng)
+
+
+def validate_points(points):
+    """التحقق من قائمة (lat, lng) دفعة واحدة. ترجع GeofenceMatch أو None لكل نقطة."""
+    if not points:
+        return []
+    arr = np.array([[np.nan if v is None else float(v) for v in p[:2]] for p in points], dtype=np.float64)
+    return get_geofence_index().batch_matches(arr[:, 0], arr[:, 1])
+
+
+def _after_flush(orm_session, flush_context):
+    for obj in list(orm_session.new) + list(orm_session.dirty) + list(orm_session.deleted):
+        if not isinstance(obj, GeofenceSite):
+            continue
+        if obj in orm_session.dirty and not orm_session.is_modified(obj, include_collections=False):
+            continue
+        bump_generation(GEOFENCE_GENERATION, connection=orm_session.connection())
+        return
+
+
+def register_geofence_cache():
+    """تسجيل مستمع الإبطال مرة واحدة."""
+    if not event.contains(Session, 'after_flush', _after_flush):
+        event.listen(Session, 'after_flush', _after_flush)
@@ -0,0 +1,197 @@
+"""
+هوية الطلب (Request-scoped identity)
+المستخدم والموظف المرتبط به وأسماء أدواره وصلاحياته تُحل مرة واحدة لكل طلب وتُحفظ في g.identity.
+خلف ذلك كاش داخل العملية بمفتاح (user_id, identity_version في الجلسة) ومدة قصيرة
+IDENTITY_CACHE_TTL: الكاش يحفظ نسخاً منفصلة (detached) من User/Employee تُربط بجلسة الطلب
+عبر merge(load=False) بدون أي استعلام.
+
+الإبطال: أي إدراج/تعديل/حذف لـ User أو Employee أو UserRole يزيد الجيل 'identity'
+(مستمع after_flush)، وتعديل الأدوار/الصلاحيات يزيد الجيل 'permissions'.
+"""
+import threading
+import time
+import uuid
+
+from flask import current_app, g, session
+from flask_login import current_user, user_logged_in
+from sqlalchemy import event, select, inspect as sa_inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app import db
+from app.models.user import User
+from app.models.employee import Employee
+from app.models.permission import Role, UserRole
+from app.utils.cache_generation import get_generation, bump_generation
+from app.utils.permission_cache import PERMISSIONS_GENERATION, effective_permissions
+
+IDENTITY_GENERATION = 'identity'
+_MAX_ENTRIES = 10000
+
+_cache = {}  # (user_id, identity_version) -> _Entry
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'queries_saved': 0}
+
+
+class _Entry:
+    __slots__ = ('expires_at', 'generation', 'user', 'employee', 'role_names')
+
+    def __init__(self, expires_at, generation, user, employee, role_names):
+        self.expires_at = expires_at
+        self.generation = generation
+        self.user = user
+        self.employee = employee
+        self.role_names = role_names
+
+
+class Identity:
+    """هوية الطلب الحالي: كائنات مربوطة بجلسة الطلب + أدوار وصلاحيات مجمّدة."""
+
+    def __init__(self, user, employee, role_names):
+        self.user = user
+        self.employee = employee
+        self.role_names = role_names
+
+    @property
+    def user_id(self):
+        return self.user.id
+
+    @property
+    def employee_id(self):
+        return self.employee.id if self.employee is not None else None
+
+    @property
+    def permissions(self):
+        return effective_permissions(self.user.id)
+
+
+def linked_employee_id(username, session_employee_id=None):
+    """رقم الموظف المرتبط بالمستخدم: من الجلسة، ثم emp_<id>، ثم اسم مستخدم رقمي."""
+    if session_employee_id:
+        try:
+            return int(session_employee_id)
+        except (TypeError, ValueError):
+            pass
+    username = username or ''
+    if username.startswith('emp_'):
+        try:
+            return int(username.split('_', 1)[1])
+        except ValueError:
+            return None
+    if username.isdigit():
+        return int(username)
+    return None
+
+
+def _snapshot(obj):
+    """نسخة منفصلة (detached) بقيم الأعمدة الحالية، صالحة لـ merge(load=False)."""
+    if obj is None:
+        return None
+    mapper = sa_inspect(type(obj))
+    copy = mapper.class_manager.new_instance()
+    for attr in mapper.column_attrs:
+        set_committed_value(copy, attr.key, getattr(obj, attr.key))
+    make_transient_to_detached(copy)
+    return copy
+
+
+def _attach(snapshot):
+    if snapshot is None:
+        return None
+    return db.session.merge(snapshot, load=False)
+
+
+def _current_generation():
+    return get_generation(IDENTITY_GENERATION), get_generation(PERMISSIONS_GENERATION)
+
+
+def _load_entry(user_id, generation, session_employee_id, ttl):
+    user = db.session.get(User, user_id)
+    if user is None:
+        return None, None, None
+    emp_id = linked_employee_id(user.username, session_employee_id)
+    employee = db.session.get(Employee, emp_id) if emp_id else None
+    role_names = tuple(sorted(db.session.execute(
+        select(Role.name).join(UserRole, UserRole.role_id == Role.id)
+        .where(UserRole.user_id == user_id, Role.is_active == True)
+    ).scalars()))
+    entry = _Entry(time.monotonic() + ttl, generation, _snapshot(user), _snapshot(employee), role_names)
+    return entry, user, employee
+
+
+def load_identity(user_id):
+    """حل هوية المستخدم لهذا الطلب (يُستدعى من user_loader). يرجع User أو None."""
+    identity = g.get('identity')
+    if identity is not None and identity.user.id == user_id:
+        return identity.user
+
+    ttl = float(current_app.config.get('IDENTITY_CACHE_TTL', 30.0))
+    key = (user_id, session.get('identity_version'))
+    generation = _current_generation()
+    entry = _cache.get(key)
+
+    if entry is not None and entry.generation == generation and entry.expires_at > time.monotonic():
+        user = _attach(entry.user)
+        employee = _attach(entry.employee)
+        with _lock:
+            _stats['hits'] += 1
+            # استعلام المستخدم + الأدوار + الموظف المرتبط
+            _stats['queries_saved'] += 2 + (1 if entry.employee is not None else 0)
+    else:
+        entry, user, employee = _load_entry(user_id, generation, session.get('employee_id'), ttl)
+        if entry is None:
+            return None
+        with _lock:
+            _stats['misses'] += 1
+            if len(_cache) >= _MAX_ENTRIES:
+                _cache.clear()
+            _cache[key] = entry
+
+    g.identity = Identity(user, employee, entry.role_names)
+    return user
+
+
+def get_identity():
+    """هوية الطلب الحالي (أو None لغير المسجلين)."""
+    if 'identity' not in g:
+        # الوصول إلى current_user يستدعي user_loader الذي يملأ g.identity
+        current_user._get_current_object()
+    return g.get('identity')
+
+
+def current_employee():
+    """الموظف المرتبط بالمستخدم الحالي بدون استعلام إضافي."""
+    identity = get_identity()
+    return identity.employee if identity is not None else None
+
+
+def identity_stats():
+    with _lock:
+        stats = dict(_stats)
+    stats['cached_identities'] = len(_cache)
+    return stats
+
+
+def _after_flush(orm_session, flush_context):
+    tracked = (User, Employee, UserRole)
+    for obj in list(orm_session.new) + list(orm_session.dirty) + list(orm_session.deleted):
+        if not isinstance(obj, tracked):
+            continue
+        if obj in orm_session.dirty and not orm_session.is_modified(obj, include_collections=False):
+            continue
+        bump_generation(IDENTITY_GENERATION, connection=orm_session.connection())
+        return
+
+
+def _on_login(sender, user, **extra):
+    # نسخة جديدة لكل تسجيل دخول: الجلسة الجديدة لا تستخدم هوية مخزنة لجلسة سابقة
+    session['identity_version'] = uuid.uuid4().hex[:12]
+    g.pop('identity', None)
+
+
+def register_identity_cache(app):
+    """تسجيل مستمعات الإبطال وتسجيل الدخول مرة واحدة، وcurrent_employee() للقوالب."""
+    app.jinja_env.globals['current_employee'] = current_employee
+    if not event.contains(Session, 'after_flush', _after_flush):
+        event.listen(Session, 'after_flush', _after_flush)
+    user_logged_in.connect(_on_login, weak=False)
@@ -0,0 +1,304 @@
+"""
+مشغّل المهام الخلفية بدون وسيط خارجي (SQLite أو PostgreSQL فقط)
+الطابور هو جدول background_job نفسه:
+  - submit_job() يُدرج سجلاً بحالة queued ويعود فوراً برقم المهمة.
+  - الموزّع (JobRunner) يحجز المهام المنتظرة بتحديث شرطي (queued -> running)
+    فلا تُنفذ المهمة مرتين حتى مع عدة عمليات gunicorn أو عامل منفصل،
+    ثم ينفذها في ThreadPoolExecutor داخل app_context.
+  - التقدم والإلغاء يمران عبر نفس الجدول (JobContext.progress).
+  - submit_job(..., delay=ثوانٍ) يؤجل المهمة (run_after)؛ الموزّع لا يحجزها قبل موعدها.
+    بها تعيد مهام تفريغ الطوابير جدولة نفسها عند موعد أقرب سجل مؤجَّل (submit_once).
+
+الإعدادات: JOBS_EAGER (تنفيذ فوري داخل الطلب - للاختبارات)، JOBS_IN_PROCESS (تشغيل
+الموزّع داخل عملية الويب؛ عطّله عند استخدام scripts/job_worker.py)، JOBS_WORKERS،
+JOBS_POLL_INTERVAL، JOBS_STALE_SECONDS.
+"""
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import or_, select, update
+
+from app import db
+from app.models.job import BackgroundJob
+
+_HANDLERS = {}
+_runner = None
+_runner_lock = threading.Lock()
+
+_PROGRESS_MIN_INTERVAL = 0.5  # ثوانٍ بين كتابتين للتقدم
+
+
+class JobCancelled(Exception):
+    """تُرفع من JobContext.progress() عندما يطلب المستخدم إلغاء المهمة."""
+
+
+def job_handler(job_type, transient_payload=False):
+    """تسجيل دالة تنفيذ لنوع مهمة. الدالة تستقبل JobContext وترجع نتيجة قابلة لـ JSON.
+    transient_payload: حذف المدخلات من الجدول بعد الانتهاء (مثل محتوى ملف CSV).
+    """
+    def decorator(func):
+        _HANDLERS[job_type] = (func, transient_payload)
+        return func
+    return decorator
+
+
+class JobContext:
+    """ما تتلقاه دالة المهمة: المدخلات ومعرّف المستخدم وتحديث التقدم/فحص الإلغاء."""
+
+    def __init__(self, job_id, job_type, payload, user_id, eager=False):
+        self.job_id = job_id
+        self.job_type = job_type
+        self.payload = payload
+        self.user_id = user_id
+        self.eager = eager
+        self._last_write = 0.0
+
+    def progress(self, pct, message=None, force=False):
+        """تحديث نسبة التقدم وفحص طلب الإلغاء (يرفع JobCancelled).
+        الكتابة عبر اتصال مستقل خارج معاملة المهمة، لذا تُستدعى قبل مرحلة الكتابة
+        أو بعد commit وليس أثناء معاملة كتابة مفتوحة (قفل SQLite).
+        """
+        if self.eager:
+            return
+        pct = max(0, min(100, int(pct)))
+        now = time.monotonic()
+        if not force and pct < 100 and now - self._last_write < _PROGRESS_MIN_INTERVAL:
+            return
+        self._last_write = now
+        table = BackgroundJob.__table__
+        with db.engine.begin() as conn:
+            conn.execute(update(table).where(table.c.id == self.job_id).values(
+                progress=pct,
+                progress_message=(message or '')[:255] or None,
+                heartbeat_at=datetime.utcnow()
+            ))
+            cancel = conn.execute(select(table.c.cancel_requested).where(table.c.id == self.job_id)).scalar()
+        if cancel:
+            raise JobCancelled()
+
+
+def _finish(job_id, status, result=None, error=None, message=None, clear_payload=False):
+    table = BackgroundJob.__table__
+    values = {
+        'status': status,
+        'finished_at': datetime.utcnow(),
+        'result': json.dumps(result, ensure_ascii=False, default=str) if result is not None else None,
+        'error': error,
+    }
+    if status == 'succeeded':
+        values['progress'] = 100
+        message = message or 'اكتملت المهمة'
+    if message:
+        values['progress_message'] = message[:255]
+    if clear_payload:
+        values['payload'] = None
+    with db.engine.begin() as conn:
+        conn.execute(update(table).where(table.c.id == job_id).values(**values))
+
+
+def _claim(job_id, worker_id):
+    """حجز مهمة منتظرة بتحديث شرطي؛ ترجع True إذا فاز هذا العامل بها."""
+    table = BackgroundJob.__table__
+    now = datetime.utcnow()
+    with db.engine.begin() as conn:
+        res = conn.execute(update(table).where(
+            table.c.id == job_id, table.c.status == 'queued'
+        ).values(status='running', worker_id=worker_id, started_at=now, heartbeat_at=now))
+        return res.rowcount == 1
+
+
+def execute_job(job_id, eager=False):
+    """تنفيذ مهمة محجوزة (status=running) وتسجيل نتيجتها."""
+    job = db.session.get(BackgroundJob, job_id)
+    if job is None:
+        return
+    handler, transient = _HANDLERS.get(job.job_type, (None, False))
+    ctx = JobContext(job.id, job.job_type, job.get_payload(), job.created_by, eager=eager)
+    db.session.rollback()
+    if handler is None:
+        _finish(job_id, 'failed', error=f'Unknown job type: {ctx.job_type}')
+        return
+    try:
+        result = handler(ctx)
+        db.session.commit()
+        _finish(job_id, 'succeeded', result=result, clear_payload=transient)
+    except JobCancelled:
+        db.session.rollback()
+        _finish(job_id, 'cancelled', message='تم إلغاء المهمة', clear_payload=transient)
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.exception(f"Background job {job_id} ({ctx.job_type}) failed: {e}")
+        _finish(job_id, 'failed', error=str(e), clear_payload=transient)
+
+
+def _due(table, at):
+    return or_(table.c.run_after.is_(None), table.c.run_after <= at)
+
+
+def submit_job(job_type, payload=None, user_id=None, delay=None):
+    """إدراج مهمة في الطابور وإيقاظ الموزّع. ترجع سجل BackgroundJob.
+    delay: ثوانٍ قبل أن تصبح المهمة قابلة للحجز (لا تُنفذ فوراً حتى مع JOBS_EAGER).
+    """
+    if job_type not in _HANDLERS:
+        raise ValueError(f'Unknown job type: {job_type}')
+    job = BackgroundJob(
+        job_type=job_type,
+        status='queued',
+        payload=json.dumps(payload or {}, ensure_ascii=False, default=str),
+        created_by=user_id,
+        run_after=datetime.utcnow() + timedelta(seconds=delay) if delay is not None else None,
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    app = current_app._get_current_object()
+    if app.config.get('JOBS_EAGER'):
+        if job.run_after is None and _claim(job.id, f'eager:{os.getpid()}'):
+            execute_job(job.id, eager=True)
+        db.session.expire(job)
+    elif app.config.get('JOBS_IN_PROCESS', True):
+        get_runner(app).wake()
+    return job
+
+
+def submit_once(job_type, payload=None, user_id=None, delay=None):
+    """submit_job ما لم تكن هناك مهمة منتظرة من نفس النوع تبدأ بحلول الموعد نفسه
+    (المهمة الجارية تلتقط السجلات الجديدة في دفعتها التالية). ترجع المهمة الجديدة أو None.
+    """
+    table = BackgroundJob.__table__
+    at = datetime.utcnow() + timedelta(seconds=delay or 0)
+    waiting = db.session.execute(
+        select(table.c.id).where(table.c.job_type == job_type, table.c.status == 'queued', _due(table, at)).limit(1)
+    ).scalar()
+    db.session.rollback()
+    if waiting:
+        return None
+    return submit_job(job_type, payload, user_id=user_id, delay=delay)
+
+
+def cancel_job(job_id):
+    """طلب إلغاء: المنتظرة تُلغى فوراً، والجارية تتوقف عند أول تحديث للتقدم.
+    ترجع 'cancelled' أو 'cancel_requested' أو None إذا كانت منتهية.
+    """
+    now = datetime.utcnow()
+    res = db.session.execute(update(BackgroundJob).where(
+        BackgroundJob.id == job_id, BackgroundJob.status == 'queued'
+    ).values(status='cancelled', cancel_requested=True, finished_at=now, progress_message='تم إلغاء المهمة'))
+    if res.rowcount:
+        db.session.commit()
+        return 'cancelled'
+    res = db.session.execute(update(BackgroundJob).where(
+        BackgroundJob.id == job_id, BackgroundJob.status == 'running'
+    ).values(cancel_requested=True))
+    db.session.commit()
+    return 'cancel_requested' if res.rowcount else None
+
+
+class JobRunner:
+    """موزّع المهام: خيط يستطلع الجدول (أو يُوقَظ عند الإرسال) ومجموعة خيوط للتنفيذ."""
+
+    def __init__(self, app, max_workers=None, poll_interval=None):
+        self.app = app
+        self.max_workers = int(max_workers or app.config.get('JOBS_WORKERS', 2))
+        self.poll_interval = float(poll_interval or app.config.get('JOBS_POLL_INTERVAL', 2.0))
+        self.stale_after = int(app.config.get('JOBS_STALE_SECONDS', 900))
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}'
+        self.pid = os.getpid()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='job')
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._active = 0
+        self._lock = threading.Lock()
+        self._last_reap = 0.0
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name='job-dispatcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self, wait=True):
+        self._stop.set()
+        self._wake.set()
+        self._executor.shutdown(wait=wait)
+
+    def run_forever(self):
+        """للعامل المنفصل: تشغيل الموزّع في الخيط الحالي حتى المقاطعة."""
+        try:
+            self._loop()
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            with self.app.app_context():
+                try:
+                    if time.monotonic() - self._last_reap > 60:
+                        self._reap_stale()
+                        self._last_reap = time.monotonic()
+                    self._dispatch()
+                except Exception as e:
+                    self.app.logger.error(f"Job dispatcher error: {e}")
+                finally:
+                    db.session.remove()
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def _dispatch(self):
+        with self._lock:
+            free = self.max_workers - self._active
+        if free <= 0:
+            return
+        table = BackgroundJob.__table__
+        ids = db.session.execute(
+            select(table.c.id).where(table.c.status == 'queued', _due(table, datetime.utcnow()))
+            .order_by(table.c.created_at, table.c.id).limit(free)
+        ).scalars().all()
+        db.session.rollback()
+        for job_id in ids:
+            if _claim(job_id, self.worker_id):
+                with self._lock:
+                    self._active += 1
+                self._executor.submit(self._run, job_id)
+
+    def _run(self, job_id):
+        try:
+            with self.app.app_context():
+                try:
+                    execute_job(job_id)
+                finally:
+                    db.session.remove()
+        finally:
+            with self._lock:
+                self._active -= 1
+            self._wake.set()
+
+    def _reap_stale(self):
+        """المهام الجارية التي توقف نبضها (عامل أُعيد تشغيله) تُعلَّم كفاشلة."""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.stale_after)
+        table = BackgroundJob.__table__
+        with db.engine.begin() as conn:
+            conn.execute(update(table).where(
+                table.c.status == 'running', table.c.heartbeat_at < cutoff
+            ).values(status='failed', error='Worker stopped responding', finished_at=datetime.utcnow()))
+
+
+def get_runner(app):
+    """الموزّع الخاص بهذه العملية (يُنشأ عند أول استخدام وبعد fork لعمال gunicorn)."""
+    global _runner
+    with _runner_lock:
+        if _runner is None or _runner.pid != os.getpid() or _runner.app is not app:
+            if _runner is not None and _runner.pid == os.getpid():
+                _runner.stop(wait=False)
+            _runner = JobRunner(app).start()
+        return _runner
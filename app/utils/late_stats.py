@@ -0,0 +1,145 @@
+"""
+إحصائيات التأخير بتجميع SQL واحد
+- دقائق التأخير = وقت الحضور − (تاريخ السجل + AttendanceSettings.check_in_end)،
+  ويُحتسب السجل متأخراً إذا تجاوز Settings.late_arrival_threshold_min (فترة السماح).
+- المجموع والعدد والمتوسط لكل موظف بـ GROUP BY، والترتيب و Top-N بـ ORDER BY/LIMIT،
+  والإجمالي العام (عدد المتأخرين ومتوسط المتوسطات) بدوال نافذة في نفس الاستعلام.
+- بعد بناء التجميع اليومي (attendance_daily) تُقرأ دقائق التأخير منه مباشرة؛ قبله من الجدول
+  الخام: SQLite و PostgreSQL لهما تعبير فرق الوقت، وغيرهما جلب واحد ثم حساب NumPy.
+"""
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import BigInteger, cast, func, select
+
+from app import db
+from app.models.attendance import Attendance, AttendanceDaily
+from app.models.employee import Employee
+from app.utils.settings_cache import attendance_settings, system_settings
+
+DEFAULT_GRACE_MINUTES = 15
+
+
+def late_grace_minutes(settings=None):
+    """فترة السماح قبل احتساب التأخير (Settings.late_arrival_threshold_min)."""
+    settings = settings or system_settings()
+    value = getattr(settings, 'late_arrival_threshold_min', None)
+    return DEFAULT_GRACE_MINUTES if value is None else max(0, int(value))
+
+
+def late_minutes(check_in_time, day, check_in_end):
+    """دقائق التأخير لسجل واحد (نفس تعريف التعبير SQL)."""
+    if check_in_time is None or check_in_end is None:
+        return 0
+    return int((check_in_time - datetime.combine(day, check_in_end)).total_seconds() / 60)
+
+
+def _seconds(t):
+    return t.hour * 3600 + t.minute * 60 + t.second
+
+
+def _late_minutes_expr(dialect, end_seconds):
+    """تعبير دقائق التأخير لكل سجل، أو None إذا لم تُدعم اللهجة.
+    الفرق يُحسب بالملّي ثانية (julianday عدد عشري) ثم قسمة صحيحة على 60000."""
+    if dialect == 'sqlite':
+        offset_ms = cast(func.round(
+            (func.julianday(Attendance.check_in_time) - func.julianday(Attendance.date)) * 86400000
+        ), BigInteger)
+    elif dialect == 'postgresql':
+        offset_ms = cast(func.floor(
+            func.extract('epoch', Attendance.check_in_time - cast(Attendance.date, db.DateTime)) * 1000
+        ), BigInteger)
+    else:
+        return None
+    return (offset_ms - end_seconds * 1000) // 60000
+
+
+def late_statistics(start_date, end_date=None, limit=10, employee_ids=None, settings=None, grace=None):
+    """يرجع (قائمة Top-N، عدد الموظفين المتأخرين، المتوسط العام لمتوسطاتهم)."""
+    settings = settings or attendance_settings()
+    check_in_end = getattr(settings, 'check_in_end', None)
+    if check_in_end is None:
+        return [], 0, 0.0
+    grace = late_grace_minutes() if grace is None else grace
+    limit = max(int(limit), 0)
+
+    from app.utils.attendance_daily import PRESENT, rollup_ready
+    if rollup_ready():
+        # دقائق التأخير محسوبة مسبقاً في التجميع اليومي
+        source, late = AttendanceDaily, AttendanceDaily.late_minutes
+        conditions = [AttendanceDaily.day_status == PRESENT, AttendanceDaily.first_in.isnot(None)]
+    else:
+        source, late = Attendance, _late_minutes_expr(db.engine.dialect.name, _seconds(check_in_end))
+        conditions = [Attendance.check_in_time.isnot(None)]
+    conditions.append(source.date >= start_date)
+    if end_date is not None:
+        conditions.append(source.date <= end_date)
+    if employee_ids is not None:
+        conditions.append(source.employee_id.in_(list(employee_ids)))
+    if late is None:
+        return _late_statistics_numpy(conditions, check_in_end, grace, limit)
+    employee_col = source.employee_id
+
+    per_employee = (
+        select(employee_col.label('employee_id'),
+               func.sum(late).label('total'),
+               func.count().label('late_count'))
+        .where(*conditions, late > grace)
+        .group_by(employee_col)
+        .subquery()
+    )
+    average = per_employee.c.total * 1.0 / per_employee.c.late_count
+    rows = db.session.execute(
+        select(Employee.id, Employee.name, Employee.department,
+               per_employee.c.total, per_employee.c.late_count, average.label('average'),
+               func.count().over().label('late_employees'),
+               func.avg(average).over().label('overall_average'))
+        .join(per_employee, per_employee.c.employee_id == Employee.id)
+        .where(Employee.active == True)
+        .order_by(per_employee.c.total.desc(), Employee.id)
+        .limit(max(limit, 1))
+    ).all()
+    if not rows:
+        return [], 0, 0.0
+    top = [_entry(r.id, r.name, r.department, r.total, r.late_count) for r in rows[:limit]]
+    return top, int(rows[0].late_employees), float(rows[0].overall_average or 0.0)
+
+
+def _entry(emp_id, name, department, total, count):
+    return {
+        'id': emp_id,
+        'name': name,
+        'department': department,
+        'total_late_minutes': int(total),
+        'late_count': int(count),
+        'average_late_minutes': round(float(total) / count, 2),
+    }
+
+
+def _late_statistics_numpy(conditions, check_in_end, grace, limit):
+    """بديل اللهجات الأخرى: جلب واحد (موظف، تاريخ، وقت الحضور) ثم تجميع متجهي."""
+    rows = db.session.execute(
+        select(Attendance.employee_id, Attendance.date, Attendance.check_in_time)
+        .join(Employee, Employee.id == Attendance.employee_id)
+        .where(*conditions, Employee.active == True)
+    ).all()
+    if not rows:
+        return [], 0, 0.0
+    emp = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+    minutes = np.fromiter((late_minutes(r[2], r[1], check_in_end) for r in rows), dtype=np.int64, count=len(rows))
+    mask = minutes > grace
+    if not mask.any():
+        return [], 0, 0.0
+    ids, inverse = np.unique(emp[mask], return_inverse=True)
+    totals = np.bincount(inverse, weights=minutes[mask]).astype(np.int64)
+    counts = np.bincount(inverse)
+    order = np.lexsort((ids, -totals))[:limit]
+    info = {r.id: r for r in db.session.execute(
+        select(Employee.id, Employee.name, Employee.department).where(Employee.id.in_(ids[order].tolist()))
+    )}
+    top = []
+    for i in order:
+        emp_id = int(ids[i])
+        row = info.get(emp_id)
+        top.append(_entry(emp_id, row.name if row else None, row.department if row else None, totals[i], counts[i]))
+    return top, len(ids), float(np.mean(totals / counts))
@@ -0,0 +1,137 @@
+"""
+تخزين وسائط WhatsApp بعنوان المحتوى (Content-addressed)
+- الملف يُكتب بالتدفق (قطع 64KB) لملف مؤقت داخل مجلد الوسائط مع حساب SHA-256 أثناء الكتابة،
+  فالذاكرة ثابتة مهما كان حجم المرفق.
+- الاسم النهائي <أول حرفين>/<sha256>.<ext> تحت WhatsAppConfig.MEDIA_UPLOAD_FOLDER؛ إذا وُجد
+  الملف (نفس المحتوى أُعيد توجيهه أو أُرسل مرتين) يُحذف المؤقت ويُستخدم الموجود.
+- الملفات لا تتغير بعد كتابتها، فتُخدم عبر send_media بدعم Range (تشغيل الصوت/الفيديو من منتصفه)
+  و ETag = البصمة وترويسة Cache-Control طويلة immutable.
+- migrate_legacy_media تنسخ الملفات القديمة المسماة بالوقت إلى التخزين الجديد، و remove_legacy_media
+  تحذفها بعد commit تحديث الروابط (scripts/dedupe_whatsapp_media.py).
+"""
+import hashlib
+import os
+import re
+import tempfile
+from collections import namedtuple
+
+from flask import abort, send_file
+from werkzeug.security import safe_join
+
+from app.whatsapp_config import WhatsAppConfig
+
+CHUNK_SIZE = 64 * 1024
+URL_PREFIX = '/whatsapp/media/'
+LEGACY_URL_PREFIX = '/static/whatsapp_media/'
+_CONTENT_ADDRESSED = re.compile(r'^([0-9a-f]{2})/(\1[0-9a-f]{62})\.[a-z0-9]{1,8}$')
+
+StoredMedia = namedtuple('StoredMedia', 'digest relpath size created')
+
+
+class MediaTooLarge(ValueError):
+    pass
+
+
+def _clean_extension(extension):
+    extension = re.sub(r'[^a-z0-9]', '', (extension or '').lower())[:8]
+    return extension or 'bin'
+
+
+def store_chunks(chunks, extension, folder=None, max_bytes=None):
+    """كتابة قطع bytes بالتدفق وتخزينها بالبصمة؛ ترجع StoredMedia (created=False إذا كان موجوداً).
+    لا تحتاج app_context (تُستدعى من خيوط التحميل).
+    """
+    folder = folder or WhatsAppConfig.MEDIA_UPLOAD_FOLDER
+    os.makedirs(folder, exist_ok=True)
+    fd, partial = tempfile.mkstemp(prefix='.incoming-', suffix='.part', dir=folder)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                size += len(chunk)
+                if max_bytes and size > max_bytes:
+                    raise MediaTooLarge(f'Media exceeds {max_bytes} bytes')
+                digest.update(chunk)
+                f.write(chunk)
+        hexdigest = digest.hexdigest()
+        relpath = f'{hexdigest[:2]}/{hexdigest}.{_clean_extension(extension)}'
+        target = os.path.join(folder, relpath)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.exists(target):
+            os.remove(partial)
+            return StoredMedia(hexdigest, relpath, size, False)
+        os.replace(partial, target)
+        return StoredMedia(hexdigest, relpath, size, True)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+
+
+def store_file(fileobj, extension, folder=None, max_bytes=None):
+    """تخزين ملف مفتوح (مثل FileStorage.stream للرفع) دون قراءته كاملاً في الذاكرة."""
+    return store_chunks(iter(lambda: fileobj.read(CHUNK_SIZE), b''), extension, folder, max_bytes)
+
+
+def media_url(relpath):
+    return URL_PREFIX + relpath
+
+
+def media_path(relpath, folder=None):
+    """المسار المطلق لملف داخل مجلد الوسائط، أو None إذا كان الاسم يخرج عنه."""
+    return safe_join(folder or WhatsAppConfig.MEDIA_UPLOAD_FOLDER, relpath)
+
+
+def send_media(name, max_age=31536000, folder=None):
+    """استجابة الملف مع Range/If-None-Match. الملفات بعنوان المحتوى تُخزن مؤقتاً طويلاً (immutable)."""
+    path = media_path(name, folder)
+    if not path or not os.path.isfile(path):
+        abort(404)
+    match = _CONTENT_ADDRESSED.match(name)
+    response = send_file(path, conditional=True, etag=match.group(2) if match else True,
+                         max_age=max_age if match else 0)
+    response.cache_control.private = True  # محادثات العملاء: لا تخزين في الوسطاء المشتركين
+    response.cache_control.public = False
+    if match:
+        response.cache_control.immutable = True
+    return response
+
+
+def migrate_legacy_media(folder=None):
+    """نسخ الملفات القديمة (أسماء بالوقت في جذر المجلد) إلى التخزين بالبصمة دون حذفها؛
+    الحذف في remove_legacy_media بعد commit الروابط الجديدة، فالتوقف في أي نقطة لا يترك رابطاً
+    لملف محذوف وإعادة التشغيل تكمل. ترجع ({الاسم القديم: المسار الجديد}، البايتات الموفرة بعد الحذف).
+    """
+    folder = folder or WhatsAppConfig.MEDIA_UPLOAD_FOLDER
+    if not os.path.isdir(folder):
+        return {}, 0
+    mapping, saved = {}, 0
+    for name in sorted(os.listdir(folder)):
+        path = os.path.join(folder, name)
+        if name.startswith('.') or not os.path.isfile(path):
+            continue
+        extension = name.rsplit('.', 1)[-1] if '.' in name else ''
+        with open(path, 'rb') as f:
+            stored = store_file(f, extension, folder)
+        if not stored.created:
+            saved += stored.size
+        mapping[name] = stored.relpath
+    return mapping, saved
+
+
+def remove_legacy_media(mapping, folder=None):
+    """حذف الملفات القديمة بعد commit الروابط الجديدة؛ فقط إذا وُجدت نسختها بالبصمة. ترجع عدد المحذوف."""
+    folder = folder or WhatsAppConfig.MEDIA_UPLOAD_FOLDER
+    removed = 0
+    for name, relpath in mapping.items():
+        if not os.path.isfile(os.path.join(folder, relpath)):
+            continue
+        try:
+            os.remove(os.path.join(folder, name))
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
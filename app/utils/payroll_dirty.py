@@ -0,0 +1,211 @@
+"""
+تتبع التغييرات المؤثرة على الرواتب (Dirty tracking)
+أي إدراج/تعديل/حذف لسجلات الحضور أو الإجازات أو السلف يسجّل علامة
+(employee_id, year, month) في جدول payroll_dirty_mark ضمن نفس المعاملة،
+فتعيد إعادة الحساب التزايدية معالجة هؤلاء الموظفين فقط.
+
+ملاحظة: العمليات المجمّعة (bulk_insert_mappings / update بالاستعلام) لا تمر
+بأحداث ORM، لذا يجب أن تستدعي mark_payroll_dirty() صراحةً.
+"""
+from datetime import datetime
+
+from sqlalchemy import event, func, select, delete, inspect as sa_inspect
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models.attendance import Attendance
+from app.models.leave import Leave
+from app.models.payroll import Payroll, EmployeeLoan, PayrollDirtyMark
+
+_OPEN_STATUSES = ('pending', 'approved')
+_MAX_LEAVE_MONTHS = 24
+
+
+def _months_between(start, end):
+    """الأشهر (year, month) التي تغطيها الفترة [start, end]."""
+    if not start:
+        return []
+    end = end or start
+    if end < start:
+        start, end = end, start
+    months = []
+    y, m = start.year, start.month
+    while (y, m) <= (end.year, end.month) and len(months) < _MAX_LEAVE_MONTHS:
+        months.append((y, m))
+        m += 1
+        if m > 12:
+            y, m = y + 1, 1
+    return months
+
+
+def _history_values(obj, attr):
+    """القيمة الحالية والقيم السابقة (قبل التعديل) لحقل ما."""
+    hist = sa_inspect(obj).attrs[attr].history
+    values = list(hist.added or ()) + list(hist.unchanged or ()) + list(hist.deleted or ())
+    if not values:
+        values = [getattr(obj, attr, None)]
+    return [v for v in values if v is not None]
+
+
+def _marks_for_object(connection, obj):
+    if isinstance(obj, Attendance):
+        keys = set()
+        for emp_id in _history_values(obj, 'employee_id'):
+            for d in _history_values(obj, 'date'):
+                keys.add((emp_id, d.year, d.month, 'attendance'))
+        return keys
+    if isinstance(obj, Leave):
+        keys = set()
+        starts = _history_values(obj, 'start_date')
+        ends = _history_values(obj, 'end_date')
+        if not starts:
+            return keys
+        span_start, span_end = min(starts), max(ends or starts)
+        for emp_id in _history_values(obj, 'employee_id'):
+            for y, m in _months_between(span_start, span_end):
+                keys.add((emp_id, y, m, 'leave'))
+        return keys
+    if isinstance(obj, EmployeeLoan):
+        # قسط السلفة يؤثر على كل راتب مفتوح يبدأ بعد تاريخ بدء الخصم
+        q = select(Payroll.employee_id, Payroll.year, Payroll.month).where(
+            Payroll.employee_id.in_(_history_values(obj, 'employee_id')),
+            Payroll.status.in_(_OPEN_STATUSES)
+        )
+        starts = _history_values(obj, 'start_date')
+        if starts:
+            q = q.where(Payroll.period_end >= min(starts))
+        return {(emp_id, y, m, 'loan') for emp_id, y, m in connection.execute(q) if y and m}
+    return set()
+
+
+def _fresh_mark_id(connection, table):
+    """معرّف جديد لعلامة أُعيد تعليمها، أكبر من أي معرّف قرأته إعادة حساب جارية."""
+    if connection.dialect.name == 'postgresql':
+        return func.nextval(func.pg_get_serial_sequence(table.name, 'id'))
+    return select(func.max(table.c.id) + 1).scalar_subquery()
+
+
+def _insert_marks(connection, keys):
+    """إدراج العلامات، أو نقل الموجودة إلى معرّف جديد (قيد فريد على employee_id/year/month).
+    المعرّف الجديد يضمن ألا يحذف clear_dirty_marks(mark_ids=...) تغييراً وقع بعد قراءة العلامات.
+    """
+    if not keys:
+        return
+    now = datetime.utcnow()
+    rows = [
+        {'employee_id': emp_id, 'year': y, 'month': m, 'source': source, 'marked_at': now}
+        for emp_id, y, m, source in sorted(keys, key=lambda k: (k[0], k[1], k[2]))
+    ]
+    # إزالة التكرار داخل الدفعة نفسها
+    unique = {}
+    for row in rows:
+        unique.setdefault((row['employee_id'], row['year'], row['month']), row)
+    rows = list(unique.values())
+
+    dialect = connection.dialect.name
+    table = PayrollDirtyMark.__table__
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['employee_id', 'year', 'month'],
+            set_={'id': _fresh_mark_id(connection, table),
+                  'marked_at': stmt.excluded.marked_at, 'source': stmt.excluded.source}
+        )
+        connection.execute(stmt, rows)
+    else:
+        existing = set(connection.execute(
+            select(table.c.employee_id, table.c.year, table.c.month).where(
+                table.c.employee_id.in_({r['employee_id'] for r in rows})
+            )
+        ))
+        for r in rows:
+            key = (r['employee_id'], r['year'], r['month'])
+            if key in existing:
+                # حذف ثم إدراج: العلامة تأخذ معرّفاً جديداً
+                connection.execute(table.delete().where(
+                    table.c.employee_id == key[0], table.c.year == key[1], table.c.month == key[2]
+                ))
+            connection.execute(table.insert(), [r])
+
+
+def _after_flush(session, flush_context):
+    tracked = (Attendance, Leave, EmployeeLoan)
+    objs = [o for o in list(session.new) + list(session.dirty) + list(session.deleted) if isinstance(o, tracked)]
+    if not objs:
+        return
+    connection = session.connection()
+    keys = set()
+    for obj in objs:
+        if obj in session.dirty and not session.is_modified(obj, include_collections=False):
+            continue
+        keys |= _marks_for_object(connection, obj)
+    _insert_marks(connection, keys)
+
+
+def _keep_old_value(target, value, oldvalue, initiator):
+    pass
+
+
+def register_payroll_dirty_tracking():
+    """تسجيل مستمع after_flush مرة واحدة لكل عملية.
+    active_history: تعديل حقل منتهي الصلاحية (بعد commit) يحمّل القيمة القديمة أولاً،
+    فنقل سجل لشهر آخر يعلّم الشهر القديم أيضاً.
+    """
+    for attr in (Attendance.employee_id, Attendance.date, Leave.employee_id, Leave.start_date, Leave.end_date,
+                 EmployeeLoan.employee_id, EmployeeLoan.start_date):
+        if not event.contains(attr, 'set', _keep_old_value):
+            event.listen(attr, 'set', _keep_old_value, active_history=True)
+    if not event.contains(Session, 'after_flush', _after_flush):
+        event.listen(Session, 'after_flush', _after_flush)
+
+
+def mark_payroll_dirty(pairs, source='bulk', connection=None):
+    """تسجيل علامات يدوياً لمسارات bulk التي لا تمر بأحداث ORM.
+    pairs: iterable من (employee_id, date) أو (employee_id, year, month).
+    connection: اتصال معاملة خارج جلسة ORM (مثل كاتب الحضور المجمّع).
+    """
+    keys = set()
+    for pair in pairs:
+        if len(pair) == 2:
+            emp_id, d = pair
+            if emp_id is None or d is None:
+                continue
+            keys.add((emp_id, d.year, d.month, source))
+        else:
+            emp_id, y, m = pair
+            keys.add((emp_id, y, m, source))
+    _insert_marks(connection if connection is not None else db.session.connection(), keys)
+    return len(keys)
+
+
+def dirty_employees(year: int, month: int):
+    """الموظفون المعلَّمون لهذا الشهر ومعرّفات علاماتهم: (employee_ids, mark_ids).
+    تُمرَّر المعرّفات إلى clear_dirty_marks بعد إعادة الحساب؛ علامة أُعيد تعليمها أثناء التشغيل
+    تأخذ معرّفاً جديداً فلا تُحذف.
+    """
+    rows = db.session.execute(
+        select(PayrollDirtyMark.employee_id, PayrollDirtyMark.id).where(
+            PayrollDirtyMark.year == year, PayrollDirtyMark.month == month
+        )
+    ).all()
+    return {r[0] for r in rows}, [r[1] for r in rows]
+
+
+def clear_dirty_marks(year: int, month: int, employee_ids=None, mark_ids=None):
+    """حذف علامات شهر (كاملاً أو لموظفين محددين) بعد حساب رواتبهم من جديد.
+    mark_ids: حذف العلامات المقروءة بـ dirty_employees فقط (وليس ما عُلِّم بعدها).
+    """
+    q = delete(PayrollDirtyMark).where(PayrollDirtyMark.year == year, PayrollDirtyMark.month == month)
+    if mark_ids is not None:
+        column, ids = PayrollDirtyMark.id, list(mark_ids)
+    elif employee_ids is not None:
+        column, ids = PayrollDirtyMark.employee_id, list(employee_ids)
+    else:
+        db.session.execute(q)
+        return
+    for i in range(0, len(ids), 500):
+        db.session.execute(q.where(column.in_(ids[i:i + 500])))
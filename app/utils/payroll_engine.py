@@ -0,0 +1,379 @@
+"""
+محرك دفعات الرواتب (Set-based)
+يجلب الحضور والإجازات والسلف لفترة كاملة بعدد ثابت من الاستعلامات
+ثم يحسب جميع الرواتب في الذاكرة بدلاً من استعلامات لكل موظف.
+"""
+from datetime import datetime, date
+
+import numpy as np
+from dateutil.relativedelta import relativedelta
+from flask import current_app
+from sqlalchemy import func
+
+from app import db
+from app.models.attendance import Attendance, AttendanceDaily
+from app.models.leave import Leave
+from app.models.payroll import Payroll, EmployeeLoan
+from app.utils.attendance_daily import PRESENT, rollup_ready
+from app.utils.settings_cache import system_settings
+from app.utils.work_calendar import period_calendar, to_days
+
+
+def get_work_schedule(settings=None):
+    """إرجاع (أيام العمل كنصوص "0".."6" حيث 0=الأحد، وقت بداية الدوام)."""
+    if settings is None:
+        settings = system_settings()
+    work_days = set((settings.work_days or '0,1,2,3,4').split(','))
+    work_start_str = settings.work_start or current_app.config.get('WORK_START', '08:00')
+    try:
+        work_start_time = datetime.strptime(work_start_str, '%H:%M').time()
+    except Exception:
+        work_start_time = datetime.strptime('08:00', '%H:%M').time()
+    return work_days, work_start_time
+
+
+def period_working_dates(period_start: date, period_end: date):
+    """قائمة أيام العمل ضمن الفترة من تقويم العمل (work_days مطروحاً منها العطل الرسمية)."""
+    return period_calendar(period_start, period_end).working_dates
+
+
+def attendance_metrics_from_first_ins(first_in_by_date, calendar, work_start_time, leave_mask=None):
+    """احسب (الغياب، دقائق التأخير، عدد أيام العمل) لموظف واحد من أول دخول لكل يوم.
+    first_in_by_date: {date: datetime|None} — وجود المفتاح يعني وجود سجل حضور لذلك اليوم.
+    الغياب = أيام العمل بلا حضور ولا إجازة (leave_mask من leave_masks).
+    """
+    present = calendar.mask(first_in_by_date.keys())
+    missing = calendar.working & ~present
+    if leave_mask is not None:
+        missing &= ~leave_mask
+    total_late_minutes = 0
+    for d, first_in in first_in_by_date.items():
+        if first_in and calendar.is_working(d):
+            scheduled_dt = datetime.combine(first_in.date(), work_start_time)
+            if first_in > scheduled_dt:
+                delta = first_in - scheduled_dt
+                total_late_minutes += max(0, int(delta.total_seconds() // 60))
+    return int(np.count_nonzero(missing)), total_late_minutes, calendar.working_count
+
+
+def leave_masks(leaves, calendar):
+    """أقنعة أيام الإجازات الموافق عليها (paid, unpaid) على أيام الفترة.
+    الإجازة المرضية ذات paid_days: أول paid_days يوماً من جزئها داخل الفترة مدفوعة والباقي لا.
+    """
+    paid = np.zeros(len(calendar), dtype=bool)
+    unpaid = np.zeros(len(calendar), dtype=bool)
+    for lv in leaves:
+        lo, hi = calendar.span(lv.start_date, lv.end_date)
+        if lo > hi:
+            continue
+        if lv.leave_type == 'sick' and lv.paid_days is not None:
+            split = lo + max(0, min(hi - lo + 1, int(lv.paid_days or 0)))
+            paid[lo:split] = True
+            unpaid[split:hi + 1] = True
+        elif lv.paid:
+            paid[lo:hi + 1] = True
+        else:
+            unpaid[lo:hi + 1] = True
+    return paid, unpaid
+
+
+def leave_dates_from_rows(leaves, period_start: date, period_end: date):
+    """توزيع أيام الإجازات الموافق عليها على (paid_dates, unpaid_dates) ضمن الفترة."""
+    calendar = period_calendar(period_start, period_end)
+    paid, unpaid = leave_masks(leaves, calendar)
+    return set(calendar.dates(paid)), set(calendar.dates(unpaid))
+
+
+def loan_monthly_due(loan, period_end: date):
+    """قسط القرض المستحق لهذا الشهر (0 إن لم يستحق) دون تعديل السجل."""
+    if loan.start_date and loan.start_date > period_end:
+        return 0.0, 0.0, 0.0
+    remaining = float(loan.remaining_amount if loan.remaining_amount is not None else (loan.amount or 0.0))
+    if remaining <= 0:
+        return 0.0, remaining, 0.0
+    monthly = loan.monthly_deduction
+    if (monthly is None or monthly == 0) and loan.amount and loan.installments:
+        try:
+            monthly = round(float(loan.amount) / float(loan.installments), 2)
+        except Exception:
+            monthly = 0.0
+    monthly = float(monthly or 0.0)
+    if monthly <= 0:
+        return 0.0, remaining, monthly
+    return min(remaining, monthly), remaining, monthly
+
+
+def loan_due_from_rows(loans, period_end: date) -> float:
+    """إجمالي أقساط السلف/القروض المستحقة من قائمة قروض نشطة."""
+    total_due = 0.0
+    for loan in loans:
+        due, _, _ = loan_monthly_due(loan, period_end)
+        total_due += due
+    return round(total_due, 2)
+
+
+def apply_attendance_deductions(payroll, abs_days, late_mins, working_days, paid_dates, unpaid_dates, cfg=None):
+    """تطبيق خصومات الغياب والتأخير والإجازات غير المدفوعة على سجل راتب.
+    abs_days: أيام الغياب بعد استبعاد أيام الإجازة (attendance_metrics).
+    """
+    cfg = cfg if cfg is not None else current_app.config
+    basic = float(payroll.basic or 0.0)
+    adj_absence = max(0, int(abs_days))
+    payroll.absence_days = adj_absence
+    payroll.late_minutes = late_mins
+    daily_rate = (basic / float(working_days or 30)) if (working_days or 0) > 0 else (basic / 30.0)
+    absence_rate = float(cfg.get('PAYROLL_ABSENCE_DEDUCTION_RATE', 1.0))
+    payroll.absence_deduction = round(daily_rate * adj_absence * absence_rate, 2)
+    hourly_basic = (basic / 240.0) if basic else 0.0
+    per_hour = float(cfg.get('PAYROLL_LATE_DEDUCTION_PER_HOUR', 0.0)) or hourly_basic
+    payroll.late_deduction = round(per_hour * (late_mins or 0) / 60.0, 2)
+    payroll.unpaid_leave_days = len(unpaid_dates)
+    payroll.unpaid_leave_deduction = round(daily_rate * payroll.unpaid_leave_days, 2)
+    return payroll
+
+
+class PeriodInputs:
+    """مدخلات فترة رواتب محمّلة دفعة واحدة لمجموعة موظفين.
+    الحضور مخزن كمصفوفات (موظف، موقع اليوم في الفترة، أول دخول)، ومقاييس كل الموظفين
+    تُحسب بتمريرة NumPy واحدة عند أول طلب.
+    """
+
+    def __init__(self, period_start, period_end, calendar, work_start_time,
+                 attendance, leaves, loans, auto_loan):
+        self.period_start = period_start
+        self.period_end = period_end
+        self.calendar = calendar
+        self.work_start_time = work_start_time
+        self.attendance = attendance    # (employee_ids, offsets, first_ins datetime64[s])
+        self.leaves = leaves            # {employee_id: [Leave]}
+        self.loans = loans              # {employee_id: [EmployeeLoan]}
+        self.auto_loan = auto_loan
+        self._metrics = None
+        self._leave_masks = {}
+
+    @property
+    def working_dates(self):
+        return self.calendar.working_dates
+
+    def _leave_masks_for(self, emp_id):
+        masks = self._leave_masks.get(emp_id)
+        if masks is None:
+            masks = self._leave_masks[emp_id] = leave_masks(self.leaves.get(emp_id, ()), self.calendar)
+        return masks
+
+    def _compute_metrics(self):
+        """{employee_id: (غياب، تأخير)} لكل من له سجل حضور أو إجازة في الفترة."""
+        calendar = self.calendar
+        emp_ids, offsets, first_ins = self.attendance
+        on_working = calendar.working[offsets]
+        ids, inverse = np.unique(emp_ids, return_inverse=True)
+        present_days = np.bincount(inverse[on_working], minlength=len(ids))
+
+        start_seconds = self.work_start_time.hour * 3600 + self.work_start_time.minute * 60 + self.work_start_time.second
+        checked_in = ~np.isnat(first_ins)
+        seconds = np.zeros(len(first_ins), dtype=np.int64)
+        seconds[checked_in] = (first_ins[checked_in] - first_ins[checked_in].astype('datetime64[D]')).astype(np.int64)
+        late = seconds - start_seconds
+        counted = on_working & checked_in & (late > 0)
+        late_minutes = np.bincount(inverse[counted], weights=late[counted] // 60, minlength=len(ids))
+
+        metrics = {
+            int(emp_id): (calendar.working_count - int(present), int(late))
+            for emp_id, present, late in zip(ids, present_days, late_minutes)
+        }
+        # الإجازات: أيام عمل مغطاة بإجازة وليس فيها حضور لا تُحسب غياباً
+        order = np.argsort(inverse, kind='stable')
+        bounds = np.concatenate(([0], np.cumsum(np.bincount(inverse, minlength=len(ids)))))
+        for emp_id in self.leaves:
+            paid, unpaid = self._leave_masks_for(emp_id)
+            excused = calendar.working & (paid | unpaid)
+            k = int(np.searchsorted(ids, emp_id))
+            if k < len(ids) and ids[k] == emp_id:
+                excused[offsets[order[bounds[k]:bounds[k + 1]]]] = False
+            absence, late = metrics.get(emp_id, (calendar.working_count, 0))
+            metrics[emp_id] = (absence - int(np.count_nonzero(excused)), late)
+        return metrics
+
+    def attendance_metrics(self, emp_id):
+        if self._metrics is None:
+            self._metrics = self._compute_metrics()
+        absence, late = self._metrics.get(emp_id, (self.calendar.working_count, 0))
+        return absence, late, self.calendar.working_count
+
+    def leave_dates(self, emp_id):
+        paid, unpaid = self._leave_masks_for(emp_id)
+        return self.calendar.dates(paid), self.calendar.dates(unpaid)
+
+    def loan_due(self, emp_id):
+        if not self.auto_loan:
+            return 0.0
+        return loan_due_from_rows(self.loans.get(emp_id, ()), self.period_end)
+
+
+_IN_FILTER_MAX = 500  # حتى هذا العدد من الموظفين يُقيَّد الاستعلام بـ IN بدل الفلترة في الذاكرة
+
+
+def load_period_inputs(period_start: date, period_end: date, employee_ids=None):
+    """تحميل الحضور والإجازات والسلف للفترة بثلاثة استعلامات مجمّعة.
+    employee_ids: مجموعة اختيارية لتقييد النتائج (None = الجميع).
+    """
+    _, work_start_time = get_work_schedule()
+    calendar = period_calendar(period_start, period_end)
+    ids = set(employee_ids) if employee_ids is not None else None
+    in_filter = ids is not None and len(ids) <= _IN_FILTER_MAX
+
+    # أول دخول لكل (موظف، يوم) — وجود الصف يعني وجود سجل حضور
+    if rollup_ready():
+        # من التجميع اليومي مباشرة (بدون GROUP BY على الجدول الخام)
+        att_q = db.session.query(
+            AttendanceDaily.employee_id, AttendanceDaily.date, AttendanceDaily.first_in
+        ).filter(
+            AttendanceDaily.date >= period_start,
+            AttendanceDaily.date <= period_end,
+            AttendanceDaily.day_status == PRESENT
+        )
+        if in_filter:
+            att_q = att_q.filter(AttendanceDaily.employee_id.in_(ids))
+    else:
+        att_q = db.session.query(
+            Attendance.employee_id, Attendance.date, func.min(Attendance.check_in_time)
+        ).filter(
+            Attendance.date >= period_start,
+            Attendance.date <= period_end
+        )
+        if in_filter:
+            att_q = att_q.filter(Attendance.employee_id.in_(ids))
+        att_q = att_q.group_by(Attendance.employee_id, Attendance.date)
+    rows = att_q.all()
+    emp_arr = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+    day_arr = to_days(r[1] for r in rows)
+    first_in_arr = np.array([r[2] for r in rows], dtype='datetime64[s]')
+    keep = np.ones(len(rows), dtype=bool) if ids is None else np.isin(emp_arr, list(ids))
+    offsets = (day_arr - calendar.days[0]).astype(np.int64) if len(rows) else np.empty(0, np.int64)
+    keep &= (offsets >= 0) & (offsets < len(calendar))
+    attendance = (emp_arr[keep], offsets[keep], first_in_arr[keep])
+
+    leave_q = Leave.query.filter(
+        Leave.status == 'Approved',
+        Leave.end_date >= period_start,
+        Leave.start_date <= period_end
+    )
+    if in_filter:
+        leave_q = leave_q.filter(Leave.employee_id.in_(ids))
+    leaves = {}
+    for lv in leave_q:
+        if ids is not None and lv.employee_id not in ids:
+            continue
+        leaves.setdefault(lv.employee_id, []).append(lv)
+
+    auto_loan = current_app.config.get('PAYROLL_AUTO_LOAN_DEDUCTION', True)
+    loans = {}
+    if auto_loan:
+        loan_q = EmployeeLoan.query.filter(EmployeeLoan.status == 'active')
+        if in_filter:
+            loan_q = loan_q.filter(EmployeeLoan.employee_id.in_(ids))
+        for loan in loan_q:
+            if ids is not None and loan.employee_id not in ids:
+                continue
+            loans.setdefault(loan.employee_id, []).append(loan)
+
+    return PeriodInputs(period_start, period_end, calendar, work_start_time,
+                        attendance, leaves, loans, auto_loan)
+
+
+_PAYROLL_INSERT_COLUMNS = [c.key for c in Payroll.__table__.columns if c.key != 'id']
+
+
+def payroll_to_row(payroll):
+    """تحويل كائن راتب (غير محفوظ) إلى قاموس صالح للإدراج المجمّع."""
+    row = {}
+    for key in _PAYROLL_INSERT_COLUMNS:
+        value = getattr(payroll, key)
+        if value is not None:
+            row[key] = value
+    return row
+
+
+def build_batch_payrolls(templates, month: int, year: int, generated_by=None, inputs=None):
+    """حساب رواتب الشهر لكل القوالب في الذاكرة.
+    يرجع (rows, totals) حيث rows قواميس جاهزة لـ bulk insert.
+    """
+    period_start = date(year, month, 1)
+    period_end = period_start + relativedelta(months=1, days=-1)
+    if inputs is None:
+        inputs = load_period_inputs(period_start, period_end, {t.employee_id for t in templates})
+    cfg = current_app.config
+    now = datetime.utcnow()
+
+    payrolls = []
+    for template in templates:
+        payroll = Payroll(
+            employee_id=template.employee_id,
+            month=month,
+            year=year,
+            period_start=period_start,
+            period_end=period_end,
+            basic=float(template.basic_salary or 0.0),
+            housing_allowance=template.housing_allowance,
+            transport_allowance=template.transport_allowance,
+            food_allowance=template.food_allowance,
+            phone_allowance=template.phone_allowance,
+            other_allowances=template.other_allowances,
+            status='pending',
+            generated_by=generated_by,
+            generated_at=now
+        )
+        abs_days, late_mins, working_days = inputs.attendance_metrics(template.employee_id)
+        paid_dates, unpaid_dates = inputs.leave_dates(template.employee_id)
+        apply_attendance_deductions(payroll, abs_days, late_mins, working_days, paid_dates, unpaid_dates, cfg)
+        payroll.loan_deduction = inputs.loan_due(template.employee_id)
+        payrolls.append(payroll)
+
+    # حساب الصافي لكل الدفعة عبر النواة العمودية
+    Payroll.compute_net_many(payrolls, cfg=cfg)
+
+    rows = [payroll_to_row(p) for p in payrolls]
+    totals = {
+        'gross': sum(float(p.gross_salary or 0.0) for p in payrolls),
+        'deductions': sum(float(p.total_deductions or 0.0) for p in payrolls),
+        'net': sum(float(p.net or 0.0) for p in payrolls),
+    }
+    totals = {k: round(v, 2) for k, v in totals.items()}
+    return rows, totals
+
+
+def bulk_insert_payrolls(rows, chunk_size=1000):
+    """إدراج صفوف الرواتب بدفعات executemany بدلاً من add() لكل سجل."""
+    for i in range(0, len(rows), chunk_size):
+        db.session.bulk_insert_mappings(Payroll, rows[i:i + chunk_size])
+    return len(rows)
+
+
+def recalculate_payrolls(payrolls, period_start: date, period_end: date, inputs=None):
+    """إعادة حساب رواتب موجودة من الحضور والإجازات والسلف بتحميل مجمّع.
+    ترجع (عدد السجلات، مجموع فروقات الصافي).
+    """
+    payrolls = list(payrolls)
+    if not payrolls:
+        return 0, 0.0
+    if inputs is None:
+        inputs = load_period_inputs(period_start, period_end, {p.employee_id for p in payrolls})
+    cfg = current_app.config
+    before = [float(p.net or 0.0) for p in payrolls]
+
+    for p in payrolls:
+        abs_days, late_mins, working_days = inputs.attendance_metrics(p.employee_id)
+        paid_dates, unpaid_dates = inputs.leave_dates(p.employee_id)
+        apply_attendance_deductions(p, abs_days, late_mins, working_days, paid_dates, unpaid_dates, cfg)
+        p.loan_deduction = inputs.loan_due(p.employee_id)
+
+    Payroll.compute_net_many(payrolls, cfg=cfg)
+
+    now = datetime.utcnow()
+    total_diff = 0.0
+    for p, before_net in zip(payrolls, before):
+        diff = round(float(p.net or 0.0) - before_net, 2)
+        p.last_recalc_net_diff = diff
+        p.last_recalc_at = now
+        total_diff = round(total_diff + diff, 2)
+    return len(payrolls), total_diff
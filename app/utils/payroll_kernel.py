@@ -0,0 +1,93 @@
+"""
+نواة حساب الرواتب العمودية (NumPy)
+تحسب الإجمالي والضريبة والتأمينات والصافي لمصفوفات كاملة دفعة واحدة
+بنفس ترتيب العمليات والتقريب في Payroll.compute_net حتى تتطابق النتائج بالهللة.
+"""
+import numpy as np
+
+
+def rates_from_config(cfg):
+    """قراءة نسب الضريبة والتأمينات من الإعدادات مرة واحدة (نفس افتراضيات compute_net)."""
+    cfg = cfg or {}
+    return {
+        'tax_rate': float(cfg.get('PAYROLL_TAX_RATE', 0.10)),
+        'insurance_rate': float(cfg.get('PAYROLL_INSURANCE_RATE', 0.02)),
+        'health_insurance_rate': float(cfg.get('PAYROLL_HEALTH_INSURANCE_RATE', 0.01)),
+        'exempt_limit': float(cfg.get('PAYROLL_TAX_EXEMPT_LIMIT', 0.0)),
+    }
+
+
+def round_cents(values):
+    """تقريب إلى منزلتين مطابق لـ round() في بايثون.
+    np.round يضرب في 100 ثم يقرّب، وقد يختلف عن round() في حالات الحد (x.xx5)،
+    لذا تُعاد حالات الحد القليلة عبر round() العادية.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    out = np.round(values, 2)
+    scaled = values * 100.0
+    frac = np.abs(scaled - np.trunc(scaled))
+    ties = np.nonzero(np.abs(frac - 0.5) < 1e-6)[0] if out.ndim else ()
+    for i in ties:
+        out[i] = round(float(values[i]), 2)
+    return out
+
+
+def _col(value, n):
+    arr = np.asarray(value, dtype=np.float64)
+    if arr.ndim == 0:
+        return np.full(n, float(arr))
+    return np.nan_to_num(arr, nan=0.0)
+
+
+def allowances_total(housing, transport, food, phone, other, allowances):
+    """مكافئ Payroll.calculate_allowances: البدلات التفصيلية إن وُجدت وإلا الحقل allowances."""
+    detailed = housing + transport + food + phone + other
+    return np.where(detailed > 0, detailed, allowances)
+
+
+def deductions_total(absence, late, loan, unpaid_leave, other):
+    """مكافئ Payroll.calculate_deductions."""
+    return absence + late + loan + unpaid_leave + other
+
+
+def compute_net_arrays(basic, allowances, bonus, commission, overtime_amount, incentives, deductions,
+                       tax_rate=0.10, insurance_rate=0.02, health_insurance_rate=0.01,
+                       exempt_limit=0.0, apply_rules=True):
+    """حساب صافي الرواتب لدفعة كاملة.
+    المدخلات مصفوفات متساوية الطول (أو أرقام ثابتة للنسب)، وقيم NaN تعامل كصفر.
+    ترجع قاموس مصفوفات: gross, tax, insurance, health_insurance, total_deductions, net
+    """
+    basic = np.asarray(basic, dtype=np.float64)
+    n = basic.shape[0]
+    basic = np.nan_to_num(basic, nan=0.0)
+    allowances = _col(allowances, n)
+    deductions = _col(deductions, n)
+
+    gross = basic + allowances + _col(bonus, n) + _col(commission, n) + _col(overtime_amount, n) + _col(incentives, n)
+
+    if apply_rules:
+        tax_rate = _col(tax_rate, n)
+        insurance_rate = _col(insurance_rate, n)
+        health_insurance_rate = _col(health_insurance_rate, n)
+        exempt_limit = _col(exempt_limit, n)
+
+        taxable = np.maximum(0.0, gross - deductions)
+        tax = np.where(taxable > exempt_limit, round_cents(taxable * tax_rate), 0.0)
+        insurance_base = basic + allowances
+        insurance = round_cents(insurance_base * insurance_rate)
+        health_insurance = round_cents(insurance_base * health_insurance_rate)
+    else:
+        tax = np.zeros(n)
+        insurance = np.zeros(n)
+        health_insurance = np.zeros(n)
+
+    total_deductions = deductions + tax + insurance + health_insurance
+    net = round_cents(gross - total_deductions)
+    return {
+        'gross': gross,
+        'tax': tax,
+        'insurance': insurance,
+        'health_insurance': health_insurance,
+        'total_deductions': total_deductions,
+        'net': net,
+    }
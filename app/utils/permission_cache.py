@@ -0,0 +1,51 @@
+"""
+محلل الصلاحيات المجمّع مسبقاً
+صلاحيات كل مستخدم الفعلية تُحسب مرة واحدة باستعلام واحد (أدواره النشطة × الصلاحيات الممنوحة)
+وتُحفظ كـ frozenset من (module, action) داخل العملية، فيصبح الفحص بحث O(1) بدون استعلامات.
+الكاش يُبطَل بزيادة الجيل 'permissions' عند أي تعديل على الأدوار أو التعيينات
+(invalidate_permissions) من مسارات /api/roles و /api/user-roles.
+"""
+from sqlalchemy import select
+
+from app import db
+from app.models.permission import Role, Permission, RolePermission, UserRole
+from app.utils.cache_generation import get_generation, bump_generation
+
+PERMISSIONS_GENERATION = 'permissions'
+_MAX_CACHED_USERS = 10000
+
+_cache = {}  # user_id -> (generation, frozenset)
+
+
+def _load_permissions(user_id):
+    q = (
+        select(Permission.module, Permission.action)
+        .join(RolePermission, RolePermission.permission_id == Permission.id)
+        .join(Role, Role.id == RolePermission.role_id)
+        .join(UserRole, UserRole.role_id == Role.id)
+        .where(
+            UserRole.user_id == user_id,
+            Role.is_active == True,
+            RolePermission.granted == True
+        )
+    )
+    with db.session.no_autoflush:
+        return frozenset((module, action) for module, action in db.session.execute(q))
+
+
+def effective_permissions(user_id):
+    """مجموعة (module, action) الممنوحة للمستخدم عبر أدواره النشطة."""
+    generation = get_generation(PERMISSIONS_GENERATION)
+    entry = _cache.get(user_id)
+    if entry is not None and entry[0] == generation:
+        return entry[1]
+    perms = _load_permissions(user_id)
+    if len(_cache) >= _MAX_CACHED_USERS:
+        _cache.clear()
+    _cache[user_id] = (generation, perms)
+    return perms
+
+
+def invalidate_permissions():
+    """إبطال صلاحيات جميع المستخدمين في كل العمليات (ضمن معاملة التعديل)."""
+    bump_generation(PERMISSIONS_GENERATION)
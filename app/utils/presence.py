@@ -0,0 +1,443 @@
+"""
+مخزن التواجد المشترك (Presence store) مع كتابة مؤجلة (write-behind)
+- النبضة (/api/presence/update) لا تكتب في قاعدة البيانات: تُدمج في ذاكرة العملية
+  (آخر نبضة لكل موظف فقط) بحد أقصى PRESENCE_BUFFER_MAX.
+- خيط لكل عملية يفرّغ الذاكرة كل PRESENCE_FLUSH_SECONDS بعبارة upsert واحدة إلى
+  presence_heartbeat (جدول UNLOGGED مشترك بين عمال gunicorn).
+- كل PRESENCE_SYNC_SECONDS تُنقل النبضات الجديدة إلى EmployeePresence دفعة واحدة
+  (تحديث الصفوف المتغيرة فقط)، وتُحسب انتقالات online/away/offline بعبارتي UPDATE
+  من وقت آخر ظهور، بدل حسابها في كل طلب، وتُبث كأحداث SSE (app/utils/feed.py).
+- الحالة تُحسب من Settings.presence_interval_min و presence_grace_min:
+  online حتى (الفترة + السماح)، away حتى (فترتين + السماح)، ثم offline.
+- لوحة التواجد: استعلام واحد (Employee LEFT JOIN النبضات/EmployeePresence) مع فلاتر
+  وترقيم keyset، وبصمة ETag من استعلام تجميعي واحد.
+"""
+import atexit
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, bindparam, case, func, literal, or_, select, update
+
+from app import db
+from app.models.employee import Employee
+from app.models.presence import EmployeePresence, PresenceHeartbeat
+from app.utils.cache_generation import get_generation
+from app.utils.feed import PRESENCE, publish_many
+from app.utils.identity import IDENTITY_GENERATION
+from app.utils.settings_cache import SETTINGS_GENERATION, system_settings
+
+ONLINE = 'online'
+AWAY = 'away'
+OFFLINE = 'offline'
+
+_store = None
+_store_lock = threading.Lock()
+_IN_CHUNK = 500
+
+
+def presence_windows(settings=None):
+    """(فترة النبضة، نافذة online، نافذة away) كـ timedelta من لقطة الإعدادات."""
+    settings = settings or system_settings()
+    interval = timedelta(minutes=max(1, int(getattr(settings, 'presence_interval_min', None) or 30)))
+    grace = timedelta(minutes=max(0, int(getattr(settings, 'presence_grace_min', None) or 0)))
+    return interval, interval + grace, 2 * interval + grace
+
+
+def status_for(last_seen, now=None, windows=None):
+    """حالة الموظف من وقت آخر ظهور."""
+    if last_seen is None:
+        return OFFLINE
+    now = now or datetime.utcnow()
+    _, online_window, away_window = windows or presence_windows()
+    age = now - last_seen
+    if age <= online_window:
+        return ONLINE
+    if age <= away_window:
+        return AWAY
+    return OFFLINE
+
+
+class PresenceStore:
+    """ذاكرة النبضات لهذه العملية وخيط التفريغ/المزامنة."""
+
+    def __init__(self, app):
+        self.app = app
+        self.pid = os.getpid()
+        self.flush_seconds = float(app.config.get('PRESENCE_FLUSH_SECONDS', 5.0))
+        self.sync_seconds = float(app.config.get('PRESENCE_SYNC_SECONDS', 60.0))
+        self.buffer_max = int(app.config.get('PRESENCE_BUFFER_MAX', 10000))
+        self._buffer = {}  # employee_id -> (last_seen, ip_address)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._watermark = None  # أحدث last_seen نُقل إلى EmployeePresence
+        self.stats = {'heartbeats': 0, 'flushes': 0, 'flushed_rows': 0, 'syncs': 0}
+
+    @property
+    def write_behind(self):
+        return self.flush_seconds > 0
+
+    def start(self):
+        if self.write_behind:
+            self._thread = threading.Thread(target=self._loop, name='presence-flusher', daemon=True)
+            self._thread.start()
+            atexit.register(self._flush_at_exit)
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    # --- مسار الطلب ---
+
+    def heartbeat(self, employee_id, ip_address=None, now=None):
+        now = now or datetime.utcnow()
+        with self._lock:
+            self._buffer[employee_id] = (now, ip_address)
+            self.stats['heartbeats'] += 1
+            full = len(self._buffer) >= self.buffer_max
+        if not self.write_behind or full:
+            self.flush()
+        return now
+
+    def pending(self, employee_id):
+        """آخر نبضة لم تُفرّغ بعد لهذا الموظف (أو None)."""
+        with self._lock:
+            entry = self._buffer.get(employee_id)
+        return entry[0] if entry else None
+
+    # --- الخيط الخلفي ---
+
+    def _loop(self):
+        next_sync = time.monotonic() + self.sync_seconds
+        while not self._stop.wait(self.flush_seconds):
+            with self.app.app_context():
+                try:
+                    self.flush()
+                    if time.monotonic() >= next_sync:
+                        next_sync = time.monotonic() + self.sync_seconds
+                        self.sync()
+                except Exception as e:
+                    self.app.logger.error(f"Presence flush failed: {e}")
+                finally:
+                    db.session.remove()
+
+    def _flush_at_exit(self):
+        if self.pid != os.getpid() or not self._buffer:
+            return
+        try:
+            with self.app.app_context():
+                self.flush()
+                db.session.remove()
+        except Exception:
+            pass
+
+    def flush(self):
+        """كتابة النبضات المتراكمة في presence_heartbeat بعبارة واحدة. ترجع عدد الصفوف."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._buffer = self._buffer, {}
+            if not batch:
+                return 0
+            rows = [{'employee_id': emp_id, 'last_seen': seen, 'session_start': seen, 'ip_address': ip}
+                    for emp_id, (seen, ip) in batch.items()]
+            _, _, away_window = presence_windows()
+            session_cutoff = min(r['last_seen'] for r in rows) - away_window
+            try:
+                with db.engine.begin() as connection:
+                    _upsert_heartbeats(connection, rows, session_cutoff)
+            except Exception:
+                # إعادة النبضات للذاكرة ما لم تصلها نبضة أحدث؛ تُعاد المحاولة في الدورة التالية
+                with self._lock:
+                    for emp_id, entry in batch.items():
+                        self._buffer.setdefault(emp_id, entry)
+                raise
+            self.stats['flushes'] += 1
+            self.stats['flushed_rows'] += len(rows)
+            return len(rows)
+
+    def sync(self, now=None):
+        """نقل النبضات الجديدة إلى EmployeePresence وتطبيق انتقالات away/offline."""
+        now = now or datetime.utcnow()
+        windows = presence_windows()
+        _, online_window, away_window = windows
+        if self._watermark is None:
+            since = now - away_window
+        else:
+            # هامش لنبضات عمال آخرين فُرّغت متأخرة بتوقيت أقدم (المزامنة idempotent)
+            since = self._watermark - timedelta(seconds=2 * max(self.flush_seconds, 1.0))
+        with db.engine.begin() as connection:
+            watermark, changes = _sync_presence(connection, since, now, windows)
+            presence = EmployeePresence.__table__
+            changes += _transition(connection, AWAY, and_(
+                presence.c.status == ONLINE, presence.c.last_activity < now - online_window
+            ))
+            changes += _transition(connection, OFFLINE, and_(
+                or_(presence.c.status != OFFLINE, presence.c.status.is_(None)),
+                or_(presence.c.last_activity < now - away_window, presence.c.last_activity.is_(None)),
+            ))
+            # الانتقالات تُبث في نفس المعاملة (app/utils/feed.py)
+            publish_many(connection, PRESENCE, changes)
+        if watermark:
+            self._watermark = max(watermark, self._watermark or watermark)
+        self.stats['syncs'] += 1
+
+
+def _transition(connection, status, condition):
+    """تطبيق انتقال حالة بعبارة UPDATE واحدة. ترجع الأحداث {employee_id, status, last_activity}."""
+    presence = EmployeePresence.__table__
+    stmt = update(presence).where(condition).values(status=status)
+    if connection.dialect.update_returning:
+        rows = connection.execute(stmt.returning(presence.c.employee_id, presence.c.last_activity)).all()
+    else:
+        rows = connection.execute(
+            select(presence.c.employee_id, presence.c.last_activity).where(condition)
+        ).all()
+        connection.execute(stmt)
+    return [{'employee_id': r.employee_id, 'status': status, 'last_activity': r.last_activity}
+            for r in rows if r.employee_id is not None]
+
+
+def _upsert_heartbeats(connection, rows, session_cutoff):
+    table = PresenceHeartbeat.__table__
+    dialect = connection.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(table)
+        excluded = stmt.excluded
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['employee_id'],
+            set_={
+                # عمال مختلفون قد يفرّغون بترتيب غير زمني: الأحدث يغلب
+                'last_seen': case((excluded.last_seen > table.c.last_seen, excluded.last_seen),
+                                  else_=table.c.last_seen),
+                'ip_address': case((excluded.last_seen > table.c.last_seen, excluded.ip_address),
+                                   else_=table.c.ip_address),
+                # جلسة جديدة إذا انقطعت النبضات أكثر من نافذة away
+                'session_start': case((table.c.last_seen < session_cutoff, excluded.session_start),
+                                      else_=table.c.session_start),
+            },
+        )
+        connection.execute(stmt, rows)
+        return
+    known = set()
+    ids = [r['employee_id'] for r in rows]
+    for i in range(0, len(ids), _IN_CHUNK):
+        known.update(connection.execute(
+            select(table.c.employee_id).where(table.c.employee_id.in_(ids[i:i + _IN_CHUNK]))
+        ).scalars())
+    updates = [{'k_emp': r['employee_id'], 'n_seen': r['last_seen'], 'n_ip': r['ip_address']}
+               for r in rows if r['employee_id'] in known]
+    inserts = [r for r in rows if r['employee_id'] not in known]
+    if updates:
+        connection.execute(
+            update(table).where(table.c.employee_id == bindparam('k_emp')).values(
+                last_seen=bindparam('n_seen'),
+                ip_address=bindparam('n_ip'),
+                session_start=case((table.c.last_seen < session_cutoff, bindparam('n_seen')),
+                                   else_=table.c.session_start),
+            ),
+            updates,
+        )
+    if inserts:
+        connection.execute(table.insert(), inserts)
+
+
+def _sync_presence(connection, since, now, windows):
+    """يرجع (أحدث last_seen نُقل أو None، أحداث تغيّر الحالة)."""
+    heartbeat = PresenceHeartbeat.__table__
+    presence = EmployeePresence.__table__
+    employee = Employee.__table__
+    rows = connection.execute(
+        select(heartbeat.c.employee_id, heartbeat.c.last_seen, heartbeat.c.session_start, heartbeat.c.ip_address,
+               employee.c.id.label('known'))
+        .select_from(heartbeat.outerjoin(employee, employee.c.id == heartbeat.c.employee_id))
+        .where(heartbeat.c.last_seen > since)
+    ).all()
+    # نبضة لموظف محذوف أو معرّف غير موجود: employee_presence له FK على employee، فإدراجها يُفشل
+    # معاملة المزامنة كلها في كل دورة (PostgreSQL) فلا يتقدم الحد. تُحذف من المخزن المشترك.
+    unknown = [r.employee_id for r in rows if r.known is None]
+    for i in range(0, len(unknown), _IN_CHUNK):
+        connection.execute(heartbeat.delete().where(heartbeat.c.employee_id.in_(unknown[i:i + _IN_CHUNK])))
+    beats = [r for r in rows if r.known is not None]
+    if not beats:
+        return None, []
+
+    current = {}
+    ids = [b.employee_id for b in beats]
+    for i in range(0, len(ids), _IN_CHUNK):
+        for row in connection.execute(
+            select(presence.c.id, presence.c.employee_id, presence.c.status, presence.c.last_activity)
+            .where(presence.c.employee_id.in_(ids[i:i + _IN_CHUNK]))
+            .order_by(presence.c.id)
+        ):
+            current.setdefault(row.employee_id, row)
+
+    updates, inserts, changes = [], [], []
+    for beat in beats:
+        status = status_for(beat.last_seen, now, windows)
+        row = current.get(beat.employee_id)
+        if row is None or row.status != status:
+            changes.append({'employee_id': beat.employee_id, 'status': status, 'last_activity': beat.last_seen})
+        if row is None:
+            inserts.append({
+                'employee_id': beat.employee_id, 'status': status, 'last_activity': beat.last_seen,
+                'session_start': beat.session_start or beat.last_seen, 'ip_address': beat.ip_address,
+                'created_at': now,
+            })
+        elif row.last_activity != beat.last_seen or row.status != status:
+            updates.append({
+                'k_id': row.id, 'n_status': status, 'n_seen': beat.last_seen,
+                'n_start': beat.session_start or beat.last_seen, 'n_ip': beat.ip_address,
+            })
+    if updates:
+        connection.execute(
+            update(presence).where(presence.c.id == bindparam('k_id')).values(
+                status=bindparam('n_status'),
+                last_activity=bindparam('n_seen'),
+                session_start=bindparam('n_start'),
+                ip_address=bindparam('n_ip'),
+            ),
+            updates,
+        )
+    if inserts:
+        connection.execute(presence.insert(), inserts)
+    return max(b.last_seen for b in beats), changes
+
+
+def get_presence_store(app=None):
+    """مخزن هذه العملية (يُنشأ عند أول استخدام وبعد fork لعمال gunicorn)."""
+    global _store
+    app = app or current_app._get_current_object()
+    with _store_lock:
+        if _store is None or _store.pid != os.getpid() or _store.app is not app:
+            if _store is not None and _store.pid == os.getpid():
+                _store.stop()
+            _store = PresenceStore(app).start()
+        return _store
+
+
+def record_heartbeat(employee_id, ip_address=None):
+    return get_presence_store().heartbeat(employee_id, ip_address)
+
+
+def last_seen(employee_id):
+    """آخر ظهور: من ذاكرة هذه العملية، ثم المخزن المشترك، ثم EmployeePresence (بيانات قديمة)."""
+    seen = get_presence_store().pending(employee_id)
+    if seen is not None:
+        return seen
+    seen = db.session.execute(
+        select(PresenceHeartbeat.last_seen).where(PresenceHeartbeat.employee_id == employee_id)
+    ).scalar()
+    if seen is None:
+        seen = db.session.execute(
+            select(EmployeePresence.last_activity)
+            .where(EmployeePresence.employee_id == employee_id)
+            .order_by(EmployeePresence.id).limit(1)
+        ).scalar()
+    return seen
+
+
+def employee_status(employee_id):
+    seen = last_seen(employee_id)
+    return {'status': status_for(seen), 'last_activity': seen}
+
+
+# --- لوحة التواجد ---
+
+def _dashboard_source(now, windows):
+    """(الأعمدة، from مع الـ joins، تعبير آخر ظهور، تعبير الحالة) للوحة.
+    EmployeePresence قد يحوي أكثر من صف للموظف: يُختار أقدمها (min id) داخل نفس الاستعلام.
+    """
+    _, online_window, away_window = windows
+    first_row = (
+        select(EmployeePresence.employee_id.label('employee_id'), func.min(EmployeePresence.id).label('row_id'))
+        .group_by(EmployeePresence.employee_id)
+        .subquery()
+    )
+    joined = (
+        Employee.__table__
+        .outerjoin(PresenceHeartbeat.__table__, PresenceHeartbeat.employee_id == Employee.id)
+        .outerjoin(first_row, first_row.c.employee_id == Employee.id)
+        .outerjoin(EmployeePresence.__table__, EmployeePresence.id == first_row.c.row_id)
+    )
+    seen = func.coalesce(PresenceHeartbeat.last_seen, EmployeePresence.last_activity)
+    status = case(
+        (seen >= now - online_window, literal(ONLINE)),
+        (seen >= now - away_window, literal(AWAY)),
+        else_=literal(OFFLINE),
+    )
+    return joined, seen, status
+
+
+def _dashboard_filters(seen, now, windows, department=None, status=None):
+    _, online_window, away_window = windows
+    filters = []
+    if department:
+        filters.append(Employee.department == department)
+    if status == ONLINE:
+        filters.append(seen >= now - online_window)
+    elif status == AWAY:
+        filters.append(seen < now - online_window)
+        filters.append(seen >= now - away_window)
+    elif status == OFFLINE:
+        filters.append(or_(seen.is_(None), seen < now - away_window))
+    return filters
+
+
+def dashboard_etag(department=None, status=None, after=None, limit=None, now=None):
+    """بصمة ضعيفة للوحة: أحدث ظهور + أعداد online/away (تتغير عند عبور أي موظف لحد
+    الحالة مع الوقت) + أجيال الموظفين والإعدادات + معاملات الطلب. استعلام واحد."""
+    now = now or datetime.utcnow()
+    windows = presence_windows()
+    _, online_window, away_window = windows
+    joined, seen, _ = _dashboard_source(now, windows)
+    row = db.session.execute(
+        select(
+            func.max(seen),
+            func.count(),
+            func.sum(case((seen >= now - online_window, 1), else_=0)),
+            func.sum(case((seen >= now - away_window, 1), else_=0)),
+        ).select_from(joined).where(*_dashboard_filters(seen, now, windows, department, status))
+    ).one()
+    parts = (row[0], row[1], row[2] or 0, row[3] or 0, department, status, after, limit,
+             get_generation(IDENTITY_GENERATION), get_generation(SETTINGS_GENERATION))
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:32]
+
+
+def dashboard_page(department=None, status=None, after=None, limit=100, now=None):
+    """صفحة من اللوحة مرتبة بمعرّف الموظف (keyset: after = آخر معرّف في الصفحة السابقة).
+    يرجع (العناصر، next_cursor أو None)."""
+    now = now or datetime.utcnow()
+    windows = presence_windows()
+    joined, seen, status_expr = _dashboard_source(now, windows)
+    filters = _dashboard_filters(seen, now, windows, department, status)
+    if after is not None:
+        filters.append(Employee.id > after)
+    rows = db.session.execute(
+        select(
+            Employee.id, Employee.name, Employee.department,
+            status_expr.label('status'), seen.label('last_activity'),
+            func.coalesce(PresenceHeartbeat.session_start, EmployeePresence.session_start).label('session_start'),
+        )
+        .select_from(joined).where(*filters)
+        .order_by(Employee.id).limit(limit + 1)
+    ).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    items = [{
+        'employee_id': r.id,
+        'name': r.name,
+        'department': r.department,
+        'status': r.status,
+        'last_activity': r.last_activity,
+        'session_start': r.session_start,
+    } for r in rows]
+    return items, (rows[-1].id if more and rows else None)
@@ -0,0 +1,308 @@
+"""
+محرك تقارير الحضور المجمّعة (AttendanceReport) لكل الموظفين دفعة واحدة
+- جلب واحد لسجلات الفترة (من التجميع اليومي إن كان مبنياً، وإلا من جدول الحضور الخام)
+  ثم تجميع NumPy لكل موظف (bincount) بنفس قواعد تقرير الموظف الواحد.
+- الكتابة upsert مجمّع على (employee_id, period_type, period_start, period_end): تحديث التقارير
+  الموجودة بمعرّفاتها (تبقى روابط الرواتب صالحة) وإدراج الجديد، بدون استعلام لكل موظف.
+- ربط اختياري براتب نفس الشهر (PayrollAttendanceLink) في نفس المعاملة. المبالغ تُسجل في
+  الرابط فقط ولا تُضاف للراتب: دفعة الرواتب تحتسب خصومات الحضور بنفسها.
+- المستأجرون الكبار: أجزاء الموظفين تُحسب في ProcessPoolExecutor (كل عامل يجلب جزءه)،
+  والكتابة من العملية الأم. SQLite أو أقل من ATTENDANCE_REPORT_POOL_MIN موظف: داخل العملية.
+  العمال تُنشأ بـ spawn وتبني تطبيقها الخاص: المهمة تعمل في خيط JobRunner داخل عملية ويب
+  متعددة الخيوط، و fork منها قد يرث أقفالاً محجوزة (اتصالات، logging) فيتجمد الابن.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import bindparam, select, update
+
+from app import db
+from app.models.attendance import Attendance, AttendanceDaily
+from app.models.attendance_advanced import AttendanceReport, PayrollAttendanceLink
+from app.models.employee import Employee
+from app.models.payroll import Payroll
+from app.utils.attendance_daily import PRESENT, overtime_after_minutes, rollup_ready
+from app.utils.late_stats import late_grace_minutes
+from app.utils.settings_cache import attendance_settings
+
+_IN_CHUNK = 500
+_US_PER_MINUTE = 60 * 1000000
+
+STAT_FIELDS = (
+    'present_days', 'late_days', 'total_work_minutes', 'total_late_minutes', 'total_overtime_minutes',
+    'location_violations', 'time_violations', 'device_violations',
+)
+
+
+def report_employee_ids(department=None, employee_ids=None):
+    """الموظفون النشطون المشمولون بالتقرير (اختيارياً لقسم أو قائمة محددة)."""
+    query = select(Employee.id).where(Employee.active == True)
+    if department:
+        query = query.where(Employee.department == department)
+    ids = db.session.execute(query.order_by(Employee.id)).scalars().all()
+    if employee_ids is not None:
+        wanted = set(employee_ids)
+        ids = [i for i in ids if i in wanted]
+    return ids
+
+
+def _time_us(t):
+    return ((t.hour * 60 + t.minute) * 60 + t.second) * 1000000 + t.microsecond
+
+
+def _fetch(columns, table_date, table_emp, conditions, ids, period_start, period_end):
+    rows = []
+    for i in range(0, len(ids), _IN_CHUNK):
+        rows.extend(db.session.execute(select(*columns).where(
+            table_date >= period_start, table_date <= period_end, table_emp.in_(ids[i:i + _IN_CHUNK]), *conditions
+        )).all())
+    return rows
+
+
+def _flags(rows, start):
+    """أعلام التحقق الثلاثة كمصفوفات (None = مخالفة كما في التقرير الفردي)."""
+    return [np.fromiter((not r[k] for r in rows), dtype=bool, count=len(rows)) for k in range(start, start + 3)]
+
+
+def compute_report_stats(employee_ids, period_start, period_end, grace=None, use_rollup=None):
+    """{employee_id: {field: value}} لإحصائيات STAT_FIELDS من جلب واحد لكل جزء IN."""
+    ids = sorted(set(employee_ids))
+    stats = {emp_id: dict.fromkeys(STAT_FIELDS, 0) for emp_id in ids}
+    if not ids:
+        return stats
+    grace = late_grace_minutes() if grace is None else grace
+    use_rollup = rollup_ready() if use_rollup is None else use_rollup
+    index = np.asarray(ids, dtype=np.int64)
+
+    if use_rollup:
+        rows = _fetch((AttendanceDaily.employee_id, AttendanceDaily.first_in, AttendanceDaily.late_minutes,
+                       AttendanceDaily.worked_minutes, AttendanceDaily.overtime_minutes,
+                       AttendanceDaily.location_verified, AttendanceDaily.time_verified,
+                       AttendanceDaily.device_verified),
+                      AttendanceDaily.date, AttendanceDaily.employee_id, [AttendanceDaily.day_status == PRESENT],
+                      ids, period_start, period_end)
+        if not rows:
+            return stats
+        emp = np.searchsorted(index, np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows)))
+        checked_in = np.fromiter((r[1] is not None for r in rows), dtype=bool, count=len(rows))
+        late = np.fromiter((r[2] or 0 for r in rows), dtype=np.int64, count=len(rows))
+        worked = np.fromiter((r[3] or 0 for r in rows), dtype=np.int64, count=len(rows))
+        overtime = np.fromiter((r[4] or 0 for r in rows), dtype=np.int64, count=len(rows))
+        present = checked_in
+        late_counted = checked_in & (late > grace)
+    else:
+        settings = attendance_settings()
+        check_in_end = getattr(settings, 'check_in_end', None)
+        min_work_minutes = overtime_after_minutes(settings)
+        rows = _fetch((Attendance.employee_id, Attendance.date, Attendance.check_in_time, Attendance.check_out_time,
+                       Attendance.location_verified, Attendance.time_verified, Attendance.device_verified),
+                      Attendance.date, Attendance.employee_id, [], ids, period_start, period_end)
+        if not rows:
+            return stats
+        emp = np.searchsorted(index, np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows)))
+        days = np.array([r[1] for r in rows], dtype='datetime64[D]')
+        ins = np.array([r[2] for r in rows], dtype='datetime64[us]')
+        outs = np.array([r[3] for r in rows], dtype='datetime64[us]')
+        checked_in = ~np.isnat(ins)
+        # يوم حضور = (موظف، تاريخ) فيه دخول؛ الفهرس الفريد يضمن سجلاً واحداً لكل يوم
+        present = checked_in
+        late = np.zeros(len(rows), dtype=np.int64)
+        late_counted = np.zeros(len(rows), dtype=bool)
+        if check_in_end is not None:
+            end_us = _time_us(check_in_end)
+            safe_ins = np.where(checked_in, ins, days.astype('datetime64[us]'))
+            after_end = checked_in & ((safe_ins - safe_ins.astype('datetime64[D]')).astype(np.int64) > end_us)
+            delta = (safe_ins - days.astype('datetime64[us]')).astype(np.int64) - end_us
+            late = np.trunc(delta / _US_PER_MINUTE).astype(np.int64)
+            late_counted = after_end & (late > grace)
+        both = checked_in & ~np.isnat(outs)
+        worked = np.zeros(len(rows), dtype=np.int64)
+        worked[both] = np.trunc((outs[both] - ins[both]).astype(np.int64) / _US_PER_MINUTE).astype(np.int64)
+        overtime = np.where(both & (worked > min_work_minutes), worked - min_work_minutes, 0)
+
+    location, time_flag, device = _flags(rows, 5 if use_rollup else 4)
+    n = len(ids)
+    totals = {
+        'present_days': np.bincount(emp[present], minlength=n),
+        'late_days': np.bincount(emp[late_counted], minlength=n),
+        'total_work_minutes': np.bincount(emp, weights=worked, minlength=n),
+        'total_late_minutes': np.bincount(emp[late_counted], weights=late[late_counted], minlength=n),
+        'total_overtime_minutes': np.bincount(emp, weights=overtime, minlength=n),
+        'location_violations': np.bincount(emp[location], minlength=n),
+        'time_violations': np.bincount(emp[time_flag], minlength=n),
+        'device_violations': np.bincount(emp[device], minlength=n),
+    }
+    for k, emp_id in enumerate(ids):
+        stats[emp_id] = {field: int(round(totals[field][k])) for field in STAT_FIELDS}
+    return stats
+
+
+def build_report_rows(stats, period_type, period_start, period_end, generated_by=None):
+    """صفوف AttendanceReport جاهزة للكتابة من الإحصائيات."""
+    total_days = (period_end - period_start).days + 1
+    now = datetime.utcnow()
+    rows = []
+    for emp_id, s in stats.items():
+        row = dict(s)
+        row.update(
+            employee_id=emp_id, period_type=period_type, period_start=period_start, period_end=period_end,
+            total_days=total_days, absent_days=total_days - s['present_days'],
+            average_late_minutes=s['total_late_minutes'] / s['late_days'] if s['late_days'] > 0 else 0,
+            generated_at=now, generated_by=generated_by,
+        )
+        rows.append(row)
+    return rows
+
+
+def _existing_reports(connection, period_type, period_start, period_end, ids):
+    table = AttendanceReport.__table__
+    found = {}
+    for i in range(0, len(ids), _IN_CHUNK):
+        for report_id, emp_id in connection.execute(select(table.c.id, table.c.employee_id).where(
+            table.c.period_type == period_type, table.c.period_start == period_start,
+            table.c.period_end == period_end, table.c.employee_id.in_(ids[i:i + _IN_CHUNK])
+        ).order_by(table.c.id)):
+            found[emp_id] = report_id  # عند تكرار قديم: الأحدث يُحدَّث
+    return found
+
+
+def upsert_reports(connection, rows):
+    """كتابة التقارير: تحديث الموجود بمعرّفه وإدراج الجديد. ترجع {employee_id: report_id}."""
+    if not rows:
+        return {}
+    table = AttendanceReport.__table__
+    first = rows[0]
+    key = (first['period_type'], first['period_start'], first['period_end'])
+    ids = sorted(r['employee_id'] for r in rows)
+    existing = _existing_reports(connection, *key, ids)
+    updates = [dict(r, b_id=existing[r['employee_id']]) for r in rows if r['employee_id'] in existing]
+    inserts = [r for r in rows if r['employee_id'] not in existing]
+    if updates:
+        fields = [f for f in updates[0] if f not in ('b_id', 'employee_id', 'period_type', 'period_start', 'period_end')]
+        connection.execute(
+            update(table).where(table.c.id == bindparam('b_id')).values({f: bindparam(f) for f in fields}),
+            updates,
+        )
+    if inserts:
+        connection.execute(table.insert(), [dict(r, linked_to_payroll=False) for r in inserts])
+        existing.update(_existing_reports(connection, *key, sorted(r['employee_id'] for r in inserts)))
+    return existing
+
+
+def link_reports_to_payroll(connection, report_ids, rows, month, year):
+    """ربط كل تقرير براتب الموظف لنفس الشهر (PayrollAttendanceLink). يرجع عدد الروابط.
+    report_ids: {employee_id: report_id}؛ rows: صفوف build_report_rows لنفس الموظفين."""
+    settings = attendance_settings()
+    late_rate = getattr(settings, 'late_deduction_per_minute', 1.0)
+    absence_rate = getattr(settings, 'absence_deduction_per_day', 100.0)
+    overtime_rate = getattr(settings, 'overtime_bonus_per_hour', 50.0)
+    payroll = Payroll.__table__
+    link = PayrollAttendanceLink.__table__
+    report = AttendanceReport.__table__
+    ids = sorted(report_ids)
+    payrolls = {}
+    for i in range(0, len(ids), _IN_CHUNK):
+        for payroll_id, emp_id in connection.execute(select(payroll.c.id, payroll.c.employee_id).where(
+            payroll.c.month == month, payroll.c.year == year, payroll.c.employee_id.in_(ids[i:i + _IN_CHUNK])
+        ).order_by(payroll.c.id)):
+            payrolls[emp_id] = payroll_id
+    pairs = [(payrolls[e], report_ids[e]) for e in ids if e in payrolls]
+    if not pairs:
+        return 0
+    existing = {}
+    for i in range(0, len(pairs), _IN_CHUNK):
+        chunk = [r for _, r in pairs[i:i + _IN_CHUNK]]
+        for link_id, payroll_id, report_id in connection.execute(
+            select(link.c.id, link.c.payroll_id, link.c.report_id).where(link.c.report_id.in_(chunk))
+        ):
+            existing[(payroll_id, report_id)] = link_id
+
+    now = datetime.utcnow()
+    by_report = {report_ids[r['employee_id']]: r for r in rows if r['employee_id'] in report_ids}
+    inserts, updates = [], []
+    for payroll_id, report_id in pairs:
+        r = by_report[report_id]
+        values = {
+            'late_deduction_amount': r['total_late_minutes'] * late_rate,
+            'absence_deduction_amount': r['absent_days'] * absence_rate,
+            'overtime_bonus_amount': (r['total_overtime_minutes'] / 60) * overtime_rate,
+            'late_deduction_rate': late_rate,
+            'absence_deduction_rate': absence_rate,
+            'overtime_bonus_rate': overtime_rate,
+            'auto_calculated': True,
+            'updated_at': now,
+        }
+        if (payroll_id, report_id) in existing:
+            updates.append(dict(values, b_id=existing[(payroll_id, report_id)]))
+        else:
+            inserts.append(dict(values, payroll_id=payroll_id, report_id=report_id, approved=False, created_at=now))
+    if updates:
+        fields = [f for f in updates[0] if f != 'b_id']
+        connection.execute(
+            update(link).where(link.c.id == bindparam('b_id')).values({f: bindparam(f) for f in fields}), updates
+        )
+    if inserts:
+        connection.execute(link.insert(), inserts)
+    connection.execute(
+        update(report).where(report.c.id == bindparam('b_report')).values(linked_to_payroll=True, payroll_id=bindparam('b_payroll')),
+        [{'b_report': r, 'b_payroll': p} for p, r in pairs],
+    )
+    return len(pairs)
+
+
+# --- الحساب المتوازي ---
+
+_pool_app = None
+
+
+def _pool_init():
+    # عملية spawn جديدة: لا شيء موروث من الأم، التطبيق يُبنى مرة لكل عامل
+    global _pool_app
+    from app import create_app
+    _pool_app = create_app()
+
+
+def _pool_compute(args):
+    ids, period_start, period_end, grace, use_rollup = args
+    with _pool_app.app_context():
+        try:
+            return compute_report_stats(ids, period_start, period_end, grace, use_rollup)
+        finally:
+            db.session.remove()
+
+
+def _chunks(ids, size):
+    return [ids[i:i + size] for i in range(0, len(ids), size)]
+
+
+def compute_stats_parallel(ids, period_start, period_end, progress=None):
+    """إحصائيات كل الموظفين: أجزاء على مجمع عمليات للمستأجرين الكبار، وإلا داخل العملية."""
+    cfg = current_app.config
+    chunk_size = max(int(cfg.get('ATTENDANCE_REPORT_CHUNK', 2000)), 1)
+    workers = int(cfg.get('ATTENDANCE_REPORT_WORKERS', 0)) or min(os.cpu_count() or 1, 4)
+    grace = late_grace_minutes()
+    use_rollup = rollup_ready()
+    chunks = _chunks(ids, chunk_size)
+    parallel = (
+        len(ids) >= int(cfg.get('ATTENDANCE_REPORT_POOL_MIN', 5000)) and workers > 1 and len(chunks) > 1
+        and db.engine.dialect.name != 'sqlite'
+    )
+    stats = {}
+    if not parallel:
+        for n, chunk in enumerate(chunks, start=1):
+            stats.update(compute_report_stats(chunk, period_start, period_end, grace, use_rollup))
+            if progress:
+                progress(n, len(chunks))
+        return stats
+    with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_pool_init) as pool:
+        args = [(chunk, period_start, period_end, grace, use_rollup) for chunk in chunks]
+        for n, part in enumerate(pool.map(_pool_compute, args), start=1):
+            stats.update(part)
+            if progress:
+                progress(n, len(chunks))
+    return stats
@@ -0,0 +1,396 @@
+"""
+البحث النصي الموحد (رسائل WhatsApp، ClientSupport، الشكاوى، SupportTicket)
+- كل مستند مصدر له صف في search_documents بنص مطبّع: حذف التشكيل والتطويل، توحيد أ/إ/آ/ٱ -> ا
+  و ى/ئ -> ي و ة -> ه و ؤ -> و، الأرقام الهندية -> 0-9، وكل كلمة تُفهرس أيضاً بلا أداة التعريف
+  (ال/وال/بال/...)، وأرقام الهاتف بصيغتها الدولية والمحلية (آخر 9 أرقام) فيطابق '0501234567'
+  و '966501234567' نفس العميل.
+- الفهرس: FTS5 (external content فوق search_documents بمشغّلات SQL) على SQLite، وعمود tsvector
+  مولّد + فهرس GIN على PostgreSQL؛ غيرهما: LIKE على النص المطبّع. التطبيع في Python فقط فيرى
+  المحركان نفس الكلمات.
+- التحديث تزايدي في نفس معاملة التغيير: مستمع after_flush لتعديلات ORM، و
+  index_whatsapp_messages() صراحةً لمسارات الإدراج المجمّع (صندوق الوارد/الصادر).
+- البناء الأول أو إعادة البناء: rebuild_search_index() (scripts/rebuild_search_index.py أو مهمة search.rebuild).
+"""
+import re
+from datetime import datetime
+
+from sqlalchemy import bindparam, delete, event, func, inspect, select, text
+from sqlalchemy.orm import Session, attributes
+
+from app import db
+from app.models.search import SearchDocument
+
+SOURCES = ('whatsapp', 'client_support', 'complaint', 'ticket')
+PREVIEW_LENGTH = 300
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+_IN_CHUNK = 500
+_DIACRITICS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')  # التشكيل والتطويل
+_NON_WORD = re.compile(r'[\W_]+')
+_ARTICLES = ('وال', 'بال', 'كال', 'فال', 'لل', 'ال')  # بعد التطبيع
+_PHONE_QUERY = re.compile(r'^[\d\s+\-()]+$')
+_FOLD = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ى': 'ي', 'ئ': 'ي', 'ة': 'ه', 'ؤ': 'و',
+    **{chr(0x0660 + i): str(i) for i in range(10)},
+    **{chr(0x06f0 + i): str(i) for i in range(10)},
+})
+
+_SQLITE_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5("
+    "title, body, phone, content='search_documents', content_rowid='id', tokenize='unicode61', prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS search_documents_ai AFTER INSERT ON search_documents BEGIN "
+    "INSERT INTO search_fts(rowid, title, body, phone) VALUES (new.id, new.title, new.body, new.phone); END",
+    "CREATE TRIGGER IF NOT EXISTS search_documents_ad AFTER DELETE ON search_documents BEGIN "
+    "INSERT INTO search_fts(search_fts, rowid, title, body, phone) "
+    "VALUES ('delete', old.id, old.title, old.body, old.phone); END",
+    "CREATE TRIGGER IF NOT EXISTS search_documents_au AFTER UPDATE ON search_documents BEGIN "
+    "INSERT INTO search_fts(search_fts, rowid, title, body, phone) "
+    "VALUES ('delete', old.id, old.title, old.body, old.phone); "
+    "INSERT INTO search_fts(rowid, title, body, phone) VALUES (new.id, new.title, new.body, new.phone); END",
+)
+_POSTGRES_DDL = (
+    "ALTER TABLE search_documents ADD COLUMN IF NOT EXISTS tsv tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(phone, '')), 'A') || "
+    "to_tsvector('simple', coalesce(body, ''))) STORED",
+    "CREATE INDEX IF NOT EXISTS idx_search_documents_tsv ON search_documents USING gin (tsv)",
+)
+
+
+# ==================== التطبيع ====================
+
+def normalize_text(value):
+    """نص للفهرسة/الاستعلام: بلا تشكيل، حروف عربية موحدة، أحرف صغيرة، كلمات مفصولة بمسافة."""
+    if not value:
+        return ''
+    value = _DIACRITICS.sub('', str(value)).translate(_FOLD).lower()
+    return ' '.join(_NON_WORD.sub(' ', value).split())
+
+
+def index_text(value):
+    """النص المطبّع مع صيغة كل كلمة بلا أداة التعريف ('الفاتوره' -> 'الفاتوره فاتوره')
+    فيطابق البحث عن 'فاتورة' الكلمة المعرّفة وغيرها."""
+    words = normalize_text(value).split()
+    stripped = [_strip_article(w) for w in words]
+    return ' '.join(words + [w for w, original in zip(stripped, words) if w != original])
+
+
+def _strip_article(word):
+    for prefix in _ARTICLES:
+        if word.startswith(prefix) and len(word) - len(prefix) >= 2:
+            return word[len(prefix):]
+    return word
+
+
+def phone_terms(phone):
+    """'+966 50 123 4567' -> '966501234567 501234567' (الدولي والمحلي بلا الصفر)."""
+    digits = ''.join(ch for ch in normalize_text(phone) if ch.isdigit())
+    if digits.startswith('00'):
+        digits = digits[2:]
+    terms = [digits, digits.lstrip('0')]
+    if len(digits) > 9:
+        terms.append(digits[-9:])
+    return ' '.join(dict.fromkeys(t for t in terms if t))
+
+
+def _document(source, source_id, name, phone, content, created_at):
+    content = ' '.join(str(part) for part in content if part)
+    return {
+        'source': source,
+        'source_id': source_id,
+        'title': index_text(name),
+        'body': index_text(content),
+        'phone': phone_terms(phone),
+        'display_name': (name or '')[:128] or None,
+        'preview': content[:PREVIEW_LENGTH] or None,
+        'source_created_at': created_at,
+        'indexed_at': datetime.utcnow(),
+    }
+
+
+# ==================== المصادر ====================
+
+def _models():
+    from app.models.client_support import ClientSupport
+    from app.models.customer_complaints import CustomerComplaint
+    from app.models.support import SupportTicket
+    from app.models.whatsapp_models import WhatsAppMessage
+    return {
+        WhatsAppMessage: ('whatsapp', ('message_content', 'caption')),
+        ClientSupport: ('client_support', ('issue', 'client_name', 'client_phone', 'client_company')),
+        CustomerComplaint: ('complaint', ('issue_description', 'customer_name', 'customer_phone')),
+        SupportTicket: ('ticket', ('issue', 'customer_name', 'customer_phone')),
+    }
+
+
+def _build(source, row, conversation=None):
+    """مستند من كائن ORM أو صف (نفس أسماء الأعمدة). conversation = (phone, name) لرسائل WhatsApp."""
+    if source == 'whatsapp':
+        phone, name = conversation or (None, None)
+        return _document(source, row.id, name, phone, (row.message_content, row.caption), row.timestamp)
+    if source == 'client_support':
+        return _document(source, row.id, row.client_name, row.client_phone,
+                         (row.issue, row.client_company), row.created_at)
+    if source == 'complaint':
+        return _document(source, row.id, row.customer_name, row.customer_phone,
+                         (row.issue_description,), row.issue_date)
+    return _document(source, row.id, row.customer_name, row.customer_phone, (row.issue,), row.created_at)
+
+
+def _conversations(connection, conversation_ids):
+    from app.models.whatsapp_models import WhatsAppConversation
+    table = WhatsAppConversation.__table__
+    found = {}
+    for chunk in _chunks(sorted(set(conversation_ids))):
+        found.update({r.id: (r.customer_phone, r.customer_name) for r in connection.execute(
+            select(table.c.id, table.c.customer_phone, table.c.customer_name).where(table.c.id.in_(chunk)))})
+    return found
+
+
+def _chunks(values, size=_IN_CHUNK):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+# ==================== الكتابة ====================
+
+def upsert_documents(connection, documents):
+    """إدراج أو تحديث المستندات بالمفتاح (source, source_id)."""
+    if not documents:
+        return
+    unique = {}
+    for doc in documents:
+        unique[(doc['source'], doc['source_id'])] = doc
+    rows = list(unique.values())
+    table = SearchDocument.__table__
+    dialect = connection.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['source', 'source_id'],
+            set_={c: stmt.excluded[c] for c in ('title', 'body', 'phone', 'display_name', 'preview',
+                                                'source_created_at', 'indexed_at')},
+        )
+        for chunk in _chunks(rows):
+            connection.execute(stmt, chunk)
+        return
+    for row in rows:
+        existing = connection.execute(select(table.c.id).where(
+            table.c.source == row['source'], table.c.source_id == row['source_id'])).scalar()
+        if existing:
+            connection.execute(table.update().where(table.c.id == existing).values(**row))
+        else:
+            connection.execute(table.insert(), [row])
+
+
+def delete_documents(connection, keys):
+    """حذف مستندات [(source, source_id)]."""
+    if not keys:
+        return
+    table = SearchDocument.__table__
+    connection.execute(delete(table).where(
+        table.c.source == bindparam('b_source'), table.c.source_id == bindparam('b_id')
+    ), [{'b_source': source, 'b_id': source_id} for source, source_id in set(keys)])
+
+
+def index_whatsapp_messages(connection, message_ids):
+    """فهرسة رسائل أُدرجت بعبارة مجمّعة (لا تمر بأحداث ORM)، بمعرّف واتساب message_id."""
+    from app.models.whatsapp_models import WhatsAppMessage
+    table = WhatsAppMessage.__table__
+    rows = []
+    for chunk in _chunks([m for m in message_ids if m]):
+        rows.extend(connection.execute(
+            select(table.c.id, table.c.conversation_id, table.c.message_content, table.c.caption,
+                   table.c.timestamp).where(table.c.message_id.in_(chunk))
+        ).all())
+    conversations = _conversations(connection, [r.conversation_id for r in rows])
+    upsert_documents(connection, [_build('whatsapp', r, conversations.get(r.conversation_id)) for r in rows])
+
+
+def _after_flush(orm_session, flush_context):
+    models = _models()
+    documents, deletes, messages = [], [], []
+    for obj in list(orm_session.new) + list(orm_session.dirty):
+        spec = models.get(type(obj))
+        if spec is None:
+            continue
+        source, fields = spec
+        if obj not in orm_session.new and not any(
+                attributes.get_history(obj, field).has_changes() for field in fields):
+            continue
+        if source == 'whatsapp':
+            messages.append(obj)
+        else:
+            documents.append(_build(source, obj))
+    for obj in orm_session.deleted:
+        spec = models.get(type(obj))
+        if spec is not None:
+            deletes.append((spec[0], obj.id))
+    if not (documents or deletes or messages):
+        return
+    connection = orm_session.connection()
+    if messages:
+        conversations = _conversations(connection, [m.conversation_id for m in messages])
+        documents.extend(_build('whatsapp', m, conversations.get(m.conversation_id)) for m in messages)
+    upsert_documents(connection, documents)
+    delete_documents(connection, deletes)
+
+
+def register_search_index():
+    """تسجيل مستمع after_flush مرة واحدة لكل عملية."""
+    if not event.contains(Session, 'after_flush', _after_flush):
+        event.listen(Session, 'after_flush', _after_flush)
+
+
+# ==================== الفهرس ====================
+
+def ensure_search_index():
+    """إنشاء فهرس النص الكامل للمحرك الحالي (FTS5 أو tsvector). ترجع رسائل للسجل."""
+    messages = []
+    dialect = db.engine.dialect.name
+    if dialect not in ('sqlite', 'postgresql'):
+        return messages
+    try:
+        with db.engine.connect() as connection:
+            if dialect == 'sqlite':
+                created = 'search_fts' not in inspect(connection).get_table_names()
+                for statement in _SQLITE_DDL:
+                    connection.execute(text(statement))
+                if created:
+                    connection.execute(text("INSERT INTO search_fts(search_fts) VALUES ('rebuild')"))
+            else:
+                columns = {c['name'] for c in inspect(connection).get_columns('search_documents')}
+                created = 'tsv' not in columns
+                for statement in _POSTGRES_DDL:
+                    connection.execute(text(statement))
+            connection.commit()
+        if created:
+            messages.append(f"[+] Created full-text search index ({dialect}); "
+                            f"run scripts/rebuild_search_index.py to index existing records")
+    except Exception as e:
+        messages.append(f"[-] Error creating full-text search index: {e}")
+    return messages
+
+
+def source_row_count(sources=SOURCES):
+    """عدد سجلات المصادر (لنسبة تقدم إعادة البناء)."""
+    models = {source: model for model, (source, _) in _models().items()}
+    return sum(db.session.execute(select(func.count()).select_from(models[s].__table__)).scalar() or 0
+               for s in sources)
+
+
+def rebuild_search_index(sources=SOURCES, chunk_size=5000, progress=None):
+    """فهرسة كل سجلات المصادر بدفعات (keyset على id) وحذف مستندات سجلات محذوفة.
+    progress(done, message) اختياري. ترجع {المصدر: العدد}.
+    """
+    models = {source: model for model, (source, _) in _models().items()}
+    totals = {}
+    done = 0
+    for source in sources:
+        model = models[source]
+        table = model.__table__
+        last_id, count = 0, 0
+        while True:
+            rows = db.session.execute(
+                select(table).where(table.c.id > last_id).order_by(table.c.id).limit(chunk_size)
+            ).all()
+            if not rows:
+                break
+            connection = db.session.connection()
+            conversations = (_conversations(connection, [r.conversation_id for r in rows])
+                             if source == 'whatsapp' else {})
+            upsert_documents(connection, [
+                _build(source, r, conversations.get(r.conversation_id) if source == 'whatsapp' else None)
+                for r in rows])
+            db.session.commit()
+            last_id = rows[-1].id
+            count += len(rows)
+            done += len(rows)
+            if progress is not None:
+                progress(done, f'{source}: {count}')
+        documents = SearchDocument.__table__
+        db.session.execute(delete(documents).where(
+            documents.c.source == source, documents.c.source_id.not_in(select(table.c.id))))
+        db.session.commit()
+        totals[source] = count
+    return totals
+
+
+# ==================== البحث ====================
+
+def _query_terms(query):
+    """كلمات الاستعلام المطبّعة بلا أداة التعريف، ولكل كلمة صيغها البديلة؛ استعلام من أرقام ومسافات
+    ('+966 50 123') رقم هاتف واحد يُطابق أيضاً بلا 00 أو الصفر البادئ أو بآخر 9 أرقام (الصيغة المحلية)."""
+    normalized = normalize_text(query)
+    if _PHONE_QUERY.match(query or '') and normalized:
+        words = [normalized.replace(' ', '')]
+    else:
+        words = [_strip_article(w) for w in normalized.split()]
+    terms = []
+    for term in words[:10]:
+        forms = [term]
+        if term.isdigit():
+            local = (term[2:] if term.startswith('00') else term).lstrip('0')
+            forms.extend([local, local[-9:] if len(local) > 9 else ''])
+        terms.append([f for f in dict.fromkeys(forms) if f])
+    return terms
+
+
+def search(query, sources=None, limit=DEFAULT_LIMIT):
+    """بحث مرتب بالصلة؛ كل كلمة تطابق كبادئة (prefix). ترجع قائمة dict."""
+    terms = _query_terms(query)
+    if not terms:
+        return []
+    limit = min(max(int(limit), 1), MAX_LIMIT)
+    sources = [s for s in (sources or ()) if s in SOURCES]
+    dialect = db.engine.dialect.name
+    params = {'limit': limit}
+    source_filter = ''
+    if sources:
+        source_filter = 'AND d.source IN (' + ', '.join(f':s{i}' for i in range(len(sources))) + ')'
+        params.update({f's{i}': s for i, s in enumerate(sources)})
+
+    if dialect == 'sqlite':
+        params['match'] = ' AND '.join('(' + ' OR '.join(f'"{t}"*' for t in forms) + ')' for forms in terms)
+        sql = (
+            "SELECT d.source, d.source_id, d.display_name, d.phone, d.preview, d.source_created_at, "
+            "bm25(search_fts, 5.0, 1.0, 5.0) AS score "
+            "FROM search_fts JOIN search_documents d ON d.id = search_fts.rowid "
+            f"WHERE search_fts MATCH :match {source_filter} ORDER BY score LIMIT :limit"
+        )
+    elif dialect == 'postgresql':
+        params['tsquery'] = ' & '.join('(' + ' | '.join(f'{t}:*' for t in forms) + ')' for forms in terms)
+        sql = (
+            "SELECT d.source, d.source_id, d.display_name, d.phone, d.preview, d.source_created_at, "
+            "ts_rank_cd(d.tsv, q) AS score "
+            "FROM search_documents d, to_tsquery('simple', :tsquery) q "
+            f"WHERE d.tsv @@ q {source_filter} ORDER BY score DESC LIMIT :limit"
+        )
+    else:
+        conditions = []
+        for i, forms in enumerate(terms):
+            params[f't{i}'] = f'%{forms[-1]}%'
+            conditions.append(f"(d.title LIKE :t{i} OR d.body LIKE :t{i} OR d.phone LIKE :t{i})")
+        sql = (
+            "SELECT d.source, d.source_id, d.display_name, d.phone, d.preview, d.source_created_at, 0 AS score "
+            f"FROM search_documents d WHERE {' AND '.join(conditions)} {source_filter} "
+            "ORDER BY d.source_created_at DESC LIMIT :limit"
+        )
+    rows = db.session.execute(text(sql), params).all()
+    return [{
+        'source': r.source,
+        'id': r.source_id,
+        'name': r.display_name,
+        'phone': (r.phone or '').split(' ')[0] or None,
+        'preview': r.preview,
+        'created_at': r.source_created_at.isoformat() if isinstance(r.source_created_at, datetime)
+        else r.source_created_at,
+        'score': round(float(r.score or 0), 4),
+    } for r in rows]
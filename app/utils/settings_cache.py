@@ -0,0 +1,119 @@
+"""
+لقطات الإعدادات المجمّدة (Settings snapshots)
+AttendanceSettings و Settings تُقرأ في كل طلب حضور وفي حساب الرواتب لكل موظف،
+لذا تُحمّل مرة واحدة لكل عملية كـ SettingsSnapshot غير قابلة للتعديل (صفر استعلامات بعدها).
+
+الإبطال: أي إدراج/تعديل/حذف لـ Settings أو AttendanceSettings يزيد الجيل 'settings'
+(مستمع after_flush) فتلاحظ كل عمليات gunicorn التغيير خلال CACHE_GENERATION_TTL.
+للتعديل استخدم النموذج نفسه (Settings.get_settings / AttendanceSettings.query) وليس اللقطة.
+"""
+import threading
+
+from sqlalchemy import event, inspect as sa_inspect
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models.attendance import AttendanceSettings
+from app.models.settings import Settings
+from app.utils.cache_generation import get_generation, bump_generation
+
+SETTINGS_GENERATION = 'settings'
+
+_cache = {}  # model class -> (generation, SettingsSnapshot)
+_lock = threading.Lock()
+
+
+class SettingsSnapshot:
+    """نسخة للقراءة فقط من صف إعدادات: الوصول بالخصائص كالنموذج، والتعديل يرفع AttributeError."""
+
+    __slots__ = ('_model', '_values')
+
+    def __init__(self, model_name, values):
+        object.__setattr__(self, '_model', model_name)
+        object.__setattr__(self, '_values', dict(values))
+
+    def __getattr__(self, name):
+        try:
+            return self._values[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{self._model} snapshot is read-only')
+
+    def __delattr__(self, name):
+        raise AttributeError(f'{self._model} snapshot is read-only')
+
+    def to_dict(self):
+        return dict(self._values)
+
+    def __repr__(self):
+        return f'<{self._model} snapshot>'
+
+
+def _ensure_default_row(model):
+    """إنشاء إعدادات افتراضية إن لم يوجد صف (نفس سلوك المسارات السابقة). الإدراج يزيد الجيل."""
+    with db.session.no_autoflush:
+        exists = db.session.query(model.id).first()
+    if exists is None:
+        db.session.add(model())
+        db.session.commit()
+
+
+def _load_snapshot(model):
+    with db.session.no_autoflush:
+        row = model.query.first()
+    if row is None:
+        # حُذف الصف بعد قراءة الجيل: الإنشاء يزيد الجيل فتُعاد القراءة في الاستدعاء التالي
+        _ensure_default_row(model)
+        row = model.query.first()
+    mapper = sa_inspect(model)
+    return SettingsSnapshot(model.__name__, {attr.key: getattr(row, attr.key) for attr in mapper.column_attrs})
+
+
+def _get_snapshot(model):
+    generation = get_generation(SETTINGS_GENERATION)
+    entry = _cache.get(model)
+    if entry is not None and entry[0] == generation:
+        return entry[1]
+    # الإنشاء الافتراضي خطوة مستقلة قبل قراءة الجيل لأنه يزيده
+    _ensure_default_row(model)
+    # الجيل يُقرأ قبل التحميل: تعديل يُلتزم بينهما يغيّر الجيل فيُعاد التحميل في الاستدعاء التالي،
+    # بدل تخزين لقطة قديمة تحت الجيل الجديد
+    generation = get_generation(SETTINGS_GENERATION)
+    snapshot = _load_snapshot(model)
+    with _lock:
+        _cache[model] = (generation, snapshot)
+    return snapshot
+
+
+def attendance_settings():
+    """لقطة إعدادات الحضور الحالية (AttendanceSettings)."""
+    return _get_snapshot(AttendanceSettings)
+
+
+def system_settings():
+    """لقطة إعدادات النظام الحالية (Settings)."""
+    return _get_snapshot(Settings)
+
+
+def invalidate_settings():
+    """إبطال لقطات الإعدادات في كل العمليات (ضمن معاملة التعديل)."""
+    bump_generation(SETTINGS_GENERATION)
+
+
+def _after_flush(orm_session, flush_context):
+    tracked = (Settings, AttendanceSettings)
+    for obj in list(orm_session.new) + list(orm_session.dirty) + list(orm_session.deleted):
+        if not isinstance(obj, tracked):
+            continue
+        if obj in orm_session.dirty and not orm_session.is_modified(obj, include_collections=False):
+            continue
+        bump_generation(SETTINGS_GENERATION, connection=orm_session.connection())
+        return
+
+
+def register_settings_cache():
+    """تسجيل مستمع الإبطال مرة واحدة."""
+    if not event.contains(Session, 'after_flush', _after_flush):
+        event.listen(Session, 'after_flush', _after_flush)
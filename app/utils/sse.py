@@ -0,0 +1,43 @@
+"""
+حد اتصالات البث (Server-Sent Events) لكل عملية
+- كل اتصال SSE مفتوح يحجز خيطاً من خيوط عامل gunicorn (gthread --threads) طوال مدته، فلو فُتح
+  اتصال لكل متصفح لما بقي خيط للطلبات العادية.
+- البث المباشر (/api/feed/stream) وتقدم المهام (/api/jobs/<id>/events) يتقاسمان SSE_MAX_STREAMS
+  مكاناً في العملية؛ ما زاد يُرد بـ 503 ويعود المتصفح إلى الاستعلام الدوري.
+- المكان يُحرر عند إغلاق الاستجابة (call_on_close) ولو انقطع الاتصال قبل أول رسالة.
+"""
+import threading
+
+from flask import current_app, jsonify
+
+_lock = threading.Lock()
+_open = 0
+
+
+def acquire_stream():
+    """حجز مكان لاتصال بث؛ False عند بلوغ الحد."""
+    global _open
+    limit = int(current_app.config.get('SSE_MAX_STREAMS', 4))
+    with _lock:
+        if _open >= limit:
+            return False
+        _open += 1
+        return True
+
+
+def release_stream():
+    global _open
+    with _lock:
+        _open = max(_open - 1, 0)
+
+
+def open_streams():
+    return _open
+
+
+def streams_busy():
+    """رد 503: EventSource يتوقف عنده ولا يعيد الاتصال، فتنتقل الصفحة إلى الاستعلام الدوري."""
+    response = jsonify({'status': 'error', 'message': 'Too many live connections; use polling'})
+    response.status_code = 503
+    response.headers['Retry-After'] = '60'
+    return response
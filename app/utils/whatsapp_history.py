@@ -0,0 +1,85 @@
+"""
+صفحات دردشة WhatsApp (Keyset pagination)
+- المحادثات بالأحدث نشاطاً على (updated_at, id)، والرسائل على (timestamp, id) داخل المحادثة؛
+  المؤشر before = آخر عنصر في الصفحة السابقة، فكل صفحة مسح فهرس محدود مهما طال السجل
+  (بدل OFFSET أو جلب كل التاريخ).
+- وضع since: ما تغيّر منذ آخر استطلاع فقط (رسائل جديدة أو تغيّر حالتها عبر updated_at،
+  ومحادثات بنشاط جديد). القيمة تأتي من حقل since في الاستجابة السابقة (وقت الخادم)، ويُطرح منها
+  هامش صغير لأن معاملة بدأت قبل الاستطلاع قد تُثبّت بعده؛ العميل يستبدل العناصر بمعرّفها.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, tuple_
+
+from app import db
+from app.models.whatsapp_models import WhatsAppConversation, WhatsAppMessage
+
+DEFAULT_PAGE = 50
+MAX_PAGE = 200
+SINCE_OVERLAP = timedelta(seconds=5)
+
+
+def encode_cursor(moment, row_id):
+    return f"{(moment or datetime.min).isoformat()}_{row_id}"
+
+
+def decode_cursor(cursor):
+    """'2025-01-02T10:00:00_15' -> (datetime, 15). ValueError إذا كان غير صالح."""
+    moment, _, row_id = (cursor or '').rpartition('_')
+    return datetime.fromisoformat(moment), int(row_id)
+
+
+def parse_since(value):
+    return datetime.fromisoformat(value) - SINCE_OVERLAP
+
+
+def _page(rows, limit, key):
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return rows, (encode_cursor(*key(rows[-1])) if more and rows else None)
+
+
+def conversation_page(before=None, limit=DEFAULT_PAGE):
+    """صفحة محادثات (الأحدث أولاً). يرجع (المحادثات، next_cursor أو None)."""
+    query = select(WhatsAppConversation).order_by(
+        WhatsAppConversation.updated_at.desc(), WhatsAppConversation.id.desc()).limit(limit + 1)
+    if before:
+        cursor = tuple_(*decode_cursor(before))
+        query = query.where(tuple_(WhatsAppConversation.updated_at, WhatsAppConversation.id) < cursor)
+    rows = db.session.execute(query).scalars().all()
+    return _page(rows, limit, lambda c: (c.updated_at, c.id))
+
+
+def conversation_changes(since, limit=MAX_PAGE):
+    """المحادثات ذات النشاط منذ since. يرجع (المحادثات، truncated)؛ truncated = أعد تحميل الصفحة الأولى."""
+    rows = db.session.execute(
+        select(WhatsAppConversation).where(WhatsAppConversation.updated_at >= parse_since(since))
+        .order_by(WhatsAppConversation.updated_at.desc(), WhatsAppConversation.id.desc()).limit(limit + 1)
+    ).scalars().all()
+    return rows[:limit], len(rows) > limit
+
+
+def message_page(conversation_id, before=None, limit=DEFAULT_PAGE):
+    """رسائل محادثة بترتيب العرض (الأقدم أولاً): بدون مؤشر آخر limit رسالة، ومع before
+    الأقدم منها (تحميل التاريخ عند التمرير للأعلى). يرجع (الرسائل، next_cursor للأقدم أو None).
+    """
+    query = select(WhatsAppMessage).where(WhatsAppMessage.conversation_id == conversation_id)
+    if before:
+        cursor = tuple_(*decode_cursor(before))
+        query = query.where(tuple_(WhatsAppMessage.timestamp, WhatsAppMessage.id) < cursor)
+    rows = db.session.execute(
+        query.order_by(WhatsAppMessage.timestamp.desc(), WhatsAppMessage.id.desc()).limit(limit + 1)
+    ).scalars().all()
+    rows, cursor = _page(rows, limit, lambda m: (m.timestamp, m.id))
+    rows.reverse()
+    return rows, cursor
+
+
+def message_changes(conversation_id, since, limit=MAX_PAGE):
+    """الرسائل الجديدة أو المتغيرة حالتها منذ since (الأقدم أولاً). يرجع (الرسائل، truncated)."""
+    rows = db.session.execute(
+        select(WhatsAppMessage).where(WhatsAppMessage.conversation_id == conversation_id,
+                                      WhatsAppMessage.updated_at >= parse_since(since))
+        .order_by(WhatsAppMessage.timestamp, WhatsAppMessage.id).limit(limit + 1)
+    ).scalars().all()
+    return rows[:limit], len(rows) > limit
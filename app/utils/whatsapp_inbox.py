@@ -0,0 +1,448 @@
+"""
+صندوق وارد WhatsApp (Durable webhook inbox)
+- الـ webhook يحفظ جسم الطلب الخام في whatsapp_inbox ويرد 200 فوراً؛ لا تحميل وسائط ولا
+  commit لكل رسالة داخل الطلب، فلا تتأخر الاستجابة وتعيد Meta الإرسال.
+- المعالجة مهمة خلفية (whatsapp.inbox_drain) تسحب دفعات من الصندوق بحجز شرطي
+  (queued -> processing برمز حجز)، فعدة عمال (خيوط JobRunner أو عمليات) لا يعالجون
+  نفس الحمولة مرتين.
+- لكل دفعة: استخراج الرسائل والحالات، حذف المكرر بمعرّف الرسالة (داخل الدفعة ومع
+  الموجود في القاعدة)، تحميل الوسائط بالتوازي (WHATSAPP_MEDIA_WORKERS) بمهلات اتصال
+  وقراءة وبالتدفق إلى التخزين بالبصمة (app/utils/media_store.py)، ثم كتابة الرسائل والمحادثات وتحديثات الحالة في commit واحد.
+- كل حمولة تُحلل وحدها: JSON غير صالح أو حقول غير صالحة (timestamp مثلاً) تجعلها failed فوراً
+  دون أن تُفشل جاراتها. فشل كتابة الدفعة يعيد كل حمولة في معاملتها الخاصة لعزل السبب؛
+  الحمولة الفاشلة تُؤجَّل بتراجع أُسّي (next_attempt_at) حتى WHATSAPP_INBOX_MAX_ATTEMPTS ثم failed،
+  ومهمة التفريغ تجدول نفسها عند أقرب موعد. الحمولات المحجوزة لعامل توقف
+  (أقدم من WHATSAPP_INBOX_STALE_SECONDS) تعود للطابور.
+"""
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+from flask import current_app
+from sqlalchemy import bindparam, delete, func, or_, select, update
+
+from app import db
+from app.models.whatsapp_models import WhatsAppConversation, WhatsAppInbox, WhatsAppMessage
+from app.utils.media_store import CHUNK_SIZE, media_url as stored_media_url, store_chunks
+from app.utils.search_index import index_whatsapp_messages
+from app.whatsapp_config import WhatsAppConfig
+
+QUEUED = 'queued'
+PROCESSING = 'processing'
+DONE = 'done'
+FAILED = 'failed'
+
+MEDIA_TYPES = ('audio', 'image', 'document', 'video')
+_MEDIA_LABELS = {'audio': 'رسالة صوتية', 'image': 'صورة', 'document': 'مستند', 'video': 'فيديو'}
+_MIME_EXTENSIONS = {
+    'audio/mpeg': 'mp3',
+    'audio/ogg': 'ogg',
+    'audio/wav': 'wav',
+    'image/jpeg': 'jpg',
+    'image/png': 'png',
+    'image/gif': 'gif',
+    'video/mp4': 'mp4',
+    'application/pdf': 'pdf',
+}
+# ترتيب الحالات: حالة أقدم تصل متأخرة (delivered بعد read) لا تُرجع الرسالة للخلف
+_STATUS_RANK = {'sent': 1, 'delivered': 2, 'read': 3}
+
+_IN_CHUNK = 500
+_write_lock = threading.Lock()  # إنشاء المحادثات داخل العملية الواحدة بالتسلسل
+_http = threading.local()
+
+
+def get_extension_from_mime(mime_type):
+    """الحصول على الامتداد من نوع MIME (يتجاهل المعاملات مثل 'audio/ogg; codecs=opus')"""
+    return _MIME_EXTENSIONS.get((mime_type or '').split(';')[0].strip().lower(), 'bin')
+
+
+def _chunks(values, size=_IN_CHUNK):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def enqueue_webhook(raw_body):
+    """حفظ حمولة webhook في الصندوق (لا commit هنا). ترجع السجل."""
+    item = WhatsAppInbox(payload=raw_body, status=QUEUED, attempts=0)
+    db.session.add(item)
+    return item
+
+
+# ==================== التحليل ====================
+
+def parse_payload(data):
+    """حمولة webhook -> (رسائل، حالات). الرسالة: dict بمعرّفها ورقم العميل واسمه ونوعها ومحتواها."""
+    messages, statuses = [], []
+    for entry in data.get('entry') or []:
+        for change in entry.get('changes') or []:
+            value = change.get('value') or {}
+            names = {c.get('wa_id'): (c.get('profile') or {}).get('name') for c in value.get('contacts') or []}
+            default_name = next(iter(names.values()), None)
+            for message in value.get('messages') or []:
+                phone = message.get('from')
+                message_type = message.get('type')
+                body = message.get(message_type) if isinstance(message.get(message_type), dict) else {}
+                content, caption, media_id = '', None, None
+                if message_type == 'text':
+                    content = body.get('body', '')
+                elif message_type in MEDIA_TYPES:
+                    media_id = body.get('id')
+                    if message_type != 'audio':
+                        caption = body.get('caption', '')
+                    content = caption or _MEDIA_LABELS[message_type]
+                messages.append({
+                    'message_id': message.get('id'),
+                    'phone': phone,
+                    'name': names.get(phone) or default_name or phone,
+                    'type': message_type,
+                    'content': content,
+                    'caption': caption,
+                    'media_id': media_id,
+                    'timestamp': datetime.fromtimestamp(int(message.get('timestamp', 0))),
+                })
+            for status in value.get('statuses') or []:
+                if status.get('id') and status.get('status'):
+                    statuses.append({
+                        'message_id': status['id'],
+                        'status': status['status'],
+                        'timestamp': int(status.get('timestamp') or 0),
+                    })
+    return messages, statuses
+
+
+# ==================== الوسائط ====================
+
+def _session():
+    session = getattr(_http, 'session', None)
+    if session is None:
+        session = _http.session = requests.Session()
+    return session
+
+
+def download_media(media_id, timeout=(5, 30), folder=None, max_bytes=None):
+    """تحميل وسيط من Graph API بالتدفق إلى التخزين بالبصمة (app/utils/media_store.py)؛
+    ترجع الرابط أو None. لا تحتاج app_context (تُستدعى من خيوط التحميل).
+    """
+    headers = {'Authorization': f'Bearer {WhatsAppConfig.ACCESS_TOKEN}'}
+    session = _session()
+    response = session.get(WhatsAppConfig.get_api_url(media_id), headers=headers, timeout=timeout)
+    if response.status_code != 200:
+        return None
+    media_info = response.json()
+    media_url = media_info.get('url')
+    if not media_url:
+        return None
+    with session.get(media_url, headers=headers, timeout=timeout, stream=True) as media_response:
+        if media_response.status_code != 200:
+            return None
+        stored = store_chunks(media_response.iter_content(chunk_size=CHUNK_SIZE),
+                              get_extension_from_mime(media_info.get('mime_type')), folder, max_bytes)
+    return stored_media_url(stored.relpath)
+
+
+def _download_all(messages, cfg, logger):
+    """تحميل وسائط الرسائل بالتوازي؛ فشل التحميل يحفظ الرسالة بدون رابط كما في السابق."""
+    pending = [m for m in messages if m['media_id']]
+    if not pending:
+        return
+    timeout = (float(cfg.get('WHATSAPP_HTTP_CONNECT_TIMEOUT', 5)), float(cfg.get('WHATSAPP_MEDIA_TIMEOUT', 30)))
+    max_bytes = int(cfg.get('WHATSAPP_MEDIA_MAX_BYTES', 0)) or None
+
+    def fetch(message):
+        try:
+            message['media_url'] = download_media(message['media_id'], timeout=timeout, max_bytes=max_bytes)
+        except Exception as e:
+            logger.error(f"Error downloading media {message['media_id']}: {e}")
+            message['media_url'] = None
+
+    workers = min(int(cfg.get('WHATSAPP_MEDIA_WORKERS', 8)), len(pending))
+    if workers <= 1:
+        for message in pending:
+            fetch(message)
+        return
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='wa-media') as pool:
+        list(pool.map(fetch, pending))
+
+
+# ==================== الكتابة ====================
+
+def _existing_message_ids(message_ids):
+    table = WhatsAppMessage.__table__
+    found = set()
+    for chunk in _chunks(message_ids):
+        found.update(db.session.execute(select(table.c.message_id).where(table.c.message_id.in_(chunk))).scalars())
+    return found
+
+
+def conversation_ids(messages):
+    """رقم -> معرّف المحادثة، مع إنشاء المحادثات الناقصة بعبارة مجمّعة واحدة.
+    messages: عناصر فيها 'phone' و 'name' (الاسم للمحادثات الجديدة فقط).
+    """
+    table = WhatsAppConversation.__table__
+    phones = {m['phone'] for m in messages}
+    found = {}
+    for chunk in _chunks(phones):
+        found.update(db.session.execute(
+            select(table.c.customer_phone, table.c.id).where(table.c.customer_phone.in_(chunk))
+        ).all())
+    missing = {}
+    for m in messages:
+        if m['phone'] not in found:
+            missing.setdefault(m['phone'], m['name'])
+    if missing:
+        now = datetime.utcnow()
+        db.session.execute(table.insert(), [{
+            'customer_phone': phone, 'customer_name': name, 'status': 'active',
+            'unread_count': 0, 'created_at': now, 'updated_at': now,
+        } for phone, name in missing.items()])
+        for chunk in _chunks(missing):
+            found.update(db.session.execute(
+                select(table.c.customer_phone, table.c.id).where(table.c.customer_phone.in_(chunk))
+            ).all())
+    return found
+
+
+def _write_messages(messages):
+    """إدراج الرسائل الجديدة وتحديث محادثاتها (آخر رسالة وعداد غير المقروءة)."""
+    conversations = conversation_ids(messages)
+    table = WhatsAppMessage.__table__
+    now = datetime.utcnow()
+    rows = []
+    for m in messages:
+        url = m.get('media_url')
+        rows.append({
+            'conversation_id': conversations[m['phone']],
+            'message_id': m['message_id'],
+            'message_type': m['type'] or 'unknown',
+            'message_content': m['content'],
+            'audio_url': url if m['type'] == 'audio' else None,
+            'image_url': url if m['type'] == 'image' else None,
+            'document_url': url if m['type'] == 'document' else None,
+            'video_url': url if m['type'] == 'video' else None,
+            'caption': m['caption'],
+            'direction': 'incoming',
+            'status': 'sent',
+            'timestamp': m['timestamp'],
+            'created_at': now,
+        })
+    db.session.execute(table.insert(), rows)
+
+    latest, counts = {}, {}
+    for row in rows:
+        conv_id = row['conversation_id']
+        counts[conv_id] = counts.get(conv_id, 0) + 1
+        if conv_id not in latest or row['timestamp'] >= latest[conv_id]['timestamp']:
+            latest[conv_id] = row
+    conv = WhatsAppConversation.__table__
+    db.session.execute(update(conv).where(conv.c.id == bindparam('b_id')).values(
+        last_message=bindparam('b_message'),
+        last_message_type=bindparam('b_type'),
+        last_message_direction='incoming',
+        unread_count=func.coalesce(conv.c.unread_count, 0) + bindparam('b_count'),
+        updated_at=now,
+    ), [{
+        'b_id': conv_id, 'b_message': row['message_content'], 'b_type': row['message_type'],
+        'b_count': counts[conv_id],
+    } for conv_id, row in latest.items()])
+    index_whatsapp_messages(db.session.connection(), [row['message_id'] for row in rows])
+
+
+def _write_statuses(statuses):
+    """آخر حالة لكل رسالة؛ عبارة مجمّعة لكل قيمة حالة مع منع الرجوع لحالة أقدم."""
+    latest = {}
+    for s in sorted(statuses, key=lambda s: s['timestamp']):
+        latest[s['message_id']] = s['status']
+    by_status = {}
+    for message_id, status in latest.items():
+        by_status.setdefault(status, []).append({'b_mid': message_id})
+    table = WhatsAppMessage.__table__
+    for status, params in by_status.items():
+        rank = _STATUS_RANK.get(status)
+        newer = [s for s, r in _STATUS_RANK.items() if rank is not None and r > rank]
+        condition = table.c.message_id == bindparam('b_mid')
+        if newer:
+            condition = condition & func.coalesce(table.c.status, '').not_in(newer)
+        db.session.execute(update(table).where(condition).values(status=status), params)
+
+
+def process_payloads(parsed, cfg, logger):
+    """معالجة حمولات محللة [(رسائل، حالات)] من parse_payload؛ الكتابة في commit واحد.
+    ترجع عدد الرسائل الجديدة والمكررة وتحديثات الحالة.
+    """
+    messages, statuses = [], []
+    for m, s in parsed:
+        messages.extend(m)
+        statuses.extend(s)
+
+    unique = {}
+    for m in messages:
+        if m['message_id'] and m['phone']:
+            unique.setdefault(m['message_id'], m)
+    existing = _existing_message_ids(unique)
+    db.session.rollback()  # لا معاملة مفتوحة أثناء تحميل الوسائط
+    fresh = [m for mid, m in unique.items() if mid not in existing]
+    _download_all(fresh, cfg, logger)
+
+    with _write_lock:
+        # إعادة الفحص بعد التحميل: عامل آخر قد يكون حفظ نفس الرسالة
+        existing = _existing_message_ids([m['message_id'] for m in fresh])
+        fresh = [m for m in fresh if m['message_id'] not in existing]
+        if fresh:
+            _write_messages(fresh)
+        if statuses:
+            _write_statuses(statuses)
+        db.session.commit()
+    return {'messages': len(fresh), 'duplicates': len(messages) - len(fresh), 'statuses': len(statuses)}
+
+
+# ==================== التفريغ ====================
+
+def queued_count():
+    return db.session.execute(
+        select(func.count()).select_from(WhatsAppInbox).where(WhatsAppInbox.status == QUEUED)
+    ).scalar() or 0
+
+
+def _claim_batch(limit, now):
+    """حجز حتى limit حمولة مستحقة؛ ترجع [(id, payload, attempts)] المحجوزة لهذا العامل."""
+    table = WhatsAppInbox.__table__
+    ids = db.session.execute(
+        select(table.c.id).where(
+            table.c.status == QUEUED, or_(table.c.next_attempt_at.is_(None), table.c.next_attempt_at <= now)
+        ).order_by(table.c.id).limit(limit)
+    ).scalars().all()
+    if not ids:
+        db.session.rollback()
+        return []
+    token = uuid.uuid4().hex
+    db.session.execute(update(table).where(table.c.id.in_(ids), table.c.status == QUEUED).values(
+        status=PROCESSING, claim_token=token, claimed_at=now,
+        attempts=func.coalesce(table.c.attempts, 0) + 1,
+    ))
+    db.session.commit()
+    return db.session.execute(
+        select(table.c.id, table.c.payload, table.c.attempts).where(table.c.claim_token == token)
+        .order_by(table.c.id)
+    ).all()
+
+
+def _finish(ids, status, error=None):
+    table = WhatsAppInbox.__table__
+    db.session.execute(update(table).where(table.c.id.in_(ids)).values(
+        status=status, error=error, processed_at=datetime.utcnow() if status in (DONE, FAILED) else None,
+        claim_token=None, next_attempt_at=None,
+    ))
+    db.session.commit()
+
+
+def _backoff(attempts, cfg):
+    base = float(cfg.get('WHATSAPP_INBOX_BACKOFF_SECONDS', 30))
+    cap = float(cfg.get('WHATSAPP_INBOX_BACKOFF_MAX', 3600))
+    return timedelta(seconds=min(base * 2 ** max(attempts - 1, 0), cap))
+
+
+def _defer(item_id, attempts, error, cfg):
+    """حمولة فشلت كتابتها: إعادة المحاولة بعد تراجع أُسّي، أو failed بعد الحد الأقصى. ترجع True عند failed."""
+    if attempts >= int(cfg.get('WHATSAPP_INBOX_MAX_ATTEMPTS', 5)):
+        _finish([item_id], FAILED, error=str(error)[:1000])
+        return True
+    table = WhatsAppInbox.__table__
+    db.session.execute(update(table).where(table.c.id == item_id).values(
+        status=QUEUED, error=str(error)[:1000], claim_token=None,
+        next_attempt_at=datetime.utcnow() + _backoff(attempts, cfg),
+    ))
+    db.session.commit()
+    return False
+
+
+def _requeue_stale(cfg, now):
+    table = WhatsAppInbox.__table__
+    cutoff = now - timedelta(seconds=int(cfg.get('WHATSAPP_INBOX_STALE_SECONDS', 600)))
+    db.session.execute(update(table).where(table.c.status == PROCESSING, table.c.claimed_at < cutoff)
+                       .values(status=QUEUED, claim_token=None))
+    retention = int(cfg.get('WHATSAPP_INBOX_RETENTION_DAYS', 7))
+    db.session.execute(delete(table).where(table.c.status == DONE,
+                                           table.c.processed_at < now - timedelta(days=retention)))
+    db.session.commit()
+
+
+def next_retry_in():
+    """ثوانٍ حتى أقرب حمولة مؤجلة (لجدولة مهمة تفريغ لاحقة)، أو None إذا لا يوجد شيء مؤجل."""
+    now = datetime.utcnow()
+    earliest = db.session.execute(
+        select(func.min(WhatsAppInbox.next_attempt_at)).where(WhatsAppInbox.status == QUEUED)
+    ).scalar()
+    db.session.rollback()
+    if earliest is None:
+        return None
+    return max((earliest - now).total_seconds(), 0.0)
+
+
+def _parse_item(raw):
+    data = json.loads(raw)
+    if not isinstance(data, dict):
+        raise ValueError('payload is not an object')
+    return parse_payload(data)
+
+
+def _add(totals, counts):
+    for name, value in counts.items():
+        totals[name] += value
+
+
+def drain_inbox(progress=None):
+    """معالجة كل الحمولات المستحقة دفعة بعد دفعة. progress(done, message) اختياري."""
+    app = current_app._get_current_object()
+    cfg = app.config
+    batch_size = int(cfg.get('WHATSAPP_INBOX_BATCH', 50))
+    totals = {'payloads': 0, 'messages': 0, 'duplicates': 0, 'statuses': 0, 'failed': 0, 'deferred': 0}
+    started = time.monotonic()
+    _requeue_stale(cfg, datetime.utcnow())
+
+    while True:
+        batch = _claim_batch(batch_size, datetime.utcnow())
+        if not batch:
+            break
+        parsed, bad = {}, {}
+        for item_id, raw, attempts in batch:
+            try:
+                parsed[item_id] = (_parse_item(raw), attempts)
+            except Exception as e:
+                # حمولة تالفة لن تنجح بإعادة المحاولة؛ لا تُفشل جاراتها
+                bad[item_id] = f'Invalid payload: {e}'[:1000]
+        for item_id, error in bad.items():
+            _finish([item_id], FAILED, error=error)
+        totals['failed'] += len(bad)
+        if not parsed:
+            continue
+        try:
+            _add(totals, process_payloads([p for p, _ in parsed.values()], cfg, app.logger))
+            _finish(list(parsed), DONE)
+            totals['payloads'] += len(parsed)
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f'WhatsApp inbox batch failed ({len(parsed)} payloads), retrying one by one: {e}')
+            # عزل السبب: كل حمولة في معاملتها الخاصة
+            for item_id, (payload, attempts) in parsed.items():
+                try:
+                    _add(totals, process_payloads([payload], cfg, app.logger))
+                    _finish([item_id], DONE)
+                    totals['payloads'] += 1
+                except Exception as item_error:
+                    db.session.rollback()
+                    app.logger.error(f'WhatsApp inbox payload {item_id} failed: {item_error}')
+                    if _defer(item_id, attempts, item_error, cfg):
+                        totals['failed'] += 1
+                    else:
+                        totals['deferred'] += 1
+        if progress is not None:
+            progress(totals['payloads'], f"{totals['payloads']} حمولة، {totals['messages']} رسالة جديدة")
+
+    totals['seconds'] = round(time.monotonic() - started, 3)
+    return totals
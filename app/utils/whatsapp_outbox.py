@@ -0,0 +1,469 @@
+"""
+إرسال WhatsApp الصادر (Outbox + connection pool)
+- GraphClient: جلسة requests واحدة لكل عملية بمجمع اتصالات (HTTPAdapter) ومهلات اتصال/قراءة،
+  بدل اتصال جديد بلا مهلة لكل رسالة.
+- رسائل الموظفين والبث الجماعي تُكتب في whatsapp_outbox ويعود الطلب فوراً؛ المهمة الخلفية
+  whatsapp.outbox_drain تحجز دفعات مستحقة (queued -> sending برمز حجز) وترسلها.
+- الترتيب لكل رقم: رسائل الرقم الواحد تُرسل بالتسلسل في خيط واحد، ولا تُحجز رسالة لرقم له رسالة
+  أقدم قيد الإرسال أو مؤجلة. الأرقام المختلفة تُرسل بالتوازي (WHATSAPP_SEND_WORKERS).
+- دلو رموز (TokenBucket) مشترك بين الخيوط يحد المعدل بحد Graph API لرقم الإرسال
+  (WHATSAPP_SEND_RATE رسالة/ث، افتراضياً 80)، ويتوقف الجميع مؤقتاً عند 429.
+- 429 و 5xx وأخطاء الشبكة تُعاد بتراجع أُسّي (WHATSAPP_SEND_BACKOFF_SECONDS × 2^(المحاولات-1)) حتى
+  WHATSAPP_SEND_MAX_ATTEMPTS؛ أخطاء 4xx الأخرى نهائية. نتائج الدفعة تُكتب في commit واحد.
+"""
+import mimetypes
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+from flask import current_app
+from requests.adapters import HTTPAdapter
+from sqlalchemy import and_, bindparam, func, or_, select, update
+
+from app import db
+from app.models.whatsapp_models import WhatsAppConversation, WhatsAppMessage, WhatsAppOutbox
+from app.utils.search_index import index_whatsapp_messages
+from app.utils.whatsapp_inbox import conversation_ids
+from app.whatsapp_config import WhatsAppConfig
+
+QUEUED = 'queued'
+SENDING = 'sending'
+SENT = 'sent'
+FAILED = 'failed'
+
+_IN_CHUNK = 500
+_ERROR_MAX = 1000
+_MIN_SLEEP = 0.05  # أقل انتظار بين محاولات الحجز (لا حلقة مشغولة عند رسالة مستحقة محجوبة)
+
+_client = None
+_client_lock = threading.Lock()
+_bucket = None
+_bucket_lock = threading.Lock()
+
+
+class GraphError(Exception):
+    """فشل طلب Graph API. status None = خطأ شبكة/مهلة."""
+
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self):
+        return self.status is None or self.status == 429 or self.status >= 500
+
+
+class GraphClient:
+    """عميل Graph API بجلسة ومجمع اتصالات دائمين (آمن للاستخدام من عدة خيوط)."""
+
+    def __init__(self, base_url=None, access_token=None, phone_number_id=None, pool_size=10, timeout=(5, 15)):
+        self.base_url = base_url or WhatsAppConfig.API_URL
+        self.access_token = access_token or WhatsAppConfig.ACCESS_TOKEN
+        self.phone_number_id = phone_number_id or WhatsAppConfig.PHONE_NUMBER_ID
+        self.timeout = timeout
+        self.pid = os.getpid()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=max(int(pool_size), 1), max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers['Authorization'] = f'Bearer {self.access_token}'
+
+    def _post(self, endpoint, **kwargs):
+        try:
+            response = self.session.post(f'{self.base_url}{endpoint}', timeout=self.timeout, **kwargs)
+        except requests.RequestException as e:
+            raise GraphError(str(e))
+        if response.status_code != 200:
+            retry_after = response.headers.get('Retry-After')
+            raise GraphError(response.text[:_ERROR_MAX], response.status_code,
+                             float(retry_after) if retry_after and retry_after.isdigit() else None)
+        return response.json()
+
+    def _send(self, payload):
+        result = self._post(f'{self.phone_number_id}/messages', json={'messaging_product': 'whatsapp', **payload})
+        return result['messages'][0]['id']
+
+    def send_text(self, phone, body):
+        return self._send({'to': phone, 'type': 'text', 'text': {'body': body}})
+
+    def send_audio(self, phone, media_id):
+        return self._send({'to': phone, 'type': 'audio', 'audio': {'id': media_id}})
+
+    def upload_media(self, filepath, media_type):
+        mime_type = mimetypes.guess_type(filepath)[0] or 'application/octet-stream'
+        with open(filepath, 'rb') as f:
+            result = self._post(f'{self.phone_number_id}/media', files={
+                'file': (os.path.basename(filepath), f, mime_type),
+                'messaging_product': (None, 'whatsapp'),
+                'type': (None, media_type),
+            })
+        return result.get('id')
+
+
+class TokenBucket:
+    """حد المعدل: rate رمز/ث بسعة burst؛ acquire() تنتظر حتى يتوفر رمز."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                wait = self.paused_until - now
+                if wait <= 0 and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                if wait <= 0:
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """إيقاف كل المرسلين مؤقتاً (استجابة 429 من Graph API)."""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+
+def get_graph_client(cfg=None):
+    """عميل هذه العملية (يُعاد إنشاؤه بعد fork أو تغيّر رابط API)."""
+    global _client
+    cfg = cfg or current_app.config
+    with _client_lock:
+        if _client is None or _client.pid != os.getpid() or _client.base_url != WhatsAppConfig.API_URL:
+            _client = GraphClient(
+                pool_size=int(cfg.get('WHATSAPP_SEND_WORKERS', 8)),
+                timeout=(float(cfg.get('WHATSAPP_HTTP_CONNECT_TIMEOUT', 5)),
+                         float(cfg.get('WHATSAPP_SEND_TIMEOUT', 15))),
+            )
+        return _client
+
+
+def _get_bucket(cfg):
+    global _bucket
+    rate = float(cfg.get('WHATSAPP_SEND_RATE', 80))
+    burst = float(cfg.get('WHATSAPP_SEND_BURST', 0)) or rate
+    with _bucket_lock:
+        if _bucket is None or _bucket.rate != rate or _bucket.capacity != burst:
+            _bucket = TokenBucket(rate, burst)
+        return _bucket
+
+
+def _chunks(values, size=_IN_CHUNK):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def normalize_phone(phone):
+    """أرقام فقط بالصيغة الدولية كما يقبلها Graph API ('+966 50-123' -> '96650123')."""
+    digits = ''.join(ch for ch in str(phone or '') if ch.isdigit())
+    return digits.lstrip('0') if digits.startswith('00') else digits
+
+
+# ==================== الإدراج ====================
+
+def enqueue_message(conversation, message, body=None, media_path=None, user_id=None):
+    """رسالة موظف لمحادثة: سجل صادر مرتبط برسالة المحادثة (لا commit هنا)."""
+    item = WhatsAppOutbox(
+        phone=conversation.customer_phone,
+        conversation_id=conversation.id,
+        message_row_id=message.id,
+        message_type=message.message_type,
+        body=body,
+        media_path=media_path,
+        media_url=message.audio_url,
+        status=QUEUED,
+        attempts=0,
+        created_by=user_id,
+    )
+    db.session.add(item)
+    return item
+
+
+def render_template_text(content, context):
+    """استبدال {name} و {code} و {department} ... بقيم المستلم (المتغيرات غير المعروفة تبقى كما هي)."""
+    for key, value in context.items():
+        content = content.replace('{' + key + '}', '' if value is None else str(value))
+    return content
+
+
+def queue_broadcast(recipients, content, user_id=None):
+    """بث جماعي: recipients قائمة dict فيها phone و name وقيم القالب.
+    محادثات الأرقام تُنشأ بعبارة مجمّعة، ورسائل المحادثة تُكتب عند نجاح الإرسال.
+    ترجع (broadcast_id، عدد المُدرج). لا commit هنا.
+    """
+    unique = {}
+    for recipient in recipients:
+        phone = normalize_phone(recipient.get('phone'))
+        if phone and phone not in unique:
+            unique[phone] = {**recipient, 'phone': phone, 'name': recipient.get('name') or phone}
+    if not unique:
+        return None, 0
+    broadcast_id = uuid.uuid4().hex
+    conversations = conversation_ids(list(unique.values()))
+    now = datetime.utcnow()
+    db.session.execute(WhatsAppOutbox.__table__.insert(), [{
+        'phone': phone,
+        'conversation_id': conversations[phone],
+        'message_type': 'text',
+        'body': render_template_text(content, recipient),
+        'broadcast_id': broadcast_id,
+        'status': QUEUED,
+        'attempts': 0,
+        'created_by': user_id,
+        'created_at': now,
+    } for phone, recipient in unique.items()])
+    return broadcast_id, len(unique)
+
+
+def broadcast_status(broadcast_id):
+    rows = db.session.execute(
+        select(WhatsAppOutbox.status, func.count()).where(WhatsAppOutbox.broadcast_id == broadcast_id)
+        .group_by(WhatsAppOutbox.status)
+    ).all()
+    return {status: count for status, count in rows}
+
+
+# ==================== الإرسال ====================
+
+def _send_one(client, row):
+    if row['message_type'] == 'audio':
+        media_id = client.upload_media(row['media_path'], 'audio')
+        if not media_id:
+            raise GraphError('Media upload returned no id', 400)
+        return client.send_audio(row['phone'], media_id)
+    return client.send_text(row['phone'], row['body'] or '')
+
+
+def _send_group(client, bucket, rows, pause_seconds):
+    """رسائل رقم واحد بالترتيب. ترجع [(row, outcome, value)]:
+    sent/wa_id، failed/خطأ نهائي، retry/GraphError، release/None (لم تُرسل لأن ما قبلها سيُعاد).
+    """
+    results = []
+    blocked = False
+    for row in rows:
+        if blocked:
+            results.append((row, 'release', None))
+            continue
+        bucket.acquire()
+        try:
+            results.append((row, SENT, _send_one(client, row)))
+        except GraphError as e:
+            if e.retryable:
+                if e.status == 429:
+                    bucket.pause(e.retry_after or pause_seconds)
+                results.append((row, 'retry', e))
+                blocked = True
+            else:
+                results.append((row, FAILED, e))
+        except Exception as e:
+            results.append((row, FAILED, e))
+    return results
+
+
+def _due_condition(table, now):
+    """queued ومستحق، ولا رسالة أقدم لنفس الرقم قيد الإرسال أو مؤجلة (حفظ الترتيب)."""
+    earlier = table.alias('earlier')
+    blocking = select(earlier.c.id).where(
+        earlier.c.phone == table.c.phone,
+        earlier.c.id < table.c.id,
+        or_(earlier.c.status == SENDING,
+            and_(earlier.c.status == QUEUED, earlier.c.next_attempt_at > now)),
+    ).exists()
+    return and_(
+        table.c.status == QUEUED,
+        or_(table.c.next_attempt_at.is_(None), table.c.next_attempt_at <= now),
+        ~blocking,
+    )
+
+
+def _claim_batch(limit, now):
+    table = WhatsAppOutbox.__table__
+    ids = db.session.execute(
+        select(table.c.id).where(_due_condition(table, now)).order_by(table.c.id).limit(limit)
+    ).scalars().all()
+    if not ids:
+        db.session.rollback()
+        return []
+    token = uuid.uuid4().hex
+    for chunk in _chunks(ids):
+        db.session.execute(update(table).where(table.c.id.in_(chunk), table.c.status == QUEUED).values(
+            status=SENDING, claim_token=token, claimed_at=now))
+    db.session.commit()
+    rows = db.session.execute(
+        select(table.c.id, table.c.phone, table.c.conversation_id, table.c.message_row_id, table.c.message_type,
+               table.c.body, table.c.media_path, table.c.media_url, table.c.attempts)
+        .where(table.c.claim_token == token).order_by(table.c.id)
+    ).all()
+    db.session.rollback()
+    return [dict(r._mapping) for r in rows]
+
+
+def _backoff(attempts, error, cfg):
+    base = float(cfg.get('WHATSAPP_SEND_BACKOFF_SECONDS', 2))
+    cap = float(cfg.get('WHATSAPP_SEND_BACKOFF_MAX', 600))
+    return timedelta(seconds=min(max(base * 2 ** max(attempts - 1, 0), error.retry_after or 0), cap))
+
+
+def _record(results, cfg):
+    """كتابة نتائج الدفعة: حالة الصادر ورسائل المحادثة وآخر رسالة، في commit واحد."""
+    outbox = WhatsAppOutbox.__table__
+    messages = WhatsAppMessage.__table__
+    now = datetime.utcnow()
+    max_attempts = int(cfg.get('WHATSAPP_SEND_MAX_ATTEMPTS', 6))
+    outbox_updates, message_updates, new_messages = [], [], []
+    counts = {SENT: 0, FAILED: 0, 'retry': 0}
+
+    for row, outcome, value in results:
+        update_values = {'b_id': row['id'], 'b_status': QUEUED, 'b_attempts': row['attempts'] or 0,
+                         'b_next': None, 'b_error': None, 'b_wa': None, 'b_sent': None}
+        if outcome == SENT:
+            update_values.update(b_status=SENT, b_wa=value, b_sent=now)
+            if row['message_row_id']:
+                message_updates.append({'b_mid': row['message_row_id'], 'b_wa': value, 'b_status': SENT})
+            elif row['conversation_id']:
+                new_messages.append({
+                    'conversation_id': row['conversation_id'], 'message_id': value,
+                    'message_type': row['message_type'], 'message_content': row['body'],
+                    'audio_url': row['media_url'], 'direction': 'outgoing', 'status': SENT,
+                    'timestamp': now, 'created_at': now,
+                })
+        elif outcome == FAILED:
+            update_values.update(b_status=FAILED, b_error=str(value)[:_ERROR_MAX],
+                                 b_attempts=(row['attempts'] or 0) + 1)
+            if row['message_row_id']:
+                message_updates.append({'b_mid': row['message_row_id'], 'b_wa': None, 'b_status': FAILED})
+        elif outcome == 'retry':
+            attempts = (row['attempts'] or 0) + 1
+            if attempts >= max_attempts:
+                outcome = FAILED
+                update_values['b_status'] = FAILED
+                if row['message_row_id']:
+                    message_updates.append({'b_mid': row['message_row_id'], 'b_wa': None, 'b_status': FAILED})
+            else:
+                update_values['b_next'] = now + _backoff(attempts, value, cfg)
+            update_values.update(b_attempts=attempts, b_error=str(value)[:_ERROR_MAX])
+        if outcome in counts:
+            counts[outcome] += 1
+        outbox_updates.append(update_values)
+
+    if outbox_updates:
+        db.session.execute(update(outbox).where(outbox.c.id == bindparam('b_id')).values(
+            status=bindparam('b_status'), attempts=bindparam('b_attempts'),
+            next_attempt_at=bindparam('b_next'), last_error=bindparam('b_error'),
+            wa_message_id=bindparam('b_wa'), sent_at=bindparam('b_sent'), claim_token=None,
+        ), outbox_updates)
+    if message_updates:
+        db.session.execute(update(messages).where(messages.c.id == bindparam('b_mid')).values(
+            message_id=func.coalesce(bindparam('b_wa'), messages.c.message_id), status=bindparam('b_status'),
+        ), message_updates)
+    if new_messages:
+        db.session.execute(messages.insert(), new_messages)
+        index_whatsapp_messages(db.session.connection(), [m['message_id'] for m in new_messages])
+        latest = {m['conversation_id']: m for m in new_messages}
+        conv = WhatsAppConversation.__table__
+        db.session.execute(update(conv).where(conv.c.id == bindparam('b_id')).values(
+            last_message=bindparam('b_message'), last_message_type=bindparam('b_type'),
+            last_message_direction='outgoing', updated_at=now,
+        ), [{'b_id': conv_id, 'b_message': m['message_content'], 'b_type': m['message_type']}
+            for conv_id, m in latest.items()])
+    db.session.commit()
+    return counts
+
+
+def _requeue_stale(cfg, now):
+    table = WhatsAppOutbox.__table__
+    cutoff = now - timedelta(seconds=int(cfg.get('WHATSAPP_OUTBOX_STALE_SECONDS', 300)))
+    db.session.execute(update(table).where(table.c.status == SENDING, table.c.claimed_at < cutoff)
+                       .values(status=QUEUED, claim_token=None))
+    db.session.commit()
+
+
+def _next_due_in(now):
+    """ثوانٍ حتى أقرب رسالة مؤجلة تصبح قابلة للحجز، أو None إذا لا يوجد شيء منتظر.
+    0 إذا كانت هناك رسالة قابلة للحجز الآن (انتهى تأجيلها بعد محاولة الحجز الأخيرة).
+    نفس شرط _due_condition مقيّماً عند موعد الرسالة نفسها: رسالة محجوبة خلف أخرى لنفس الرقم
+    لا تُحتسب (تُحتسب الأقدم منها)."""
+    table = WhatsAppOutbox.__table__
+    due_now = db.session.execute(select(select(table.c.id).where(_due_condition(table, now)).exists())).scalar()
+    if due_now:
+        db.session.rollback()
+        return 0.0
+    earliest = db.session.execute(
+        select(func.min(table.c.next_attempt_at)).where(
+            table.c.next_attempt_at > now, _due_condition(table, table.c.next_attempt_at)
+        )
+    ).scalar()
+    db.session.rollback()
+    if earliest is None:
+        return None
+    return max((earliest - now).total_seconds(), 0.0)
+
+
+def next_retry_in():
+    """ثوانٍ حتى أقرب رسالة مؤجلة (لجدولة مهمة تفريغ لاحقة)، أو None إذا لا يوجد شيء منتظر."""
+    return _next_due_in(datetime.utcnow())
+
+
+def queued_count():
+    return db.session.execute(
+        select(func.count()).select_from(WhatsAppOutbox).where(WhatsAppOutbox.status == QUEUED)
+    ).scalar() or 0
+
+
+def drain_outbox(progress=None, client=None):
+    """إرسال كل الرسائل المستحقة؛ تنتظر المؤجلة القريبة ما دام مجموع الوقت منذ البدء
+    لا يتجاوز WHATSAPP_OUTBOX_MAX_WAIT ثانية. progress(done, message) اختياري (يرفع JobCancelled عند الإلغاء).
+    """
+    app = current_app._get_current_object()
+    cfg = app.config
+    client = client or get_graph_client(cfg)
+    bucket = _get_bucket(cfg)
+    workers = int(cfg.get('WHATSAPP_SEND_WORKERS', 8))
+    batch_size = int(cfg.get('WHATSAPP_OUTBOX_BATCH', 500))
+    max_wait = float(cfg.get('WHATSAPP_OUTBOX_MAX_WAIT', 120))
+    pause_seconds = float(cfg.get('WHATSAPP_SEND_BACKOFF_SECONDS', 2))
+    totals = {SENT: 0, FAILED: 0, 'retry': 0, 'batches': 0}
+    started = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='wa-send') as pool:
+        while True:
+            # حجز عامل مات أثناء التشغيل يعود للطابور دون انتظار تشغيل جديد
+            _requeue_stale(cfg, datetime.utcnow())
+            rows = _claim_batch(batch_size, datetime.utcnow())
+            if not rows:
+                wait = _next_due_in(datetime.utcnow())
+                # wait == 0: تأجيل انتهى بين الحجز والفحص -> حجز فوري مهما مضى من الوقت
+                if wait is None or (wait > 0 and time.monotonic() - started + wait > max_wait):
+                    break
+                time.sleep(max(wait, _MIN_SLEEP))
+                continue
+            groups = {}
+            for row in rows:
+                groups.setdefault(row['phone'], []).append(row)
+            results = []
+            for group in pool.map(lambda g: _send_group(client, bucket, g, pause_seconds), groups.values()):
+                results.extend(group)
+            counts = _record(results, cfg)
+            for name, value in counts.items():
+                totals[name] += value
+            totals['batches'] += 1
+            if progress is not None:
+                elapsed = max(time.monotonic() - started, 1e-6)
+                progress(totals[SENT], f"تم إرسال {totals[SENT]} رسالة ({totals[SENT] / elapsed:.0f} رسالة/ث)")
+
+    totals['seconds'] = round(time.monotonic() - started, 3)
+    return totals
@@ -0,0 +1,226 @@
+"""
+تقويم أيام العمل (Working-day calendar)
+- يوم العمل: يوم أسبوع ضمن Settings.work_days (0 = الأحد؛ إذا كانت فارغة فكل الأيام عدا
+  weekend_days) وليس عطلة رسمية (PublicHoliday).
+- period_calendar(start, end) يرجع WorkCalendar للفترة: مصفوفة أيام NumPy (datetime64[D])
+  وقناع أيام العمل (bitmap). يُبنى مرة لكل فترة في كل عملية ويُعاد بناؤه عند تغيّر الجيل
+  'calendar' (تعديل العطل) أو 'settings'.
+- الغياب وتداخل الإجازات عمليات على الأقنعة (working & ~present & ~leave) بدل المرور على
+  كل يوم لكل موظف.
+- إضافة عطلة أو حذفها أو نقلها تعلّم رواتب كل الموظفين النشطين لأشهرها لإعادة الحساب
+  (payroll_dirty)، وتغيير work_days/weekend_days يعلّم كل الرواتب المفتوحة.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from sqlalchemy import event, inspect as sa_inspect, select
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models.employee import Employee
+from app.models.holiday import PublicHoliday
+from app.models.payroll import Payroll
+from app.models.settings import Settings
+from app.utils.cache_generation import bump_generation, get_generation
+from app.utils.payroll_dirty import mark_payroll_dirty
+from app.utils.settings_cache import SETTINGS_GENERATION, system_settings
+
+CALENDAR_GENERATION = 'calendar'
+ALL_WEEKDAYS = frozenset(range(7))
+_EPOCH = np.datetime64('1970-01-01', 'D')  # الخميس = 4 بترقيم الأحد = 0
+_CACHE_SIZE = 64
+
+_cache = OrderedDict()  # (start, end) -> (generation, WorkCalendar)
+_holidays = None  # (generation, frozenset)
+_lock = threading.Lock()
+
+
+def parse_weekdays(value):
+    """"0,1,2" -> frozenset({0, 1, 2}) مع تجاهل القيم غير الصالحة."""
+    days = set()
+    for part in str(value or '').split(','):
+        part = part.strip()
+        if part.isdigit() and int(part) < 7:
+            days.add(int(part))
+    return frozenset(days)
+
+
+def work_weekdays(work_days, weekend_days=None):
+    """أيام العمل في الأسبوع من نصوص الإعدادات (الافتراضي الأحد–الخميس)."""
+    days = parse_weekdays(work_days)
+    if not days and weekend_days:
+        days = ALL_WEEKDAYS - parse_weekdays(weekend_days)
+    return days or frozenset(range(5))
+
+
+def weekday_numbers(days):
+    """رقم يوم الأسبوع (0 = الأحد) لمصفوفة datetime64[D]."""
+    return ((days - _EPOCH).astype(np.int64) + 4) % 7
+
+
+def to_days(dates):
+    """قائمة تواريخ -> مصفوفة datetime64[D]."""
+    return np.array(list(dates), dtype='datetime64[D]')
+
+
+class WorkCalendar:
+    """أيام الفترة [start, end] وقناع أيام العمل. الكائن مشترك بين الطلبات: للقراءة فقط."""
+
+    def __init__(self, start, end, weekdays, holidays=()):
+        self.start = start
+        self.end = end
+        self.days = np.arange(np.datetime64(start, 'D'), np.datetime64(end, 'D') + 1)
+        holiday_days = to_days(sorted(d for d in holidays if start <= d <= end))
+        self.holidays = np.isin(self.days, holiday_days)
+        self.working = np.isin(weekday_numbers(self.days), sorted(weekdays)) & ~self.holidays
+        for arr in (self.days, self.holidays, self.working):
+            arr.flags.writeable = False
+        self.working_count = int(np.count_nonzero(self.working))
+        self._working_dates = None
+
+    def __len__(self):
+        return len(self.days)
+
+    @property
+    def working_dates(self):
+        """أيام العمل كقائمة date (للمستدعين القدامى)."""
+        if self._working_dates is None:
+            self._working_dates = self.days[self.working].tolist()
+        return self._working_dates
+
+    def offsets(self, dates):
+        """مواقع التواريخ داخل الفترة (تُسقط التواريخ خارجها)."""
+        offsets = (to_days(dates) - self.days[0]).astype(np.int64) if len(self.days) else np.empty(0, np.int64)
+        return offsets[(offsets >= 0) & (offsets < len(self.days))]
+
+    def mask(self, dates):
+        """قناع الأيام الموجودة في dates."""
+        mask = np.zeros(len(self.days), dtype=bool)
+        mask[self.offsets(dates)] = True
+        return mask
+
+    def span(self, first, last):
+        """(بداية، نهاية) مواقع [first, last] بعد قصّها على الفترة؛ فارغ إذا بداية > نهاية."""
+        lo = max((first - self.start).days, 0)
+        hi = min((last - self.start).days, len(self.days) - 1)
+        return lo, hi
+
+    def dates(self, mask):
+        """الأيام المحددة في القناع كقائمة date."""
+        return self.days[mask].tolist()
+
+    def is_working(self, day):
+        offset = (day - self.start).days
+        return 0 <= offset < len(self.days) and bool(self.working[offset])
+
+
+def _load_holidays(connection=None):
+    query = select(PublicHoliday.__table__.c.date)
+    if connection is not None:
+        return frozenset(connection.execute(query).scalars())
+    with db.session.no_autoflush:
+        return frozenset(db.session.execute(query).scalars())
+
+
+def holiday_dates(connection=None):
+    """كل تواريخ العطل الرسمية. connection: قراءة مباشرة داخل flush بدون الكاش."""
+    global _holidays
+    if connection is not None:
+        return _load_holidays(connection)
+    generation = get_generation(CALENDAR_GENERATION)
+    entry = _holidays
+    if entry is not None and entry[0] == generation:
+        return entry[1]
+    holidays = _load_holidays()
+    with _lock:
+        _holidays = (generation, holidays)
+    return holidays
+
+
+def period_calendar(start, end, settings=None):
+    """تقويم الفترة من الإعدادات والعطل الحالية (من الكاش إن لم يتغير شيء)."""
+    settings = settings or system_settings()
+    generation = (get_generation(CALENDAR_GENERATION), get_generation(SETTINGS_GENERATION))
+    key = (start, end)
+    entry = _cache.get(key)
+    if entry is not None and entry[0] == generation:
+        return entry[1]
+    calendar = WorkCalendar(start, end, work_weekdays(settings.work_days, getattr(settings, 'weekend_days', None)),
+                            holiday_dates())
+    with _lock:
+        _cache[key] = (generation, calendar)
+        _cache.move_to_end(key)
+        while len(_cache) > _CACHE_SIZE:
+            _cache.popitem(last=False)
+    return calendar
+
+
+_OPEN_PAYROLL_STATUSES = ('pending', 'approved')
+
+
+def _holiday_months(obj):
+    """أشهر العطلة قبل التعديل وبعده (نقل عطلة يغيّر الشهرين)."""
+    history = sa_inspect(obj).attrs.date.history
+    days = list(history.added or ()) + list(history.unchanged or ()) + list(history.deleted or ())
+    return {(d.year, d.month) for d in days or [obj.date] if d is not None}
+
+
+def _work_week_changed(obj):
+    state = sa_inspect(obj)
+    return any(state.attrs[name].history.has_changes() for name in ('work_days', 'weekend_days'))
+
+
+def _mark_calendar_payrolls(connection, months, work_week_changed):
+    """أيام العمل تغيّرت: الغياب والخصم يتغيران لكل موظف في تلك الأشهر."""
+    keys = set()
+    if months:
+        employee_ids = connection.execute(
+            select(Employee.__table__.c.id).where(Employee.__table__.c.active == True)
+        ).scalars().all()
+        keys |= {(emp_id, y, m) for emp_id in employee_ids for y, m in months}
+    if work_week_changed:
+        payroll = Payroll.__table__
+        keys |= {tuple(row) for row in connection.execute(
+            select(payroll.c.employee_id, payroll.c.year, payroll.c.month).where(
+                payroll.c.status.in_(_OPEN_PAYROLL_STATUSES),
+                payroll.c.employee_id.isnot(None), payroll.c.year.isnot(None), payroll.c.month.isnot(None))
+        )}
+    mark_payroll_dirty(keys, source='calendar', connection=connection)
+
+
+def _after_flush(orm_session, flush_context):
+    months, holidays_changed, work_week_changed = set(), False, False
+    for obj in list(orm_session.new) + list(orm_session.dirty) + list(orm_session.deleted):
+        if not isinstance(obj, (PublicHoliday, Settings)):
+            continue
+        if obj in orm_session.dirty and not orm_session.is_modified(obj, include_collections=False):
+            continue
+        if isinstance(obj, Settings):
+            work_week_changed = work_week_changed or (obj in orm_session.dirty and _work_week_changed(obj))
+            continue
+        holidays_changed = True
+        if obj in orm_session.dirty and not sa_inspect(obj).attrs.date.history.has_changes():
+            continue  # تغيير الاسم فقط
+        months |= _holiday_months(obj)
+    if not (holidays_changed or months or work_week_changed):
+        return
+    connection = orm_session.connection()
+    if holidays_changed:
+        bump_generation(CALENDAR_GENERATION, connection=connection)
+    if months or work_week_changed:
+        _mark_calendar_payrolls(connection, months, work_week_changed)
+
+
+def _keep_old_value(target, value, oldvalue, initiator):
+    pass
+
+
+def register_calendar_cache():
+    """تسجيل مستمع الإبطال مرة واحدة. active_history: نقل عطلة بعد commit يحمّل تاريخها القديم
+    فيُعلَّم الشهر القديم أيضاً."""
+    for attr in (PublicHoliday.date, Settings.work_days, Settings.weekend_days):
+        if not event.contains(attr, 'set', _keep_old_value):
+            event.listen(attr, 'set', _keep_old_value, active_history=True)
+    if not event.contains(Session, 'after_flush', _after_flush):
+        event.listen(Session, 'after_flush', _after_flush)
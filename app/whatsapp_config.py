@@ -12,7 +12,7 @@ class WhatsAppConfig:
     BUSINESS_ACCOUNT_ID = os.environ.get('WHATSAPP_BUSINESS_ACCOUNT_ID', 'YOUR_BUSINESS_ACCOUNT_ID')
     
     # رابط API
-    API_URL = 'https://graph.facebook.com/v18.0/'
+    API_URL = os.environ.get('WHATSAPP_API_URL', 'https://graph.facebook.com/v18.0/')  # خادم وهمي للاختبار: scripts/fake_graph_api.py
     
     # Webhook
     WEBHOOK_VERIFY_TOKEN = os.environ.get('WHATSAPP_WEBHOOK_TOKEN', 'YOUR_WEBHOOK_VERIFY_TOKEN_123456')
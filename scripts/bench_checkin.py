@@ -0,0 +1,166 @@
+"""Load test: morning check-in rush against POST /api/attendance.
+
+Seeds N employees in a throwaway database, then fires check-ins at a fixed
+arrival rate (open loop, default 1,000 per minute) from a pool of client
+threads through the full Flask request path, and reports p50/p95/p99 latency.
+
+Run it once with direct commits and once with --group-commit to compare.
+
+Usage:
+  python scripts/bench_checkin.py                          # SQLite, 1000/min for 60s
+  python scripts/bench_checkin.py --rate 6000 --duration 20 --group-commit
+  python scripts/bench_checkin.py --database-url postgresql://user:pw@localhost/bench_hr
+
+The database is wiped of attendance rows for the seeded employees; never point
+--database-url at a real deployment.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Check-in load test')
+    parser.add_argument('--rate', type=float, default=1000, help='check-ins per minute (default 1000)')
+    parser.add_argument('--duration', type=float, default=60, help='seconds of load (default 60)')
+    parser.add_argument('--threads', type=int, default=32, help='concurrent client threads (default 32)')
+    parser.add_argument('--group-commit', action='store_true', help='enable CHECKIN_GROUP_COMMIT')
+    parser.add_argument('--database-url', default=None, help='default: a temp SQLite file')
+    return parser.parse_args()
+
+
+ARGS = parse_args()
+if ARGS.database_url:
+    os.environ['DATABASE_URL'] = ARGS.database_url
+else:
+    DB_PATH = os.path.join(tempfile.gettempdir(), 'bench_checkin.db')
+    if os.path.exists(DB_PATH):
+        os.remove(DB_PATH)
+    os.environ['DATABASE_URL'] = f'sqlite:///{DB_PATH}'
+os.environ['CHECKIN_GROUP_COMMIT'] = '1' if ARGS.group_commit else '0'
+
+from app import create_app, db  # noqa: E402
+from app.models.attendance import Attendance, AttendanceSettings  # noqa: E402
+from app.models.employee import Employee  # noqa: E402
+from app.models.permission import Role, UserRole  # noqa: E402
+from app.models.user import User  # noqa: E402
+
+EMPLOYEE_BASE = 900000  # نطاق أرقام بعيد عن بيانات حقيقية
+
+
+def seed(n):
+    ids = list(range(EMPLOYEE_BASE + 1, EMPLOYEE_BASE + n + 1))
+    existing = {i for (i,) in db.session.query(Employee.id).filter(Employee.id.in_(ids))}
+    db.session.bulk_insert_mappings(Employee, [
+        {'id': i, 'code': f'L{i}', 'name': f'Load {i}', 'active': True}
+        for i in ids if i not in existing
+    ])
+    Attendance.query.filter(Attendance.employee_id.in_(ids)).delete(synchronize_session=False)
+
+    settings = AttendanceSettings.query.first() or AttendanceSettings()
+    settings.require_time_verification = False
+    settings.require_device_verification = False
+    settings.require_location_verification = True
+    db.session.add(settings)
+
+    admin = User.query.filter_by(username='1').first()
+    admin_role = Role.query.filter_by(name='admin').first()
+    if admin_role and not UserRole.query.filter_by(user_id=admin.id, role_id=admin_role.id).first():
+        db.session.add(UserRole(user_id=admin.id, role_id=admin_role.id))
+    db.session.commit()
+    return ids, admin.id, (settings.company_lat, settings.company_lng)
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * (len(sorted_values) - 1)))))
+    return sorted_values[k]
+
+
+def main():
+    app = create_app()
+    app.config.update({'TESTING': True, 'WTF_CSRF_ENABLED': False})
+    total = max(1, int(ARGS.rate * ARGS.duration / 60.0))
+    with app.app_context():
+        ids, admin_id, (lat, lng) = seed(total)
+
+    interval = 60.0 / ARGS.rate
+    latencies = []
+    lags = []
+    statuses = {}
+    lock = threading.Lock()
+    next_index = [0]
+    start = time.perf_counter() + 0.5
+
+    def worker():
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['_user_id'] = str(admin_id)
+            sess['_fresh'] = True
+        while True:
+            with lock:
+                i = next_index[0]
+                next_index[0] += 1
+            if i >= total:
+                return
+            scheduled = start + i * interval
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            t0 = time.perf_counter()
+            resp = client.post('/api/attendance', json={
+                'employee_id': ids[i], 'action': 'حضور', 'lat': lat, 'lng': lng
+            })
+            t1 = time.perf_counter()
+            with lock:
+                latencies.append(t1 - t0)
+                lags.append(t1 - scheduled)
+                statuses[resp.status_code] = statuses.get(resp.status_code, 0) + 1
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(ARGS.threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    with app.app_context():
+        stored = Attendance.query.filter(Attendance.employee_id.in_(ids)).count()
+        # تسجيل حضور مكرر يجب أن يرفضه الفهرس الفريد
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['_user_id'] = str(admin_id)
+            sess['_fresh'] = True
+        dup = client.post('/api/attendance', json={'employee_id': ids[0], 'action': 'حضور', 'lat': lat, 'lng': lng})
+
+    latencies.sort()
+    lags.sort()
+    ms = lambda v: f'{v * 1000:8.1f} ms'  # noqa: E731
+    print(f"database      : {app.config['SQLALCHEMY_DATABASE_URI'].split('@')[-1]}")
+    print(f"mode          : {'group commit' if ARGS.group_commit else 'direct commit'}")
+    print(f"requests      : {total} at {ARGS.rate:.0f}/min, {ARGS.threads} threads, {elapsed:.1f}s "
+          f"({total / elapsed * 60:.0f}/min achieved)")
+    print(f"status codes  : {dict(sorted(statuses.items()))}")
+    print(f"rows stored   : {stored} (duplicate check-in -> {dup.status_code})")
+    print(f"latency p50   : {ms(percentile(latencies, 50))}")
+    print(f"latency p95   : {ms(percentile(latencies, 95))}")
+    print(f"latency p99   : {ms(percentile(latencies, 99))}")
+    print(f"latency max   : {ms(latencies[-1] if latencies else 0)}")
+    print(f"schedule lag p99 (queueing behind the arrival rate): {ms(percentile(lags, 99))}")
+    if ARGS.group_commit:
+        from app.utils.checkin import get_checkin_writer
+        stats = get_checkin_writer(app).stats
+        avg = stats['items'] / stats['batches'] if stats['batches'] else 0
+        print(f"group commits : {stats['batches']} batches, avg {avg:.1f} / max {stats['max_batch_seen']} per batch")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Benchmark: email outbox throughput against the local fake SMTP server.
+
+Queues N messages in a throwaway SQLite database and drains the outbox through
+scripts/fake_smtp_server.py, which adds handshake latency (greeting + AUTH, what
+a TLS handshake and login cost against a real provider), per-message latency
+and optionally a provider-style rate limit. Reports messages/second, SMTP
+connections opened, throttling replies and retries, and checks every recipient
+got exactly one message.
+
+--naive also times the old path for comparison: connect, log in, send and quit
+for every message, sequentially (first 200 messages only).
+
+Usage:
+  python scripts/bench_email_outbox.py                          # 2000 messages
+  python scripts/bench_email_outbox.py 5000 --handshake-ms 200 --workers 8
+  python scripts/bench_email_outbox.py 1000 --rate 100 --naive
+"""
+import argparse
+import os
+import smtplib
+import sys
+import tempfile
+import time
+from email.mime.text import MIMEText
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+DB_PATH = os.path.join(tempfile.gettempdir(), 'bench_email_outbox.db')
+if os.path.exists(DB_PATH):
+    os.remove(DB_PATH)
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_PATH}'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Email outbox throughput benchmark')
+    parser.add_argument('messages', type=int, nargs='?', default=2000)
+    parser.add_argument('--handshake-ms', type=float, default=100, help='fake server greeting/AUTH latency')
+    parser.add_argument('--latency-ms', type=float, default=5, help='fake server per-message latency')
+    parser.add_argument('--rate', type=float, default=0, help='fake server limit, messages/s (0 = none)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of transient 451 replies')
+    parser.add_argument('--workers', type=int, default=4, help='EMAIL_SEND_WORKERS (default 4)')
+    parser.add_argument('--naive', action='store_true', help='also time a new connection per message')
+    return parser.parse_args()
+
+
+ARGS = parse_args()
+
+from app import create_app, db  # noqa: E402
+from app.models.email_outbox import EmailOutbox  # noqa: E402
+from app.utils.emailer import get_transport, drain_outbox, mail_settings, outbox_status, queue_email  # noqa: E402
+from scripts.fake_smtp_server import FakeSMTPServer  # noqa: E402
+
+SUBJECT = 'Quick Sale HR - كشف الراتب'
+BODY = 'مرحباً،\n\nكشف راتبك لهذا الشهر متاح في بوابة الموظفين.\n\nQuick Sale HR'
+
+
+def run_naive(server, count):
+    t0 = time.perf_counter()
+    for i in range(count):
+        msg = MIMEText(BODY, 'plain', 'utf-8')
+        msg['Subject'] = SUBJECT
+        msg['From'] = 'no-reply@example.com'
+        msg['To'] = f'naive{i}@example.com'
+        with smtplib.SMTP(server.host, server.port, timeout=15) as smtp:
+            smtp.login('bench', 'secret')
+            smtp.sendmail('no-reply@example.com', [msg['To']], msg.as_string())
+    return time.perf_counter() - t0
+
+
+def main():
+    app = create_app()
+    with FakeSMTPServer(username='bench', password='secret', handshake_latency=ARGS.handshake_ms / 1000.0,
+                        latency=ARGS.latency_ms / 1000.0, rate=ARGS.rate, error_rate=ARGS.error_rate) as server:
+        app.config.update(
+            EMAIL_PROVIDER='SMTP', SMTP_SERVER=server.host, SMTP_PORT=server.port, SMTP_USERNAME='bench',
+            SMTP_PASSWORD='secret', SMTP_USE_TLS=False, SMTP_USE_SSL=False,
+            EMAIL_SEND_WORKERS=ARGS.workers, EMAIL_SEND_BACKOFF_SECONDS=0.2, EMAIL_SEND_MAX_ATTEMPTS=50,
+        )
+        with app.app_context():
+            print(f'[*] Fake SMTP server {server.host}:{server.port} (handshake {ARGS.handshake_ms:.0f}ms, '
+                  f'message {ARGS.latency_ms:.0f}ms, limit {ARGS.rate or "none"})')
+            if ARGS.naive:
+                sample = min(ARGS.messages, 200)
+                naive = run_naive(server, sample)
+                print(f'[+] naive per-message   : {sample / naive:8.1f} msg/s ({sample} msgs in {naive:.2f}s)')
+                server.stats.clear()
+                server.delivered.clear()
+
+            t0 = time.perf_counter()
+            for i in range(ARGS.messages):
+                queue_email(f'user{i}@example.com', SUBJECT, BODY, category='bench')
+            db.session.commit()
+            enqueue = time.perf_counter() - t0
+
+            totals = drain_outbox()
+            status = outbox_status()
+            connects = get_transport(mail_settings()).connects
+
+            print(f'[+] enqueue             : {ARGS.messages} rows in {enqueue:.2f}s')
+            print(f'[+] pooled outbox       : {totals["sent"] / totals["seconds"]:8.1f} msg/s '
+                  f'({totals["sent"]} msgs in {totals["seconds"]:.2f}s, {ARGS.workers} workers)')
+            print(f'[+] connections={connects} throttled={server.stats["throttled"]} '
+                  f'errors={server.stats["errors"]} retries={totals["retry"]} status={status}')
+            duplicates = sum(1 for subjects in server.delivered.values() if len(subjects) > 1)
+            if status.get('sent') != ARGS.messages or duplicates:
+                print(f'[-] expected {ARGS.messages} sent exactly once; duplicates={duplicates}')
+                raise SystemExit(1)
+            EmailOutbox.query.delete()
+            db.session.commit()
+
+
+if __name__ == '__main__':
+    main()
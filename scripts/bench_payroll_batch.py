@@ -0,0 +1,128 @@
+"""Benchmark: per-employee payroll batch vs the set-based batch engine.
+
+Seeds a throwaway SQLite database with N employees (templates, one month of
+attendance, some leaves and loans), then times:
+  - legacy: the old per-template loop (3 queries per employee + add())
+  - engine: load_period_inputs + build_batch_payrolls + bulk insert
+
+Usage:
+  python scripts/bench_payroll_batch.py            # 5000 employees
+  python scripts/bench_payroll_batch.py 2000
+"""
+import os, sys, time, random, tempfile
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+DB_PATH = os.path.join(tempfile.gettempdir(), 'bench_payroll_batch.db')
+if os.path.exists(DB_PATH):
+    os.remove(DB_PATH)
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_PATH}'
+
+from datetime import date, datetime, timedelta  # noqa: E402
+from dateutil.relativedelta import relativedelta  # noqa: E402
+from app import create_app, db  # noqa: E402
+from app.models.employee import Employee  # noqa: E402
+from app.models.attendance import Attendance  # noqa: E402
+from app.models.leave import Leave  # noqa: E402
+from app.models.payroll import Payroll, PayrollTemplate, EmployeeLoan  # noqa: E402
+
+MONTH, YEAR = 3, 2025
+
+
+def seed(n):
+    rnd = random.Random(42)
+    period_start = date(YEAR, MONTH, 1)
+    period_end = period_start + relativedelta(months=1, days=-1)
+    db.session.bulk_insert_mappings(Employee, [
+        {'id': i, 'code': f'B{i:06d}', 'name': f'Bench {i}', 'active': True, 'salary': 5000.0}
+        for i in range(1, n + 1)
+    ])
+    db.session.bulk_insert_mappings(PayrollTemplate, [
+        {'employee_id': i, 'basic_salary': 4000.0 + (i % 7) * 250, 'housing_allowance': 800.0,
+         'transport_allowance': 300.0, 'is_active': True}
+        for i in range(1, n + 1)
+    ])
+    att = []
+    d = period_start
+    while d <= period_end:
+        for i in range(1, n + 1):
+            if rnd.random() < 0.08:
+                continue  # absent
+            check_in = datetime.combine(d, datetime.min.time()) + timedelta(hours=8, minutes=rnd.randint(-20, 40))
+            att.append({'employee_id': i, 'date': d, 'check_in_time': check_in,
+                        'check_out_time': check_in + timedelta(hours=8), 'status': 'outside'})
+        d += timedelta(days=1)
+    for i in range(0, len(att), 20000):
+        db.session.bulk_insert_mappings(Attendance, att[i:i + 20000])
+    db.session.bulk_insert_mappings(Leave, [
+        {'employee_id': i, 'leave_type': 'annual', 'status': 'Approved', 'paid': i % 2 == 0,
+         'start_date': period_start + timedelta(days=10), 'end_date': period_start + timedelta(days=12)}
+        for i in range(1, n + 1, 9)
+    ])
+    db.session.bulk_insert_mappings(EmployeeLoan, [
+        {'employee_id': i, 'amount': 3000.0, 'installments': 6, 'status': 'active',
+         'start_date': period_start - timedelta(days=40)}
+        for i in range(1, n + 1, 5)
+    ])
+    db.session.commit()
+    return len(att)
+
+
+def run_legacy(templates):
+    from app.routes.payroll import _compute_attendance_metrics, _get_leave_dates, _compute_loan_due_amount
+    from app.utils.payroll_engine import apply_attendance_deductions
+    period_start = date(YEAR, MONTH, 1)
+    period_end = period_start + relativedelta(months=1, days=-1)
+    for template in templates:
+        payroll = Payroll(employee_id=template.employee_id, month=MONTH, year=YEAR,
+                          period_start=period_start, period_end=period_end,
+                          basic=template.basic_salary, housing_allowance=template.housing_allowance,
+                          transport_allowance=template.transport_allowance, status='pending')
+        abs_days, late_mins, working_days = _compute_attendance_metrics(template.employee_id, period_start, period_end)
+        paid_dates, unpaid_dates = _get_leave_dates(template.employee_id, period_start, period_end)
+        apply_attendance_deductions(payroll, abs_days, late_mins, working_days, paid_dates, unpaid_dates)
+        payroll.loan_deduction = _compute_loan_due_amount(template.employee_id, period_end)
+        payroll.compute_net()
+        db.session.add(payroll)
+    db.session.commit()
+
+
+def run_engine(templates):
+    from app.utils.payroll_engine import build_batch_payrolls, bulk_insert_payrolls
+    rows, totals = build_batch_payrolls(templates, MONTH, YEAR)
+    bulk_insert_payrolls(rows)
+    db.session.commit()
+    return totals
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    app = create_app()
+    with app.app_context():
+        t0 = time.perf_counter()
+        att_rows = seed(n)
+        print(f'[*] Seeded {n} employees, {att_rows} attendance rows in {time.perf_counter() - t0:.1f}s')
+        templates = PayrollTemplate.query.all()
+
+        t0 = time.perf_counter()
+        run_legacy(templates)
+        legacy = time.perf_counter() - t0
+        legacy_net = db.session.query(db.func.sum(Payroll.net)).scalar() or 0.0
+        Payroll.query.delete()
+        db.session.commit()
+
+        t0 = time.perf_counter()
+        totals = run_engine(templates)
+        engine = time.perf_counter() - t0
+        engine_net = db.session.query(db.func.sum(Payroll.net)).scalar() or 0.0
+
+        print(f'[+] legacy per-employee : {legacy:8.2f}s')
+        print(f'[+] set-based engine    : {engine:8.2f}s  (x{legacy / engine:.1f} faster)')
+        print(f'[+] total net legacy={legacy_net:.2f} engine={engine_net:.2f} batch_totals={totals["net"]:.2f}')
+        if round(legacy_net, 2) != round(engine_net, 2):
+            print('[-] MISMATCH between legacy and engine totals')
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Benchmark: create_app() startup time with and without the schema fingerprint check.
+
+Uses a throwaway SQLite database and times, each in a fresh interpreter
+(what a gunicorn worker, CLI script or test process pays):
+  - cold:    first create_app() on an empty database (full migration)
+  - warm:    create_app() when the stored fingerprint matches (one query)
+  - legacy:  create_app() plus the old unconditional auto_migrate_database()
+and, in-process, the cost of repeated create_app() calls (one per test setUp).
+
+Usage:
+  python scripts/bench_startup.py
+  python scripts/bench_startup.py --runs 10
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+DB_PATH = os.path.join(tempfile.gettempdir(), 'bench_startup.db')
+
+_CHILD = r'''
+import contextlib, io, sys, time
+sys.path.insert(0, {base!r})
+t0 = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    from app import create_app
+    imported = time.perf_counter()
+    app = create_app()
+    created = time.perf_counter()
+    if {legacy!r}:
+        from app.db_manager import auto_migrate_database
+        with app.app_context():
+            auto_migrate_database()
+done = time.perf_counter()
+n = {repeat}
+with contextlib.redirect_stdout(io.StringIO()):
+    r0 = time.perf_counter()
+    for _ in range(n):
+        app = create_app()
+        if {legacy!r}:
+            with app.app_context():
+                auto_migrate_database()
+    repeat = (time.perf_counter() - r0) / n if n else 0
+print(f"{{(imported - t0) * 1000:.1f}} {{(done - imported) * 1000:.1f}} {{repeat * 1000:.1f}}")
+'''
+
+
+def run_child(legacy=False, repeat=0):
+    code = _CHILD.format(base=BASE_DIR, legacy=legacy, repeat=repeat)
+    env = {**os.environ, 'DATABASE_URL': f'sqlite:///{DB_PATH}', 'JOBS_IN_PROCESS': '0'}
+    out = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True, check=True)
+    imported, startup, repeated = (float(x) for x in out.stdout.split()[-3:])
+    return imported, startup, repeated
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='create_app() startup benchmark')
+    parser.add_argument('--runs', type=int, default=5, help='fresh processes per scenario (default 5)')
+    parser.add_argument('--repeat', type=int, default=20, help='in-process create_app() calls (default 20)')
+    args = parser.parse_args()
+
+    if os.path.exists(DB_PATH):
+        os.remove(DB_PATH)
+    imported, cold, _ = run_child()
+    print(f'[*] import app: {imported:.0f}ms (not included below)')
+    print(f'[+] cold (empty database, full migration) : {cold:8.1f} ms')
+
+    warm = [run_child() for _ in range(args.runs)]
+    legacy = [run_child(legacy=True) for _ in range(args.runs)]
+    _, _, repeated = run_child(repeat=args.repeat)
+    _, _, legacy_repeated = run_child(legacy=True, repeat=args.repeat)
+    print(f'[+] warm (fingerprint matches)            : {median(w[1] for w in warm):8.1f} ms (median of {args.runs})')
+    print(f'[+] legacy (auto_migrate every start)     : {median(l[1] for l in legacy):8.1f} ms (median of {args.runs})')
+    print(f'[+] repeated create_app() in one process  : {repeated:8.1f} ms per call ({args.repeat} calls, '
+          f'{legacy_repeated:.1f} ms with auto_migrate)')
+    os.remove(DB_PATH)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""Move legacy WhatsApp media into content-addressed storage and drop duplicates.
+
+Older builds saved each attachment as <timestamp>_<name> in the media folder,
+so forwarded content was stored once per message. This hashes every such
+file, keeps one copy per SHA-256 under <aa>/<digest>.<ext> (see
+app/utils/media_store.py) and rewrites the /static/whatsapp_media/... URLs in
+whatsapp_messages and whatsapp_outbox to the new /whatsapp/media/... URLs.
+The legacy files are deleted only after the URL rewrite is committed, so an
+interrupted run never leaves a message pointing at a removed file; just run
+it again.
+
+Usage:
+  python scripts/dedupe_whatsapp_media.py
+"""
+import os
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+from sqlalchemy import bindparam, update  # noqa: E402
+from app import create_app, db  # noqa: E402
+from app.models.whatsapp_models import WhatsAppMessage, WhatsAppOutbox  # noqa: E402
+from app.utils.media_store import (  # noqa: E402
+    LEGACY_URL_PREFIX, media_path, media_url, migrate_legacy_media, remove_legacy_media,
+)
+
+URL_COLUMNS = ('audio_url', 'image_url', 'document_url', 'video_url')
+
+
+def main():
+    app = create_app()
+    with app.app_context():
+        mapping, saved = migrate_legacy_media()
+        if not mapping:
+            print('[*] No legacy media files found')
+            return
+        messages = WhatsAppMessage.__table__
+        updated = 0
+        for column in URL_COLUMNS:
+            result = db.session.execute(
+                update(messages).where(messages.c[column] == bindparam('b_old')).values({column: bindparam('b_new')}),
+                [{'b_old': LEGACY_URL_PREFIX + old, 'b_new': media_url(new)} for old, new in mapping.items()],
+            )
+            updated += result.rowcount or 0
+        outbox = WhatsAppOutbox.__table__
+        db.session.execute(
+            update(outbox).where(outbox.c.media_url == bindparam('b_old')).values(
+                media_url=bindparam('b_new'), media_path=bindparam('b_path')),
+            [{'b_old': LEGACY_URL_PREFIX + old, 'b_new': media_url(new), 'b_path': media_path(new)}
+             for old, new in mapping.items()],
+        )
+        db.session.commit()
+        # الروابط الجديدة محفوظة: الآن فقط تُحذف الملفات القديمة
+        removed = remove_legacy_media(mapping)
+        unique = len(set(mapping.values()))
+        print(f'[+] {len(mapping)} files -> {unique} unique, {saved / 1024 / 1024:.1f} MB freed, '
+              f'{updated} message URLs updated, {removed} legacy files removed')
+
+
+if __name__ == '__main__':
+    main()
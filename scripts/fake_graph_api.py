@@ -0,0 +1,173 @@
+"""Local fake of the WhatsApp Cloud (Graph) API for tests and throughput benchmarks.
+
+Implements just enough of the API for the outbound sender:
+  POST /<version>/<phone_number_id>/messages   -> {"messages": [{"id": "wamid.<n>"}]}
+  POST /<version>/<phone_number_id>/media      -> {"id": "<media id>"}
+  GET  /<version>/<media_id>                   -> {"url": ..., "mime_type": ...}
+  GET  /files/<media_id>                       -> uploaded bytes
+
+It enforces a token-bucket rate limit like Graph does (429 with error code
+130429 once the bucket is empty), can add per-request latency and random 5xx
+errors, and records per-recipient delivery order so tests can check ordering.
+
+Usage:
+  python scripts/fake_graph_api.py --port 8089 --rate 80 --latency-ms 50
+  WHATSAPP_API_URL=http://127.0.0.1:8089/v18.0/ flask run
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+VERSION = 'v18.0'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive: lets clients reuse pooled connections
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body, content_type='application/json'):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def do_POST(self):
+        server = self.server.fake
+        body = self._read_body()
+        if server.latency:
+            time.sleep(server.latency)
+        match = re.fullmatch(rf'/{VERSION}/([^/]+)/(messages|media)', self.path)
+        if not match:
+            return self._reply(404, {'error': {'message': 'Unknown path'}})
+        status, payload = server.handle(match.group(2), body)
+        self._reply(status, payload)
+
+    def do_GET(self):
+        server = self.server.fake
+        if self.path.startswith('/files/'):
+            data = server.media.get(self.path[len('/files/'):])
+            if data is None:
+                return self._reply(404, {'error': {'message': 'Unknown media'}})
+            return self._reply(200, data, 'application/octet-stream')
+        media_id = self.path.rsplit('/', 1)[-1]
+        if media_id not in server.media:
+            return self._reply(404, {'error': {'message': 'Unknown media'}})
+        self._reply(200, {'url': f'{server.root_url}/files/{media_id}', 'mime_type': 'audio/ogg', 'id': media_id})
+
+
+class FakeGraphServer:
+    """Threaded fake Graph API; use as a context manager or start()/stop()."""
+
+    def __init__(self, host='127.0.0.1', port=0, rate=80.0, burst=None, latency=0.0, error_rate=0.0, seed=None):
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self.latency = float(latency)
+        self.error_rate = float(error_rate)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._counter = 0
+        self.media = {}
+        self.stats = defaultdict(int)
+        self.delivered = defaultdict(list)  # recipient -> text bodies in delivery order
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.fake = self
+        self._thread = None
+
+    @property
+    def root_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def base_url(self):
+        """Value for WHATSAPP_API_URL / GraphClient(base_url=...)."""
+        return f'{self.root_url}/{VERSION}/'
+
+    def _take_token(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def handle(self, kind, body):
+        with self._lock:
+            self.stats['requests'] += 1
+            if kind == 'messages' and not self._take_token():
+                self.stats['throttled'] += 1
+                return 429, {'error': {'message': '(#130429) Rate limit hit', 'code': 130429}}
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.stats['errors'] += 1
+                return 500, {'error': {'message': 'Internal error', 'code': 1}}
+            self._counter += 1
+            if kind == 'media':
+                media_id = f'media{self._counter}'
+                self.media[media_id] = body
+                self.stats['uploads'] += 1
+                return 200, {'id': media_id}
+            message = json.loads(body or b'{}')
+            recipient = message.get('to')
+            if not recipient:
+                return 400, {'error': {'message': 'Missing recipient', 'code': 100}}
+            content = (message.get('text') or {}).get('body') or (message.get('audio') or {}).get('id')
+            self.delivered[recipient].append(content)
+            self.stats['sent'] += 1
+            return 200, {'messaging_product': 'whatsapp', 'contacts': [{'wa_id': recipient}],
+                         'messages': [{'id': f'wamid.fake{self._counter}'}]}
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='fake-graph-api', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake WhatsApp Graph API server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--rate', type=float, default=80, help='messages per second before 429 (default 80)')
+    parser.add_argument('--latency-ms', type=float, default=50, help='added latency per request (default 50)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with 500')
+    args = parser.parse_args()
+    server = FakeGraphServer(args.host, args.port, rate=args.rate, latency=args.latency_ms / 1000.0,
+                             error_rate=args.error_rate)
+    print(f'[*] Fake Graph API on {server.base_url} (rate={args.rate}/s, latency={args.latency_ms}ms)')
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        print(f'[*] {dict(server.stats)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+"""Local debugging SMTP server for tests and email throughput benchmarks.
+
+Speaks just enough ESMTP for smtplib: EHLO/HELO, AUTH PLAIN/LOGIN, MAIL, RCPT,
+DATA, RSET, NOOP, QUIT (no STARTTLS - use SMTP_USE_TLS=0 against it).
+Delivered messages are kept in memory (and printed when run standalone).
+
+It can add latency to the connection handshake (greeting + AUTH, the cost a
+connect-per-message sender pays every time) and to each message, throttle like
+a provider does (451 once the token bucket is empty, 421 after
+max_per_connection messages on one connection), answer a fraction of messages
+with a transient 451, and refuse recipients containing "reject" with 550.
+
+Usage:
+  python scripts/fake_smtp_server.py --port 8025 --handshake-ms 150
+  SMTP_SERVER=127.0.0.1 SMTP_PORT=8025 SMTP_USE_TLS=0 flask run
+"""
+import argparse
+import base64
+import random
+import re
+import socketserver
+import threading
+import time
+from collections import defaultdict
+from email import message_from_bytes, policy
+
+
+def _address(args):
+    """'FROM:<a@b> SIZE=10' -> 'a@b'"""
+    match = re.search(r'<([^>]*)>', args)
+    return match.group(1) if match else args.split(':', 1)[-1].strip()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    timeout = 60
+
+    def _reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def _read_line(self):
+        line = self.rfile.readline(65536)
+        if not line:
+            return None
+        return line.rstrip(b'\r\n').decode('utf-8', 'replace')
+
+    def _read_data(self):
+        lines = []
+        while True:
+            line = self.rfile.readline(1 << 20)
+            if not line:
+                return None
+            if line in (b'.\r\n', b'.\n'):
+                return b''.join(lines)
+            lines.append(line[1:] if line.startswith(b'..') else line)
+
+    def _auth(self, args):
+        server = self.server.fake
+        parts = args.split()
+        mechanism = parts[0].upper() if parts else ''
+        if mechanism == 'PLAIN':
+            if len(parts) > 1:
+                token = parts[1]
+            else:
+                self._reply('334 ')
+                token = self._read_line() or ''
+            try:
+                _, username, password = base64.b64decode(token).decode().split('\0')
+            except ValueError:
+                return self._reply('501 Malformed AUTH PLAIN')
+        elif mechanism == 'LOGIN':
+            self._reply('334 VXNlcm5hbWU6')
+            username = base64.b64decode(self._read_line() or '').decode()
+            self._reply('334 UGFzc3dvcmQ6')
+            password = base64.b64decode(self._read_line() or '').decode()
+        else:
+            return self._reply('504 Unrecognized authentication type')
+        server.sleep(server.handshake_latency)
+        if server.username and (username, password) != (server.username, server.password):
+            server.count('auth_failed')
+            return self._reply('535 Authentication credentials invalid')
+        server.count('logins')
+        self.authenticated = True
+        self._reply('235 Authentication successful')
+
+    def handle(self):
+        server = self.server.fake
+        server.count('connections')
+        server.sleep(server.handshake_latency)
+        self.authenticated = False
+        sent_here = 0
+        mail_from, recipients = None, []
+        self._reply('220 fake-smtp ESMTP ready')
+        while True:
+            line = self._read_line()
+            if line is None:
+                return
+            command, _, args = line.partition(' ')
+            command = command.upper()
+            if command in ('EHLO', 'HELO'):
+                if command == 'EHLO':
+                    self._reply('250-fake-smtp')
+                    self._reply('250-8BITMIME')
+                    self._reply('250-SIZE 52428800')
+                    self._reply('250 AUTH PLAIN LOGIN')
+                else:
+                    self._reply('250 fake-smtp')
+            elif command == 'AUTH':
+                self._auth(args)
+            elif command == 'MAIL':
+                if server.username and not self.authenticated:
+                    self._reply('530 Authentication required')
+                elif server.max_per_connection and sent_here >= server.max_per_connection:
+                    server.count('connection_limit')
+                    self._reply('421 Too many messages on this connection')
+                    return
+                elif not server.take_token():
+                    server.count('throttled')
+                    self._reply('451 Rate limit exceeded, try again later')
+                else:
+                    mail_from, recipients = _address(args), []
+                    self._reply('250 OK')
+            elif command == 'RCPT':
+                recipient = _address(args)
+                if mail_from is None:
+                    self._reply('503 Need MAIL first')
+                elif 'reject' in recipient:
+                    server.count('rejected')
+                    self._reply('550 Mailbox unavailable')
+                else:
+                    recipients.append(recipient)
+                    self._reply('250 OK')
+            elif command == 'DATA':
+                if not recipients:
+                    self._reply('503 Need RCPT first')
+                    continue
+                self._reply('354 End data with <CR><LF>.<CR><LF>')
+                data = self._read_data()
+                if data is None:
+                    return
+                server.sleep(server.latency)
+                if server.fail_next():
+                    server.count('errors')
+                    self._reply('451 Temporary local problem')
+                else:
+                    server.deliver(mail_from, recipients, data)
+                    sent_here += 1
+                    self._reply('250 OK queued')
+                mail_from, recipients = None, []
+            elif command == 'RSET':
+                mail_from, recipients = None, []
+                self._reply('250 OK')
+            elif command == 'NOOP':
+                self._reply('250 OK')
+            elif command == 'QUIT':
+                self._reply('221 Bye')
+                return
+            elif command == 'STARTTLS':
+                self._reply('454 TLS not available')
+            else:
+                self._reply('502 Command not implemented')
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeSMTPServer:
+    """Threaded fake SMTP server; use as a context manager or start()/stop()."""
+
+    def __init__(self, host='127.0.0.1', port=0, username='', password='', handshake_latency=0.0, latency=0.0,
+                 rate=0.0, burst=None, max_per_connection=0, error_rate=0.0, seed=None):
+        self.username = username
+        self.password = password
+        self.handshake_latency = float(handshake_latency)
+        self.latency = float(latency)
+        self.rate = float(rate)
+        self.burst = float(burst or rate or 1)
+        self.max_per_connection = int(max_per_connection)
+        self.error_rate = float(error_rate)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self.stats = defaultdict(int)
+        self.messages = []  # (mail_from, recipients, raw bytes)
+        self.delivered = defaultdict(list)  # recipient -> subjects in delivery order
+        self.server = _TCPServer((host, port), _Handler)
+        self.server.fake = self
+        self._thread = None
+
+    @property
+    def host(self):
+        return self.server.server_address[0]
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    @staticmethod
+    def sleep(seconds):
+        if seconds:
+            time.sleep(seconds)
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def take_token(self):
+        if not self.rate:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def fail_next(self):
+        with self._lock:
+            return bool(self.error_rate) and self._random.random() < self.error_rate
+
+    def deliver(self, mail_from, recipients, data):
+        subject = str(message_from_bytes(data, policy=policy.default).get('Subject', ''))
+        with self._lock:
+            self.stats['messages'] += 1
+            self.messages.append((mail_from, list(recipients), data))
+            for recipient in recipients:
+                self.delivered[recipient].append(subject)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='fake-smtp', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local debugging SMTP server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8025)
+    parser.add_argument('--username', default='', help='require AUTH with this username (and --password)')
+    parser.add_argument('--password', default='')
+    parser.add_argument('--handshake-ms', type=float, default=0, help='added latency to greeting and AUTH')
+    parser.add_argument('--latency-ms', type=float, default=0, help='added latency per message')
+    parser.add_argument('--rate', type=float, default=0, help='messages per second before 451 (0 = unlimited)')
+    parser.add_argument('--max-per-connection', type=int, default=0, help='421 after N messages (0 = unlimited)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of messages answered with 451')
+    parser.add_argument('--quiet', action='store_true', help="don't print delivered messages")
+    args = parser.parse_args()
+    server = FakeSMTPServer(args.host, args.port, args.username, args.password,
+                            handshake_latency=args.handshake_ms / 1000.0, latency=args.latency_ms / 1000.0,
+                            rate=args.rate, max_per_connection=args.max_per_connection, error_rate=args.error_rate)
+    if not args.quiet:
+        deliver = server.deliver
+
+        def deliver_and_print(mail_from, recipients, data):
+            deliver(mail_from, recipients, data)
+            print(f'--- {mail_from} -> {", ".join(recipients)}\n{data.decode("utf-8", "replace")}')
+
+        server.deliver = deliver_and_print
+    print(f'[*] Fake SMTP server on {server.host}:{server.port}')
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server.server_close()
+        print(f'[*] {dict(server.stats)}')
+
+
+if __name__ == '__main__':
+    main()
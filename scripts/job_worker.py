@@ -0,0 +1,44 @@
+"""Background job worker process (no external broker).
+
+Runs the same dispatcher as the web process but in its own process, so long
+payroll/report/import jobs never share CPU with gunicorn request workers.
+Jobs are claimed from the background_job table with a conditional UPDATE, so
+several workers (and web processes) can run side by side safely.
+
+Set JOBS_IN_PROCESS=0 on the web service when this worker is deployed, and
+point ATTENDANCE_IMPORT_SPOOL_DIR on both services at a shared directory:
+uploaded CSV imports are spooled there and the worker reads them by path.
+
+Usage:
+  python scripts/job_worker.py                 # JOBS_WORKERS threads
+  python scripts/job_worker.py --workers 4
+"""
+import os, sys, argparse
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+# عملية العامل تنفذ المهام بنفسها: لا موزّع إضافي عند import التطبيق
+os.environ.setdefault('JOBS_IN_PROCESS', '0')
+
+from app import create_app  # noqa: E402
+from app.utils.jobs import JobRunner  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run background jobs from the database queue')
+    parser.add_argument('--workers', type=int, default=None, help='thread pool size (default JOBS_WORKERS)')
+    parser.add_argument('--poll', type=float, default=None, help='poll interval in seconds')
+    args = parser.parse_args()
+
+    app = create_app()
+    runner = JobRunner(app, max_workers=args.workers, poll_interval=args.poll)
+    print(f'[*] Job worker {runner.worker_id} started with {runner.max_workers} threads')
+    try:
+        runner.run_forever()
+    except KeyboardInterrupt:
+        print('[*] Stopping job worker')
+
+
+if __name__ == '__main__':
+    main()
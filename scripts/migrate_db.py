@@ -0,0 +1,80 @@
+"""Release step: migrate the database schema once, before the web workers start.
+
+create_app() only compares the schema fingerprint stored in schema_version with
+the one computed from the models and migration steps (app/db_manager.py). With
+AUTO_MIGRATE=0 (recommended in production) it never migrates by itself, so run
+this (or `flask schema-migrate`) on every deploy. A lock row in schema_lock
+keeps concurrent runs from racing; a second run waits and then finds the
+schema already up to date.
+
+Usage:
+  python scripts/migrate_db.py                # migrate if the fingerprint changed
+  python scripts/migrate_db.py --force        # run every step anyway (re-seed roles, admin user)
+  python scripts/migrate_db.py --check        # exit 1 if a migration is pending
+  python scripts/migrate_db.py --merge-attendance  # also merge duplicate attendance rows
+                                                   # (exported to MERGE_EXPORT_DIR first)
+"""
+import argparse
+import os
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+# الترحيل هنا فقط، لا أثناء create_app
+os.environ.setdefault('AUTO_MIGRATE', '0')
+
+from app import create_app  # noqa: E402
+from app.db_manager import (  # noqa: E402
+    SchemaMigrationError, migrate_database, schema_fingerprint, stored_fingerprint, stored_version,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Migrate the database schema once (locked)')
+    parser.add_argument('--force', action='store_true', help='run every migration step even if up to date')
+    parser.add_argument('--check', action='store_true', help="only report; exit 1 if a migration is pending")
+    parser.add_argument('--timeout', type=int, default=None, help='seconds to wait for the migration lock')
+    parser.add_argument('--merge-attendance', action='store_true',
+                        help='merge duplicate attendance rows before creating their unique index')
+    args = parser.parse_args()
+
+    app = create_app()
+    if args.merge_attendance:
+        # البصمة مسجلة غالباً مع الفهرس المعلق: تشغيل كل الخطوات
+        app.config['MERGE_DUPLICATE_ATTENDANCE'] = True
+        args.force = True
+    with app.app_context():
+        fingerprint = schema_fingerprint()
+        stored = stored_fingerprint()
+        if args.check:
+            if stored == fingerprint:
+                print(f'[+] Schema up to date ({fingerprint[:12]})')
+                return
+            print(f'[!] Migration pending: database {stored[:12] if stored else "none"} -> {fingerprint[:12]}')
+            raise SystemExit(1)
+        t0 = time.perf_counter()
+        try:
+            migrated = migrate_database(
+                force=args.force, fingerprint=fingerprint,
+                timeout=args.timeout or app.config.get('SCHEMA_LOCK_TIMEOUT', 300),
+                stale_seconds=app.config.get('SCHEMA_LOCK_STALE_SECONDS', 600),
+            )
+        except SchemaMigrationError as e:
+            # البصمة لم تُسجل: التشغيل التالي يعيد الترحيل
+            print(f'[-] Schema migration failed, fingerprint not recorded: {e}')
+            raise SystemExit(1)
+        elapsed = (time.perf_counter() - t0) * 1000
+        if migrated:
+            print(f'[+] Schema migrated to {fingerprint[:12]} in {elapsed:.0f}ms')
+        else:
+            print(f'[+] Schema already up to date ({fingerprint[:12]})')
+        # خطوات تُخطيت (مثل فهرس فريد ينتظر --merge-attendance): لا تفشل الإصدار
+        for message in (stored_version()[1] or '').splitlines():
+            print(message)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Rebuild the attendance_daily rollup from the raw attendance/leave tables.
+
+The range is split into date chunks; each chunk is rebuilt (delete + insert) in
+its own transaction by a pool of worker processes. A full rebuild (no --start)
+marks the rollup as built afterwards, switching reports and payroll to read it.
+
+Usage:
+  python scripts/rebuild_attendance_daily.py                     # whole history
+  python scripts/rebuild_attendance_daily.py --start 2025-01-01 --end 2025-03-31
+  python scripts/rebuild_attendance_daily.py --workers 4 --chunk-days 14
+"""
+import os, sys, time, argparse
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+from concurrent.futures import ProcessPoolExecutor  # noqa: E402
+from datetime import date  # noqa: E402
+from app import create_app, db  # noqa: E402
+from app.utils.attendance_daily import (  # noqa: E402
+    daily_rules, date_chunks, history_bounds, mark_rollup_built, rebuild_range
+)
+
+_app = None
+
+
+def _init_worker():
+    global _app
+    _app = create_app()
+    with _app.app_context():
+        db.engine.dispose()  # لا تُشارك اتصالات العملية الأم
+
+
+def _rebuild_chunk(chunk):
+    first, last = chunk
+    with _app.app_context():
+        rules = daily_rules()
+        with db.engine.begin() as connection:
+            return first, last, rebuild_range(connection, first, last, rules=rules)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild attendance_daily')
+    parser.add_argument('--start', type=date.fromisoformat)
+    parser.add_argument('--end', type=date.fromisoformat)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--chunk-days', type=int, default=7)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        bounds = history_bounds(db.session.connection())
+        db.session.commit()
+        if args.start is None and bounds is None:
+            mark_rollup_built()
+            db.session.commit()
+            print('No attendance history; rollup marked as built.')
+            return
+        first = args.start or bounds[0]
+        last = args.end or (bounds[1] if bounds else first)
+        # SQLite يسمح بكاتب واحد فقط
+        workers = 1 if db.engine.dialect.name == 'sqlite' else max(args.workers, 1)
+        db.engine.dispose()
+
+    chunks = list(date_chunks(first, last, args.chunk_days))
+    print(f'Rebuilding {first} .. {last}: {len(chunks)} chunks, {workers} workers')
+    started = time.perf_counter()
+    total = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        for start, end, rows in pool.map(_rebuild_chunk, chunks):
+            total += rows
+            print(f'  {start} .. {end}: {rows} rows')
+
+    if args.start is None:
+        with app.app_context():
+            mark_rollup_built()
+            db.session.commit()
+    print(f'Done: {total} rows in {time.perf_counter() - started:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Build or rebuild the unified full-text search index.
+
+Indexes every WhatsApp message, ClientSupport ticket, customer complaint and
+SupportTicket into search_documents (SQLite FTS5 / Postgres tsvector, see
+app/utils/search_index.py). New and edited records are indexed automatically;
+run this once after upgrading, or after loading data with raw SQL.
+
+Usage:
+  python scripts/rebuild_search_index.py                    # all sources
+  python scripts/rebuild_search_index.py whatsapp ticket
+  python scripts/rebuild_search_index.py --query "فاتورة"   # search only
+"""
+import argparse
+import os
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+from app import create_app  # noqa: E402
+from app.utils.search_index import SOURCES, rebuild_search_index, search  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild the unified search index')
+    parser.add_argument('sources', nargs='*', help=f"subset of {', '.join(SOURCES)} (default: all)")
+    parser.add_argument('--chunk', type=int, default=5000, help='rows per transaction (default 5000)')
+    parser.add_argument('--query', help='run a search instead of rebuilding')
+    args = parser.parse_args()
+    unknown = set(args.sources) - set(SOURCES)
+    if unknown:
+        parser.error(f"unknown sources: {', '.join(sorted(unknown))}")
+
+    app = create_app()
+    with app.app_context():
+        if args.query:
+            t0 = time.perf_counter()
+            results = search(args.query, limit=20)
+            print(f'[+] {len(results)} results in {(time.perf_counter() - t0) * 1000:.1f}ms')
+            for item in results:
+                print(f"  {item['score']:>8} {item['source']}:{item['id']} {item['name'] or ''} "
+                      f"{item['phone'] or ''} {(item['preview'] or '')[:60]}")
+            return
+        t0 = time.perf_counter()
+        last = [t0]
+
+        def progress(done, message):
+            if time.perf_counter() - last[0] > 2:
+                last[0] = time.perf_counter()
+                print(f'  ... {done} rows ({message})')
+
+        totals = rebuild_search_index(args.sources or list(SOURCES), chunk_size=args.chunk, progress=progress)
+        print(f'[+] Indexed {totals} in {time.perf_counter() - t0:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
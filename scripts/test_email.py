@@ -19,11 +19,11 @@ def main():
 
     app = create_app()
     with app.app_context():
-        from app.utils.emailer import send_email
+        from app.utils.emailer import send_email_now
         app.logger.setLevel(logging.DEBUG)
         subject = 'Test email from Quick-Sale-HR'
         body = 'This is a test message. If you received this, SMTP is working.'
-        ok = send_email(app, recipient, subject, body)
+        ok = send_email_now(app, recipient, subject, body)
         if ok:
             print(f'[+] Email send attempted to {recipient} — reported as sent')
         else:
@@ -0,0 +1,43 @@
+"""
+قاعدة SQLite معزولة لكل اختبار (لا كتابة في DATABASE_URL المضبوطة أو instance/hrcloud.db)
+- قالب يُرحّل مرة واحدة للجلسة (create_app على ملف مؤقت)، ثم يُنسخ لكل اختبار إلى tmp_path
+  فيبدأ كل اختبار من قاعدة نظيفة مُرحّلة (البصمة مطابقة: create_app لا يعيد الترحيل).
+- Config يُقرأ عند الاستيراد: يُضبط المتغير قبل استيراد app، ثم يُبدّل المسار لكل اختبار.
+"""
+import os
+import shutil
+import tempfile
+
+import pytest
+
+_TEMPLATE_DIR = tempfile.mkdtemp(prefix='hrcloud-tests-')
+_TEMPLATE = os.path.join(_TEMPLATE_DIR, 'template.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{_TEMPLATE}'
+
+from app.config import Config  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def _template_db():
+    from app import create_app, db
+    app = create_app()  # ترحيل كامل مرة واحدة
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+    yield _TEMPLATE
+    shutil.rmtree(_TEMPLATE_DIR, ignore_errors=True)
+
+
+@pytest.fixture(autouse=True)
+def isolated_database(_template_db, tmp_path, monkeypatch):
+    path = tmp_path / 'test.db'
+    shutil.copyfile(_template_db, path)
+    uri = f'sqlite:///{path}'
+    monkeypatch.setattr(Config, 'SQLALCHEMY_DATABASE_URI', uri)
+    monkeypatch.setattr(Config, 'ATTENDANCE_IMPORT_SPOOL_DIR', str(tmp_path / 'imports'))
+    # العمليات الفرعية (عمال spawn) تبني Config من البيئة
+    monkeypatch.setenv('DATABASE_URL', uri)
+    # أجيال الكاش المحفوظة في العملية تخص قاعدة الاختبار السابق
+    from app.utils import cache_generation
+    cache_generation._local.clear()
+    yield uri
@@ -0,0 +1,147 @@
+import unittest
+from collections import namedtuple
+from datetime import date, datetime, time, timedelta
+from app import create_app, db
+from app.models.attendance import Attendance, AttendanceDaily
+from app.models.employee import Employee
+from app.models.leave import Leave
+from app.models.payroll import PayrollDirtyMark
+from app.utils import attendance_daily
+from app.utils.attendance_daily import (
+    ABSENT, LEAVE, PRESENT, DailyRules, build_row, rebuild_range, refresh_daily,
+)
+
+EMPLOYEES = (990161, 990162, 990163)
+SUNDAY = date(2025, 3, 2)  # يوم عمل (الأحد–الخميس)
+FRIDAY = date(2025, 3, 7)
+RULES = DailyRules(time(9, 0), 8 * 60)
+Record = namedtuple('Record', 'check_in_time check_out_time location_verified time_verified device_verified')
+LeaveRow = namedtuple('LeaveRow', 'leave_type paid paid_days start_date end_date')
+
+
+class BuildRowTests(unittest.TestCase):
+    def _row(self, day, records=None, leave=None):
+        return build_row(EMPLOYEES[0], day, records, leave, RULES, datetime(2025, 4, 1))
+
+    def test_present_day_minutes_and_overtime(self):
+        record = Record(datetime.combine(SUNDAY, time(9, 20)), datetime.combine(SUNDAY, time(18, 50)), True, True, True)
+        row = self._row(SUNDAY, [record])
+        self.assertEqual((row['day_status'], row['worked_minutes'], row['late_minutes'], row['overtime_minutes']),
+                         (PRESENT, 570, 20, 90))
+        self.assertEqual((row['location_verified'], row['time_verified'], row['device_verified']), (True, True, True))
+
+    def test_verification_flags_keep_unknown(self):
+        start = datetime.combine(SUNDAY, time(8, 0))
+        row = self._row(SUNDAY, [Record(start, None, None, False, True), Record(start, None, True, None, True)])
+        self.assertEqual((row['location_verified'], row['time_verified'], row['device_verified']), (None, False, True))
+        self.assertEqual(row['worked_minutes'], 0)
+
+    def test_leave_and_empty_days(self):
+        sick = LeaveRow('sick', False, 1, SUNDAY, SUNDAY + timedelta(days=2))
+        self.assertEqual((self._row(SUNDAY, leave=sick)['leave_paid'], self._row(SUNDAY + timedelta(days=1), leave=sick)['leave_paid']),
+                         (True, False))
+        # الغياب يُشتق عند القراءة من تقويم العمل: يوم بلا حضور ولا إجازة لا صف له
+        self.assertIsNone(self._row(SUNDAY))
+        self.assertIsNone(self._row(FRIDAY))
+
+
+class DailyRollupTests(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        self._clean()
+        for emp_id in EMPLOYEES:
+            db.session.add(Employee(id=emp_id, code=f'D{emp_id}', name=f'daily {emp_id}', active=True))
+        db.session.commit()
+        self._saved = attendance_daily._fetch_attendance
+
+    def tearDown(self):
+        attendance_daily._fetch_attendance = self._saved
+        self._clean()
+        db.session.remove()
+        self.ctx.pop()
+
+    def _clean(self):
+        for model in (Attendance, AttendanceDaily, PayrollDirtyMark, Leave):
+            model.query.filter(model.employee_id.in_(EMPLOYEES)).delete(synchronize_session=False)
+        Employee.query.filter(Employee.id.in_(EMPLOYEES)).delete(synchronize_session=False)
+        db.session.commit()
+
+    def _daily(self):
+        db.session.expire_all()
+        return {(r.employee_id, r.date): r for r in
+                AttendanceDaily.query.filter(AttendanceDaily.employee_id.in_(EMPLOYEES))}
+
+    def test_refresh_daily_follows_core_writes(self):
+        table = Attendance.__table__
+        connection = db.session.connection()
+        connection.execute(table.insert().values(
+            employee_id=EMPLOYEES[0], date=SUNDAY, check_in_time=datetime.combine(SUNDAY, time(9, 0)),
+            check_out_time=datetime.combine(SUNDAY, time(17, 0)), location_verified=True))
+        key = (EMPLOYEES[0], SUNDAY)
+        self.assertEqual(refresh_daily(connection, [key, (EMPLOYEES[0], FRIDAY)], rules=RULES), 1)
+        db.session.commit()
+        daily = self._daily()
+        self.assertEqual((daily[key].day_status, daily[key].worked_minutes), (PRESENT, 480))
+        self.assertNotIn((EMPLOYEES[0], FRIDAY), daily)
+
+        connection = db.session.connection()
+        connection.execute(table.update().where(table.c.employee_id == EMPLOYEES[0])
+                           .values(check_out_time=datetime.combine(SUNDAY, time(18, 0))))
+        refresh_daily(connection, [key], rules=RULES)
+        db.session.commit()
+        self.assertEqual(self._daily()[key].overtime_minutes, 60)
+
+        connection = db.session.connection()
+        connection.execute(table.delete().where(table.c.employee_id == EMPLOYEES[0]))
+        refresh_daily(connection, [key], rules=RULES)
+        db.session.commit()
+        self.assertNotIn(key, self._daily())
+
+    def test_rebuild_range_upserts_and_keeps_concurrent_writes(self):
+        db.session.add(Attendance(employee_id=EMPLOYEES[0], date=SUNDAY,
+                                  check_in_time=datetime.combine(SUNDAY, time(9, 30))))
+        db.session.add(Leave(employee_id=EMPLOYEES[1], leave_type='annual', start_date=SUNDAY,
+                             end_date=SUNDAY + timedelta(days=1), paid=True, status='Approved'))
+        db.session.commit()
+        # صف غياب قديم (لم يعد يُخزن) يُحذف
+        connection = db.session.connection()
+        connection.execute(AttendanceDaily.__table__.insert().values(
+            employee_id=EMPLOYEES[0], date=FRIDAY, day_status=ABSENT, worked_minutes=0))
+        db.session.commit()
+
+        late_in = datetime.combine(SUNDAY, time(10, 0))
+
+        def fetch_then_check_in(connection, employee_ids, first, last):
+            # تسجيل حضور يُلتزم بعد القراءة الأولى لإعادة البناء
+            records = self._saved(connection, employee_ids, first, last)
+            attendance_daily._fetch_attendance = self._saved
+            connection.execute(Attendance.__table__.insert().values(
+                employee_id=EMPLOYEES[2], date=SUNDAY, check_in_time=late_in))
+            return records
+
+        attendance_daily._fetch_attendance = fetch_then_check_in
+        connection = db.session.connection()
+        rebuild_range(connection, SUNDAY, FRIDAY, employee_ids=EMPLOYEES, rules=RULES)
+        db.session.commit()
+
+        daily = self._daily()
+        self.assertEqual((daily[(EMPLOYEES[0], SUNDAY)].day_status, daily[(EMPLOYEES[0], SUNDAY)].late_minutes),
+                         (PRESENT, 30))
+        self.assertEqual(daily[(EMPLOYEES[1], SUNDAY + timedelta(days=1))].day_status, LEAVE)
+        self.assertEqual(daily[(EMPLOYEES[2], SUNDAY)].day_status, PRESENT)
+        self.assertEqual(daily[(EMPLOYEES[2], SUNDAY)].first_in, late_in)
+        self.assertNotIn((EMPLOYEES[0], FRIDAY), daily)
+        self.assertNotIn((EMPLOYEES[2], SUNDAY + timedelta(days=1)), daily)
+
+        # إعادة البناء مرة ثانية لا تغيّر عدد الصفوف
+        count = len(daily)
+        rebuild_range(db.session.connection(), SUNDAY, FRIDAY, employee_ids=EMPLOYEES, rules=RULES)
+        db.session.commit()
+        self.assertEqual(len(self._daily()), count)
+
+
+if __name__ == '__main__':
+    unittest.main()
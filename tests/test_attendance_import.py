@@ -0,0 +1,112 @@
+import unittest
+from datetime import date, datetime
+from io import StringIO
+from sqlalchemy import text
+from app import create_app, db
+from app.models.attendance import Attendance, AttendanceDaily
+from app.models.employee import Employee
+from app.models.payroll import PayrollDirtyMark
+from app.utils.attendance_import import import_attendance_rows
+
+EMPLOYEES = (990501, 990502)
+
+
+class _Ctx:
+    def __init__(self):
+        self.calls = []
+
+    def progress(self, percent, message=None):
+        self.calls.append((percent, message))
+
+
+def _source(text):
+    return lambda: StringIO(text)
+
+
+class AttendanceImportTests(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        self._clean()
+        db.session.add(Employee(id=EMPLOYEES[0], code='IMP-A', name='import test', active=True))
+        db.session.add(Employee(id=EMPLOYEES[1], code='IMP-B', name='import test', active=True))
+        db.session.commit()
+
+    def tearDown(self):
+        self._clean()
+        db.session.remove()
+        self.ctx.pop()
+
+    def _clean(self):
+        for model in (Attendance, AttendanceDaily, PayrollDirtyMark):
+            model.query.filter(model.employee_id.in_(EMPLOYEES)).delete(synchronize_session=False)
+        Employee.query.filter(Employee.id.in_(EMPLOYEES)).delete(synchronize_session=False)
+        db.session.commit()
+
+    def _rows(self):
+        return {(r.employee_id, r.date): (r.check_in_time, r.check_out_time, r.status)
+                for r in Attendance.query.filter(Attendance.employee_id.in_(EMPLOYEES))}
+
+    def test_chunked_commits_and_reimport_is_idempotent(self):
+        lines = ['Date,Employee_ID,Check_In,Check_Out']
+        for day in range(1, 11):
+            lines.append(f'2025-03-{day:02d},{EMPLOYEES[0]},08:0{day % 10},17:00')
+            lines.append(f'2025-03-{day:02d},,09:00,')  # بدون موظف
+        text = '\n'.join(lines) + '\n'
+
+        ctx = _Ctx()
+        result = import_attendance_rows(_source(text), ctx, chunk_size=4)
+        self.assertEqual((result['created'], result['updated'], result['rows']), (10, 0, 20))
+        self.assertEqual(len(ctx.calls), 20 // 4 + 1)  # تقدم بعد كل جزء + الجزء الأخير
+        first = self._rows()
+        self.assertEqual(first[(EMPLOYEES[0], date(2025, 3, 1))],
+                         (datetime(2025, 3, 1, 8, 1), datetime(2025, 3, 1, 17, 0), 'outside'))
+        self.assertEqual(AttendanceDaily.query.filter_by(employee_id=EMPLOYEES[0]).count(), 10)
+        self.assertEqual(PayrollDirtyMark.query.filter_by(employee_id=EMPLOYEES[0]).count(), 1)
+
+        again = import_attendance_rows(_source(text), chunk_size=4)
+        self.assertEqual((again['created'], again['updated']), (0, 10))
+        self.assertEqual(self._rows(), first)
+
+    def test_bad_rows_are_reported_and_partial_rows_merge(self):
+        text = (
+            'date,employee_code,check_in,check_out\n'
+            '2025-04-01,IMP-B,08:00,\n'
+            '2025-04-01,IMP-B,,16:30\n'          # نفس اليوم: الانصراف يُدمج مع الحضور
+            '2025-04-02,NOPE,08:00,17:00\n'       # موظف غير موجود
+            'not-a-date,IMP-B,08:00,17:00\n'      # تاريخ غير صالح
+            ',IMP-B,08:00,17:00\n'                # بيانات ناقصة
+            '2025-04-03,IMP-B,xx,17:00\n'         # وقت غير صالح: يُتجاهل الحقل فقط
+        )
+        result = import_attendance_rows(_source(text), chunk_size=2)
+        self.assertEqual(result['error_count'], 3)
+        self.assertEqual([e.split(':')[0] for e in result['errors']], ['سطر 4', 'سطر 5', 'سطر 6'])
+        rows = self._rows()
+        self.assertEqual(rows[(EMPLOYEES[1], date(2025, 4, 1))],
+                         (datetime(2025, 4, 1, 8, 0), datetime(2025, 4, 1, 16, 30), 'outside'))
+        self.assertEqual(rows[(EMPLOYEES[1], date(2025, 4, 3))], (None, datetime(2025, 4, 3, 17, 0), 'outside'))
+        self.assertEqual(len(rows), 2)
+
+    def test_import_without_unique_index(self):
+        # قاعدة قديمة تخطى فيها الترحيل الفهرس: ON CONFLICT كان يُفشل كل جزء
+        db.session.execute(text('DROP INDEX uq_attendance_employee_date'))
+        db.session.add(Attendance(employee_id=EMPLOYEES[0], date=date(2025, 3, 1),
+                                  check_in_time=datetime(2025, 3, 1, 8, 0), status='inside'))
+        db.session.commit()
+        csv_text = (
+            'date,employee_id,check_in,check_out\n'
+            f'2025-03-01,{EMPLOYEES[0]},,17:00\n'
+            f'2025-03-02,{EMPLOYEES[0]},08:30,16:00\n'
+        )
+        result = import_attendance_rows(_source(csv_text), chunk_size=1)
+        self.assertEqual((result['created'], result['updated'], result['error_count']), (1, 1, 0))
+        rows = self._rows()
+        self.assertEqual(rows[(EMPLOYEES[0], date(2025, 3, 1))],
+                         (datetime(2025, 3, 1, 8, 0), datetime(2025, 3, 1, 17, 0), 'outside'))
+        self.assertEqual(len(rows), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
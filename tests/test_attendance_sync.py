@@ -0,0 +1,135 @@
+import unittest
+from datetime import date, datetime, timedelta
+from sqlalchemy import text
+from app import create_app, db
+from app.models.attendance import Attendance, AttendanceDaily
+from app.models.attendance_advanced import AttendanceSync
+from app.models.employee import Employee
+from app.models.feed import FeedEvent
+from app.models.payroll import PayrollDirtyMark
+from app.utils import attendance_sync
+from app.utils.attendance_sync import drain_sync_queue, enqueue_sync_records, merge_punches
+
+EMPLOYEES = (990101, 990102)
+
+
+def _punch(employee_id, action, at, **extra):
+    return {'employee_id': employee_id, 'action': action, 'timestamp': at.isoformat(), **extra}
+
+
+class MergePunchesTests(unittest.TestCase):
+    def test_first_check_in_and_last_check_out_per_day(self):
+        day = datetime(2025, 3, 2)
+        rows = [
+            {'id': 3, 'employee_id': 1, 'action': 'check_out', 'timestamp': day.replace(hour=17),
+             'lat': 2, 'lng': 2, 'address': 'out', 'mac_address': None, 'device_info': None},
+            {'id': 2, 'employee_id': 1, 'action': 'check_in', 'timestamp': day.replace(hour=9),
+             'lat': 1, 'lng': 1, 'address': 'late', 'mac_address': None, 'device_info': None},
+            {'id': 1, 'employee_id': 1, 'action': 'check_in', 'timestamp': day.replace(hour=8),
+             'lat': 0, 'lng': 0, 'address': 'in', 'mac_address': 'aa', 'device_info': None},
+        ]
+        merged = merge_punches(rows)
+        values = merged[(1, date(2025, 3, 2))]
+        self.assertEqual(values['check_in_time'], day.replace(hour=8))
+        self.assertEqual(values['address'], 'in')
+        self.assertEqual(values['check_out_time'], day.replace(hour=17))
+        self.assertEqual(values['address_out'], 'out')
+
+
+class AttendanceSyncTests(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.app.config['ATTENDANCE_SYNC_BACKOFF_SECONDS'] = 60
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        self._clean()
+        for emp_id in EMPLOYEES:
+            db.session.add(Employee(id=emp_id, code=f'S{emp_id}', name='sync test', active=True))
+        db.session.commit()
+
+    def tearDown(self):
+        self._clean()
+        db.session.remove()
+        self.ctx.pop()
+
+    def _clean(self):
+        for model in (AttendanceSync, Attendance, AttendanceDaily, PayrollDirtyMark):
+            model.query.filter(model.employee_id.in_(EMPLOYEES)).delete(synchronize_session=False)
+        FeedEvent.query.filter(FeedEvent.payload.like('%"offline": true%')).delete(synchronize_session=False)
+        Employee.query.filter(Employee.id.in_(EMPLOYEES)).delete(synchronize_session=False)
+        db.session.commit()
+
+    def test_replayed_punches_are_deduplicated_and_merged_once(self):
+        day = datetime(2025, 3, 2, 8, 0)
+        records = [_punch(990101, 'check_in', day), _punch(990101, 'check_out', day + timedelta(hours=9))]
+        first = enqueue_sync_records(records)
+        db.session.commit()
+        replay = enqueue_sync_records(records + [_punch(990101, 'check_in', day)])
+        db.session.commit()
+        self.assertFalse(any(r['duplicate'] for r in first))
+        self.assertTrue(all(r['duplicate'] for r in replay))
+        self.assertEqual([r['sync_id'] for r in replay[:2]], [r['sync_id'] for r in first])
+
+        totals = drain_sync_queue()
+        self.assertEqual(totals['processed'], 2)
+        rows = Attendance.query.filter_by(employee_id=990101).all()
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0].check_in_time, day)
+        self.assertEqual(rows[0].check_out_time, day + timedelta(hours=9))
+        self.assertEqual(drain_sync_queue()['processed'], 0)
+
+    def test_failed_employee_backs_off_and_blocks_later_punches(self):
+        day = datetime(2025, 3, 2, 8, 0)
+        enqueue_sync_records([_punch(990101, 'check_in', day), _punch(990102, 'check_in', day)])
+        db.session.commit()
+        original = attendance_sync._write_attendance
+
+        def failing(connection, merged):
+            if any(emp_id == 990102 for emp_id, _ in merged):
+                raise RuntimeError('device clock rejected')
+            return original(connection, merged)
+
+        attendance_sync._write_attendance = failing
+        try:
+            totals = drain_sync_queue()
+        finally:
+            attendance_sync._write_attendance = original
+        self.assertEqual((totals['processed'], totals['deferred']), (1, 1))
+        deferred = AttendanceSync.query.filter_by(employee_id=990102).one()
+        self.assertEqual((deferred.sync_status, deferred.sync_attempts), ('pending', 1))
+        self.assertGreater(deferred.next_attempt_at, datetime.now() + timedelta(seconds=30))
+
+        # ضغطة لاحقة لنفس الموظف تنتظر موعد إعادة المحاولة حفاظاً على الترتيب
+        enqueue_sync_records([_punch(990102, 'check_out', day + timedelta(hours=9))])
+        db.session.commit()
+        self.assertEqual(drain_sync_queue()['processed'], 0)
+
+        deferred.next_attempt_at = datetime.now() - timedelta(seconds=1)
+        db.session.commit()
+        self.assertEqual(drain_sync_queue()['processed'], 2)
+        row = Attendance.query.filter_by(employee_id=990102).one()
+        self.assertEqual(row.check_out_time, day + timedelta(hours=9))
+
+    def test_write_without_unique_indexes(self):
+        # قاعدة قديمة تخطى فيها الترحيل الفهارس: لا ON CONFLICT، ولا تضيع الضغطات
+        db.session.execute(text('DROP INDEX uq_attendance_employee_date'))
+        db.session.execute(text('DROP INDEX uq_attendance_sync_idempotency_key'))
+        day = datetime(2025, 3, 2, 8, 0)
+        db.session.add(Attendance(employee_id=990101, date=day.date(), check_in_time=day, status='inside'))
+        db.session.commit()
+        enqueue_sync_records([_punch(990101, 'check_in', day + timedelta(minutes=20)),
+                              _punch(990101, 'check_out', day + timedelta(hours=9)),
+                              _punch(990102, 'check_in', day)])
+        db.session.commit()
+
+        totals = drain_sync_queue()
+        self.assertEqual((totals['processed'], totals['deferred']), (3, 0))
+        row = Attendance.query.filter_by(employee_id=990101).one()
+        self.assertEqual((row.check_in_time, row.check_out_time, row.status),
+                         (day, day + timedelta(hours=9), 'outside'))
+        self.assertEqual(Attendance.query.filter_by(employee_id=990102).one().check_in_time, day)
+
+
+if __name__ == '__main__':
+    unittest.main()
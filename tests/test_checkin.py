@@ -0,0 +1,113 @@
+import unittest
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from app import create_app, db
+from app.models.attendance import Attendance, AttendanceDaily
+from app.models.employee import Employee
+from app.models.feed import FeedEvent
+from app.models.payroll import PayrollDirtyMark
+from app.utils import checkin
+from app.utils.checkin import (
+    ALREADY_CHECKED_IN, ALREADY_CHECKED_OUT, CHECK_IN, CHECK_OUT, CHECKED_OUT, CREATED, NOT_CHECKED_IN, PENDING,
+    CheckinRequest, CheckinWriter, apply_checkins, record_checkin, written_outcome,
+)
+
+EMPLOYEES = tuple(range(990801, 990806))
+DAY = datetime(2025, 3, 2, 8, 0)
+
+
+class CheckinWriterTests(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        self._clean()
+        for emp_id in EMPLOYEES:
+            db.session.add(Employee(id=emp_id, code=f'C{emp_id}', name='checkin test', active=True))
+        db.session.commit()
+        self.writer = None
+
+    def tearDown(self):
+        if self.writer is not None:
+            self.writer.stop()
+        checkin._writer = None
+        self._clean()
+        db.session.remove()
+        self.ctx.pop()
+
+    def _clean(self):
+        for model in (Attendance, AttendanceDaily, PayrollDirtyMark):
+            model.query.filter(model.employee_id.in_(EMPLOYEES)).delete(synchronize_session=False)
+        for emp_id in EMPLOYEES:
+            FeedEvent.query.filter(FeedEvent.payload.like(f'%"employee_id": {emp_id},%')).delete(synchronize_session=False)
+        Employee.query.filter(Employee.id.in_(EMPLOYEES)).delete(synchronize_session=False)
+        db.session.commit()
+
+    def _submit_all(self, writer, items):
+        return [f.result(timeout=10) for f in [writer.submit(item) for item in items]]
+
+    def test_batch_commit_and_duplicates(self):
+        self.writer = CheckinWriter(self.app, max_batch=16, max_wait_ms=300).start()
+        items = [CheckinRequest(emp_id, CHECK_IN, at=DAY) for emp_id in EMPLOYEES]
+        items.append(CheckinRequest(EMPLOYEES[0], CHECK_IN, at=DAY + timedelta(minutes=5)))
+        self.assertEqual(self._submit_all(self.writer, items), [CREATED] * len(EMPLOYEES) + [ALREADY_CHECKED_IN])
+        self.assertEqual((self.writer.stats['batches'], self.writer.stats['items']), (1, len(items)))
+
+        rows = Attendance.query.filter(Attendance.employee_id.in_(EMPLOYEES)).all()
+        self.assertEqual(len(rows), len(EMPLOYEES))
+        first = next(r for r in rows if r.employee_id == EMPLOYEES[0])
+        self.assertEqual(first.check_in_time, DAY)  # الطلب المكرر لا يغيّر السجل
+        # نفس المعاملة: علامة الراتب والتجميع اليومي
+        self.assertEqual(PayrollDirtyMark.query.filter(PayrollDirtyMark.employee_id.in_(EMPLOYEES)).count(),
+                         len(EMPLOYEES))
+        self.assertEqual(AttendanceDaily.query.filter(AttendanceDaily.employee_id.in_(EMPLOYEES)).count(),
+                         len(EMPLOYEES))
+
+    def test_check_out_without_check_in_and_twice(self):
+        self.writer = CheckinWriter(self.app).start()
+        out = DAY + timedelta(hours=9)
+        self.assertEqual(self._submit_all(self.writer, [
+            CheckinRequest(EMPLOYEES[1], CHECK_OUT, at=out),
+            CheckinRequest(EMPLOYEES[2], CHECK_IN, at=DAY),
+            CheckinRequest(EMPLOYEES[2], CHECK_OUT, at=out),
+            CheckinRequest(EMPLOYEES[2], CHECK_OUT, at=out + timedelta(minutes=1)),
+        ]), [NOT_CHECKED_IN, CREATED, CHECKED_OUT, ALREADY_CHECKED_OUT])
+        self.assertIsNone(Attendance.query.filter_by(employee_id=EMPLOYEES[1]).first())
+        self.assertEqual(Attendance.query.filter_by(employee_id=EMPLOYEES[2]).one().check_out_time, out)
+
+    def test_timeout_reports_pending_then_written(self):
+        self.app.config.update(CHECKIN_GROUP_COMMIT=True, CHECKIN_SUBMIT_TIMEOUT=0.05)
+        # كاتب لم يبدأ بعد: الطلب يبقى في الطابور بعد المهلة
+        self.writer = CheckinWriter(self.app)
+        checkin._writer = self.writer
+        item = CheckinRequest(EMPLOYEES[3], CHECK_IN, at=DAY)
+        self.assertEqual(record_checkin(item), PENDING)
+
+        self.writer.start()
+        deadline = datetime.now() + timedelta(seconds=10)
+        while written_outcome(item) is None and datetime.now() < deadline:
+            db.session.rollback()
+        self.assertEqual(written_outcome(item), CREATED)
+        # إعادة المحاولة بعد ذلك لا تنشئ سجلاً ثانياً
+        self.app.config['CHECKIN_SUBMIT_TIMEOUT'] = 10.0
+        retry = CheckinRequest(EMPLOYEES[3], CHECK_IN, at=DAY + timedelta(seconds=30))
+        self.assertEqual(record_checkin(retry), ALREADY_CHECKED_IN)
+        self.assertEqual(Attendance.query.filter_by(employee_id=EMPLOYEES[3]).count(), 1)
+
+    def test_check_in_without_unique_index(self):
+        # قاعدة قديمة تخطى فيها الترحيل الفهرس: لا ON CONFLICT، والتكرار يُمنع بالفحص
+        db.session.execute(text('DROP INDEX uq_attendance_employee_date'))
+        db.session.commit()
+        with db.engine.begin() as connection:
+            outcomes = apply_checkins(connection, [
+                CheckinRequest(EMPLOYEES[4], CHECK_IN, at=DAY),
+                CheckinRequest(EMPLOYEES[4], CHECK_IN, at=DAY + timedelta(minutes=5)),
+                CheckinRequest(EMPLOYEES[4], CHECK_OUT, at=DAY + timedelta(hours=9)),
+            ])
+        self.assertEqual(outcomes, [CREATED, ALREADY_CHECKED_IN, CHECKED_OUT])
+        self.assertEqual(Attendance.query.filter_by(employee_id=EMPLOYEES[4]).one().check_in_time, DAY)
+
+
+if __name__ == '__main__':
+    unittest.main()
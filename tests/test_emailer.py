@@ -0,0 +1,123 @@
+import unittest
+from datetime import datetime, timedelta
+from app import create_app, db
+from app.models.email_outbox import EmailOutbox
+from app.models.job import BackgroundJob
+from app.models.user import User
+from app.utils.emailer import SMTPPool, drain_outbox, outbox_status, queue_email, schedule_drain
+from app.utils.jobs import JobRunner
+from scripts.fake_smtp_server import FakeSMTPServer
+
+DOMAIN = '@outbox-test.example'
+ADMIN = 'outbox_test_admin'
+
+
+class EmailOutboxTests(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config.update(TESTING=True, EMAIL_PROVIDER='SMTP', SMTP_USE_TLS=False, EMAIL_SEND_WORKERS=3,
+                               EMAIL_SEND_BACKOFF_SECONDS=0.05, EMAIL_SEND_MAX_ATTEMPTS=50)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        self._clean()
+
+    def tearDown(self):
+        self._clean()
+        db.session.remove()
+        self.ctx.pop()
+
+    def _clean(self):
+        EmailOutbox.query.filter(EmailOutbox.to_email.like(f'%{DOMAIN}')).delete(synchronize_session=False)
+        User.query.filter_by(username=ADMIN).delete()
+        db.session.commit()
+
+    def test_pooled_drain_survives_throttling_and_reuses_connections(self):
+        for i in range(30):
+            queue_email(f'user{i}{DOMAIN}', f'رسالة {i}', 'نص', html='<b>x</b>' if i % 2 else None)
+        queue_email(f'reject{DOMAIN}', 'bad', 'x')
+        db.session.commit()
+
+        # الخادم يسمح بـ 100 رسالة/ث بعد دفعة من 3 -> ردود 451 يعاد إرسالها
+        with FakeSMTPServer(username='u', password='p', rate=100, burst=3) as server:
+            self.app.config.update(SMTP_SERVER=server.host, SMTP_PORT=server.port,
+                                   SMTP_USERNAME='u', SMTP_PASSWORD='p')
+            pool = SMTPPool(server.host, server.port, 'u', 'p', use_tls=False, size=3, max_messages=10)
+            totals = drain_outbox(transport=pool)
+            pool.close()
+
+        self.assertGreater(server.stats['throttled'], 0)
+        self.assertEqual((totals['sent'], totals['failed']), (30, 1))
+        self.assertLessEqual(pool.connects, 8)  # 30 رسالة بحد 10 لكل اتصال، لا اتصال لكل رسالة
+        self.assertEqual(server.delivered[f'user7{DOMAIN}'], ['رسالة 7'])
+        self.assertEqual(sum(len(s) for s in server.delivered.values()), 30)
+        rejected = EmailOutbox.query.filter_by(to_email=f'reject{DOMAIN}').one()
+        self.assertEqual(rejected.status, 'failed')  # 550 خطأ نهائي
+        self.assertIn('550', rejected.last_error)
+        sent = EmailOutbox.query.filter_by(to_email=f'user1{DOMAIN}').one()
+        self.assertEqual(sent.status, 'sent')
+        self.assertTrue(sent.provider_message_id)
+        self.assertEqual(outbox_status().get('queued'), None)
+
+    def test_deferred_mail_is_delivered_by_a_follow_up_job(self):
+        self.app.config.update(JOBS_EAGER=True, JOBS_IN_PROCESS=False)
+        item = queue_email(f'later{DOMAIN}', 'لاحقاً', 'نص')
+        item.next_attempt_at = datetime.utcnow() + timedelta(seconds=600)  # أبعد من EMAIL_OUTBOX_MAX_WAIT
+        db.session.commit()
+
+        first = schedule_drain()
+        self.assertEqual(first.status, 'succeeded')
+        follow_up = BackgroundJob.query.filter_by(job_type='email.outbox_drain', status='queued').one()
+        self.assertGreater(follow_up.run_after, datetime.utcnow() + timedelta(seconds=590))
+        self.assertIsNone(schedule_drain(delay=900))  # لا تكديس لمهام المتابعة
+
+        # يحين موعد الرسالة ومهمة المتابعة دون أي إرسال جديد
+        EmailOutbox.query.filter_by(id=item.id).update({'next_attempt_at': datetime.utcnow()})
+        BackgroundJob.query.filter_by(id=follow_up.id).update({'run_after': datetime.utcnow()})
+        db.session.commit()
+        with FakeSMTPServer(username='u', password='p') as server:
+            self.app.config.update(SMTP_SERVER=server.host, SMTP_PORT=server.port,
+                                   SMTP_USERNAME='u', SMTP_PASSWORD='p')
+            runner = JobRunner(self.app, max_workers=1)
+            runner._dispatch()
+            runner.stop(wait=True)
+
+        self.assertEqual(db.session.get(BackgroundJob, follow_up.id).status, 'succeeded')
+        self.assertEqual(db.session.get(EmailOutbox, item.id).status, 'sent')
+        self.assertEqual(server.delivered[f'later{DOMAIN}'], ['لاحقاً'])
+
+    def test_reset_codes_are_dropped_once_delivery_ends(self):
+        sent = queue_email(f'reset{DOMAIN}', 'رمز الاستعادة', 'الرمز 123456', html='<b>123456</b>',
+                           category='password_reset')
+        failed = queue_email(f'reject-reset{DOMAIN}', 'رمز الاستعادة', 'الرمز 654321', category='password_reset')
+        other = queue_email(f'notice{DOMAIN}', 'تنبيه', 'نص', category='password_changed')
+        db.session.commit()
+        with FakeSMTPServer(username='u', password='p') as server:
+            self.app.config.update(SMTP_SERVER=server.host, SMTP_PORT=server.port,
+                                   SMTP_USERNAME='u', SMTP_PASSWORD='p')
+            pool = SMTPPool(server.host, server.port, 'u', 'p', use_tls=False, size=1)
+            drain_outbox(transport=pool)
+            pool.close()
+
+        db.session.expire_all()
+        self.assertEqual(server.delivered[f'reset{DOMAIN}'], ['رمز الاستعادة'])
+        for item, status in ((sent, 'sent'), (failed, 'failed')):
+            row = db.session.get(EmailOutbox, item.id)
+            self.assertEqual(row.status, status)
+            self.assertEqual((row.body, row.html), (None, None))
+        self.assertEqual(db.session.get(EmailOutbox, other.id).body, 'نص')
+
+        # لا إعادة إرسال لرسالة بلا محتوى
+        admin = User(username=ADMIN, password_hash='x', role='admin')
+        db.session.add(admin)
+        db.session.commit()
+        client = self.app.test_client()
+        with client.session_transaction() as sess:
+            sess['_user_id'] = str(admin.id)
+            sess['_fresh'] = True
+        response = client.post(f'/api/email/outbox/{failed.id}/retry')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(db.session.get(EmailOutbox, failed.id).status, 'failed')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import unittest
+from app import create_app, db
+from app.models.client_support import ClientSupport
+from app.models.customer_complaints import CustomerComplaint
+from app.models.feed import FeedEvent
+from app.models.user import User
+from app.utils.feed import ATTENDANCE, SUPPORT, FeedHub, fetch_events, get_feed_hub, latest_event_id, publish
+from app.utils.sse import open_streams
+
+PHONE = '0500990013'
+
+
+class FeedEventTests(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        self._clean()
+        self.agent = User(username='feed_test_agent', password_hash='x', role='employee')
+        db.session.add(self.agent)
+        db.session.commit()
+        self.start_id = latest_event_id()
+
+    def tearDown(self):
+        self._clean()
+        FeedEvent.query.filter(FeedEvent.id > self.start_id).delete()
+        db.session.commit()
+        db.session.remove()
+        self.ctx.pop()
+
+    def _clean(self):
+        for obj in (ClientSupport.query.filter_by(client_phone=PHONE).all()
+                    + CustomerComplaint.query.filter_by(customer_phone=PHONE).all()):
+            db.session.delete(obj)
+        User.query.filter_by(username='feed_test_agent').delete()
+        db.session.commit()
+
+    def _support_events(self):
+        return [payload for _, channel, payload, _ in fetch_events(self.start_id) if channel == SUPPORT]
+
+    def test_ticket_and_complaint_assignment_emit_events_once(self):
+        ticket = ClientSupport(client_phone=PHONE, client_name='عميل', issue='مشكلة')
+        complaint = CustomerComplaint(customer_phone=PHONE, issue_description='شكوى', assigned_to=self.agent.id)
+        db.session.add_all([ticket, complaint])
+        db.session.commit()
+        # تذكرة بدون مسؤول لا تنتج حدثاً؛ الشكوى المعيّنة عند الإنشاء تنتج حدثاً
+        self.assertEqual([(p['kind'], p['ticket_id']) for p in self._support_events()], [('complaint', complaint.id)])
+
+        ticket.assigned_to = self.agent.id
+        db.session.commit()
+        ticket.status = 'in_progress'  # تعديل لا يغيّر المسؤول
+        complaint.status = 'in_progress'
+        db.session.commit()
+        events = self._support_events()
+        self.assertEqual([(p['kind'], p['ticket_id'], p['employee_id']) for p in events],
+                         [('complaint', complaint.id, self.agent.id), ('client_support', ticket.id, self.agent.id)])
+
+        ticket.assigned_to = None
+        db.session.rollback()
+        self.assertEqual(len(self._support_events()), 2)
+
+    def test_hub_dispatches_only_to_matching_subscribers(self):
+        hub = FeedHub(self.app)  # بدون تشغيل الخيط: التوزيع يُستدعى مباشرة
+        hub.last_id = self.start_id
+        manager = hub.subscribe([ATTENDANCE, SUPPORT])
+        own = hub.subscribe([ATTENDANCE], audience={ATTENDANCE: {990131}})
+        publish(ATTENDANCE, {'type': 'check_in', 'employee_id': 990131})
+        publish(ATTENDANCE, {'type': 'check_in', 'employee_id': 990132})
+        db.session.commit()
+        hub._dispatch()
+
+        def drain(sub):
+            items = []
+            while not sub.queue.empty():
+                items.append(sub.queue.get_nowait()[2]['employee_id'])
+            return items
+
+        self.assertEqual(drain(manager), [990131, 990132])
+        self.assertEqual(drain(own), [990131])
+        self.assertEqual(hub.last_id, latest_event_id())
+
+    def test_hub_delivers_ids_committed_out_of_order(self):
+        hub = FeedHub(self.app)
+        hub.last_id = self.start_id
+        sub = hub.subscribe([ATTENDANCE])
+        # معاملة أخذت المعرّف الأصغر ولم تُنهَ بعد، وأخرى بعدها أنهت أولاً
+        late_id = self.start_id + 1
+        publish(ATTENDANCE, {'type': 'check_in', 'employee_id': 990133})
+        db.session.commit()
+        FeedEvent.query.filter(FeedEvent.id > self.start_id).update({'id': late_id + 1})
+        db.session.commit()
+        hub._dispatch(now=0)
+        self.assertEqual(sub.queue.get_nowait()[2]['employee_id'], 990133)
+        self.assertEqual((hub.last_id, hub.cursor), (late_id + 1, self.start_id))
+
+        db.session.add(FeedEvent(id=late_id, channel=ATTENDANCE, payload='{"employee_id": 990134}'))
+        db.session.commit()
+        hub._dispatch(now=1)
+        item = sub.queue.get_nowait()
+        self.assertEqual((item[0], item[2]['employee_id'], item[3]), (late_id, 990134, self.start_id))
+        self.assertEqual(hub.cursor, late_id + 1)
+
+    def test_hub_abandons_gaps_after_the_window(self):
+        hub = FeedHub(self.app)
+        hub.last_id = self.start_id
+        publish(ATTENDANCE, {'type': 'check_in', 'employee_id': 990135})
+        db.session.commit()
+        FeedEvent.query.filter(FeedEvent.id > self.start_id).update({'id': self.start_id + 3})
+        db.session.commit()
+        hub._dispatch(now=0)
+        self.assertEqual(hub.cursor, self.start_id)
+        hub._dispatch(now=hub.gap_seconds)  # معاملات تراجعت: الحد يتقدم
+        self.assertEqual((hub.cursor, hub.stats['abandoned']), (self.start_id + 3, 2))
+
+    def test_streams_beyond_the_cap_are_refused(self):
+        self.app.config['SSE_MAX_STREAMS'] = 1
+        client = self.app.test_client()
+        with client.session_transaction() as sess:
+            sess['_user_id'] = str(self.agent.id)
+            sess['_fresh'] = True
+        before = open_streams()
+        first = client.get('/api/feed/stream?channels=support', buffered=False)
+        try:
+            self.assertEqual(first.status_code, 200)
+            # المكان محجوز ما دام الاتصال مفتوحاً: الثاني 503 فتعود الصفحة إلى الاستعلام الدوري
+            refused = client.get('/api/feed/stream?channels=support', buffered=False)
+            self.assertEqual(refused.status_code, 503)
+            self.assertEqual(open_streams(), before + 1)
+        finally:
+            first.close()
+            get_feed_hub(self.app).stop()
+        self.assertEqual(open_streams(), before)
+        second = client.get('/api/feed/stream?channels=support', buffered=False)
+        self.assertEqual(second.status_code, 200)
+        second.close()
+        self.assertEqual(open_streams(), before)
+
+
+if __name__ == '__main__':
+    unittest.main()
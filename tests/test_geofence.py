@@ -0,0 +1,91 @@
+import random
+import unittest
+from app import create_app, db
+from app.models.attendance import AttendanceSettings
+from app.models.geofence import GeofenceSite
+from app.utils.geofence import GeofenceIndex, haversine_m, locate, validate_points
+
+
+SITES = [
+    {'id': 1, 'name': 'HQ', 'site_type': 'circle', 'center_lat': 24.7136, 'center_lng': 46.6753, 'radius_meters': 150},
+    {'id': 2, 'name': 'Branch', 'site_type': 'circle', 'center_lat': 24.7743, 'center_lng': 46.7386, 'radius_meters': 80},
+    {'id': 3, 'name': 'Warehouse', 'site_type': 'polygon', 'polygon': [
+        [24.6500, 46.7000], [24.6500, 46.7100], [24.6580, 46.7100], [24.6580, 46.7000]
+    ]},
+]
+
+
+class GeofenceIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.index = GeofenceIndex(SITES)
+
+    def test_circle_and_polygon_membership(self):
+        hq = self.index.locate(24.7137, 46.6754)
+        self.assertTrue(hq.inside)
+        self.assertEqual(hq.site_id, 1)
+        self.assertEqual(hq.allowed_meters, 150)
+
+        warehouse = self.index.locate(24.6540, 46.7050)
+        self.assertTrue(warehouse.inside)
+        self.assertEqual(warehouse.site_id, 3)
+        self.assertEqual(warehouse.distance_meters, 0.0)
+
+    def test_outside_reports_nearest_site(self):
+        # ≈ 300 م شمال المستودع
+        match = self.index.locate(24.6607, 46.7050)
+        self.assertFalse(match.inside)
+        self.assertEqual(match.site_id, 3)
+        self.assertAlmostEqual(match.distance_meters, 300, delta=5)
+
+        far = self.index.locate(24.7136, 46.6853)  # ≈ 1 كم شرق المقر
+        self.assertFalse(far.inside)
+        self.assertEqual(far.site_id, 1)
+        self.assertAlmostEqual(far.distance_meters, haversine_m(24.7136, 46.6753, 24.7136, 46.6853), places=3)
+
+    def test_batch_matches_scalar_locate(self):
+        rnd = random.Random(7)
+        points = [(rnd.uniform(24.64, 24.78), rnd.uniform(46.66, 46.75)) for _ in range(2000)]
+        for name in ('HQ', 'Branch'):
+            site = next(s for s in SITES if s['name'] == name)
+            points += [(site['center_lat'] + rnd.uniform(-0.001, 0.001),
+                        site['center_lng'] + rnd.uniform(-0.001, 0.001)) for _ in range(200)]
+        batch = self.index.batch_matches([p[0] for p in points], [p[1] for p in points])
+        for (lat, lng), got in zip(points, batch):
+            expected = self.index.locate(lat, lng)
+            self.assertEqual((got.site_id, got.inside), (expected.site_id, expected.inside))
+            self.assertAlmostEqual(got.distance_meters, expected.distance_meters, places=3)
+
+    def test_missing_coordinates_and_empty_index(self):
+        res = self.index.batch_matches([float('nan')], [46.6])
+        self.assertEqual(res, [None])
+        self.assertIsNone(GeofenceIndex([]).locate(24.7, 46.6))
+
+
+class GeofenceCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        GeofenceSite.query.delete()
+        db.session.commit()
+
+    def tearDown(self):
+        GeofenceSite.query.delete()
+        db.session.commit()
+        db.session.remove()
+        self.ctx.pop()
+
+    def test_falls_back_to_company_point_then_uses_sites(self):
+        settings = AttendanceSettings.query.first() or AttendanceSettings()
+        db.session.add(settings)
+        db.session.commit()
+        self.assertIsNone(locate(settings.company_lat, settings.company_lng).site_id)
+
+        site = GeofenceSite(name='Field', site_type='circle', center_lat=10.0, center_lng=20.0, radius_meters=50)
+        db.session.add(site)
+        db.session.commit()
+        match = locate(10.0001, 20.0001)
+        self.assertTrue(match.inside)
+        self.assertEqual(match.site_id, site.id)
+        self.assertEqual([m.site_id for m in validate_points([(10.0, 20.0), (None, None)]) if m], [site.id])
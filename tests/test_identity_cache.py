@@ -0,0 +1,97 @@
+import unittest
+from flask import session
+from app import create_app, db
+from app.models.employee import Employee
+from app.models.permission import Role, UserRole
+from app.models.user import User
+from app.utils.cache_generation import get_generation
+from app.utils.identity import IDENTITY_GENERATION, current_employee, get_identity, identity_stats, load_identity
+
+EMPLOYEE = 990601
+USERNAME = 'identity_test_user'
+
+
+class IdentityCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.app.config['CACHE_GENERATION_TTL'] = 60.0
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        self._clean()
+        db.session.add(Employee(id=EMPLOYEE, code=f'I{EMPLOYEE}', name='identity test', active=True))
+        self.user = User(username=USERNAME, password_hash='x', role='employee')
+        db.session.add(self.user)
+        db.session.commit()
+        self.user_id = self.user.id
+
+    def tearDown(self):
+        self._clean()
+        db.session.remove()
+        self.ctx.pop()
+
+    def _clean(self):
+        users = [u.id for u in User.query.filter(User.username.like(f'{USERNAME}%'))]
+        UserRole.query.filter(UserRole.user_id.in_(users)).delete(synchronize_session=False)
+        Role.query.filter_by(name='identity_test_role').delete()
+        User.query.filter(User.id.in_(users)).delete(synchronize_session=False)
+        Employee.query.filter_by(id=EMPLOYEE).delete()
+        db.session.commit()
+
+    def _request(self):
+        """طلب جديد بنفس الجلسة (سياق تطبيق جديد = g جديد): (اسم المستخدم، اسم الموظف، الأدوار)."""
+        with self.app.app_context(), self.app.test_request_context('/'):
+            session['identity_version'] = 'v1'
+            session['employee_id'] = EMPLOYEE
+            user = load_identity(self.user_id)
+            identity = get_identity()
+            employee = current_employee()
+            result = (user.username, employee.name if employee else None, identity.role_names)
+            db.session.remove()
+            return result
+
+    def test_cached_identity_refreshes_after_user_employee_and_role_writes(self):
+        before = identity_stats()
+        self.assertEqual(self._request(), (USERNAME, 'identity test', ()))
+        self.assertEqual(self._request(), (USERNAME, 'identity test', ()))
+        after = identity_stats()
+        self.assertEqual((after['misses'] - before['misses'], after['hits'] - before['hits']), (1, 1))
+
+        generation = get_generation(IDENTITY_GENERATION)
+        db.session.get(User, self.user_id).username = f'{USERNAME}_renamed'
+        db.session.commit()
+        self.assertNotEqual(get_generation(IDENTITY_GENERATION), generation)
+        self.assertEqual(self._request()[0], f'{USERNAME}_renamed')
+
+        db.session.get(Employee, EMPLOYEE).name = 'identity test 2'
+        db.session.commit()
+        self.assertEqual(self._request()[1], 'identity test 2')
+
+        role = Role(name='identity_test_role', is_active=True)
+        db.session.add(role)
+        db.session.flush()
+        db.session.add(UserRole(user_id=self.user_id, role_id=role.id))
+        db.session.commit()
+        self.assertEqual(self._request()[2], ('identity_test_role',))
+
+    def test_own_employee_pages_use_the_linked_employee(self):
+        # رقم المستخدم ليس رقم الموظف: "صفحتي" تُحدد بالموظف المرتبط
+        client = self.app.test_client()
+        with client.session_transaction() as sess:
+            sess['_user_id'] = str(self.user_id)
+            sess['_fresh'] = True
+            sess['employee_id'] = EMPLOYEE
+        self.assertNotEqual(self.user_id, EMPLOYEE)
+        self.assertEqual(client.get(f'/employee/{EMPLOYEE}').status_code, 200)
+        self.assertEqual(client.get(f'/employee/{self.user_id}').status_code, 403)
+
+    def test_unmodified_objects_do_not_bump_generation(self):
+        generation = get_generation(IDENTITY_GENERATION)
+        user = db.session.get(User, self.user_id)
+        user.username = user.username  # بدون تغيير فعلي
+        db.session.commit()
+        self.assertEqual(get_generation(IDENTITY_GENERATION), generation)
+
+
+if __name__ == '__main__':
+    unittest.main()
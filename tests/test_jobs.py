@@ -0,0 +1,74 @@
+import unittest
+from app import create_app, db
+from app.models.job import BackgroundJob
+from app.utils.jobs import job_handler, submit_job, cancel_job, execute_job, _claim
+
+
+@job_handler('test.echo')
+def _echo(ctx):
+    ctx.progress(50, 'half way')
+    return {'echo': ctx.payload.get('value'), 'user_id': ctx.user_id}
+
+
+@job_handler('test.boom', transient_payload=True)
+def _boom(ctx):
+    raise RuntimeError('boom')
+
+
+class BackgroundJobTests(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.app.config['JOBS_IN_PROCESS'] = False
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+
+    def tearDown(self):
+        db.session.remove()
+        self.ctx.pop()
+
+    def test_eager_job_stores_result(self):
+        self.app.config['JOBS_EAGER'] = True
+        job = submit_job('test.echo', {'value': 'hi'})
+        self.assertEqual(job.status, 'succeeded')
+        self.assertEqual(job.progress, 100)
+        self.assertEqual(job.get_result(), {'echo': 'hi', 'user_id': None})
+
+    def test_failed_job_records_error_and_drops_transient_payload(self):
+        self.app.config['JOBS_EAGER'] = True
+        job = submit_job('test.boom', {'secret': 'x'})
+        self.assertEqual(job.status, 'failed')
+        self.assertIn('boom', job.error)
+        self.assertIsNone(job.payload)
+
+    def test_claim_is_exclusive(self):
+        job = submit_job('test.echo', {'value': 1})
+        self.assertTrue(_claim(job.id, 'worker-a'))
+        self.assertFalse(_claim(job.id, 'worker-b'))
+        execute_job(job.id)
+        db.session.expire(job)
+        self.assertEqual(job.status, 'succeeded')
+        self.assertEqual(job.worker_id, 'worker-a')
+
+    def test_cancel_queued_and_running(self):
+        queued = submit_job('test.echo', {})
+        self.assertEqual(cancel_job(queued.id), 'cancelled')
+        self.assertFalse(_claim(queued.id, 'worker-a'))
+
+        running = submit_job('test.echo', {})
+        _claim(running.id, 'worker-a')
+        self.assertEqual(cancel_job(running.id), 'cancel_requested')
+        # المهمة تتوقف عند أول تحديث للتقدم
+        execute_job(running.id)
+        db.session.expire(running)
+        self.assertEqual(running.status, 'cancelled')
+        self.assertIsNone(cancel_job(running.id))
+
+    def test_unknown_job_type_rejected(self):
+        with self.assertRaises(ValueError):
+            submit_job('test.missing')
+        self.assertEqual(BackgroundJob.query.filter_by(job_type='test.missing').count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+from datetime import date, datetime, timedelta
+from app import create_app, db
+from app.models.attendance import Attendance, AttendanceDaily
+from app.models.employee import Employee
+from app.models.payroll import PayrollDirtyMark
+from app.utils import attendance_daily, late_stats
+from app.utils.late_stats import late_statistics
+from app.utils.settings_cache import attendance_settings
+
+EMPLOYEES = (990141, 990142, 990143)
+# دقائق (وثوانٍ) بعد check_in_end لكل موظف؛ فترة السماح 15 دقيقة
+OFFSETS = {
+    990141: [timedelta(minutes=20), timedelta(minutes=5), timedelta(minutes=15), timedelta(minutes=40)],
+    990142: [timedelta(minutes=90), timedelta(minutes=16, seconds=30)],
+    990143: [timedelta(minutes=-10), timedelta(minutes=10)],
+}
+
+
+class LateStatisticsTests(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        self._clean()
+        end = attendance_settings().check_in_end
+        for emp_id in EMPLOYEES:
+            db.session.add(Employee(id=emp_id, code=f'L{emp_id}', name=f'late {emp_id}', active=True))
+            for n, offset in enumerate(OFFSETS[emp_id]):
+                day = date(2025, 3, 2) + timedelta(days=n)
+                db.session.add(Attendance(employee_id=emp_id, date=day,
+                                          check_in_time=datetime.combine(day, end) + offset))
+        db.session.commit()
+        self._saved = (attendance_daily.rollup_ready, late_stats._late_minutes_expr)
+
+    def tearDown(self):
+        attendance_daily.rollup_ready, late_stats._late_minutes_expr = self._saved
+        self._clean()
+        db.session.remove()
+        self.ctx.pop()
+
+    def _clean(self):
+        for model in (Attendance, AttendanceDaily, PayrollDirtyMark):
+            model.query.filter(model.employee_id.in_(EMPLOYEES)).delete(synchronize_session=False)
+        Employee.query.filter(Employee.id.in_(EMPLOYEES)).delete(synchronize_session=False)
+        db.session.commit()
+
+    def _all_paths(self, **kwargs):
+        """(SQL خام، NumPy، التجميع اليومي) لنفس الاستعلام."""
+        kwargs.setdefault('employee_ids', EMPLOYEES)
+        attendance_daily.rollup_ready = lambda: False
+        sql = late_statistics(date(2025, 3, 1), date(2025, 3, 31), **kwargs)
+        late_stats._late_minutes_expr = lambda dialect, end_seconds: None
+        numpy_result = late_statistics(date(2025, 3, 1), date(2025, 3, 31), **kwargs)
+        attendance_daily.rollup_ready = lambda: True
+        rollup = late_statistics(date(2025, 3, 1), date(2025, 3, 31), **kwargs)
+        late_stats._late_minutes_expr = self._saved[1]
+        return sql, numpy_result, rollup
+
+    def test_paths_agree_and_grace_is_exclusive(self):
+        for result in self._all_paths(grace=15):
+            top, late_employees, overall = result
+            self.assertEqual([(e['id'], e['total_late_minutes'], e['late_count']) for e in top],
+                             [(990142, 106, 2), (990141, 60, 2)])
+            self.assertEqual(top[0]['average_late_minutes'], 53.0)
+            self.assertEqual(late_employees, 2)
+            self.assertAlmostEqual(overall, 41.5)
+
+    def test_zero_grace_and_limits(self):
+        for top, late_employees, _ in self._all_paths(grace=0):
+            self.assertEqual([(e['id'], e['late_count']) for e in top], [(990142, 2), (990141, 4), (990143, 1)])
+            self.assertEqual(late_employees, 3)
+        for limit in (1, 0):
+            for top, late_employees, _ in self._all_paths(grace=15, limit=limit):
+                self.assertEqual([e['id'] for e in top], [990142][:limit])
+                self.assertEqual(late_employees, 2)  # العدد الكلي لا يتأثر بـ Top-N
+        for result in self._all_paths(grace=200):
+            self.assertEqual(result, ([], 0, 0.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from flask import Flask
+from app.utils.media_store import (
+    MediaTooLarge, migrate_legacy_media, remove_legacy_media, send_media, store_chunks, store_file,
+)
+
+
+class MediaStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _files(self):
+        return sorted(os.path.relpath(os.path.join(root, name), self.folder)
+                      for root, _, names in os.walk(self.folder) for name in names)
+
+    def test_same_content_is_stored_once(self):
+        first = store_chunks([b'voice-', b'note'], 'ogg', self.folder)
+        forwarded = store_file(io.BytesIO(b'voice-note'), 'ogg', self.folder)
+        self.assertTrue(first.created)
+        self.assertFalse(forwarded.created)
+        self.assertEqual(first.relpath, forwarded.relpath)
+        self.assertEqual(first.relpath, f'{first.digest[:2]}/{first.digest}.ogg')
+        self.assertEqual(self._files(), [first.relpath])
+
+    def test_oversized_media_leaves_no_partial_file(self):
+        with self.assertRaises(MediaTooLarge):
+            store_chunks([b'x' * 10, b'y' * 10], 'mp4', self.folder, max_bytes=15)
+        self.assertEqual(self._files(), [])
+
+    def test_legacy_files_are_deduplicated(self):
+        for name in ('1.0_a.mp3', '2.0_b.mp3'):
+            with open(os.path.join(self.folder, name), 'wb') as f:
+                f.write(b'same bytes')
+        mapping, saved = migrate_legacy_media(self.folder)
+        self.assertEqual(mapping['1.0_a.mp3'], mapping['2.0_b.mp3'])
+        self.assertEqual(saved, len(b'same bytes'))
+        # القديمة تبقى حتى commit الروابط الجديدة
+        self.assertEqual(self._files(), sorted(['1.0_a.mp3', '2.0_b.mp3', mapping['1.0_a.mp3']]))
+
+        # تشغيل متقطع ثم إعادة: نفس النتيجة
+        self.assertEqual(migrate_legacy_media(self.folder)[0], mapping)
+        self.assertEqual(remove_legacy_media(mapping, self.folder), 2)
+        self.assertEqual(self._files(), [mapping['1.0_a.mp3']])
+
+    def test_range_request_and_cache_headers(self):
+        stored = store_chunks([b'0123456789'], 'mp3', self.folder)
+        app = Flask(__name__)
+        with app.test_request_context(headers={'Range': 'bytes=2-5'}):
+            response = send_media(stored.relpath, folder=self.folder)
+            response.direct_passthrough = False
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response.get_data(), b'2345')
+            self.assertIn('immutable', response.headers['Cache-Control'])
+            self.assertEqual(response.get_etag()[0], stored.digest)
+            response.close()
+        with app.test_request_context(headers={'If-None-Match': f'"{stored.digest}"'}):
+            self.assertEqual(send_media(stored.relpath, folder=self.folder).status_code, 304)
+
+
+if __name__ == '__main__':
+    unittest.main()
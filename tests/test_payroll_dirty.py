@@ -0,0 +1,103 @@
+import unittest
+from datetime import date, datetime
+from app import create_app, db
+from app.models.attendance import Attendance, AttendanceDaily
+from app.models.employee import Employee
+from app.models.holiday import PublicHoliday
+from app.models.leave import Leave
+from app.models.payroll import PayrollDirtyMark
+from app.utils.payroll_dirty import clear_dirty_marks, dirty_employees, mark_payroll_dirty
+
+EMPLOYEE = 990301
+
+
+class PayrollDirtyTrackingTests(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        self._clean()
+        db.session.add(Employee(id=EMPLOYEE, code=f'D{EMPLOYEE}', name='dirty test', active=True))
+        db.session.commit()
+
+    def tearDown(self):
+        self._clean()
+        db.session.remove()
+        self.ctx.pop()
+
+    def _clean(self):
+        for model in (Attendance, AttendanceDaily, Leave, PayrollDirtyMark):
+            model.query.filter(model.employee_id == EMPLOYEE).delete(synchronize_session=False)
+        PublicHoliday.query.filter(PublicHoliday.date.between(date(2031, 1, 1), date(2031, 12, 31))).delete()
+        Employee.query.filter_by(id=EMPLOYEE).delete()
+        db.session.commit()
+
+    def _marks(self):
+        return {(m.year, m.month, m.source) for m in PayrollDirtyMark.query.filter_by(employee_id=EMPLOYEE)}
+
+    def test_attendance_changes_mark_old_and_new_month_in_same_commit(self):
+        row = Attendance(employee_id=EMPLOYEE, date=date(2025, 3, 31), check_in_time=datetime(2025, 3, 31, 8))
+        db.session.add(row)
+        db.session.commit()
+        self.assertEqual(self._marks(), {(2025, 3, 'attendance')})
+
+        clear_dirty_marks(2025, 3, [EMPLOYEE])
+        db.session.commit()
+        row.date = date(2025, 4, 1)
+        db.session.commit()
+        # نقل السجل لشهر آخر يعلّم الشهرين
+        self.assertEqual({(y, m) for y, m, _ in self._marks()}, {(2025, 3), (2025, 4)})
+
+    def test_rolled_back_change_leaves_no_mark_and_leave_spans_months(self):
+        db.session.add(Attendance(employee_id=EMPLOYEE, date=date(2025, 5, 2)))
+        db.session.flush()
+        db.session.rollback()
+        self.assertEqual(self._marks(), set())
+
+        db.session.add(Leave(employee_id=EMPLOYEE, leave_type='annual',
+                             start_date=date(2025, 5, 28), end_date=date(2025, 6, 3)))
+        db.session.commit()
+        self.assertEqual(self._marks(), {(2025, 5, 'leave'), (2025, 6, 'leave')})
+
+    def test_holiday_create_move_and_delete_mark_every_active_employee(self):
+        holiday = PublicHoliday(date=date(2031, 7, 15), name='dirty test holiday')
+        db.session.add(holiday)
+        db.session.commit()
+        self.assertEqual(self._marks(), {(2031, 7, 'calendar')})
+
+        clear_dirty_marks(2031, 7)
+        holiday.name = 'renamed'  # الاسم وحده لا يغيّر أيام العمل
+        db.session.commit()
+        self.assertEqual(self._marks(), set())
+
+        holiday.date = date(2031, 8, 1)
+        db.session.commit()
+        self.assertEqual({(y, m) for y, m, _ in self._marks()}, {(2031, 7), (2031, 8)})
+
+        clear_dirty_marks(2031, 7)
+        clear_dirty_marks(2031, 8)
+        db.session.delete(holiday)
+        db.session.commit()
+        self.assertEqual(self._marks(), {(2031, 8, 'calendar')})
+
+    def test_clear_keeps_marks_made_after_read(self):
+        mark_payroll_dirty([(EMPLOYEE, date(2025, 7, 10))])
+        db.session.commit()
+        employees, mark_ids = dirty_employees(2025, 7)
+        self.assertIn(EMPLOYEE, employees)
+
+        # تغيير بعد قراءة العلامات (مهما كانت ساعة العملية التي سجلته) يبقى معلَّماً
+        mark_payroll_dirty([(EMPLOYEE, date(2025, 7, 11))], source='leave')
+        db.session.commit()
+        clear_dirty_marks(2025, 7, mark_ids=mark_ids)
+        db.session.commit()
+        self.assertIn(EMPLOYEE, dirty_employees(2025, 7)[0])
+        self.assertEqual(self._marks(), {(2025, 7, 'leave')})
+
+        clear_dirty_marks(2025, 7, mark_ids=dirty_employees(2025, 7)[1])
+        db.session.commit()
+        self.assertNotIn(EMPLOYEE, dirty_employees(2025, 7)[0])
+
+if __name__ == '__main__':
+    unittest.main()
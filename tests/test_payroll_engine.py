@@ -0,0 +1,138 @@
+import unittest
+from datetime import date, datetime, time, timedelta
+from types import SimpleNamespace
+from app import create_app, db
+from app.models.attendance import Attendance, AttendanceDaily
+from app.models.employee import Employee
+from app.models.leave import Leave
+from app.models.payroll import PayrollDirtyMark
+from app.utils.attendance_daily import mark_rollup_built, rebuild_range
+from app.utils.payroll_engine import build_batch_payrolls
+
+START, END = date(2025, 3, 1), date(2025, 3, 31)
+WORK_DAYS = {'0', '1', '2', '3', '4'}  # الإعدادات الافتراضية: الأحد–الخميس
+WORK_START = time(9, 0)
+BASIC = 3100.0
+FIELDS = ('absence_days', 'late_minutes', 'unpaid_leave_days',
+          'absence_deduction', 'late_deduction', 'unpaid_leave_deduction')
+
+# موظف: (أيام العمل الغائبة، {يوم: دقائق التأخير}، إجازات (النوع، مدفوعة، paid_days، من، إلى))
+FIXTURE = {
+    # نفس النتيجة بالقاعدتين: إجازة على أيام عمل غائبة فقط، أو لا إجازة
+    990401: ({4, 5}, {2: 25, 3: -10}, []),
+    990402: ({9, 10, 11}, {}, [('sick', False, 1, 9, 11)]),
+    990403: (None, {}, []),  # بلا حضور
+    # تختلف: الإجازة تغطي عطلة أسبوعية (990404) أو يوماً حضره الموظف (990405)
+    990404: ({13, 17}, {}, [('annual', True, None, 13, 15)]),
+    990405: ({24}, {}, [('annual', True, None, 20, 20)]),
+}
+EMPLOYEES = tuple(FIXTURE)
+
+
+def _legacy_payroll(emp_id, cfg):
+    """مسار الراتب لكل موظف كما كان قبل المحرك المجمّع (حلقة يومية + max(0, غياب - إجازات))."""
+    by_date = {}
+    for rec in Attendance.query.filter(Attendance.employee_id == emp_id,
+                                       Attendance.date >= START, Attendance.date <= END):
+        by_date.setdefault(rec.date, []).append(rec)
+    absence_days = late_minutes = working_days = 0
+    cur = START
+    while cur <= END:
+        if str((cur.weekday() + 1) % 7) in WORK_DAYS:
+            working_days += 1
+            day_recs = by_date.get(cur)
+            if not day_recs:
+                absence_days += 1
+            else:
+                first_in = min((r.check_in_time for r in day_recs if r.check_in_time), default=None)
+                scheduled = datetime.combine(cur, WORK_START)
+                if first_in and first_in > scheduled:
+                    late_minutes += int((first_in - scheduled).total_seconds() // 60)
+        cur += timedelta(days=1)
+
+    paid, unpaid = set(), set()
+    for lv in Leave.query.filter(Leave.employee_id == emp_id, Leave.status == 'Approved',
+                                 Leave.end_date >= START, Leave.start_date <= END):
+        days = [max(lv.start_date, START) + timedelta(days=n)
+                for n in range((min(lv.end_date, END) - max(lv.start_date, START)).days + 1)]
+        split = max(0, min(len(days), int(lv.paid_days or 0))) if lv.leave_type == 'sick' and lv.paid_days is not None \
+            else (len(days) if lv.paid else 0)
+        paid.update(days[:split])
+        unpaid.update(days[split:])
+
+    adj_absence = max(0, absence_days - len(paid) - len(unpaid))
+    daily_rate = BASIC / working_days
+    per_hour = float(cfg.get('PAYROLL_LATE_DEDUCTION_PER_HOUR', 0.0)) or BASIC / 240.0
+    return {
+        'absence_days': adj_absence,
+        'late_minutes': late_minutes,
+        'unpaid_leave_days': len(unpaid),
+        'absence_deduction': round(daily_rate * adj_absence * float(cfg.get('PAYROLL_ABSENCE_DEDUCTION_RATE', 1.0)), 2),
+        'late_deduction': round(per_hour * late_minutes / 60.0, 2),
+        'unpaid_leave_deduction': round(daily_rate * len(unpaid), 2),
+    }
+
+
+class PayrollBatchParityTests(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        for emp_id, (absent, late, leaves) in FIXTURE.items():
+            db.session.add(Employee(id=emp_id, code=f'P{emp_id}', name=f'payroll {emp_id}', active=True))
+            day = START
+            while absent is not None and day <= END:
+                if str((day.weekday() + 1) % 7) in WORK_DAYS and day.day not in absent:
+                    check_in = datetime.combine(day, WORK_START) + timedelta(minutes=late.get(day.day, 0))
+                    db.session.add(Attendance(employee_id=emp_id, date=day, check_in_time=check_in,
+                                              check_out_time=check_in + timedelta(hours=8)))
+                day += timedelta(days=1)
+            for leave_type, paid, paid_days, first, last in leaves:
+                db.session.add(Leave(employee_id=emp_id, leave_type=leave_type, paid=paid, paid_days=paid_days,
+                                     start_date=date(2025, 3, first), end_date=date(2025, 3, last), status='Approved'))
+        db.session.commit()
+        self.legacy = {emp_id: _legacy_payroll(emp_id, self.app.config) for emp_id in EMPLOYEES}
+
+    def tearDown(self):
+        for model in (Attendance, AttendanceDaily, Leave, PayrollDirtyMark):
+            model.query.filter(model.employee_id.in_(EMPLOYEES)).delete(synchronize_session=False)
+        Employee.query.filter(Employee.id.in_(EMPLOYEES)).delete(synchronize_session=False)
+        db.session.commit()
+        db.session.remove()
+        self.ctx.pop()
+
+    def _batch(self):
+        templates = [SimpleNamespace(employee_id=emp_id, basic_salary=BASIC, housing_allowance=0.0,
+                                     transport_allowance=0.0, food_allowance=0.0, phone_allowance=0.0,
+                                     other_allowances=0.0) for emp_id in EMPLOYEES]
+        rows, _ = build_batch_payrolls(templates, 3, 2025)
+        return {row['employee_id']: {name: row[name] for name in FIELDS} for row in rows}
+
+    def _assert_parity_and_documented_change(self, batch):
+        for emp_id in (990401, 990402, 990403):
+            self.assertEqual(batch[emp_id], self.legacy[emp_id], emp_id)
+        # القاعدة القديمة طرحت كل أيام الإجازة التقويمية من الغياب، فأعفت غياباً حقيقياً:
+        # 990404: إجازة الخميس–السبت (يوم عمل واحد) أعفت غياب الاثنين 17 أيضاً
+        # 990405: إجازة يوم حضره الموظف أعفت غياب الاثنين 24
+        # المحرك المجمّع يعفي فقط أيام العمل المغطاة بإجازة وبلا حضور
+        self.assertEqual((self.legacy[990404]['absence_days'], batch[990404]['absence_days']), (0, 1))
+        self.assertEqual((self.legacy[990405]['absence_days'], batch[990405]['absence_days']), (0, 1))
+        for emp_id in (990404, 990405):
+            for name in ('late_minutes', 'unpaid_leave_days', 'late_deduction', 'unpaid_leave_deduction'):
+                self.assertEqual(batch[emp_id][name], self.legacy[emp_id][name], (emp_id, name))
+            self.assertEqual(batch[emp_id]['absence_deduction'], round(BASIC / 22, 2))  # 22 يوم عمل في مارس 2025
+
+    def test_batch_matches_legacy_path_from_raw_attendance(self):
+        self._assert_parity_and_documented_change(self._batch())
+
+    def test_batch_matches_legacy_path_from_daily_rollup(self):
+        connection = db.session.connection()
+        rebuild_range(connection, START, END, employee_ids=EMPLOYEES)
+        mark_rollup_built(connection)
+        db.session.commit()
+        self._assert_parity_and_documented_change(self._batch())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import random
+import unittest
+from app import create_app
+from app.models.payroll import Payroll
+from app.utils.payroll_kernel import compute_net_arrays, round_cents
+
+
+FIELDS = [
+    'basic', 'housing_allowance', 'transport_allowance', 'food_allowance', 'phone_allowance',
+    'other_allowances', 'allowances', 'bonus', 'commission', 'overtime_amount', 'incentives',
+    'absence_deduction', 'late_deduction', 'loan_deduction', 'unpaid_leave_deduction', 'other_deductions',
+]
+
+
+def _random_payroll(rnd):
+    values = {}
+    for name in FIELDS:
+        roll = rnd.random()
+        if roll < 0.15:
+            values[name] = None
+        elif roll < 0.35:
+            values[name] = 0.0
+        else:
+            # قيم بالهللة لتوليد حالات حدّية في التقريب
+            values[name] = round(rnd.uniform(0, 20000), rnd.choice([0, 1, 2, 3]))
+    return values
+
+
+class PayrollKernelEquivalenceTests(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.app.config['PAYROLL_TAX_RATE'] = 0.10
+        self.app.config['PAYROLL_INSURANCE_RATE'] = 0.02
+        self.app.config['PAYROLL_HEALTH_INSURANCE_RATE'] = 0.0125
+        self.app.config['PAYROLL_TAX_EXEMPT_LIMIT'] = 3000.0
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+
+    def tearDown(self):
+        self.ctx.pop()
+
+    def _assert_same(self, expected, actual):
+        for name in ('allowances', 'deductions', 'gross_salary', 'tax', 'insurance',
+                     'health_insurance', 'total_deductions', 'net'):
+            self.assertEqual(getattr(expected, name), getattr(actual, name), name)
+
+    def test_compute_net_many_matches_per_row(self):
+        rnd = random.Random(2024)
+        rows = [_random_payroll(rnd) for _ in range(2000)]
+        per_row = [Payroll(**r) for r in rows]
+        batch = [Payroll(**r) for r in rows]
+        for p in per_row:
+            p.compute_net()
+        Payroll.compute_net_many(batch)
+        for expected, actual in zip(per_row, batch):
+            self._assert_same(expected, actual)
+
+    def test_compute_net_many_without_rules(self):
+        rnd = random.Random(7)
+        rows = [_random_payroll(rnd) for _ in range(200)]
+        per_row = [Payroll(**r) for r in rows]
+        batch = [Payroll(**r) for r in rows]
+        for p in per_row:
+            p.compute_net(apply_rules=False)
+        Payroll.compute_net_many(batch, apply_rules=False)
+        for expected, actual in zip(per_row, batch):
+            self._assert_same(expected, actual)
+
+    def test_exempt_limit_boundary(self):
+        # الدخل الخاضع يساوي حد الإعفاء تماماً -> لا ضريبة، وأعلى منه بهللة -> ضريبة
+        p1 = Payroll(basic=3000.0)
+        p2 = Payroll(basic=3000.01)
+        Payroll.compute_net_many([p1, p2])
+        self.assertEqual(p1.tax, 0.0)
+        self.assertEqual(p2.tax, 300.0)
+
+    def test_kernel_arrays_match_compute_net(self):
+        p = Payroll(basic=1000.0, allowances=100.0, bonus=50.0)
+        breakdown = p.compute_net()
+        out = compute_net_arrays([1000.0], [100.0], [50.0], [0.0], [0.0], [0.0], [0.0],
+                                 tax_rate=0.10, insurance_rate=0.02, health_insurance_rate=0.0125,
+                                 exempt_limit=0.0)
+        self.assertEqual(out['gross'][0], breakdown['gross_salary'])
+        self.assertEqual(out['tax'][0], 115.0)
+        self.assertEqual(out['insurance'][0], breakdown['insurance'])
+        self.assertEqual(out['health_insurance'][0], breakdown['health_insurance'])
+
+    def test_round_cents_matches_builtin_round_on_ties(self):
+        values = [2.675, 1.005, 0.285, 1.115, 10.125, 0.125, 1234.565, 2.5, 0.0, 99.995]
+        self.assertEqual(round_cents(values).tolist(), [round(v, 2) for v in values])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+from app import create_app, db
+from app.models.cache_generation import CacheGeneration
+from app.models.permission import Permission, Role, RolePermission, UserRole
+from app.models.user import User
+from app.utils.cache_generation import bump_generation, get_generation
+from app.utils.permission_cache import PERMISSIONS_GENERATION, invalidate_permissions
+
+PREFIX = 'permcache_test'
+
+
+class PermissionCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.app.config['CACHE_GENERATION_TTL'] = 60.0
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        self._clean()
+        self.user = User(username=f'{PREFIX}_user', password_hash='x', role='employee')
+        self.role = Role(name=f'{PREFIX}_role', is_active=True)
+        self.view = Permission(module=PREFIX, action='view')
+        self.edit = Permission(module=PREFIX, action='edit')
+        db.session.add_all([self.user, self.role, self.view, self.edit])
+        db.session.flush()
+        db.session.add_all([UserRole(user_id=self.user.id, role_id=self.role.id),
+                            RolePermission(role_id=self.role.id, permission_id=self.view.id, granted=True)])
+        db.session.commit()
+
+    def tearDown(self):
+        self._clean()
+        db.session.remove()
+        self.ctx.pop()
+
+    def _clean(self):
+        roles = [r.id for r in Role.query.filter(Role.name.like(f'{PREFIX}%'))]
+        users = [u.id for u in User.query.filter(User.username.like(f'{PREFIX}%'))]
+        RolePermission.query.filter(RolePermission.role_id.in_(roles)).delete(synchronize_session=False)
+        UserRole.query.filter(UserRole.user_id.in_(users)).delete(synchronize_session=False)
+        Permission.query.filter_by(module=PREFIX).delete(synchronize_session=False)
+        Role.query.filter(Role.id.in_(roles)).delete(synchronize_session=False)
+        User.query.filter(User.id.in_(users)).delete(synchronize_session=False)
+        db.session.commit()
+
+    def test_grant_is_seen_after_bump_in_same_transaction(self):
+        self.assertTrue(self.user.check_permission(PREFIX, 'view'))
+        self.assertFalse(self.user.has_any_permission(PREFIX, ['edit', 'delete']))
+
+        db.session.add(RolePermission(role_id=self.role.id, permission_id=self.edit.id, granted=True))
+        db.session.commit()
+        # بدون زيادة الجيل تبقى النسخة المخزنة كما هي
+        self.assertFalse(self.user.check_permission(PREFIX, 'edit'))
+
+        invalidate_permissions()
+        db.session.commit()
+        self.assertTrue(self.user.check_permission(PREFIX, 'edit'))
+
+        self.role.is_active = False
+        invalidate_permissions()
+        db.session.commit()
+        self.assertEqual(self.user.get_effective_permissions(), frozenset())
+
+    def test_other_process_bump_is_seen_after_ttl_and_rollback_changes_nothing(self):
+        before = get_generation(PERMISSIONS_GENERATION, ttl=0)
+        # زيادة من عملية أخرى: لا تمسح النسخة المحلية لهذه العملية
+        table = CacheGeneration.__table__
+        db.session.execute(table.update().where(table.c.name == PERMISSIONS_GENERATION)
+                           .values(version=table.c.version + 1, token='other-process'))
+        if before == (0, None):
+            db.session.execute(table.insert().values(name=PERMISSIONS_GENERATION, version=1, token='other-process'))
+        db.session.commit()
+        self.assertEqual(get_generation(PERMISSIONS_GENERATION), before)
+        self.assertEqual(get_generation(PERMISSIONS_GENERATION, ttl=0)[1], 'other-process')
+
+        bump_generation(PERMISSIONS_GENERATION)
+        db.session.rollback()
+        self.assertEqual(get_generation(PERMISSIONS_GENERATION)[1], 'other-process')
+
+
+if __name__ == '__main__':
+    unittest.main()
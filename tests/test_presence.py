@@ -0,0 +1,177 @@
+import unittest
+from datetime import datetime, timedelta
+from app import create_app, db
+from app.models.employee import Employee
+from app.models.presence import EmployeePresence, PresenceHeartbeat
+from app.models.user import User
+from app.utils.presence import (
+    AWAY, OFFLINE, ONLINE, PresenceStore, dashboard_etag, dashboard_page, get_presence_store, presence_windows,
+    status_for,
+)
+
+
+WINDOWS = (timedelta(minutes=30), timedelta(minutes=35), timedelta(minutes=65))
+
+
+class PresenceStatusTests(unittest.TestCase):
+    def test_transitions_from_last_seen(self):
+        now = datetime(2024, 1, 1, 12, 0)
+        self.assertEqual(status_for(now - timedelta(minutes=34), now, WINDOWS), ONLINE)
+        self.assertEqual(status_for(now - timedelta(minutes=40), now, WINDOWS), AWAY)
+        self.assertEqual(status_for(now - timedelta(minutes=70), now, WINDOWS), OFFLINE)
+        self.assertEqual(status_for(None, now, WINDOWS), OFFLINE)
+
+
+class PresenceStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.app.config['PRESENCE_FLUSH_SECONDS'] = 60.0  # بدون تفريغ تلقائي أثناء الاختبار
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        self._clean()
+        self.store = PresenceStore(self.app)
+
+    def tearDown(self):
+        self._clean()
+        db.session.remove()
+        self.ctx.pop()
+
+    def _clean(self):
+        PresenceHeartbeat.query.filter(PresenceHeartbeat.employee_id >= 990000).delete()
+        EmployeePresence.query.filter(EmployeePresence.employee_id >= 990000).delete()
+        Employee.query.filter(Employee.id.in_([990001, 990002])).delete()
+        db.session.commit()
+
+    def test_heartbeats_coalesce_then_flush_and_sync(self):
+        now = datetime.utcnow()
+        for emp_id in (990001, 990002):
+            db.session.add(Employee(id=emp_id, code=f'S{emp_id}', name='presence store test', active=True))
+        db.session.commit()
+        for i in range(5):
+            self.store.heartbeat(990001, '10.0.0.1', now + timedelta(seconds=i))
+        self.store.heartbeat(990002, '10.0.0.2', now - timedelta(hours=3))
+        self.store.heartbeat(990009, '10.0.0.9', now)  # لا موظف بهذا الرقم
+        self.assertEqual(db.session.get(PresenceHeartbeat, 990001), None)
+
+        self.assertEqual(self.store.flush(), 3)
+        self.assertEqual(db.session.get(PresenceHeartbeat, 990001).last_seen, now + timedelta(seconds=4))
+
+        # صف قديم online يجب أن يتحول offline بالمزامنة
+        db.session.add(EmployeePresence(employee_id=990003, status=ONLINE, last_activity=now - timedelta(days=1)))
+        db.session.commit()
+        self.store.sync(now + timedelta(seconds=5))
+        rows = {p.employee_id: p.status for p in EmployeePresence.query.filter(EmployeePresence.employee_id >= 990000)}
+        self.assertEqual(rows, {990001: ONLINE, 990003: OFFLINE})
+        # النبضة المجهولة لا تُنقل (FK) وتُحذف فلا تبقى داخل نافذة المزامنة
+        self.assertIsNone(db.session.get(PresenceHeartbeat, 990009))
+
+
+class PresenceDashboardTests(unittest.TestCase):
+    DEPARTMENT = 'presence-dashboard-test'
+
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        self._clean()
+        self.now = datetime.utcnow()
+        _, online, away = presence_windows()
+        for emp_id in (990011, 990012, 990013):
+            db.session.add(Employee(id=emp_id, code=f'P{emp_id}', name='dashboard test', department=self.DEPARTMENT,
+                                    active=True))
+        db.session.add(PresenceHeartbeat(employee_id=990011, last_seen=self.now, session_start=self.now))
+        # صفّان قديمان لنفس الموظف: يُستخدم الأول (أصغر id) فقط
+        db.session.add(EmployeePresence(employee_id=990012, last_activity=self.now - (online + away) / 2))
+        db.session.add(EmployeePresence(employee_id=990012, last_activity=self.now))
+        db.session.commit()
+
+    def tearDown(self):
+        self._clean()
+        db.session.remove()
+        self.ctx.pop()
+
+    def _clean(self):
+        PresenceHeartbeat.query.filter(PresenceHeartbeat.employee_id.between(990011, 990013)).delete()
+        EmployeePresence.query.filter(EmployeePresence.employee_id.between(990011, 990013)).delete()
+        Employee.query.filter_by(department=self.DEPARTMENT).delete()
+        db.session.commit()
+
+    def test_single_query_page_statuses_filters_and_keyset(self):
+        items, cursor = dashboard_page(self.DEPARTMENT, limit=2, now=self.now)
+        self.assertEqual([(i['employee_id'], i['status']) for i in items], [(990011, ONLINE), (990012, AWAY)])
+        self.assertEqual(cursor, 990012)
+        items, cursor = dashboard_page(self.DEPARTMENT, after=cursor, limit=2, now=self.now)
+        self.assertEqual([(i['employee_id'], i['status']) for i in items], [(990013, OFFLINE)])
+        self.assertIsNone(cursor)
+        self.assertEqual([i['employee_id'] for i in dashboard_page(self.DEPARTMENT, AWAY, now=self.now)[0]], [990012])
+
+    def test_etag_changes_after_writes_and_status_crossings(self):
+        etag = dashboard_etag(self.DEPARTMENT, now=self.now)
+        self.assertEqual(dashboard_etag(self.DEPARTMENT, now=self.now), etag)
+        self.assertNotEqual(dashboard_etag(self.DEPARTMENT, limit=10, now=self.now), etag)
+
+        db.session.add(PresenceHeartbeat(employee_id=990013, last_seen=self.now - timedelta(seconds=1)))
+        db.session.commit()
+        changed = dashboard_etag(self.DEPARTMENT, now=self.now)
+        self.assertNotEqual(changed, etag)
+        # بدون أي كتابة: مرور الوقت ينقل موظفين من online إلى away
+        _, online, _ = presence_windows()
+        self.assertNotEqual(dashboard_etag(self.DEPARTMENT, now=self.now + online + timedelta(seconds=5)), changed)
+
+
+class PresenceHeartbeatRouteTests(unittest.TestCase):
+    EMPLOYEE = 990021
+    OTHER = 990022
+    USERNAME = 'presence_route_test_user'
+
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.app.config['PRESENCE_FLUSH_SECONDS'] = 60.0
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        self._clean()
+        for emp_id in (self.EMPLOYEE, self.OTHER):
+            db.session.add(Employee(id=emp_id, code=f'H{emp_id}', name='presence route test', active=True))
+        user = User(username=self.USERNAME, password_hash='x', role='employee')
+        unlinked = User(username=f'{self.USERNAME}_unlinked', password_hash='x', role='employee')
+        db.session.add_all([user, unlinked])
+        db.session.commit()
+        self.user_id, self.unlinked_id = user.id, unlinked.id
+
+    def tearDown(self):
+        get_presence_store(self.app).stop()
+        self._clean()
+        db.session.remove()
+        self.ctx.pop()
+
+    def _clean(self):
+        User.query.filter(User.username.like(f'{self.USERNAME}%')).delete(synchronize_session=False)
+        Employee.query.filter(Employee.id.in_([self.EMPLOYEE, self.OTHER])).delete()
+        db.session.commit()
+
+    def _client(self, user_id, employee_id):
+        client = self.app.test_client()
+        with client.session_transaction() as sess:
+            sess['_user_id'] = str(user_id)
+            sess['_fresh'] = True
+            sess['employee_id'] = employee_id
+        return client
+
+    def test_heartbeat_is_keyed_by_the_linked_employee(self):
+        # رقم المستخدم ليس رقم الموظف: النبضة تُسجل للموظف المرتبط
+        client = self._client(self.user_id, self.EMPLOYEE)
+        store = get_presence_store(self.app)
+        self.assertNotEqual(self.user_id, self.EMPLOYEE)
+        self.assertEqual(client.post('/api/presence/update', json={}).status_code, 200)
+        self.assertIsNotNone(store.pending(self.EMPLOYEE))
+        self.assertEqual(client.post('/api/presence/update', json={'employee_id': self.EMPLOYEE}).status_code, 200)
+        self.assertEqual(client.post('/api/presence/update', json={'employee_id': self.OTHER}).status_code, 403)
+        self.assertIsNone(store.pending(self.OTHER))
+
+        # سياق تطبيق جديد = g جديد، فلا تُستعمل هوية الطلبات السابقة
+        with self.app.app_context():
+            unlinked = self._client(self.unlinked_id, None)
+            self.assertEqual(unlinked.post('/api/presence/update', json={}).status_code, 400)
@@ -0,0 +1,114 @@
+import multiprocessing
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from app import create_app, db
+from app.models.attendance import Attendance, AttendanceDaily
+from app.models.attendance_advanced import AttendanceReport, PayrollAttendanceLink
+from app.models.employee import Employee
+from app.models.payroll import Payroll, PayrollDirtyMark
+from app.utils import report_engine
+from app.utils.attendance_daily import rebuild_range
+from app.utils.late_stats import late_grace_minutes
+from app.utils.report_engine import build_report_rows, compute_report_stats, link_reports_to_payroll, upsert_reports
+from app.utils.settings_cache import attendance_settings
+
+EMPLOYEES = (990171, 990172, 990173)
+START, END = date(2025, 3, 1), date(2025, 3, 31)
+# (دقائق بعد check_in_end للدخول، ساعات العمل، علم الموقع) لكل يوم
+DAYS = {
+    990171: [(0, 8, True), (25, 9.5, False), (60, None, None)],
+    990172: [(-30, 10, True), (5, 7, True)],
+    990173: [],
+}
+
+
+class ReportEngineTests(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        self._clean()
+        end = attendance_settings().check_in_end
+        for emp_id in EMPLOYEES:
+            db.session.add(Employee(id=emp_id, code=f'R{emp_id}', name=f'report {emp_id}', active=True))
+            for n, (late, hours, location) in enumerate(DAYS[emp_id]):
+                day = date(2025, 3, 2) + timedelta(days=n)
+                check_in = datetime.combine(day, end) + timedelta(minutes=late)
+                db.session.add(Attendance(
+                    employee_id=emp_id, date=day, check_in_time=check_in,
+                    check_out_time=check_in + timedelta(hours=hours) if hours else None,
+                    location_verified=location, time_verified=True, device_verified=True,
+                ))
+        db.session.commit()
+
+    def tearDown(self):
+        self._clean()
+        db.session.remove()
+        self.ctx.pop()
+
+    def _clean(self):
+        reports = [r.id for r in AttendanceReport.query.filter(AttendanceReport.employee_id.in_(EMPLOYEES))]
+        PayrollAttendanceLink.query.filter(PayrollAttendanceLink.report_id.in_(reports)).delete(synchronize_session=False)
+        for model in (AttendanceReport, Payroll, Attendance, AttendanceDaily, PayrollDirtyMark):
+            model.query.filter(model.employee_id.in_(EMPLOYEES)).delete(synchronize_session=False)
+        Employee.query.filter(Employee.id.in_(EMPLOYEES)).delete(synchronize_session=False)
+        db.session.commit()
+
+    def _rows(self, **kwargs):
+        return build_report_rows(compute_report_stats(list(EMPLOYEES), START, END, **kwargs), 'monthly', START, END)
+
+    def test_rollup_and_raw_paths_agree(self):
+        rebuild_range(db.session.connection(), START, END, employee_ids=EMPLOYEES)
+        db.session.commit()
+        raw = compute_report_stats(list(EMPLOYEES), START, END, use_rollup=False)
+        rollup = compute_report_stats(list(EMPLOYEES), START, END, use_rollup=True)
+        self.assertEqual(rollup, raw)
+        self.assertEqual(raw[990171]['present_days'], 3)
+        self.assertEqual(raw[990171]['location_violations'], 2)  # False و None
+        self.assertEqual(raw[990171]['total_overtime_minutes'], 90)
+        self.assertEqual(raw[990173]['present_days'], 0)
+
+    def test_upsert_is_idempotent(self):
+        rows = self._rows(use_rollup=False)
+        first = upsert_reports(db.session.connection(), rows)
+        db.session.commit()
+        rows = self._rows(use_rollup=False)
+        second = upsert_reports(db.session.connection(), rows)
+        db.session.commit()
+        self.assertEqual(first, second)
+        self.assertEqual(sorted(first), list(EMPLOYEES))
+        self.assertEqual(AttendanceReport.query.filter(AttendanceReport.employee_id.in_(EMPLOYEES)).count(),
+                         len(EMPLOYEES))
+
+    def test_payroll_linking(self):
+        for emp_id in EMPLOYEES[:2]:
+            db.session.add(Payroll(employee_id=emp_id, month=3, year=2025, basic=1000))
+        db.session.commit()
+        for _ in range(2):  # إعادة التوليد تحدّث الروابط ولا تكررها
+            rows = self._rows(use_rollup=False)
+            connection = db.session.connection()
+            report_ids = upsert_reports(connection, rows)
+            self.assertEqual(link_reports_to_payroll(connection, report_ids, rows, 3, 2025), 2)
+            db.session.commit()
+
+        links = PayrollAttendanceLink.query.filter(PayrollAttendanceLink.report_id.in_(report_ids.values())).all()
+        self.assertEqual(len(links), 2)
+        reports = {r.employee_id: r for r in AttendanceReport.query.filter(AttendanceReport.employee_id.in_(EMPLOYEES))}
+        self.assertEqual([reports[e].linked_to_payroll for e in EMPLOYEES], [True, True, False])
+        by_report = {link.report_id: link for link in links}
+        link = by_report[report_ids[990171]]
+        self.assertAlmostEqual(link.overtime_bonus_amount, (reports[990171].total_overtime_minutes / 60) * link.overtime_bonus_rate)
+
+    def test_spawn_worker_matches_in_process(self):
+        args = (list(EMPLOYEES), START, END, late_grace_minutes(), False)
+        # العامل يبني تطبيقه من البيئة (DATABASE_URL = قاعدة هذا الاختبار، tests/conftest.py)
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=report_engine._pool_init) as pool:
+            part = pool.submit(report_engine._pool_compute, args).result(timeout=120)
+        self.assertEqual(part, compute_report_stats(*args))
+
+
+if __name__ == '__main__':
+    unittest.main()
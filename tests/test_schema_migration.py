@@ -0,0 +1,174 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import date, datetime, timedelta
+from sqlalchemy import inspect, text
+from app import create_app, db
+from app import db_manager
+from app.db_manager import (MIGRATION_LOCK, SchemaMigrationError, ensure_unique_indexes, has_unique_index,
+                            migrate_database, migration_lock, schema_fingerprint, stored_fingerprint)
+from app.models.attendance import Attendance, AttendanceDaily
+from app.models.attendance_advanced import AttendanceReport, AttendanceSync, PayrollAttendanceLink
+from app.models.employee import Employee
+from app.models.schema import SchemaLock, SchemaVersion
+from app.models.whatsapp_models import WhatsAppConversation, WhatsAppMessage
+
+
+class SchemaFingerprintTests(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        self._ensure_indexes = db_manager.ensure_indexes
+
+    def tearDown(self):
+        db_manager.ensure_indexes = self._ensure_indexes
+        SchemaLock.query.delete()
+        db.session.commit()
+        db.session.remove()
+        self.ctx.pop()
+
+    def test_startup_skips_migration_when_fingerprint_matches(self):
+        fingerprint = schema_fingerprint()
+        self.assertEqual(len(fingerprint), 64)
+        self.assertEqual(stored_fingerprint(), fingerprint)  # create_app رحّل أو وجد البنية محدثة
+        versions = SchemaVersion.query.count()
+        self.assertFalse(migrate_database())
+        create_app()
+        self.assertEqual(SchemaVersion.query.count(), versions)
+
+    def test_lock_blocks_concurrent_migration_and_expires_when_stale(self):
+        with migration_lock(timeout=1):
+            with self.assertRaises(TimeoutError):
+                with migration_lock(timeout=0.3):
+                    pass
+        self.assertEqual(SchemaLock.query.count(), 0)
+
+        # قفل تركته عملية ماتت أثناء الترحيل
+        db.session.add(SchemaLock(name=MIGRATION_LOCK, owner='dead:1',
+                                  acquired_at=datetime.utcnow() - timedelta(hours=1)))
+        db.session.commit()
+        with migration_lock(timeout=1, stale_seconds=60) as owner:
+            self.assertEqual(db.session.get(SchemaLock, MIGRATION_LOCK).owner, owner)
+            db.session.rollback()
+
+    def test_failed_step_does_not_record_fingerprint(self):
+        fingerprint = schema_fingerprint()
+        versions = SchemaVersion.query.count()
+        db_manager.ensure_indexes = lambda: ['[-] Error creating idx_test: disk full']
+        with self.assertRaises(SchemaMigrationError) as raised:
+            migrate_database(fingerprint='0' * 64)
+        self.assertEqual(raised.exception.failures, ['[-] Error creating idx_test: disk full'])
+        self.assertEqual(stored_fingerprint(), fingerprint)
+        self.assertEqual(SchemaVersion.query.count(), versions)
+        self.assertEqual(SchemaLock.query.count(), 0)
+
+        # بعد إصلاح الخطوة يُعاد الترحيل وتُسجل البصمة
+        db_manager.ensure_indexes = self._ensure_indexes
+        self.assertTrue(migrate_database(force=True, fingerprint=fingerprint))
+        self.assertEqual(SchemaVersion.query.count(), versions + 1)
+
+    def test_duplicate_attendance_merged_before_unique_index(self):
+        # قاعدة قديمة: لا فهرس فريد وسجلان لنفس الموظف واليوم
+        db.session.execute(text('DROP INDEX uq_attendance_employee_date'))
+        db.session.add(Employee(id=990251, code='M990251', name='merge test', active=True))
+        day = date(2025, 3, 2)
+        at = datetime(2025, 3, 2, 9, 0)
+        db.session.add_all([
+            Attendance(employee_id=990251, date=day, check_in_time=at + timedelta(minutes=30), status='inside'),
+            Attendance(employee_id=990251, date=day, check_in_time=at, lat=30.1, check_out_time=at + timedelta(hours=4),
+                       address_out='early'),
+            Attendance(employee_id=990251, date=day, check_in_time=at + timedelta(hours=1),
+                       check_out_time=at + timedelta(hours=9), address_out='late'),
+            Attendance(employee_id=990251, date=day + timedelta(days=1), check_in_time=at + timedelta(days=1)),
+        ])
+        db.session.commit()
+        self.assertFalse(has_unique_index(db.session.connection(), 'attendance', 'uq_attendance_employee_date'))
+        db.session.rollback()
+
+        # الدمج يحذف سجلات حضور: لا يعمل ضمنياً
+        messages = ensure_unique_indexes()
+        self.assertTrue(any(m.startswith('[!] Skipped uq_attendance_employee_date') for m in messages))
+        self.assertEqual(Attendance.query.filter_by(employee_id=990251).count(), 4)
+        # الفهرس المعلق لا يفشل الترحيل: البصمة تُسجل ومعها الخطوة المتخطاة
+        self.assertTrue(migrate_database(force=True, fingerprint='2' * 64))
+        self.assertEqual(stored_fingerprint(), '2' * 64)
+        self.assertIn('[!] Skipped uq_attendance_employee_date', db_manager.stored_version()[1])
+
+        export_dir = tempfile.mkdtemp(prefix='merged-rows-')
+        self.addCleanup(shutil.rmtree, export_dir, ignore_errors=True)
+        self.app.config.update(MERGE_DUPLICATE_ATTENDANCE=True, MERGE_EXPORT_DIR=export_dir)
+        messages = ensure_unique_indexes()
+        self.assertIn('[+] Merged 2 duplicate rows into 1 in attendance (employee_id, date)', messages)
+        [export] = os.listdir(export_dir)
+        with open(os.path.join(export_dir, export), encoding='utf-8') as f:
+            exported = [json.loads(line) for line in f]
+        self.assertEqual(len(exported), 3)
+        self.assertEqual({r['kept_id'] for r in exported}, {min(r['id'] for r in exported)})
+        self.assertEqual(db_manager.step_failures(messages), [])
+        self.assertIn('uq_attendance_employee_date', {ix['name'] for ix in inspect(db.engine).get_indexes('attendance')})
+
+        rows = Attendance.query.filter_by(employee_id=990251).order_by(Attendance.date).all()
+        self.assertEqual(len(rows), 2)
+        merged = rows[0]
+        self.assertEqual((merged.check_in_time, merged.lat), (at, 30.1))
+        self.assertEqual((merged.check_out_time, merged.address_out, merged.status),
+                         (at + timedelta(hours=9), 'late', 'outside'))
+        self.assertEqual(db.session.get(AttendanceDaily, (990251, day)).first_in, at)
+
+    def test_legacy_duplicates_merged_and_fingerprint_recorded(self):
+        for index in ('uq_attendance_report_period', 'uq_payroll_attendance_link',
+                      'uq_attendance_sync_idempotency_key', 'uq_whatsapp_message_id', 'uq_whatsapp_conversation_phone'):
+            db.session.execute(text(f'DROP INDEX {index}'))
+        period = dict(employee_id=990252, period_type='monthly', period_start=date(2025, 3, 1),
+                      period_end=date(2025, 3, 31))
+        old, linked, new = (AttendanceReport(present_days=n, **period) for n in (1, 2, 3))
+        linked.linked_to_payroll, linked.payroll_id = True, 7
+        old_conv = WhatsAppConversation(customer_phone='201000000001', customer_name='old', unread_count=2,
+                                        last_message='first', updated_at=datetime(2025, 3, 1))
+        new_conv = WhatsAppConversation(customer_phone='201000000001', unread_count=1, last_message='latest',
+                                        updated_at=datetime(2025, 3, 5))
+        db.session.add_all([old, linked, new, old_conv, new_conv])
+        db.session.flush()
+        db.session.add_all([
+            PayrollAttendanceLink(payroll_id=7, report_id=linked.id, approved=True),
+            PayrollAttendanceLink(payroll_id=7, report_id=new.id),
+            PayrollAttendanceLink(payroll_id=8, report_id=old.id),
+            PayrollAttendanceLink(payroll_id=8, report_id=old.id),
+            WhatsAppMessage(conversation_id=old_conv.id, message_id='wamid.1', message_type='text', direction='incoming',
+                            status='sent', updated_at=datetime(2025, 3, 1)),
+            WhatsAppMessage(conversation_id=new_conv.id, message_id='wamid.1', message_type='text', direction='incoming',
+                            status='read', updated_at=datetime(2025, 3, 2)),
+            AttendanceSync(employee_id=990252, action='check_in', timestamp=datetime(2025, 3, 2, 8), sync_status='pending',
+                           idempotency_key='k1'),
+            AttendanceSync(employee_id=990252, action='check_in', timestamp=datetime(2025, 3, 2, 8), sync_status='synced',
+                           idempotency_key='k1'),
+        ])
+        db.session.commit()
+        versions = SchemaVersion.query.count()
+
+        # الترحيل يكتمل فتُسجل البصمة ولا يُعاد في التشغيل التالي
+        self.assertTrue(migrate_database(force=True, fingerprint='1' * 64))
+        self.assertEqual(SchemaVersion.query.count(), versions + 1)
+        self.assertEqual(stored_fingerprint(), '1' * 64)
+        db.session.expire_all()
+
+        report = AttendanceReport.query.filter_by(employee_id=990252).one()
+        self.assertEqual((report.id, report.present_days, report.linked_to_payroll, report.payroll_id),
+                         (new.id, 3, True, 7))
+        links = {(l.payroll_id, l.report_id): l for l in PayrollAttendanceLink.query.filter_by(report_id=new.id)}
+        self.assertEqual(set(links), {(7, new.id), (8, new.id)})
+        self.assertTrue(links[(7, new.id)].approved)
+        conversation = WhatsAppConversation.query.filter_by(customer_phone='201000000001').one()
+        self.assertEqual((conversation.id, conversation.customer_name, conversation.unread_count, conversation.last_message),
+                         (old_conv.id, 'old', 3, 'latest'))
+        message = WhatsAppMessage.query.filter_by(message_id='wamid.1').one()
+        self.assertEqual((message.conversation_id, message.status), (old_conv.id, 'read'))
+        self.assertEqual(AttendanceSync.query.filter_by(idempotency_key='k1').one().sync_status, 'synced')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+from app import create_app, db
+from app.models.search import SearchDocument
+from app.models.support import SupportTicket
+from app.utils.search_index import index_text, normalize_text, phone_terms, search
+
+
+class NormalizationTests(unittest.TestCase):
+    def test_arabic_folding_and_diacritics(self):
+        self.assertEqual(normalize_text('أَحْمَدُ إلى المدرسةِ، مستشفى ٠٥٠'), 'احمد الي المدرسه مستشفي 050')
+        self.assertEqual(index_text('الفاتورة'), 'الفاتوره فاتوره')
+
+    def test_phone_terms_cover_international_and_local_forms(self):
+        self.assertEqual(phone_terms('+966 50 123 4567'), '966501234567 501234567')
+        self.assertEqual(phone_terms('0501234567'), '0501234567 501234567')
+
+
+class SearchIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        self.ticket = SupportTicket(customer_phone='0509990001', customer_name='عميل الفهرس',
+                                    issue='انقطاعٌ متكرر في خدمة زقزقة', employee_id=1)
+        db.session.add(self.ticket)
+        db.session.commit()
+
+    def tearDown(self):
+        SupportTicket.query.filter_by(customer_phone='0509990001').delete(synchronize_session=False)
+        SearchDocument.query.filter_by(source='ticket', source_id=self.ticket.id).delete(synchronize_session=False)
+        db.session.commit()
+        db.session.remove()
+        self.ctx.pop()
+
+    def _hits(self, query):
+        return [(r['source'], r['id']) for r in search(query, sources=['ticket'])]
+
+    def test_orm_changes_are_indexed_incrementally(self):
+        key = ('ticket', self.ticket.id)
+        self.assertIn(key, self._hits('انقطاع زقزقه'))
+        self.assertIn(key, self._hits('+966 50 999 0001'))
+
+        self.ticket.issue = 'تم حل مشكلة زرزور'
+        db.session.commit()
+        self.assertNotIn(key, self._hits('زقزقة'))
+        self.assertIn(key, self._hits('المشكلة زرزور'))
+
+        db.session.delete(self.ticket)
+        db.session.commit()
+        self.assertEqual(self._hits('زرزور'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+from app import create_app, db
+from app.models.attendance import AttendanceSettings
+from app.models.settings import Settings
+from app.utils import settings_cache
+from app.utils.cache_generation import get_generation
+from app.utils.settings_cache import SETTINGS_GENERATION, attendance_settings, system_settings
+
+
+class SettingsSnapshotTests(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.app.config['CACHE_GENERATION_TTL'] = 60.0
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        attendance_settings()
+        system_settings()
+        self.saved = (AttendanceSettings.query.first().max_distance_meters, Settings.query.first().company_name_ar)
+
+    def tearDown(self):
+        row = AttendanceSettings.query.first()
+        row.max_distance_meters = self.saved[0]
+        Settings.query.first().company_name_ar = self.saved[1]
+        db.session.commit()
+        db.session.remove()
+        self.ctx.pop()
+
+    def test_snapshot_is_read_only_and_cached(self):
+        snapshot = attendance_settings()
+        self.assertIs(attendance_settings(), snapshot)
+        with self.assertRaises(AttributeError):
+            snapshot.max_distance_meters = 1
+        with self.assertRaises(AttributeError):
+            snapshot.no_such_setting
+
+    def test_orm_writes_bump_generation_and_refresh_snapshots(self):
+        generation = get_generation(SETTINGS_GENERATION)
+        row = AttendanceSettings.query.first()
+        row.max_distance_meters = (row.max_distance_meters or 0) + 7
+        db.session.commit()
+        self.assertNotEqual(get_generation(SETTINGS_GENERATION), generation)
+        self.assertEqual(attendance_settings().max_distance_meters, row.max_distance_meters)
+
+        Settings.query.first().company_name_ar = 'شركة الاختبار'
+        db.session.commit()
+        self.assertEqual(system_settings().company_name_ar, 'شركة الاختبار')
+
+        # قراءة بدون تعديل لا تبطل اللقطة
+        generation = get_generation(SETTINGS_GENERATION)
+        Settings.query.first()
+        db.session.commit()
+        self.assertEqual(get_generation(SETTINGS_GENERATION), generation)
+
+    def test_write_between_generation_read_and_load_is_not_cached_as_current(self):
+        settings_cache._cache.pop(AttendanceSettings, None)
+        original = settings_cache._load_snapshot
+        row = AttendanceSettings.query.first()
+        before = row.max_distance_meters
+
+        def load_then_concurrent_write(model):
+            snapshot = original(model)
+            # عملية أخرى تلتزم تعديلاً بعد تحميل اللقطة
+            row.max_distance_meters = (before or 0) + 11
+            db.session.commit()
+            return snapshot
+
+        settings_cache._load_snapshot = load_then_concurrent_write
+        try:
+            self.assertEqual(attendance_settings().max_distance_meters, before)
+        finally:
+            settings_cache._load_snapshot = original
+        # اللقطة خُزنت بالجيل المقروء قبل التحميل، فالتعديل يُرى في الاستدعاء التالي
+        self.assertEqual(attendance_settings().max_distance_meters, (before or 0) + 11)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+from datetime import datetime, timedelta
+from app import create_app, db
+from app.models.whatsapp_models import WhatsAppConversation, WhatsAppMessage
+from app.utils.whatsapp_history import message_changes, message_page
+
+PHONE = '990000000201'
+
+
+class MessageHistoryTests(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        self._clean()
+        conversation = WhatsAppConversation(customer_phone=PHONE, customer_name='History')
+        db.session.add(conversation)
+        db.session.flush()
+        self.conversation_id = conversation.id
+        start = datetime(2025, 1, 1, 9, 0)
+        old = datetime.utcnow() - timedelta(hours=1)
+        # 120 رسالة، كل ثلاث منها بنفس التوقيت (المعرّف يفصل بينها في المؤشر)
+        db.session.execute(WhatsAppMessage.__table__.insert(), [{
+            'conversation_id': conversation.id, 'message_type': 'text', 'message_content': str(i),
+            'direction': 'incoming', 'status': 'sent', 'timestamp': start + timedelta(minutes=i // 3),
+            'created_at': old, 'updated_at': old,
+        } for i in range(120)])
+        db.session.commit()
+
+    def tearDown(self):
+        self._clean()
+        db.session.remove()
+        self.ctx.pop()
+
+    def _clean(self):
+        conv_ids = [c.id for c in WhatsAppConversation.query.filter_by(customer_phone=PHONE)]
+        WhatsAppMessage.query.filter(WhatsAppMessage.conversation_id.in_(conv_ids)).delete(synchronize_session=False)
+        WhatsAppConversation.query.filter_by(customer_phone=PHONE).delete(synchronize_session=False)
+        db.session.commit()
+
+    def test_pages_walk_history_without_gaps_or_repeats(self):
+        page, cursor = message_page(self.conversation_id, limit=50)
+        self.assertEqual([m.message_content for m in page], [str(i) for i in range(70, 120)])
+        seen = [m.message_content for m in page]
+        while cursor:
+            page, cursor = message_page(self.conversation_id, before=cursor, limit=50)
+            seen = [m.message_content for m in page] + seen
+        self.assertEqual(seen, [str(i) for i in range(120)])
+
+    def test_since_returns_only_new_and_changed_messages(self):
+        since = datetime.utcnow().isoformat()
+        changed = WhatsAppMessage.query.filter_by(conversation_id=self.conversation_id, message_content='5').one()
+        changed.status = 'read'
+        db.session.add(WhatsAppMessage(conversation_id=self.conversation_id, message_type='text',
+                                       message_content='new', direction='outgoing'))
+        db.session.commit()
+        items, truncated = message_changes(self.conversation_id, since)
+        self.assertEqual([m.message_content for m in items], ['5', 'new'])
+        self.assertFalse(truncated)
+
+
+if __name__ == '__main__':
+    unittest.main()
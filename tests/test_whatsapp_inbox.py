@@ -0,0 +1,112 @@
+import json
+import unittest
+from app import create_app, db
+from app.models.whatsapp_models import WhatsAppConversation, WhatsAppInbox, WhatsAppMessage
+from app.utils import whatsapp_inbox
+from app.utils.whatsapp_inbox import drain_inbox, enqueue_webhook, next_retry_in, parse_payload
+
+PHONE = '990000000001'
+
+
+def _payload(message_id, body, statuses=()):
+    return {'entry': [{'changes': [{'value': {
+        'contacts': [{'wa_id': PHONE, 'profile': {'name': 'Test Customer'}}],
+        'messages': [{'from': PHONE, 'id': message_id, 'timestamp': '1700000000', 'type': 'text',
+                      'text': {'body': body}}],
+        'statuses': list(statuses),
+    }}]}]}
+
+
+class ParsePayloadTests(unittest.TestCase):
+    def test_extracts_messages_and_statuses(self):
+        messages, statuses = parse_payload(_payload('wamid.a', 'hi', [{'id': 'wamid.x', 'status': 'read'}]))
+        self.assertEqual(messages[0]['message_id'], 'wamid.a')
+        self.assertEqual(messages[0]['name'], 'Test Customer')
+        self.assertEqual(messages[0]['content'], 'hi')
+        self.assertEqual(statuses[0]['status'], 'read')
+
+
+class InboxDrainTests(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        self._clean()
+
+    def tearDown(self):
+        self._clean()
+        db.session.remove()
+        self.ctx.pop()
+
+    def _clean(self):
+        conv_ids = [c.id for c in WhatsAppConversation.query.filter_by(customer_phone=PHONE)]
+        WhatsAppMessage.query.filter(WhatsAppMessage.conversation_id.in_(conv_ids)).delete(synchronize_session=False)
+        WhatsAppConversation.query.filter_by(customer_phone=PHONE).delete(synchronize_session=False)
+        WhatsAppInbox.query.delete()
+        db.session.commit()
+
+    def test_webhook_retries_are_stored_once(self):
+        for _ in range(3):  # Meta تعيد نفس الحمولة
+            enqueue_webhook(json.dumps(_payload('wamid.test1', 'hello')))
+        enqueue_webhook(json.dumps(_payload('wamid.test2', 'again', [
+            {'id': 'wamid.test1', 'status': 'read', 'timestamp': '2'},
+            {'id': 'wamid.test1', 'status': 'delivered', 'timestamp': '1'},
+        ])))
+        db.session.commit()
+
+        totals = drain_inbox()
+        self.assertEqual((totals['payloads'], totals['messages'], totals['duplicates']), (4, 2, 2))
+        conversation = WhatsAppConversation.query.filter_by(customer_phone=PHONE).one()
+        self.assertEqual(conversation.unread_count, 2)
+        self.assertEqual(conversation.last_message, 'again')
+        self.assertEqual(WhatsAppMessage.query.filter_by(message_id='wamid.test1').one().status, 'read')
+        self.assertEqual(WhatsAppInbox.query.filter_by(status='done').count(), 4)
+
+    def test_poison_payloads_fail_alone(self):
+        for i in range(5):
+            enqueue_webhook(json.dumps(_payload(f'wamid.good{i}', f'good {i}')))
+        bad_timestamp = _payload('wamid.bad', 'bad')
+        bad_timestamp['entry'][0]['changes'][0]['value']['messages'][0]['timestamp'] = 'not-a-number'
+        poison = enqueue_webhook(json.dumps(bad_timestamp))
+        garbage = enqueue_webhook('{not json')
+        db.session.commit()
+
+        totals = drain_inbox()
+        self.assertEqual((totals['payloads'], totals['messages'], totals['failed']), (5, 5, 2))
+        self.assertEqual(WhatsAppInbox.query.filter_by(status='done').count(), 5)
+        for item in (poison, garbage):
+            item = db.session.get(WhatsAppInbox, item.id)
+            self.assertEqual((item.status, item.attempts), ('failed', 1))
+            self.assertIn('Invalid payload', item.error)
+
+    def test_failed_write_is_retried_alone_with_backoff(self):
+        for i in range(3):
+            enqueue_webhook(json.dumps(_payload(f'wamid.w{i}', f'write {i}')))
+        db.session.commit()
+        write_messages = whatsapp_inbox._write_messages
+
+        def failing_write(messages):
+            if any(m['message_id'] == 'wamid.w1' for m in messages):
+                raise RuntimeError('write failed')
+            return write_messages(messages)
+
+        whatsapp_inbox._write_messages = failing_write
+        try:
+            totals = drain_inbox()
+        finally:
+            whatsapp_inbox._write_messages = write_messages
+        self.assertEqual((totals['payloads'], totals['messages'], totals['deferred']), (2, 2, 1))
+        item = WhatsAppInbox.query.filter_by(status='queued').one()
+        self.assertEqual(item.attempts, 1)  # لا إعادة حجز فورية في حلقة
+        self.assertGreater(next_retry_in(), 0)
+
+        # بعد انتهاء التأجيل تنجح الحمولة
+        item.next_attempt_at = None
+        db.session.commit()
+        self.assertEqual(drain_inbox()['messages'], 1)
+        self.assertEqual(WhatsAppInbox.query.filter_by(status='done').count(), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
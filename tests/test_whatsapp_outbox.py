@@ -0,0 +1,123 @@
+import time
+import unittest
+from datetime import datetime, timedelta
+from app import create_app, db
+from app.models.whatsapp_models import WhatsAppConversation, WhatsAppMessage, WhatsAppOutbox
+from app.utils import whatsapp_outbox
+from app.utils.whatsapp_outbox import GraphClient, TokenBucket, broadcast_status, drain_outbox, queue_broadcast
+from scripts.fake_graph_api import FakeGraphServer
+
+PHONES = ('990000000101', '990000000102', '990000000103')
+
+
+class TokenBucketTests(unittest.TestCase):
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=1000, burst=3)
+        for _ in range(3):
+            bucket.acquire()
+        self.assertLess(bucket.tokens, 1)
+        bucket.acquire()  # ينتظر ~1ms حتى يتوفر رمز
+
+
+class OutboxDrainTests(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config.update(TESTING=True, WHATSAPP_SEND_WORKERS=3, WHATSAPP_SEND_RATE=1000,
+                               WHATSAPP_SEND_BURST=1000, WHATSAPP_SEND_BACKOFF_SECONDS=0.05,
+                               WHATSAPP_SEND_MAX_ATTEMPTS=50)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        self._clean()
+
+    def tearDown(self):
+        self._clean()
+        db.session.remove()
+        self.ctx.pop()
+
+    def _clean(self):
+        WhatsAppOutbox.query.filter(WhatsAppOutbox.phone.in_(PHONES)).delete(synchronize_session=False)
+        conv_ids = [c.id for c in WhatsAppConversation.query.filter(WhatsAppConversation.customer_phone.in_(PHONES))]
+        WhatsAppMessage.query.filter(WhatsAppMessage.conversation_id.in_(conv_ids)).delete(synchronize_session=False)
+        WhatsAppConversation.query.filter(WhatsAppConversation.customer_phone.in_(PHONES)).delete(
+            synchronize_session=False)
+        db.session.commit()
+
+    def test_broadcasts_survive_429_and_keep_per_phone_order(self):
+        recipients = [{'phone': '+' + phone, 'name': f'Emp {i}'} for i, phone in enumerate(PHONES)]
+        broadcasts = []
+        for n in range(4):
+            broadcast_id, queued = queue_broadcast(recipients + recipients[:1], f'{{name}} #{n}')
+            broadcasts.append(broadcast_id)
+            self.assertEqual(queued, len(PHONES))  # الرقم المكرر يُرسل مرة واحدة
+        db.session.commit()
+
+        # الخادم يسمح بـ 20 رسالة/ث بينما العميل يرسل أسرع بكثير -> استجابات 429
+        with FakeGraphServer(rate=20, burst=2) as server:
+            client = GraphClient(base_url=server.base_url, access_token='t', phone_number_id='PN', pool_size=3)
+            totals = drain_outbox(client=client)
+
+        self.assertGreater(server.stats['throttled'], 0)
+        self.assertEqual((totals['sent'], totals['failed']), (12, 0))
+        for i, phone in enumerate(PHONES):
+            self.assertEqual(server.delivered[phone], [f'Emp {i} #{n}' for n in range(4)])
+        for broadcast_id in broadcasts:
+            self.assertEqual(broadcast_status(broadcast_id), {'sent': len(PHONES)})
+        conversation = WhatsAppConversation.query.filter_by(customer_phone=PHONES[0]).one()
+        self.assertEqual(conversation.last_message, 'Emp 0 #3')
+        self.assertEqual(WhatsAppMessage.query.filter_by(conversation_id=conversation.id, status='sent').count(), 4)
+
+    def test_wait_counts_only_claimable_rows_and_is_bounded(self):
+        now = datetime.utcnow()
+        db.session.add_all([
+            # رسالة قيد الإرسال لدى عامل آخر تحجب المؤجلة بعدها لنفس الرقم
+            WhatsAppOutbox(phone=PHONES[0], body='in flight', status='sending', claim_token='x', claimed_at=now),
+            WhatsAppOutbox(phone=PHONES[0], body='blocked', next_attempt_at=now + timedelta(seconds=1)),
+        ])
+        db.session.commit()
+        self.assertIsNone(whatsapp_outbox._next_due_in(now))
+
+        db.session.add(WhatsAppOutbox(phone=PHONES[1], body='later', next_attempt_at=now + timedelta(seconds=30)))
+        db.session.commit()
+        self.assertAlmostEqual(whatsapp_outbox._next_due_in(now), 30, delta=1)
+
+        self.app.config['WHATSAPP_OUTBOX_MAX_WAIT'] = 0.5
+        with FakeGraphServer() as server:
+            client = GraphClient(base_url=server.base_url, access_token='t', phone_number_id='PN', pool_size=1)
+            started = time.monotonic()
+            totals = drain_outbox(client=client)
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(totals['sent'], 0)
+
+    def test_row_due_after_the_claim_is_not_lost(self):
+        now = datetime.utcnow()
+        # تأجيل ينتهي بين _claim_batch و _next_due_in: يُحجز فوراً بدل الخروج
+        db.session.add(WhatsAppOutbox(phone=PHONES[2], body='expired', next_attempt_at=now - timedelta(seconds=0.01)))
+        db.session.commit()
+        self.assertEqual(whatsapp_outbox._next_due_in(now), 0)
+
+        self.app.config['WHATSAPP_OUTBOX_MAX_WAIT'] = 0
+        with FakeGraphServer() as server:
+            client = GraphClient(base_url=server.base_url, access_token='t', phone_number_id='PN', pool_size=1)
+            totals = drain_outbox(client=client)
+        self.assertEqual(totals['sent'], 1)
+
+    def test_stale_claim_is_requeued_while_draining(self):
+        self.app.config.update(WHATSAPP_OUTBOX_STALE_SECONDS=1, WHATSAPP_OUTBOX_MAX_WAIT=10)
+        now = datetime.utcnow()
+        db.session.add_all([
+            WhatsAppOutbox(phone=PHONES[2], body='first', next_attempt_at=now + timedelta(seconds=0.3)),
+            # حجز عامل مات للتو: يصبح قديماً بعد ثانية أثناء انتظار الرسالة الأولى
+            WhatsAppOutbox(phone=PHONES[0], body='orphaned', status='sending', claim_token='dead', claimed_at=now),
+            WhatsAppOutbox(phone=PHONES[2], body='second', next_attempt_at=now + timedelta(seconds=1.5)),
+        ])
+        db.session.commit()
+        with FakeGraphServer() as server:
+            client = GraphClient(base_url=server.base_url, access_token='t', phone_number_id='PN', pool_size=1)
+            totals = drain_outbox(client=client)
+        self.assertEqual(totals['sent'], 3)
+        self.assertEqual(server.delivered[PHONES[2]], ['first', 'second'])
+        self.assertEqual(server.delivered[PHONES[0]], ['orphaned'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+from datetime import date
+from types import SimpleNamespace
+from app.utils.payroll_engine import leave_masks
+from app.utils.work_calendar import WorkCalendar, work_weekdays
+
+
+def _leave(start, end, leave_type='annual', paid=True, paid_days=None):
+    return SimpleNamespace(start_date=start, end_date=end, leave_type=leave_type, paid=paid, paid_days=paid_days)
+
+
+class WorkCalendarTests(unittest.TestCase):
+    def setUp(self):
+        # مارس 2025: يبدأ السبت؛ العمل الأحد–الخميس مع عطلة يوم 10
+        self.calendar = WorkCalendar(date(2025, 3, 1), date(2025, 3, 31), work_weekdays('0,1,2,3,4'),
+                                     {date(2025, 3, 10), date(2025, 4, 1)})
+
+    def test_working_days_exclude_weekend_and_holidays(self):
+        self.assertEqual(self.calendar.working_count, 21)
+        self.assertNotIn(date(2025, 3, 1), self.calendar.working_dates)   # السبت
+        self.assertNotIn(date(2025, 3, 10), self.calendar.working_dates)  # عطلة
+        self.assertTrue(self.calendar.is_working(date(2025, 3, 2)))
+        self.assertFalse(self.calendar.is_working(date(2025, 4, 2)))
+
+    def test_weekend_fallback_when_work_days_empty(self):
+        self.assertEqual(work_weekdays('', '5,6'), frozenset({0, 1, 2, 3, 4}))
+        self.assertEqual(work_weekdays('6,0'), frozenset({0, 6}))
+
+    def test_leave_masks_clip_to_period_and_split_sick_leave(self):
+        paid, unpaid = leave_masks([
+            _leave(date(2025, 2, 25), date(2025, 3, 2)),
+            _leave(date(2025, 3, 20), date(2025, 3, 24), leave_type='sick', paid_days=2),
+            _leave(date(2025, 3, 30), date(2025, 4, 5), paid=False),
+        ], self.calendar)
+        self.assertEqual(self.calendar.dates(paid), [date(2025, 3, 1), date(2025, 3, 2),
+                                                     date(2025, 3, 20), date(2025, 3, 21)])
+        self.assertEqual(self.calendar.dates(unpaid), [date(2025, 3, 22), date(2025, 3, 23), date(2025, 3, 24),
+                                                       date(2025, 3, 30), date(2025, 3, 31)])
+
+
+if __name__ == '__main__':
+    unittest.main()